@@ -24,12 +24,27 @@ macplus/harness.py does for the Mac Plus:
     from the copper list at $76000 (COLORxx register/value pairs) -> 320x200 RGB
     PNG. Both addresses are absolute equates in the port, so relocation-proof.
 
+Checkpoints (tools/ucsnap.py): the machine is chip/slow RAM, the CIA and custom
+windows, the full Unicorn CPU context and the beam/serial model, keyed by the
+hunk-exe's hash. --checkpoint PATH saves it wherever the run stops - at ATDONE,
+at --max, or at --until SYMBOL (a kernel.lst label, so the boot can be cut off
+just before the part of the scene being worked on). --resume PATH skips the
+hunk load and everything before that point and runs on from the saved machine
+to ATDONE; an A/B check of a render-side change then only re-runs the scene
+under test. There is no automatic boot snapshot as macplus has: every build is
+its own image, rendered once per farm run.
+
 Usage: render.py <UnoDOS68K_test hunk-exe> <out.png> [--trace] [--max N]
+                 [--until SYMBOL] [--checkpoint PATH] [--resume PATH]
 """
-import os, re, struct, sys, zlib
+import os, re, struct, sys
 from unicorn import *
 from unicorn.m68k_const import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "tools"))
+import fbconv                                              # noqa: E402
+import ucsnap                                              # noqa: E402
+
 # ---- memory map ------------------------------------------------------------
 RAM_LO      = 0x000000      # chip + slow: vectors, app slots, framebuffer
 RAM_LO_SZ   = 0x400000      # 4 MB covers $60000 planes / $76000 copper / stack
@@ -54,6 +69,10 @@ R_SERDATR = 0x018
 R_SERDAT  = 0x030
 R_COLOR00 = 0x180
 
+# what a checkpoint holds besides the CPU context and the Amiga's own state
+RAM_REGIONS  = [(RAM_LO, RAM_LO_SZ), (CIA_BASE, CIA_SZ), (CUSTOM, CUSTOM_SZ)]
+DEVICE_STATE = ("serial", "beam", "stop_hit")
+
 
 # ---- AmigaDOS hunk loader --------------------------------------------------
 HUNK_CODE=0x3E9; HUNK_DATA=0x3EA; HUNK_BSS=0x3EB
@@ -123,17 +142,6 @@ def load_hunkexe(data, base):
     return hbase[0], writes, sizes
 
 
-def png_rgb(path, w, h, rows_rgb):
-    def chunk(tag, d):
-        c = tag + d
-        return struct.pack(">I", len(d)) + c + struct.pack(">I", zlib.crc32(c))
-    raw = b"".join(b"\x00" + rows_rgb[y] for y in range(h))
-    hdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)   # 8-bit truecolour
-    open(path, "wb").write(b"\x89PNG\r\n\x1a\n" +
-        chunk(b"IHDR", hdr) + chunk(b"IDAT", zlib.compress(raw, 9)) +
-        chunk(b"IEND", b""))
-
-
 def find_symbol(exe_path, name):
     """Resolve a kernel symbol's section offset from build/kernel.lst (vasm
     listing). The dump has `OFFSET  symbol` lines. Re-read per build so the
@@ -150,17 +158,39 @@ def find_symbol(exe_path, name):
 
 
 class Amiga:
-    def __init__(self, exe_path, trace=False):
+    def __init__(self, exe_path, trace=False, load=True):
         self.trace = trace
         self.serial = bytearray()
         self.beam = 0
         self.stop_hit = False
+        self.until_hit = False
+        self.resumed = False
+        self.key = ucsnap.image_key(exe_path)
         uc = Uc(UC_ARCH_M68K, UC_MODE_BIG_ENDIAN)
         uc.ctl_set_cpu_model(UC_CPU_M68K_M68000)   # real 68000, not the ColdFire default
         self.uc = uc
         uc.mem_map(RAM_LO, RAM_LO_SZ)
         uc.mem_map(CIA_BASE, CIA_SZ)
         uc.mem_map(CUSTOM, CUSTOM_SZ)
+        if load:
+            self._load(exe_path)
+        # custom-chip MMIO
+        uc.hook_add(UC_HOOK_MEM_READ, self._cread, begin=CUSTOM, end=CUSTOM+CUSTOM_SZ-1)
+        uc.hook_add(UC_HOOK_MEM_WRITE, self._cwrite, begin=CUSTOM, end=CUSTOM+CUSTOM_SZ-1)
+        # `ticks` (the vblank frame counter) is bumped by the level-3 ISR, which
+        # we don't run - the cursor it also updates is a hardware sprite, absent
+        # from the bitplanes we render. Auto-advance ticks on read so the port's
+        # frame-delays (fdd_delay etc.) terminate; deterministic per code path.
+        toff = find_symbol(exe_path, "ticks")
+        self.ticks_addr = (KERN_BASE + toff) if toff is not None else None
+        if self.ticks_addr is not None:
+            uc.hook_add(UC_HOOK_MEM_READ, self._tick_read,
+                        begin=self.ticks_addr, end=self.ticks_addr + 3)
+        if trace:
+            uc.hook_add(UC_HOOK_CODE, self._trace)
+
+    def _load(self, exe_path):
+        uc = self.uc
         # load kernel
         entry, writes, sizes = load_hunkexe(open(exe_path, "rb").read(), KERN_BASE)
         for w in writes:
@@ -179,20 +209,27 @@ class Amiga:
         # exec SysBase stub: mem[4] = EXEC_BASE; [EXEC_BASE-30] = jmp (a5) = $4ED5
         uc.mem_write(4, struct.pack(">I", EXEC_BASE))
         uc.mem_write(EXEC_BASE - 30, b"\x4E\xD5")
-        # custom-chip MMIO
-        uc.hook_add(UC_HOOK_MEM_READ, self._cread, begin=CUSTOM, end=CUSTOM+CUSTOM_SZ-1)
-        uc.hook_add(UC_HOOK_MEM_WRITE, self._cwrite, begin=CUSTOM, end=CUSTOM+CUSTOM_SZ-1)
-        # `ticks` (the vblank frame counter) is bumped by the level-3 ISR, which
-        # we don't run - the cursor it also updates is a hardware sprite, absent
-        # from the bitplanes we render. Auto-advance ticks on read so the port's
-        # frame-delays (fdd_delay etc.) terminate; deterministic per code path.
-        toff = find_symbol(exe_path, "ticks")
-        self.ticks_addr = (KERN_BASE + toff) if toff is not None else None
-        if self.ticks_addr is not None:
-            uc.hook_add(UC_HOOK_MEM_READ, self._tick_read,
-                        begin=self.ticks_addr, end=self.ticks_addr + 3)
-        if trace:
-            uc.hook_add(UC_HOOK_CODE, self._trace)
+
+    def stop_at(self, addr):
+        """End the run just before the instruction at `addr` executes."""
+        def hit(uc, a, size, user):
+            self.until_hit = True
+            uc.emu_stop()
+        self.uc.hook_add(UC_HOOK_CODE, hit, begin=addr, end=addr)
+
+    # --- checkpoints ---
+    def save_checkpoint(self, path):
+        ucsnap.save(path, self.uc, RAM_REGIONS, self.key,
+                    dict((k, getattr(self, k)) for k in DEVICE_STATE))
+
+    def load_checkpoint(self, path):
+        state, why = ucsnap.load(path, self.key)
+        if state is None:
+            raise SystemExit("--resume: %s" % why)
+        ucsnap.restore(self.uc, state)
+        for k, v in state["dev"].items():
+            setattr(self, k, v)
+        self.resumed = True
 
     # --- custom chip register model ---
     def _vpos_long(self):
@@ -252,13 +289,18 @@ class Amiga:
         # that, and super:'s first op (or.w #$0700,sr) is privileged. Set S
         # *before* SP - switching to supervisor selects the SSP, so A7 must be
         # written after, or the jsr pushes to a stale stack.
+        # A resumed machine already has its SR, SP and PC from the checkpoint.
+        if self.resumed:
+            pc = self.uc.reg_read(UC_M68K_REG_PC)
+        else:
+            try:
+                self.uc.reg_write(UC_M68K_REG_SR, 0x2700)
+            except Exception:
+                pass
+            self.uc.reg_write(UC_M68K_REG_A7, 0x7C000)
+            pc = self.entry
         try:
-            self.uc.reg_write(UC_M68K_REG_SR, 0x2700)
-        except Exception:
-            pass
-        self.uc.reg_write(UC_M68K_REG_A7, 0x7C000)
-        try:
-            self.uc.emu_start(self.entry, 0, count=max_insns)
+            self.uc.emu_start(pc, 0, count=max_insns)
         except UcError as e:
             pc = self.uc.reg_read(UC_M68K_REG_PC)
             raise SystemExit("emu error %s at PC=%06X\nserial: %r"
@@ -284,36 +326,38 @@ class Amiga:
         return pal
 
     def dump_png(self, path):
-        pal = self.palette()
         planes = [ self.uc.mem_read(PLANE0 + i*PLANE_SZ, PLANE_SZ) for i in range(NPLANES) ]
-        rows = []
-        for y in range(SCRH):
-            row = bytearray(SCRW * 3)
-            base = y * ROWB
-            for x in range(SCRW):
-                byte = base + (x >> 3)
-                bit = 7 - (x & 7)
-                idx = 0
-                for pl in range(NPLANES):
-                    idx |= ((planes[pl][byte] >> bit) & 1) << pl
-                r, g, b = pal[idx]
-                o = x * 3
-                row[o] = r; row[o+1] = g; row[o+2] = b
-            rows.append(bytes(row))
-        png_rgb(path, SCRW, SCRH, rows)
-
+        fbconv.write_png(path, SCRW, SCRH, fbconv.palette(fbconv.planar(planes), self.palette()),
+                         level=9)
 
 def main():
     argv = sys.argv[1:]
     trace = "--trace" in argv
     maxn = 200_000_000
+    opts = {"--until": None, "--checkpoint": None, "--resume": None}
     if "--max" in argv:
         i = argv.index("--max"); maxn = int(argv[i+1]); del argv[i:i+2]
+    for flag in opts:
+        if flag in argv:
+            i = argv.index(flag); opts[flag] = argv[i+1]; del argv[i:i+2]
     argv = [a for a in argv if not a.startswith("--")]
     exe, out = argv[0], argv[1]
-    a = Amiga(exe, trace)
+    a = Amiga(exe, trace, load=not opts["--resume"])
+    if opts["--resume"]:
+        a.load_checkpoint(opts["--resume"])
+        sys.stderr.write("resumed %s\n" % opts["--resume"])
+    if opts["--until"]:
+        off = find_symbol(exe, opts["--until"])
+        if off is None:
+            raise SystemExit("--until: no symbol %s in kernel.lst" % opts["--until"])
+        a.stop_at(KERN_BASE + off)
     a.run(maxn)
-    if not a.stop_hit:
+    if opts["--checkpoint"]:
+        a.save_checkpoint(opts["--checkpoint"])
+        sys.stderr.write("checkpoint %s\n" % opts["--checkpoint"])
+    if a.until_hit:
+        sys.stderr.write("stopped at %s\n" % opts["--until"])
+    elif not a.stop_hit:
         sys.stderr.write("WARN: ATDONE marker not seen; serial=%r\n" % bytes(a.serial[-80:]))
     a.dump_png(out)
     sys.stderr.write("serial: %s\n" % bytes(a.serial).decode("latin1").strip())
@@ -25,6 +25,16 @@ MPU:
     there is no ROM in a ROM-free harness - kernel.s may only READ these).
   - Framebuffer: hi-res page 1 ($2000-$3FFF), de-interleaved 280x192 -> PNG.
 
+Boot snapshot: every script opens with the same `wait N` (600 here) on the
+same disk, which is millions of py65 steps of RWTS loading and AUTOTEST setup
+before the first command that differs. So a script's leading wait is a fork
+point: the machine after it (MPU registers, the 64K, the disk image, the Disk
+II head/track/write latch, the keyboard latch, the beep count) is saved under
+build/snap/, keyed by the disk's hash, N and this harness, and every later
+run of the same disk restores it instead of booting. --no-snapshot (or
+--trace, which wants to see the boot) runs it for real; deleting build/snap/
+forgets every boot.
+
 Script on stdin (one command per line, # comments):
   wait N            run N ticks (TICK_INSTRS MPU steps each)
   shot NAME         screenshot to <artdir>/NAME.png
@@ -34,14 +44,20 @@ Script on stdin (one command per line, # comments):
   assert beep>0     fail unless the speaker ($C030) has toggled at least once
   quit              finish
 
-Usage: harness.py <disk.dsk> <artdir> [--trace] < script
+Usage: harness.py <disk.dsk> <artdir> [--trace] [--no-snapshot] < script
        harness.py --selftest      (GCR encode/decode round-trip checks)
 """
-import os, struct, sys, zlib
+import hashlib, os, sys
 from py65.devices.mpu6502 import MPU
 from py65.memory import ObservableMemory
 
 SLOT = 6
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPDIR = os.path.join(HERE, "build", "snap")
+sys.path.insert(0, os.path.join(HERE, "..", "tools"))
+import fbconv                                              # noqa: E402
+import snapfile                                            # noqa: E402
+MPU_STATE = ("pc", "a", "x", "y", "sp", "p", "processorCycles")
 # TICK_INSTRS calibration (HANDOFF.md SS6b): measured against the M1 kernel
 # (TICKS_PER_SEC=1000 in kernel.s) - boot + desktop/AUTOTEST setup costs
 # ~280,000 6502 instruction-steps before clock_secs first reaches 1; each
@@ -289,23 +305,6 @@ def selftest_write():
     print("[selftest] OK")
 
 
-# ---------------------------------------------------------------------------
-# PNG output (lifted from macplus/harness.py)
-# ---------------------------------------------------------------------------
-def png_gray(path, w, h, getpix):
-    rows = b""
-    for y in range(h):
-        rows += b"\x00" + bytes(getpix(y))
-
-    def chunk(tag, data):
-        c = tag + data
-        return struct.pack(">I", len(data)) + c + struct.pack(">I", zlib.crc32(c))
-    hdr = struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0)
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", hdr) +
-                chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b""))
-
-
 # ---------------------------------------------------------------------------
 # Keyboard - Apple II raw key codes (bit7 = "key waiting" flag at $C000)
 # ---------------------------------------------------------------------------
@@ -423,13 +422,16 @@ class Keyboard:
 class Apple2:
     def __init__(self, disk_path, artdir, trace=False):
         self.disk = bytearray(open(disk_path, "rb").read())
+        self.disk_sha = hashlib.sha256(self.disk).hexdigest()
         assert len(self.disk) == 35 * 4096, \
             f"expected a 140K (35-track) image, got {len(self.disk)} bytes"
         self.artdir = artdir
         self.trace = trace
         os.makedirs(artdir, exist_ok=True)
 
-        self.mem = ObservableMemory()
+        # the 64K itself, so a snapshot copies it without firing the I/O hooks
+        self.ram = [0] * 0x10000
+        self.mem = ObservableMemory(subject=self.ram)
         self.disk2 = DiskII(self.disk, self.mem)
         self.kbd = Keyboard()
         data_addr = 0xC08C + SLOT * 16       # $C0EC - read: next nibble
@@ -485,6 +487,62 @@ class Apple2:
     def tick(self, n=1):
         self.step(n * TICK_INSTRS)
 
+    def boot_tick(self, n, snapdir=SNAPDIR):
+        """tick(n) from power-on - or restore the machine as it was after the
+        same n ticks of the same disk the last time."""
+        h = hashlib.sha256(self.disk_sha.encode())
+        with open(os.path.abspath(__file__), "rb") as f:
+            h.update(f.read())
+        h.update(b"wait %d" % n)
+        path = os.path.join(snapdir, "boot-%s.snap" % h.hexdigest()[:32])
+        if self.steps == 0 and self.load_snapshot(path):
+            return
+        self.tick(n)
+        self.save_snapshot(path)
+
+    # ------------------------------------------------------------ snapshots
+    def snapshot(self):
+        """The machine as plain data (picklable, shares nothing). The Disk
+        II's nibble streams are not in it: they are rebuilt from the image."""
+        d = self.disk2
+        return {"mpu": dict((k, getattr(self.mpu, k)) for k in MPU_STATE),
+                "ram": bytes(self.ram), "disk": bytes(self.disk),
+                "disk2": (d.cur_track, d.pos, d.write_mode, d.write_phys,
+                          list(d.capture)),
+                "latch": self.kbd.latch, "beep_count": self.beep_count,
+                "steps": self.steps, "vars": self.vars}
+
+    def restore(self, state):
+        for k, v in state["mpu"].items():
+            setattr(self.mpu, k, v)
+        self.ram[:] = state["ram"]
+        self.disk[:] = state["disk"]
+        d = self.disk2
+        track, pos, d.write_mode, d.write_phys, capture = state["disk2"]
+        d.track_cache.clear()
+        d.cur_track = -1
+        if track >= 0:
+            d._ensure_track(track)
+        d.pos, d.capture = pos, list(capture)
+        self.kbd.latch = state["latch"]
+        self.beep_count = state["beep_count"]
+        self.steps = state["steps"]
+        self.vars = state["vars"]
+
+    def save_snapshot(self, path):
+        snapfile.save(path, self.snapshot())
+
+    def load_snapshot(self, path):
+        """Restore from `path`; False (machine untouched) if nothing usable
+        is there."""
+        state = snapfile.load(path)
+        if state is None:
+            return False
+        self.restore(state)
+        print(f"[harness] boot restored from {os.path.basename(path)} "
+              f"({state['steps']} steps)")
+        return True
+
     def _find_vars(self):
         if self.vars is None:
             # Gate on $4000 == $4C ("jmp start2") so boot-scratch garbage at
@@ -514,17 +572,14 @@ class Apple2:
     # ------------------------------------------------------------ output
     def shot(self, name):
         fb = bytes(self.mem[0x2000:0x4000])
-
-        def row(y):
-            out = bytearray()
-            base = (y & 7) * 0x400 + ((y >> 3) & 7) * 0x80 + (y >> 6) * 0x28
-            for c in range(40):
-                b = fb[base + c]
-                for bit in range(7):
-                    out.append(255 if (b >> bit) & 1 else 0)
-            return out
+        # the 192 hi-res lines in display order (interleaved in memory), each
+        # 40 bytes of 7 pixels, LSB first; bit 7 is the colour shift
+        bits = b"".join(fb[base:base + 40] for base in
+                        ((y & 7) * 0x400 + ((y >> 3) & 7) * 0x80 + (y >> 6) * 0x28
+                         for y in range(192)))
         path = os.path.join(self.artdir, name + ".png")
-        png_gray(path, 280, 192, row)
+        fbconv.write_png(path, 280, 192, fbconv.gray(fbconv.mono(bits, 7, msb_first=False),
+                                                     (0, 255)), gray=True)
         print(f"[shot] {path}")
 
 
@@ -539,15 +594,19 @@ def main():
         i = argv.index("--writeback")
         writeback = argv[i + 1]
         del argv[i:i + 2]
-    args = [a for a in argv if a != "--trace"]
+    snap = not trace and "--no-snapshot" not in argv
+    args = [a for a in argv if a not in ("--trace", "--no-snapshot")]
     disk, artdir = args[0], args[1]
     a2 = Apple2(disk, artdir, trace)
+    first = True
     for line in sys.stdin:
         line = line.split("#")[0].strip()
         if not line:
             continue
         cmd, *rest = line.split()
-        if cmd == "wait":
+        if cmd == "wait" and first and snap:
+            a2.boot_tick(int(rest[0]))
+        elif cmd == "wait":
             a2.tick(int(rest[0]))
         elif cmd == "shot":
             a2.shot(rest[0])
@@ -565,6 +624,7 @@ def main():
             break
         else:
             raise SystemExit(f"unknown command: {cmd}")
+        first = False
     print(f"[harness] done ({a2.steps} steps)")
     if writeback:
         with open(writeback, "wb") as f:
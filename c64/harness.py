@@ -23,6 +23,14 @@ port - this ships its own minimal ROM-free harness around a py65 MPU:
   - framebuffer: hi-res bitmap ($6000-$7F3F) + per-cell colour from screen RAM
     ($4000-$43E7) rendered through the 16-colour C64 palette to an RGB PNG.
 
+Boot snapshot: a script's leading `wait N` is the same PAL/NTSC sweep and
+desktop draw for every script on the same PRG, so it is a fork point. The
+machine after it (MPU registers, the 64K, keyboard column select, raster
+shadow, the TOD latch, the SID write count) is saved under build/snap/, keyed
+by the PRG, N, --ntsc, the --storage sidecar's contents, the app*.bin beside
+the PRG and this harness, and later runs restore it instead of booting.
+--no-snapshot (or --trace) boots for real; delete build/snap/ to forget them.
+
 Script on stdin (one command per line, # comments):
   wait N            run N ticks (TICK_INSTRS MPU steps each)
   shot NAME         screenshot to <artdir>/NAME.png
@@ -34,12 +42,19 @@ Script on stdin (one command per line, # comments):
   assert ntsc       fail unless the kernel detected NTSC
   quit              finish
 
-Usage: harness.py <prog.prg> <artdir> [--trace] [--ntsc] < script
+Usage: harness.py <prog.prg> <artdir> [--trace] [--ntsc] [--no-snapshot] < script
 """
-import os, struct, sys, zlib
+import glob, hashlib, os, sys
 from py65.devices.mpu6502 import MPU
 from py65.memory import ObservableMemory
 
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPDIR = os.path.join(HERE, "build", "snap")
+sys.path.insert(0, os.path.join(HERE, "..", "tools"))
+import fbconv                                              # noqa: E402
+import snapfile                                            # noqa: E402
+MPU_STATE = ("pc", "a", "x", "y", "sp", "p", "processorCycles")
+
 # Calibration. TICK_INSTRS = MPU instruction-steps per `wait` tick. The boot
 # path (PAL/NTSC raster sampling + desktop draw) costs the most up front; a
 # leading `wait` in the script absorbs it. STEPS_PER_SEC ties the CIA TOD clock
@@ -92,19 +107,6 @@ CHARS = {
 }
 
 
-# --------------------------------------------------------------------------- PNG
-def png_rgb(path, w, h, getrow):
-    rows = b"".join(b"\x00" + bytes(getrow(y)) for y in range(h))
-
-    def chunk(tag, data):
-        c = tag + data
-        return struct.pack(">I", len(data)) + c + struct.pack(">I", zlib.crc32(c))
-    hdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)   # 8-bit truecolour RGB
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", hdr) +
-                chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b""))
-
-
 def to_bcd(v):
     return ((v // 10) << 4) | (v % 10)
 
@@ -139,7 +141,10 @@ class C64:
         self.storage = storage          # sidecar file for the persisted FS region
         os.makedirs(artdir, exist_ok=True)
 
-        self.mem = ObservableMemory()
+        # the 64K itself, so a snapshot copies it without firing the I/O hooks
+        self.ram = [0] * 0x10000
+        self.mem = ObservableMemory(subject=self.ram)
+        self.boot_key = hashlib.sha256()    # everything the boot depends on
         self.kbd = Keyboard()
         self.beep_count = 0
         self.steps = 0
@@ -150,6 +155,7 @@ class C64:
 
         # load the PRG at its load address, jump to `start` ($080D)
         data = open(prg_path, "rb").read()
+        self.boot_key.update(data)
         load = data[0] | (data[1] << 8)
         body = data[2:]
         assert load == 0x0801, "expected a $0801 PRG, got $%04X" % load
@@ -162,10 +168,15 @@ class C64:
         # sharing --storage) survives; saved back on exit.
         if storage and os.path.exists(storage):
             data = open(storage, "rb").read()[:0x1000]
+            self.boot_key.update(b"storage" + data)
             self.mem.write(0xC000, list(data))
 
         # --- I/O intercepts ---
         self.app_dir = os.path.dirname(os.path.abspath(prg_path))
+        for path in sorted(glob.glob(os.path.join(self.app_dir, "app*.bin"))):
+            with open(path, "rb") as f:
+                self.boot_key.update(os.path.basename(path).encode() + f.read())
+        self.boot_key.update(b"lines %d" % self.raster_lines)
         self.mem.subscribe_to_write([0xDE00], self._load_app)
         self.mem.subscribe_to_write([0xDC00], self.kbd.write_pra)
         self.mem.subscribe_to_read([0xDC01], self.kbd.read_prb)
@@ -262,6 +273,55 @@ class C64:
     def tick(self, n=1):
         self.step(n * TICK_INSTRS)
 
+    def boot_tick(self, n, snapdir=SNAPDIR):
+        """tick(n) from power-on - or restore the machine as it was after the
+        same n ticks of the same boot the last time."""
+        h = self.boot_key.copy()
+        with open(os.path.abspath(__file__), "rb") as f:
+            h.update(f.read())
+        h.update(b"wait %d" % n)
+        path = os.path.join(snapdir, "boot-%s.snap" % h.hexdigest()[:32])
+        if self.steps == 0 and self.load_snapshot(path):
+            return
+        self.tick(n)
+        self.save_snapshot(path)
+
+    # ---- snapshots ----
+    def snapshot(self):
+        """The machine as plain data (picklable, shares nothing)."""
+        return {"mpu": dict((k, getattr(self.mpu, k)) for k in MPU_STATE),
+                "ram": bytes(self.ram),
+                "kbd": (self.kbd.colsel, sorted(self.kbd.pressed)),
+                "beep_count": self.beep_count, "steps": self.steps,
+                "vars": self.vars, "d011": self.d011,
+                "tod_latched": self.tod_latched}
+
+    def restore(self, state):
+        for k, v in state["mpu"].items():
+            setattr(self.mpu, k, v)
+        self.ram[:] = state["ram"]
+        self.kbd.colsel, pressed = state["kbd"]
+        self.kbd.pressed = set(pressed)
+        self.beep_count = state["beep_count"]
+        self.steps = state["steps"]
+        self.vars = state["vars"]
+        self.d011 = state["d011"]
+        self.tod_latched = state["tod_latched"]
+
+    def save_snapshot(self, path):
+        snapfile.save(path, self.snapshot())
+
+    def load_snapshot(self, path):
+        """Restore from `path`; False (machine untouched) if nothing usable
+        is there."""
+        state = snapfile.load(path)
+        if state is None:
+            return False
+        self.restore(state)
+        print("[harness] boot restored from %s (%d steps)"
+              % (os.path.basename(path), state["steps"]))
+        return True
+
     def _find_vars(self):
         if self.vars is None:
             for a in range(0x0801, self.prg_end):
@@ -295,21 +355,13 @@ class C64:
     def shot(self, name):
         bm = bytes(self.mem[BITMAP:BITMAP + 8000])
         sc = bytes(self.mem[SCREEN:SCREEN + 1000])
-
-        def getrow(y):
-            out = bytearray()
-            cellrow = y >> 3
-            ylo = y & 7
-            for x in range(320):
-                cell = cellrow * 40 + (x >> 3)
-                colbyte = sc[cell]
-                addr = cellrow * 320 + (x >> 3) * 8 + ylo
-                bit = (bm[addr] >> (7 - (x & 7))) & 1
-                ci = (colbyte >> 4) if bit else (colbyte & 0x0F)
-                out += bytes(PALETTE[ci])
-            return out
+        # per scanline, each cell's bitmap byte and its screen-RAM colours:
+        # a set bit is the high nibble, a clear one the low
+        bits = b"".join(bm[(y >> 3) * 320 + (y & 7)::8][:40] for y in range(200))
+        cols = b"".join(sc[(y >> 3) * 40:(y >> 3) * 40 + 40] for y in range(200))
+        idx = fbconv.two_colour(bits, bytes(c >> 4 for c in cols), bytes(c & 0x0F for c in cols))
         path = os.path.join(self.artdir, name + ".png")
-        png_rgb(path, 320, 200, getrow)
+        fbconv.write_png(path, 320, 200, fbconv.palette(idx, PALETTE))
         print("[shot] %s" % path)
 
 
@@ -324,14 +376,18 @@ def main():
         del argv[i:i + 2]
     args = [a for a in argv if not a.startswith("--")]
     prog, artdir = args[0], args[1]
+    snap = not trace and "--no-snapshot" not in argv
     c = C64(prog, artdir, trace, ntsc, storage)
+    first = True
     for line in sys.stdin:
         line = line.split("#")[0].strip()
         if not line:
             continue
         parts = line.split()
         cmd, rest = parts[0], parts[1:]
-        if cmd == "wait":
+        if cmd == "wait" and first and snap:
+            c.boot_tick(int(rest[0]))
+        elif cmd == "wait":
             c.tick(int(rest[0]))
         elif cmd == "shot":
             c.shot(rest[0])
@@ -365,6 +421,7 @@ def main():
             break
         else:
             raise SystemExit("unknown command: %s" % cmd)
+        first = False
     if c.storage:
         with open(c.storage, "wb") as f:
             f.write(bytes(c.mem[0xC000:0xD000]))
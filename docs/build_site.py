@@ -4,13 +4,60 @@
 Static, self-contained (no Jekyll -> .nojekyll), responsive, light/dark. One
 shared shell (sidebar + header + footer) wraps every page; content lives in the
 PAGES table below. Screenshots are copied into docs/assets/img by the caller.
+
+The build is incremental. .build_manifest.json records, per output page, the
+hash, size and mtime of the page as written and its byte budget; a page that
+comes out byte-identical is not rewritten, so its mtime - and the published
+copy - stays put. PAGES.deps records every input each page read: the
+pc64/sdk/ files sdk_source() quoted and the screenshots fig()/film() placed,
+which is how --watch knows what a changed file feeds.
+
+Screenshots are not served as captured: fig() points <img srcset> at narrower
+copies and the lightbox at a losslessly recompressed full-size one, all under
+assets/img/v/ and keyed by the capture's content hash (see "images" below).
+Every build ends with the byte budget of each page.
+
+    python docs/build_site.py            write what changed
+    python docs/build_site.py --force    rewrite every page
+    python docs/build_site.py --watch    ... then rebuild, on every save of this
+                                         script, an SDK sample or a screenshot,
+                                         the pages that depend on it
 """
-import os, shutil, html, re
+import os, shutil, html, re, hashlib, json, sys, time, math
+from functools import reduce
+from operator import add
 
 _HERE = os.path.dirname(os.path.abspath(__file__))
 # When this script lives inside the docs/ folder (its committed home) it writes
 # there directly; from a scratch dir it writes to a docs/ subfolder.
 OUT = _HERE if os.path.basename(_HERE) == "docs" else os.path.join(_HERE, "docs")
+SDK = os.path.normpath(os.path.join(_HERE, "..", "pc64", "sdk"))
+IMG = os.path.join(OUT, "assets", "img")
+MANIFEST = os.path.join(OUT, ".build_manifest.json")
+sys.path.insert(0, os.path.join(_HERE, "..", "pc64", "tools"))
+import ppm2png                                # read_png/encode_png, stdlib only  # noqa: E402
+try:
+    from PIL import Image                     # optional: decodes and scales faster
+except ImportError:
+    Image = None
+
+# What the page being defined has read so far (sdk_source, fig, film). Each
+# PAGES[...] = assignment takes the list as that page's inputs and clears it;
+# every page's f-string is evaluated right there, so the attribution is exact.
+_READS = []
+
+
+class _Pages(dict):
+    """PAGES, remembering what each entry read (see _READS)."""
+
+    def __init__(self):
+        dict.__init__(self)
+        self.deps = {}
+
+    def __setitem__(self, fname, entry):
+        self.deps[fname] = sorted(set(_READS))
+        del _READS[:]
+        dict.__setitem__(self, fname, entry)
 
 # --------------------------------------------------------------------------- nav
 NAV = [
@@ -284,6 +331,7 @@ def sidebar(active):
 
 def page(fname, title, body):
     active = fname
+    body = _grid_sizes(body)
     # prev/next
     idx = [h for h, _ in PAGES_NAV].index(fname)
     pn = ""
@@ -320,18 +368,241 @@ def page(fname, title, body):
 </body>
 </html>"""
 
+# --------------------------------------------------------------------------- images
+# The captures are 1280x800 and a figure is drawn at most COLUMN CSS pixels
+# wide (.wrap's max-width less its padding), a half or a third of that in a
+# .grid. So fig() gives each screenshot a copy at 1/n of its width for every n
+# in VARIANTS, area-averaged, for the browser to pick by srcset/sizes; the
+# capture itself only loads where the slot needs it (a 2x screen, a full-width
+# figure) or when the reader opens the lightbox. Only whole fractions: a UI
+# capture at 11/16 scale smears every edge into new colours and its PNG comes
+# out larger than the original, where a clean half usually keeps the palette.
+# That is why a full-width figure has no COLUMN-wide copy: at 840 px the
+# captures measured 1.7-1.8x the bytes of the 1280 px original, so the
+# original is the cheapest thing that fills the column (and 2x wants more
+# pixels than a capture has).
+# Everything is re-encoded with ppm2png.encode_png(indexed=True) - most
+# captures have under 256 colours, so even the full-size copy usually shrinks,
+# losslessly - and a copy is only used where it is smaller than what it
+# replaces.
+#
+# assets/img/v/ is a cache: files are named by the capture's content hash, and
+# index.json maps that hash to what was made from it, so a build only decodes a
+# screenshot it has not seen. Commit it with the HTML. Bump _PIPELINE when the
+# scaler or the encoder changes to redo every copy.
+VARIANTS = (2,)
+COLUMN = 840
+SLOTS = {"cols-2": (COLUMN - 18) // 2, "cols-3": (COLUMN - 36) // 3}   # .grid gap 18px
+PAGE_BUDGET = 512 * 1024                        # flagged in the report past this
+VDIR = os.path.join(IMG, "v")
+VINDEX = os.path.join(VDIR, "index.json")
+_PIPELINE = 1
+_VIDX = None                                    # index.json, loaded on first use
+_VOF = {}                                       # IMG path -> its index entry
+
+def _shrink(w, h, rgb, W):
+    """Area-average 8-bit RGB `rgb` (w x h) down to W pixels wide. Each axis
+    is scaled by the exact ratio p/q: every sample is repeated q times (a slice
+    assignment) and then summed p at a time (p strided slices added with
+    map), so the per-pixel work all happens in C."""
+    H = max(1, round(h * W / w))
+    g = math.gcd(w, W); px, qx = w // g, W // g
+    g = math.gcd(h, H); py, qy = h // g, H // g
+    rows, stride, up = [], w * 3, bytearray(w * qx)
+    for y in range(h):
+        row, out = rgb[y * stride:(y + 1) * stride], [0] * (W * 3)
+        for c in range(3):
+            for j in range(qx):
+                up[j::qx] = row[c::3]
+            out[c::3] = reduce(lambda a, b: list(map(add, a, b)),
+                               (up[k::px] for k in range(px)), [0] * W)
+        rows.append(out)
+    d = px * py
+    half = d // 2
+    out = bytearray()
+    for Y in range(H):
+        acc = reduce(lambda a, b: list(map(add, a, b)),
+                     (rows[(Y * py + k) // qy] for k in range(py)))
+        out += bytes(map(lambda v: (v + half) // d, acc))
+    return W, H, bytes(out)
+
+def _decode(path):
+    """(w, h, rgb) of a screenshot, or None for one that keeps its alpha or
+    is not a kind ppm2png reads (it is then served as it is)."""
+    if Image is not None:
+        try:
+            im = Image.open(path)
+        except OSError:
+            return None
+        if im.mode not in ("RGB", "P", "L") or "transparency" in im.info:
+            return None
+        return im.width, im.height, im.convert("RGB").tobytes()
+    try:
+        return ppm2png.read_png(path)
+    except (ValueError, OSError):
+        return None
+
+def _scale(w, h, rgb, W):
+    if Image is not None:
+        box = getattr(Image, "Resampling", Image).BOX
+        H = max(1, round(h * W / w))
+        return W, H, Image.frombytes("RGB", (w, h), rgb).resize((W, H), box).tobytes()
+    return _shrink(w, h, rgb, W)
+
+def _vindex():
+    global _VIDX
+    if _VIDX is None:
+        try:
+            with open(VINDEX, encoding="utf-8") as f:
+                _VIDX = json.load(f)
+        except (OSError, ValueError):
+            _VIDX = {}
+    return _VIDX
+
+def _variants(src):
+    """The index entry for screenshot `src`, making its copies on a miss:
+    {"w", "h", "bytes": of the original, "full": [file, bytes] for the
+    lightbox, "srcset": [[file, width, bytes], ...] narrowest first}. Files
+    are relative to assets/img."""
+    path = os.path.join(IMG, src)
+    with open(path, "rb") as f:
+        data = f.read()
+    key = "%s.%d" % (hashlib.sha256(data).hexdigest()[:20], _PIPELINE)
+    ent = _vindex().get(key)
+    if ent and all(os.path.exists(os.path.join(IMG, v[0]))
+                   for v in ent["srcset"] + [ent["full"]]):
+        return ent
+    ent = {"src": src, "w": 0, "h": 0, "bytes": len(data), "full": [src, len(data)],
+           "srcset": []}
+    img = _decode(path) if src.endswith(".png") else None
+    if img is not None:
+        w, h, rgb = img
+        ent["w"], ent["h"] = w, h
+        stem = os.path.splitext(src)[0].replace("/", "_")
+        os.makedirs(VDIR, exist_ok=True)
+        png = ppm2png.encode_png(w, h, rgb, indexed=True)
+        if len(png) < len(data):
+            ent["full"] = _vput("v/%s.%s.png" % (stem, key[:10]), png)
+        for n in sorted(VARIANTS, reverse=True):
+            if w // n < 160:
+                continue
+            vw, vh, small = _scale(w, h, rgb, w // n)
+            png = ppm2png.encode_png(vw, vh, small, indexed=True)
+            if len(png) < ent["full"][1]:
+                ent["srcset"].append(_vput("v/%s-%d.%s.png" % (stem, vw, key[:10]), png)[:1]
+                                     + [vw, len(png)])
+        print("images: %s: %d -> %s bytes" % (src, len(data), ", ".join(
+            str(v[-1]) for v in ent["srcset"] + [ent["full"]])))
+    _vindex()[key] = ent
+    return ent
+
+def _vput(rel, png):
+    with open(os.path.join(IMG, rel), "wb") as f:
+        f.write(png)
+    return [rel, len(png)]
+
+def _vsave(prune):
+    """Write index.json; with `prune`, forget (and delete) every copy no
+    page placed this time - after a full build that is all of the stale ones."""
+    idx = _vindex()
+    if prune:
+        live = {id(e) for e in _VOF.values()}
+        for k in [k for k, e in idx.items() if id(e) not in live]:
+            del idx[k]
+        keep = {v[0] for e in idx.values() for v in e["srcset"] + [e["full"]]}
+        if os.path.isdir(VDIR):
+            for fn in os.listdir(VDIR):
+                if fn != "index.json" and "v/" + fn not in keep:
+                    os.remove(os.path.join(VDIR, fn))
+    if not idx and not os.path.exists(VINDEX):
+        return
+    text = json.dumps(idx, indent=1, sort_keys=True) + "\n"
+    try:
+        with open(VINDEX, encoding="utf-8") as f:
+            if f.read() == text:
+                return
+    except OSError:
+        pass
+    os.makedirs(VDIR, exist_ok=True)
+    with open(VINDEX, "w", newline="\n", encoding="utf-8") as f:
+        f.write(text)
+
+def _sizes(slot):
+    return f"(max-width: 860px) 100vw, {slot}px"
+
+def _grid_sizes(body):
+    """Narrow the sizes= of the figures inside a .grid to their cell: they
+    collapse to one column only where the sidebar does. A grid's cells are
+    <div>s themselves, so its end is the </div> that balances its opening
+    tag, not the first one."""
+    out, pos = [], 0
+    for m in re.finditer(r'<div class="grid (cols-\d)">', body):
+        if m.start() < pos:                     # a grid nested in one just done
+            continue
+        depth, end = 1, m.end()
+        for t in re.finditer(r'<div\b|</div>', body[m.end():]):
+            depth += 1 if t.group(0) == "<div" else -1
+            if not depth:
+                end = m.end() + t.end()
+                break
+        else:
+            end = len(body)
+        out.append(body[pos:m.start()])
+        out.append(body[m.start():end].replace(f'sizes="{_sizes(COLUMN)}"',
+                                               f'sizes="{_sizes(SLOTS[m.group(1)])}"'))
+        pos = end
+    out.append(body[pos:])
+    return "".join(out)
+
+def _weight(text):
+    """(bytes as captured, bytes fetched) of the images a page shows, for a
+    1x reader at full column width: per <img>, the narrowest srcset entry
+    that covers its slot. The lightbox copies are not counted - they load on
+    a click."""
+    byfile = {v[0]: e for e in _VOF.values() for v in e["srcset"] + [e["full"]]}
+    before = after = 0
+    for m in re.finditer(r'<(?:img|video)\b[^>]*>', text):
+        tag = m.group(0)
+        src = re.search(r'(?:src|poster)="assets/img/([^"]+)"', tag)
+        if not src:
+            continue
+        fetch = src.group(1)
+        slot = re.search(r'sizes="[^"]*?(\d+)px"', tag)
+        cands = re.findall(r'assets/img/(\S+) (\d+)w', tag)
+        if slot and cands:
+            fit = [f for f, w in cands if int(w) >= int(slot.group(1))]
+            fetch = fit[0] if fit else cands[-1][0]
+        path = os.path.join(IMG, fetch)
+        n = os.path.getsize(path) if os.path.exists(path) else 0
+        ent = byfile.get(fetch)
+        before += ent["bytes"] if ent else n
+        after += n
+    return before, after
+
 # --------------------------------------------------------------------------- helpers
 def fig(src, cap, cls=""):
     """A screenshot figure. Clicking the image opens it full size in the
     lightbox (see LIGHTBOX_JS): manual screenshots are scaled down to fit the
     text column, which makes small UI detail - a status line, an icon, a menu
-    item - unreadable at the size it is printed."""
+    item - unreadable at the size it is printed. The thumbnail itself comes
+    from the narrower copies (see "images" above)."""
+    path = os.path.join(IMG, src)
+    _READS.append(path)
+    ent = _VOF[path] = _variants(src)
+    full = ent["full"][0]
     c = f' class="{cls}"' if cls else ""
     alt = html.escape(re.sub(r"<[^>]+>", "", cap))          # plain text for alt
+    thumb = ent["srcset"][-1][0] if ent["srcset"] else full
+    img = f'<img src="assets/img/{thumb}" alt="{alt}" loading="lazy"'
+    if ent["w"]:
+        img += f' width="{ent["w"]}" height="{ent["h"]}"'
+    if ent["srcset"]:
+        cands = [f'assets/img/{v[0]} {v[1]}w' for v in ent["srcset"]]
+        cands.append(f'assets/img/{full} {ent["w"]}w')
+        img += f' srcset="{", ".join(cands)}" sizes="{_sizes(COLUMN)}"'
     return (f'<figure{c}><button type="button" class="zoom" '
-            f'data-full="assets/img/{src}" aria-label="Enlarge: {alt}">'
-            f'<img src="assets/img/{src}" alt="{alt}" loading="lazy">'
-            f'</button><figcaption>{cap}</figcaption></figure>')
+            f'data-full="assets/img/{full}" aria-label="Enlarge: {alt}">'
+            f'{img}></button><figcaption>{cap}</figcaption></figure>')
 
 DEMO_MP4 = "https://unodos.arinbakht.com/assets/unodos-demo.mp4"
 DUUM_MP4 = "https://unodos.arinbakht.com/assets/duum-demo.mp4"
@@ -346,6 +617,7 @@ def film(poster, cap, mp4=DEMO_MP4):
     needs a connection. preload="none" means the page costs nothing extra
     until the reader presses play. `mp4` picks which film (the whole-OS demo by
     default, or the shorter Duum film on the Python page)."""
+    _READS.append(os.path.join(IMG, poster))
     alt = html.escape(re.sub(r"<[^>]+>", "", cap))
     return (f'<figure class="film"><video controls preload="none" '
             f'poster="assets/img/{poster}" aria-label="{alt}">'
@@ -365,7 +637,9 @@ def code(s):
 def sdk_source(name):
     """Quote a shipped SDK sample verbatim (pc64/sdk/), so the manual can
     never drift from the file the user actually opens in Studio."""
-    with open(os.path.join(_HERE, "..", "pc64", "sdk", name), "r", encoding="utf-8") as f:
+    path = os.path.join(SDK, name)
+    _READS.append(path)
+    with open(path, "r", encoding="utf-8") as f:
         return code(f.read())
 
 # ---- code snippets (defined here so their { } don't clash with page f-strings) ----
@@ -828,7 +1102,7 @@ CODE_UNOCODE_SETTINGS = code('''// UnoCode settings.  Comments and trailing comm
     "files.trimTrailingWhitespace": true,
 }''')
 
-PAGES = {}
+PAGES = _Pages()
 
 PAGES["index.html"] = ("Overview", f"""
 <div class="hero">
@@ -4321,17 +4595,163 @@ intermittent bug you no longer reproduce-then-lose-the-evidence: the log is alre
 <a href="https://github.com/hmofet/unodos/blob/master/pc64/REMOTE.md" target="_blank" rel="noopener"><code>pc64/REMOTE.md</code></a>.</p>
 """)
 
-# --------------------------------------------------------------------------- emit
-def main():
-    os.makedirs(os.path.join(OUT, "assets", "img"), exist_ok=True)
-    with open(os.path.join(OUT, "assets", "style.css"), "w", newline="\n", encoding="utf-8") as f:
-        f.write(CSS)
-    open(os.path.join(OUT, ".nojekyll"), "w").close()
+# --------------------------------------------------------------------------- build
+def _sha(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+def _file_sha(path):
+    try:
+        with open(path, "rb") as f:
+            return _sha(f.read())
+    except OSError:
+        return None                                 # a missing input is an input too
+
+def _stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def _rel(path):
+    return os.path.relpath(path, OUT).replace(os.sep, "/")
+
+def _emit(rel, text, rec, force):
+    """Write OUT/rel unless it already holds `text`; returns True if written.
+    `rec` is the manifest entry from last time: when the file still has the
+    size and mtime it was left with and `text` hashes the same, it is not even
+    read back."""
+    path = os.path.join(OUT, rel)
+    h = _sha(text)
+    if not force:
+        if rec.get("out") == h and _stamp(path) == rec.get("stamp"):
+            return False
+        if _file_sha(path) == h:
+            return False
+    with open(path, "w", newline="\n", encoding="utf-8") as f:
+        f.write(text)
+    return True
+
+def build(only=None, force=False):
+    """Write style.css, .nojekyll and the pages in `only` (default: all) that
+    changed, and update the manifest. Returns the names written."""
+    os.makedirs(IMG, exist_ok=True)
+    try:
+        with open(MANIFEST, encoding="utf-8") as f:
+            man = json.load(f)
+    except (OSError, ValueError):
+        man = {}
+    pages = man.setdefault("pages", {})
+    wrote = []
+    css = man.get("css", {})
+    if _emit("assets/style.css", CSS, css, force):
+        wrote.append("assets/style.css")
+    man["css"] = {"out": _sha(CSS), "stamp": _stamp(os.path.join(OUT, "assets", "style.css"))}
+    if not os.path.exists(os.path.join(OUT, ".nojekyll")):
+        open(os.path.join(OUT, ".nojekyll"), "w").close()
     for fname, (title, body) in PAGES.items():
-        with open(os.path.join(OUT, fname), "w", newline="\n", encoding="utf-8") as f:
-            f.write(page(fname, title, body))
+        if only is not None and fname not in only:
+            continue
+        text = page(fname, title, body)
+        if _emit(fname, text, pages.get(fname, {}), force):
+            wrote.append(fname)
+        before, after = _weight(text)
+        pages[fname] = {
+            "out": _sha(text),
+            "bytes": {"html": len(text.encode("utf-8")), "img": after, "img_orig": before},
+            "stamp": _stamp(os.path.join(OUT, fname)),
+        }
+    _vsave(prune=only is None)
+    tmp = MANIFEST + ".tmp"
+    with open(tmp, "w", newline="\n", encoding="utf-8") as f:
+        json.dump(man, f, indent=1, sort_keys=True)
+    os.replace(tmp, MANIFEST)
+    return wrote
+
+def _report(wrote, total):
+    for fname in wrote:
         print("wrote", fname)
-    print("done ->", OUT)
+    print("done -> %s (%d written, %d unchanged)"
+          % (OUT, len(wrote), total - len(wrote)))
+
+def budget():
+    """Per page: the HTML, and the images a 1x reader at column width
+    fetches, against what the page cost with the captures as they are. The
+    lightbox copies are not counted - they load on a click."""
+    try:
+        with open(MANIFEST, encoding="utf-8") as f:
+            pages = json.load(f)["pages"]
+    except (OSError, ValueError, KeyError):
+        return
+    kb = lambda n: "%7.1f" % (n / 1024)
+    print("\n%-28s %7s %7s %7s %7s  KiB" % ("page", "html", "images", "total", "was"))
+    tot = [0, 0, 0]
+    for fname in PAGES:
+        b = pages.get(fname, {}).get("bytes")
+        if not b:
+            continue
+        now = b["html"] + b["img"]
+        tot = [tot[0] + b["html"], tot[1] + b["img"], tot[2] + b["html"] + b["img_orig"]]
+        print("%-28s %s %s %s %s%s" % (fname, kb(b["html"]), kb(b["img"]), kb(now),
+                                      kb(b["html"] + b["img_orig"]),
+                                      "  over budget" if now > PAGE_BUDGET else ""))
+    print("%-28s %s %s %s %s" % ("all pages", kb(tot[0]), kb(tot[1]),
+                                 kb(tot[0] + tot[1]), kb(tot[2])))
+
+def _sources():
+    """What --watch polls: this script, the SDK samples, the screenshots."""
+    paths = [os.path.abspath(__file__)]
+    for top in (SDK, IMG):
+        for root, dirs, files in os.walk(top):
+            if root == IMG and "v" in dirs:
+                dirs.remove("v")                # our own output (see "images")
+            paths += [os.path.join(root, fn) for fn in files]
+    return {p: _stamp(p) for p in paths}
+
+def watch(interval=0.5):
+    """Rebuild on every change until interrupted. A change to this script
+    rebuilds everything (any page may have been edited); a change to an SDK
+    file or a screenshot rebuilds only the pages whose PAGES.deps lists it.
+    Each round re-runs this script for a fresh PAGES, since page bodies are
+    rendered when it is loaded."""
+    import runpy
+    me = os.path.abspath(__file__)
+    seen = _sources()
+    print("watching %s, %s and %s (Ctrl-C to stop)" % (_rel(me), SDK, IMG))
+    while True:
+        time.sleep(interval)
+        now = _sources()
+        changed = {p for p in set(seen) | set(now) if seen.get(p) != now.get(p)}
+        if not changed:
+            continue
+        seen = now
+        try:
+            ns = runpy.run_path(me)
+        except Exception as e:                      # noqa: BLE001 - a typo mid-edit
+            print("build_site: %s: %s" % (type(e).__name__, e))
+            continue
+        if me in changed:
+            only = None
+        else:
+            rels = {_rel(p) for p in changed}
+            only = {fn for fn, deps in ns["PAGES"].deps.items()
+                    if rels & {_rel(d) for d in deps}}
+        wrote = ns["build"](only)
+        print("%s changed: %s" % (", ".join(sorted(_rel(p) for p in changed)),
+                                  ", ".join(wrote) or "no page differs"))
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    wrote = build(force="--force" in argv)
+    _report(wrote, len(PAGES) + 1)
+    budget()
+    if "--watch" in argv:
+        try:
+            watch()
+        except KeyboardInterrupt:
+            pass
 
 if __name__ == "__main__":
     main()
@@ -12,10 +12,13 @@ the pad themselves, so the harness only has to tick the scanline counter.
 
 Usage: python gba/harness.py <rom.gba> <out.png> [instr_millions]
 """
-import sys, struct, zlib
+import os, sys, struct
 from unicorn import Uc, UC_ARCH_ARM, UC_MODE_ARM, UC_PROT_ALL
 from unicorn.arm_const import UC_ARM_REG_SP, UC_ARM_REG_PC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+
 ROM   = 0x08000000
 IWRAM = 0x03000000
 EWRAM = 0x02000000
@@ -26,19 +29,6 @@ IO    = 0x04000000
 KEYINPUT = 0x04000130
 VCOUNT   = 0x04000006
 
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y*w*3:(y+1)*w*3]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
-
 def main():
     rom_path, out_path = sys.argv[1], sys.argv[2]
     storage, tail = None, []
@@ -60,7 +50,6 @@ def main():
     uc.mem_write(ROM, data)
     uc.reg_write(UC_ARM_REG_SP, 0x03007F00)
     uc.mem_write(KEYINPUT, struct.pack("<H", 0x03FF))   # no keys held (active-low)
-    import os
     FS_PA, FS_SIZE = 0x03002000, 0x1000
     if storage and os.path.exists(storage):
         with open(storage,"rb") as f: uc.mem_write(FS_PA, f.read()[:FS_SIZE])
@@ -84,16 +73,7 @@ def main():
 
     # render Mode 3 framebuffer (240x160, BGR555)
     fb = uc.mem_read(VRAM, 240 * 160 * 2)
-    rgb = bytearray(240 * 160 * 3)
-    for i in range(240 * 160):
-        v = fb[i*2] | (fb[i*2+1] << 8)
-        r = (v & 31) * 255 // 31
-        g = ((v >> 5) & 31) * 255 // 31
-        b = ((v >> 10) & 31) * 255 // 31
-        rgb[i*3] = r
-        rgb[i*3+1] = g
-        rgb[i*3+2] = b
-    write_png(out_path, 240, 160, rgb)
+    fbconv.write_png(out_path, 240, 160, fbconv.bgr555(fb))
     print("wrote %s (240x160) after ~%d instrs" % (out_path, chunks * CHUNK))
     if storage:
         with open(storage,"wb") as f: f.write(bytes(uc.mem_read(FS_PA, FS_SIZE)))
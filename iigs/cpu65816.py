@@ -13,10 +13,32 @@ through optional `read_hook(addr24)->int|None` and `write_hook(addr24,val)`
 callbacks so the harness can intercept the I/O page ($00/$E0 $Cxxx) and the
 WDM-trap firmware pages without the core knowing IIGS specifics.
 
+Speed: booting the kernel is a few million instructions, and the first core
+paid for generality on every one of them - each byte fetched went fb() ->
+rb() -> read_hook() -> mem, and each opcode asked the m8/x8 properties which
+width it was. So:
+
+  * the hooks are only consulted inside the I/O windows given up front
+    (`io=[(first, last), ...]`, 24-bit and inclusive); everywhere else an
+    access is a bytearray index. Without `io`, every address is a window,
+    exactly as before.
+  * there is one opcode table per M/X/E combination, its handlers built with
+    their widths (and emulation-mode stack) fixed, and REP/SEP/XCE/PLP/RTI
+    switch tables instead of every handler re-deriving them.
+  * run_until(pc=, wdm=) runs the fetch/dispatch loop itself until the
+    program counter reaches an address or a WDM with one of the given
+    signatures has been handled, so a harness waiting for a frame marker
+    makes one Python call per frame, not one per instruction.
+
 Not modelled (unused by UnoDOS boot/kernel): decimal-mode ADC/SBC BCD
 fix-ups (binary only - we never SED), cycle counts, abort/IRQ/NMI vector
 pulls beyond what RTI needs. STP/WAI halt the core (harness watches `halted`).
+
+    python cpu65816.py            self-test -> SELFTEST OK
+    python cpu65816.py --bench    instructions per second, step() and run_until()
 """
+import sys
+import time
 
 # flag bit masks (P register)
 C = 0x01   # carry
@@ -28,14 +50,29 @@ M = 0x20   # accumulator width: 1 => A is 8-bit
 V = 0x40   # overflow
 N = 0x80   # negative
 
+EMU = 4    # tables[EMU] is emulation mode; 0..3 are native, (P >> 4) & 3
+
+# A handler returns None, or one of these when the run loop has to look up:
+SWITCH = 1         # M/X/E may have changed (or the core halted)
+WDM_BIT = 0x100    # WDM_BIT | signature: a WDM was handled
+
+# the Z and N bits of P for every 8- and 16-bit result
+ZN8 = bytes(Z if v == 0 else v & N for v in range(0x100))
+ZN16 = bytes(Z if v == 0 else (N if v & 0x8000 else 0) for v in range(0x10000))
+
 
 class CPU65816:
     def __init__(self, mem=None, read_hook=None, write_hook=None,
-                 wdm_hook=None):
+                 wdm_hook=None, io=None):
         self.mem = mem if mem is not None else bytearray(1 << 24)
         self.read_hook = read_hook
         self.write_hook = write_hook
         self.wdm_hook = wdm_hook          # wdm_hook(cpu, imm8) called on WDM
+        # io_pages[addr >> 8] is 1 where the hooks are consulted
+        self.io_pages = bytearray(b"\x01" * (1 << 16) if io is None
+                                  else 1 << 16)
+        for first, last in io or ():
+            self.io_window(first, last)
         self.a = 0          # 16-bit accumulator (B:A when M=0)
         self.x = 0
         self.y = 0
@@ -48,12 +85,21 @@ class CPU65816:
         self.e = 1          # emulation mode (reset state)
         self.halted = False
         self.cycles = 0     # instruction count (rough budget meter)
-        self._build_table()
+        # mem and io_pages are bound into the tables: change them in place
+        self.tables = [self._build_table(m8, x8, e) for m8, x8, e in
+                       ((0, 0, 0), (0, 1, 0), (1, 0, 0), (1, 1, 0), (1, 1, 1))]
+
+    def io_window(self, first, last):
+        """Route addresses first..last (24-bit, inclusive) through the hooks,
+        a 256-byte page at a time: a hook returning None/False there still
+        falls through to RAM."""
+        for page in range((first & 0xFFFFFF) >> 8, ((last & 0xFFFFFF) >> 8) + 1):
+            self.io_pages[page] = 1
 
     # ------------------------------------------------------------- memory
     def rb(self, addr):
         addr &= 0xFFFFFF
-        if self.read_hook is not None:
+        if self.read_hook is not None and self.io_pages[addr >> 8]:
             v = self.read_hook(addr)
             if v is not None:
                 return v & 0xFF
@@ -62,7 +108,7 @@ class CPU65816:
     def wb(self, addr, val):
         addr &= 0xFFFFFF
         val &= 0xFF
-        if self.write_hook is not None:
+        if self.write_hook is not None and self.io_pages[addr >> 8]:
             if self.write_hook(addr, val):
                 return
         self.mem[addr] = val
@@ -129,67 +175,6 @@ class CPU65816:
         lo = self.pop_b()
         return lo | (self.pop_b() << 8)
 
-    # ------------------------------------------------- effective addresses
-    # Each returns a 24-bit effective address. Direct-page math wraps in
-    # bank 0; data accesses add DBR for the abs/(dp),y/etc. families.
-    def _dp(self):                       # direct page,  d + offset
-        off = self.fb()
-        return (self.d + off) & 0xFFFF
-
-    def _dp_x(self):
-        off = self.fb()
-        return (self.d + off + self.x) & 0xFFFF
-
-    def _dp_y(self):
-        off = self.fb()
-        return (self.d + off + self.y) & 0xFFFF
-
-    def _abs(self):
-        return (self.dbr << 16) | self.fw()
-
-    def _abs_x(self):
-        return ((self.dbr << 16) | self.fw()) + self.x & 0xFFFFFF
-
-    def _abs_y(self):
-        return ((self.dbr << 16) | self.fw()) + self.y & 0xFFFFFF
-
-    def _absl(self):
-        return self.fl()
-
-    def _absl_x(self):
-        return (self.fl() + self.x) & 0xFFFFFF
-
-    def _ind_dp(self):                   # (dp)
-        p = self._dp()
-        return (self.dbr << 16) | self.rw(p)
-
-    def _ind_dp_x(self):                 # (dp,x)
-        p = self._dp_x()
-        return (self.dbr << 16) | self.rw(p)
-
-    def _ind_dp_y(self):                 # (dp),y
-        p = self._dp()
-        base = (self.dbr << 16) | self.rw(p)
-        return (base + self.y) & 0xFFFFFF
-
-    def _indl_dp(self):                  # [dp]
-        p = self._dp()
-        return self.rw(p) | (self.rb((p + 2) & 0xFFFF) << 16)
-
-    def _indl_dp_y(self):                # [dp],y
-        p = self._dp()
-        base = self.rw(p) | (self.rb((p + 2) & 0xFFFF) << 16)
-        return (base + self.y) & 0xFFFFFF
-
-    def _sr(self):                       # stack relative
-        off = self.fb()
-        return (self.sp + off) & 0xFFFF
-
-    def _sr_y(self):                     # (sr),y
-        p = (self.sp + self.fb()) & 0xFFFF
-        base = (self.dbr << 16) | self.rw(p)
-        return (base + self.y) & 0xFFFFFF
-
     # width-aware load/store through an effective address
     def load_m(self, ea):
         return self.rb(ea) if self.m8 else self.rw(ea)
@@ -200,71 +185,6 @@ class CPU65816:
         else:
             self.ww(ea, val)
 
-    # ------------------------------------------------------------- ALU
-    def _adc(self, val):
-        if self.m8:
-            a = self.a & 0xFF
-            r = a + val + (self.p & C)
-            self.p &= ~(C | V | Z | N)
-            if r > 0xFF:
-                self.p |= C
-            if (~(a ^ val) & (a ^ r) & 0x80):
-                self.p |= V
-            r &= 0xFF
-            self.a = (self.a & 0xFF00) | r
-            self.set_zn(r, True)
-        else:
-            a = self.a & 0xFFFF
-            r = a + val + (self.p & C)
-            self.p &= ~(C | V | Z | N)
-            if r > 0xFFFF:
-                self.p |= C
-            if (~(a ^ val) & (a ^ r) & 0x8000):
-                self.p |= V
-            r &= 0xFFFF
-            self.a = r
-            self.set_zn(r, False)
-
-    def _sbc(self, val):
-        if self.m8:
-            val ^= 0xFF
-            a = self.a & 0xFF
-            r = a + val + (self.p & C)
-            self.p &= ~(C | V | Z | N)
-            if r > 0xFF:
-                self.p |= C
-            if (~(a ^ val) & (a ^ r) & 0x80):
-                self.p |= V
-            r &= 0xFF
-            self.a = (self.a & 0xFF00) | r
-            self.set_zn(r, True)
-        else:
-            val ^= 0xFFFF
-            a = self.a & 0xFFFF
-            r = a + val + (self.p & C)
-            self.p &= ~(C | V | Z | N)
-            if r > 0xFFFF:
-                self.p |= C
-            if (~(a ^ val) & (a ^ r) & 0x8000):
-                self.p |= V
-            r &= 0xFFFF
-            self.a = r
-            self.set_zn(r, False)
-
-    def _cmp(self, reg, val, eight):
-        if eight:
-            r = (reg & 0xFF) - (val & 0xFF)
-            self.p &= ~(C | Z | N)
-            if r >= 0:
-                self.p |= C
-            self.set_zn(r & 0xFF, True)
-        else:
-            r = (reg & 0xFFFF) - (val & 0xFFFF)
-            self.p &= ~(C | Z | N)
-            if r >= 0:
-                self.p |= C
-            self.set_zn(r & 0xFFFF, False)
-
     # ------------------------------------------------------- run / step
     def reset(self, pc=None, pbr=0):
         self.e = 1
@@ -278,845 +198,788 @@ class CPU65816:
         self.pc = pc & 0xFFFF
         self.halted = False
 
+    @property
+    def mode(self):
+        """Index of the opcode table for the current M/X/E state."""
+        return EMU if self.e else (self.p >> 4) & 3
+
+    @property
+    def table(self):
+        return self.tables[self.mode]
+
     def step(self):
         op = self.fb()
         self.cycles += 1
-        self.table[op]()
+        self.tables[self.mode][op]()
 
     def run(self, max_steps=20_000_000):
+        return self.run_until(max_steps=max_steps)
+
+    def run_until(self, pc=None, wdm=(), max_steps=20_000_000):
+        """Run until the core halts, `max_steps` instructions have run, the
+        next instruction is at `pc` (24-bit, PBR:PC; not executed), or a WDM
+        whose signature is in `wdm` has been handled. Returns the number of
+        instructions run.
+
+        Hooks see the same accesses as under step(). The table is looked up
+        again after every handler that can change M/X/E, and after a WDM hook
+        (which may change P itself); a hook that sets `halted` is seen at the
+        next WDM or mode switch."""
+        if self.halted:
+            return 0
+        tables, mem, io = self.tables, self.mem, self.io_pages
+        rb = self.rb
+        stop = -1 if pc is None else pc & 0xFFFFFF
+        stop_wdm = frozenset(WDM_BIT | s for s in wdm)
+        tbl = tables[self.mode]
         n = 0
-        while not self.halted and n < max_steps:
-            self.step()
-            n += 1
+        try:
+            while n < max_steps:
+                at = (self.pbr << 16) | self.pc
+                if at == stop:
+                    break
+                self.pc = (self.pc + 1) & 0xFFFF
+                n += 1
+                r = tbl[rb(at) if io[at >> 8] else mem[at]]()
+                if r:
+                    if self.halted or r in stop_wdm:
+                        break
+                    tbl = tables[EMU if self.e else (self.p >> 4) & 3]
+        finally:
+            self.cycles += n
         return n
 
     # =====================================================================
-    #  opcode table
+    #  opcode tables
     # =====================================================================
-    def _build_table(self):
-        t = [self._op_brk] * 256
-        # --- helpers that close over a mode-fn and apply an operation -----
+    def _build_table(self, m8, x8, e):
+        """The 256 handlers for one M/X/E state: every width test and the
+        emulation-mode stack wrap are settled here, once."""
+        cpu = self
+        mem = self.mem
+        io = self.io_pages
+        hrb, hwb = self.rb, self.wb        # the hooked paths, for I/O pages
+
+        MW = 0xFF if m8 else 0xFFFF        # accumulator mask / sign bit
+        MS = 0x80 if m8 else 0x8000
+        KEEP = 0xFF00 if m8 else 0         # B survives 8-bit A writes
+        XW = 0xFF if x8 else 0xFFFF        # index mask / sign bit
+        XS = 0x80 if x8 else 0x8000
+        NZN = ~(Z | N)
+
+        # --- memory: straight to the bytearray outside the I/O windows ---
+        def rb(a):
+            return hrb(a) if io[a >> 8] else mem[a]
+
+        def rw(a):
+            b = (a + 1) & 0xFFFFFF
+            if io[a >> 8] or io[b >> 8]:
+                return hrb(a) | (hrb(b) << 8)
+            return mem[a] | (mem[b] << 8)
+
+        def wb(a, v):
+            if io[a >> 8]:
+                hwb(a, v)
+            else:
+                mem[a] = v & 0xFF
+
+        def ww(a, v):
+            b = (a + 1) & 0xFFFFFF
+            if io[a >> 8] or io[b >> 8]:
+                hwb(a, v & 0xFF)
+                hwb(b, (v >> 8) & 0xFF)
+            else:
+                mem[a] = v & 0xFF
+                mem[b] = (v >> 8) & 0xFF
+
+        def fb():
+            pc = cpu.pc
+            a = (cpu.pbr << 16) | pc
+            cpu.pc = (pc + 1) & 0xFFFF
+            return hrb(a) if io[a >> 8] else mem[a]
+
+        def fw():
+            pc = cpu.pc
+            bank = cpu.pbr << 16
+            a, b = bank | pc, bank | ((pc + 1) & 0xFFFF)
+            cpu.pc = (pc + 2) & 0xFFFF
+            if io[a >> 8] or io[b >> 8]:
+                return hrb(a) | (hrb(b) << 8)
+            return mem[a] | (mem[b] << 8)
+
+        def fl():
+            lo = fw()
+            return lo | (fb() << 16)
+
+        load_m, store_m = (rb, wb) if m8 else (rw, ww)
+        load_x, store_x = (rb, wb) if x8 else (rw, ww)
+        imm_m = fb if m8 else fw
+        imm_x = fb if x8 else fw
+
+        ZNM = ZN8 if m8 else ZN16          # P's Z/N for an A- or X-sized value
+        ZNX = ZN8 if x8 else ZN16
+
+        # --- stack ---
+        if e:
+            def push_b(v):
+                sp = cpu.sp
+                wb(sp, v & 0xFF)
+                cpu.sp = 0x0100 | ((sp - 1) & 0xFF)
+
+            def pop_b():
+                sp = cpu.sp = 0x0100 | ((cpu.sp + 1) & 0xFF)
+                return rb(sp)
+        else:
+            def push_b(v):
+                sp = cpu.sp
+                wb(sp, v & 0xFF)
+                cpu.sp = (sp - 1) & 0xFFFF
+
+            def pop_b():
+                sp = cpu.sp = (cpu.sp + 1) & 0xFFFF
+                return rb(sp)
+
+        def push_w(v):
+            push_b(v >> 8)
+            push_b(v)
+
+        def pop_w():
+            lo = pop_b()
+            return lo | (pop_b() << 8)
+
+        push_m = push_b if m8 else push_w
+        push_x = push_b if x8 else push_w
+        pop_m = pop_b if m8 else pop_w
+        pop_x = pop_b if x8 else pop_w
+
+        # --- effective addresses (24-bit). Direct-page math wraps in bank
+        #     0; data accesses add DBR for the abs/(dp),y/etc. families. ---
+        def dp():
+            pc = cpu.pc
+            a = (cpu.pbr << 16) | pc
+            cpu.pc = (pc + 1) & 0xFFFF
+            return (cpu.d + (hrb(a) if io[a >> 8] else mem[a])) & 0xFFFF
+
+        def dp_x():
+            return (cpu.d + fb() + cpu.x) & 0xFFFF
+
+        def dp_y():
+            return (cpu.d + fb() + cpu.y) & 0xFFFF
+
+        def ab():
+            pc = cpu.pc
+            bank = cpu.pbr << 16
+            a, b = bank | pc, bank | ((pc + 1) & 0xFFFF)
+            cpu.pc = (pc + 2) & 0xFFFF
+            if io[a >> 8] or io[b >> 8]:
+                return (cpu.dbr << 16) | hrb(a) | (hrb(b) << 8)
+            return (cpu.dbr << 16) | mem[a] | (mem[b] << 8)
+
+        def ab_x():
+            return ((cpu.dbr << 16) | fw()) + cpu.x & 0xFFFFFF
+
+        def ab_y():
+            return ((cpu.dbr << 16) | fw()) + cpu.y & 0xFFFFFF
+
+        def abl_x():
+            return (fl() + cpu.x) & 0xFFFFFF
+
+        def ind_dp():                      # (dp)
+            return (cpu.dbr << 16) | rw(dp())
+
+        def ind_dp_x():                    # (dp,x)
+            return (cpu.dbr << 16) | rw(dp_x())
+
+        def ind_dp_y():                    # (dp),y
+            return ((cpu.dbr << 16) | rw(dp())) + cpu.y & 0xFFFFFF
+
+        def indl_dp():                     # [dp]
+            p = dp()
+            return rw(p) | (rb((p + 2) & 0xFFFF) << 16)
+
+        def indl_dp_y():                   # [dp],y
+            p = dp()
+            return (rw(p) | (rb((p + 2) & 0xFFFF) << 16)) + cpu.y & 0xFFFFFF
+
+        def sr():                          # stack relative
+            return (cpu.sp + fb()) & 0xFFFF
+
+        def sr_y():                        # (sr),y
+            return ((cpu.dbr << 16) | rw((cpu.sp + fb()) & 0xFFFF)) + cpu.y \
+                & 0xFFFFFF
+
+        # the full ALU set; imm is the M-sized immediate, not an address
+        ALU = {0x01: ind_dp_x, 0x03: sr, 0x05: dp, 0x07: indl_dp, 0x09: None,
+               0x0D: ab, 0x0F: fl, 0x11: ind_dp_y, 0x12: ind_dp, 0x13: sr_y,
+               0x15: dp_x, 0x17: indl_dp_y, 0x19: ab_y, 0x1D: ab_x, 0x1F: abl_x}
+
+        def operand(mode):
+            """A getter for the M-sized value an ALU op works on."""
+            if mode is None:
+                return imm_m
+            if m8:
+                def get():
+                    a = mode()
+                    return hrb(a) if io[a >> 8] else mem[a]
+                return get
+            return lambda: rw(mode())
+
+        # --- ALU ---
+        def adc(v):
+            a = cpu.a & MW
+            r = a + v + (cpu.p & C)
+            p = cpu.p & ~(C | V | Z | N)
+            if r > MW:
+                p |= C
+            if ~(a ^ v) & (a ^ r) & MS:
+                p |= V
+            r &= MW
+            cpu.a = (cpu.a & KEEP) | r
+            cpu.p = p | (0 if r else Z) | (N if r & MS else 0)
+
+        def compare(reg, v, w, s):
+            r = (reg & w) - (v & w)
+            p = cpu.p & ~(C | Z | N)
+            if r >= 0:
+                p |= C
+            r &= w
+            cpu.p = p | (0 if r else Z) | (N if r & s else 0)
 
-        def ld_a(mode):
-            def f():
-                v = self.load_m(mode())
-                if self.m8:
-                    self.a = (self.a & 0xFF00) | (v & 0xFF)
-                    self.set_zn(self.a, True)
-                else:
-                    self.a = v & 0xFFFF
-                    self.set_zn(self.a, False)
-            return f
+        t = [None] * 256
 
-        def ld_x(mode):
+        def ora(get):
             def f():
-                if self.x8:
-                    self.x = self.rb(mode()) & 0xFF
-                    self.set_zn(self.x, True)
-                else:
-                    self.x = self.rw(mode()) & 0xFFFF
-                    self.set_zn(self.x, False)
+                a = cpu.a = (cpu.a & KEEP) | ((cpu.a | get()) & MW)
+                cpu.p = (cpu.p & NZN) | ZNM[a & MW]
             return f
 
-        def ld_y(mode):
+        def and_(get):
             def f():
-                if self.x8:
-                    self.y = self.rb(mode()) & 0xFF
-                    self.set_zn(self.y, True)
-                else:
-                    self.y = self.rw(mode()) & 0xFFFF
-                    self.set_zn(self.y, False)
+                a = cpu.a = (cpu.a & KEEP) | ((cpu.a & get()) & MW)
+                cpu.p = (cpu.p & NZN) | ZNM[a & MW]
             return f
 
-        def st_a(mode):
+        def eor(get):
             def f():
-                self.store_m(mode(), self.a)
+                a = cpu.a = (cpu.a & KEEP) | ((cpu.a ^ get()) & MW)
+                cpu.p = (cpu.p & NZN) | ZNM[a & MW]
             return f
 
-        def st_x(mode):
+        def adc_(get):
             def f():
-                ea = mode()
-                if self.x8:
-                    self.wb(ea, self.x)
-                else:
-                    self.ww(ea, self.x)
+                adc(get())
             return f
 
-        def st_y(mode):
+        def sbc_(get):
             def f():
-                ea = mode()
-                if self.x8:
-                    self.wb(ea, self.y)
-                else:
-                    self.ww(ea, self.y)
+                adc(get() ^ MW)
             return f
 
-        def st_z(mode):
+        def cmp_(get):
             def f():
-                self.store_m(mode(), 0)
+                compare(cpu.a, get(), MW, MS)
             return f
 
-        def op_and(mode):
+        def lda(get):
             def f():
-                v = self.load_m(mode())
-                if self.m8:
-                    self.a = (self.a & 0xFF00) | ((self.a & v) & 0xFF)
-                    self.set_zn(self.a, True)
-                else:
-                    self.a &= v
-                    self.set_zn(self.a, False)
+                a = cpu.a = (cpu.a & KEEP) | get()
+                cpu.p = (cpu.p & NZN) | ZNM[a & MW]
             return f
 
-        def op_ora(mode):
+        def sta(mode):
             def f():
-                v = self.load_m(mode())
-                if self.m8:
-                    self.a = (self.a & 0xFF00) | ((self.a | v) & 0xFF)
-                    self.set_zn(self.a, True)
-                else:
-                    self.a |= v
-                    self.set_zn(self.a, False)
+                store_m(mode(), cpu.a)
             return f
 
-        def op_eor(mode):
+        for base, fn in ((0x00, ora), (0x20, and_), (0x40, eor), (0x60, adc_),
+                         (0xA0, lda), (0xC0, cmp_), (0xE0, sbc_)):
+            for low, mode in ALU.items():
+                t[base | low] = fn(operand(mode))
+        for low, mode in ALU.items():
+            if mode is not None:
+                t[0x80 | low] = sta(mode)
+
+        # --- LDX/LDY/STX/STY/STZ/CPX/CPY ---
+        def ldx(get):
             def f():
-                v = self.load_m(mode())
-                if self.m8:
-                    self.a = (self.a & 0xFF00) | ((self.a ^ v) & 0xFF)
-                    self.set_zn(self.a, True)
-                else:
-                    self.a ^= v
-                    self.set_zn(self.a, False)
+                v = cpu.x = get()
+                cpu.p = (cpu.p & NZN) | ZNX[v & XW]
             return f
 
-        def op_adc(mode):
+        def ldy(get):
             def f():
-                self._adc(self.load_m(mode()))
+                v = cpu.y = get()
+                cpu.p = (cpu.p & NZN) | ZNX[v & XW]
             return f
 
-        def op_sbc(mode):
+        def idx(mode):
+            return imm_x if mode is None else (lambda: load_x(mode()))
+
+        def stx(mode):
             def f():
-                self._sbc(self.load_m(mode()))
+                store_x(mode(), cpu.x)
             return f
 
-        def op_cmp(mode):
+        def sty(mode):
             def f():
-                self._cmp(self.a, self.load_m(mode()), self.m8)
+                store_x(mode(), cpu.y)
             return f
 
-        def op_cpx(mode):
+        def stz(mode):
             def f():
-                v = self.rb(mode()) if self.x8 else self.rw(mode())
-                self._cmp(self.x, v, self.x8)
+                store_m(mode(), 0)
             return f
 
-        def op_cpy(mode):
+        def cpx(get):
             def f():
-                v = self.rb(mode()) if self.x8 else self.rw(mode())
-                self._cmp(self.y, v, self.x8)
+                compare(cpu.x, get(), XW, XS)
             return f
 
-        def op_bit(mode, imm=False):
+        def cpy(get):
             def f():
-                v = self.load_m(mode())
-                if self.m8:
-                    self.p &= ~Z
-                    if (self.a & v & 0xFF) == 0:
-                        self.p |= Z
-                    if not imm:
-                        self.p = (self.p & ~(N | V)) | (v & 0xC0)
-                else:
-                    self.p &= ~Z
-                    if (self.a & v & 0xFFFF) == 0:
-                        self.p |= Z
-                    if not imm:
-                        self.p = (self.p & ~(N | V)) | ((v >> 8) & 0xC0)
+                compare(cpu.y, get(), XW, XS)
             return f
 
-        # read-modify-write helpers (memory)
-        def rmw(mode, fn):
+        t[0xA2] = ldx(idx(None))
+        t[0xA6] = ldx(idx(dp)); t[0xB6] = ldx(idx(dp_y))
+        t[0xAE] = ldx(idx(ab)); t[0xBE] = ldx(idx(ab_y))
+        t[0xA0] = ldy(idx(None))
+        t[0xA4] = ldy(idx(dp)); t[0xB4] = ldy(idx(dp_x))
+        t[0xAC] = ldy(idx(ab)); t[0xBC] = ldy(idx(ab_x))
+        t[0x86] = stx(dp); t[0x96] = stx(dp_y); t[0x8E] = stx(ab)
+        t[0x84] = sty(dp); t[0x94] = sty(dp_x); t[0x8C] = sty(ab)
+        t[0x64] = stz(dp); t[0x74] = stz(dp_x)
+        t[0x9C] = stz(ab); t[0x9E] = stz(ab_x)
+        t[0xE0] = cpx(idx(None)); t[0xE4] = cpx(idx(dp)); t[0xEC] = cpx(idx(ab))
+        t[0xC0] = cpy(idx(None)); t[0xC4] = cpy(idx(dp)); t[0xCC] = cpy(idx(ab))
+
+        # --- BIT ---
+        def bit(mode):
             def f():
-                ea = mode()
-                if self.m8:
-                    v = self.rb(ea)
-                    v = fn(v, True)
-                    self.wb(ea, v & 0xFF)
-                else:
-                    v = self.rw(ea)
-                    v = fn(v, False)
-                    self.ww(ea, v & 0xFFFF)
+                v = load_m(mode())
+                p = (cpu.p & ~(Z | N | V)) | (0 if cpu.a & v & MW else Z)
+                cpu.p = p | ((v if m8 else v >> 8) & 0xC0)
             return f
 
-        def _asl(v, e8):
-            top = 0x80 if e8 else 0x8000
-            self.p = (self.p & ~C) | (C if v & top else 0)
+        def bit_imm():
+            p = cpu.p & ~Z
+            cpu.p = p | (0 if cpu.a & imm_m() & MW else Z)
+
+        t[0x89] = bit_imm
+        t[0x24] = bit(dp); t[0x34] = bit(dp_x)
+        t[0x2C] = bit(ab); t[0x3C] = bit(ab_x)
+
+        # --- shifts, INC/DEC, TSB/TRB: fn(v) -> result, flags set ---
+        def asl(v):
+            cpu.p = (cpu.p & ~C) | (C if v & MS else 0)
             v <<= 1
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _lsr(v, e8):
-            self.p = (self.p & ~C) | (C if v & 1 else 0)
+        def lsr(v):
+            cpu.p = (cpu.p & ~C) | (v & 1)
             v >>= 1
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _rol(v, e8):
-            top = 0x80 if e8 else 0x8000
-            cin = self.p & C
-            self.p = (self.p & ~C) | (C if v & top else 0)
+        def rol(v):
+            cin = cpu.p & C
+            cpu.p = (cpu.p & ~C) | (C if v & MS else 0)
             v = (v << 1) | cin
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _ror(v, e8):
-            cin = (self.p & C) << (7 if e8 else 15)
-            self.p = (self.p & ~C) | (C if v & 1 else 0)
+        def ror(v):
+            cin = (cpu.p & C) << (7 if m8 else 15)
+            cpu.p = (cpu.p & ~C) | (v & 1)
             v = (v >> 1) | cin
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _inc(v, e8):
+        def inc(v):
             v += 1
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _dec(v, e8):
+        def dec(v):
             v -= 1
-            self.set_zn(v, e8)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
             return v
 
-        def _tsb(v, e8):
-            a = self.a & (0xFF if e8 else 0xFFFF)
-            self.p = (self.p & ~Z) | (Z if (a & v) == 0 else 0)
+        def tsb(v):
+            a = cpu.a & MW
+            cpu.p = (cpu.p & ~Z) | (0 if a & v else Z)
             return v | a
 
-        def _trb(v, e8):
-            a = self.a & (0xFF if e8 else 0xFFFF)
-            self.p = (self.p & ~Z) | (Z if (a & v) == 0 else 0)
+        def trb(v):
+            a = cpu.a & MW
+            cpu.p = (cpu.p & ~Z) | (0 if a & v else Z)
             return v & ~a
 
-        # accumulator-mode shifts
-        def acc(fn):
+        def rmw(mode, fn):
             def f():
-                if self.m8:
-                    r = fn(self.a & 0xFF, True)
-                    self.a = (self.a & 0xFF00) | (r & 0xFF)
-                else:
-                    self.a = fn(self.a & 0xFFFF, False) & 0xFFFF
+                ea = mode()
+                store_m(ea, fn(load_m(ea)) & MW)
             return f
 
-        # immediate operand fetch sized by M / X
-        def imm_m():
-            return self.fw() if not self.m8 else self.fb()
-
-        def imm_x():
-            return self.fw() if not self.x8 else self.fb()
-
-        # ---- the ALU/load/store address modes, keyed by suffix ----
-        M_dp = self._dp
-        M_dpx = self._dp_x
-        M_dpy = self._dp_y
-        M_abs = self._abs
-        M_absx = self._abs_x
-        M_absy = self._abs_y
-        M_absl = self._absl
-        M_abslx = self._absl_x
-        M_indd = self._ind_dp
-        M_inddx = self._ind_dp_x
-        M_inddy = self._ind_dp_y
-        M_ildp = self._indl_dp
-        M_ildpy = self._indl_dp_y
-        M_sr = self._sr
-        M_sry = self._sr_y
-
-        # ---------- LDA (full mode set) ----------
-        t[0xA9] = self._imm_a_lda
-        t[0xA5] = ld_a(M_dp); t[0xB5] = ld_a(M_dpx)
-        t[0xAD] = ld_a(M_abs); t[0xBD] = ld_a(M_absx); t[0xB9] = ld_a(M_absy)
-        t[0xAF] = ld_a(M_absl); t[0xBF] = ld_a(M_abslx)
-        t[0xA1] = ld_a(M_inddx); t[0xB1] = ld_a(M_inddy); t[0xB2] = ld_a(M_indd)
-        t[0xA7] = ld_a(M_ildp); t[0xB7] = ld_a(M_ildpy)
-        t[0xA3] = ld_a(M_sr); t[0xB3] = ld_a(M_sry)
-        # ---------- STA ----------
-        t[0x85] = st_a(M_dp); t[0x95] = st_a(M_dpx)
-        t[0x8D] = st_a(M_abs); t[0x9D] = st_a(M_absx); t[0x99] = st_a(M_absy)
-        t[0x8F] = st_a(M_absl); t[0x9F] = st_a(M_abslx)
-        t[0x81] = st_a(M_inddx); t[0x91] = st_a(M_inddy); t[0x92] = st_a(M_indd)
-        t[0x87] = st_a(M_ildp); t[0x97] = st_a(M_ildpy)
-        t[0x83] = st_a(M_sr); t[0x93] = st_a(M_sry)
-        # ---------- LDX / LDY ----------
-        t[0xA2] = self._imm_x_ldx
-        t[0xA6] = ld_x(M_dp); t[0xB6] = ld_x(M_dpy)
-        t[0xAE] = ld_x(M_abs); t[0xBE] = ld_x(M_absy)
-        t[0xA0] = self._imm_x_ldy
-        t[0xA4] = ld_y(M_dp); t[0xB4] = ld_y(M_dpx)
-        t[0xAC] = ld_y(M_abs); t[0xBC] = ld_y(M_absx)
-        # ---------- STX / STY / STZ ----------
-        t[0x86] = st_x(M_dp); t[0x96] = st_x(M_dpy)
-        t[0x8E] = st_x(M_abs)
-        t[0x84] = st_y(M_dp); t[0x94] = st_y(M_dpx)
-        t[0x8C] = st_y(M_abs)
-        t[0x64] = st_z(M_dp); t[0x74] = st_z(M_dpx)
-        t[0x9C] = st_z(M_abs); t[0x9E] = st_z(M_absx)
-        # ---------- AND / ORA / EOR ----------
-        t[0x29] = op_and(None)  # immediate handled specially below
-        t[0x25] = op_and(M_dp); t[0x35] = op_and(M_dpx)
-        t[0x2D] = op_and(M_abs); t[0x3D] = op_and(M_absx); t[0x39] = op_and(M_absy)
-        t[0x2F] = op_and(M_absl); t[0x3F] = op_and(M_abslx)
-        t[0x21] = op_and(M_inddx); t[0x31] = op_and(M_inddy); t[0x32] = op_and(M_indd)
-        t[0x27] = op_and(M_ildp); t[0x37] = op_and(M_ildpy)
-        t[0x23] = op_and(M_sr); t[0x33] = op_and(M_sry)
-        t[0x09] = op_ora(None)
-        t[0x05] = op_ora(M_dp); t[0x15] = op_ora(M_dpx)
-        t[0x0D] = op_ora(M_abs); t[0x1D] = op_ora(M_absx); t[0x19] = op_ora(M_absy)
-        t[0x0F] = op_ora(M_absl); t[0x1F] = op_ora(M_abslx)
-        t[0x01] = op_ora(M_inddx); t[0x11] = op_ora(M_inddy); t[0x12] = op_ora(M_indd)
-        t[0x07] = op_ora(M_ildp); t[0x17] = op_ora(M_ildpy)
-        t[0x03] = op_ora(M_sr); t[0x13] = op_ora(M_sry)
-        t[0x49] = op_eor(None)
-        t[0x45] = op_eor(M_dp); t[0x55] = op_eor(M_dpx)
-        t[0x4D] = op_eor(M_abs); t[0x5D] = op_eor(M_absx); t[0x59] = op_eor(M_absy)
-        t[0x4F] = op_eor(M_absl); t[0x5F] = op_eor(M_abslx)
-        t[0x41] = op_eor(M_inddx); t[0x51] = op_eor(M_inddy); t[0x52] = op_eor(M_indd)
-        t[0x47] = op_eor(M_ildp); t[0x57] = op_eor(M_ildpy)
-        t[0x43] = op_eor(M_sr); t[0x53] = op_eor(M_sry)
-        # immediate AND/ORA/EOR need M-sized fetch -> dedicated handlers
-        t[0x29] = self._imm_and; t[0x09] = self._imm_ora; t[0x49] = self._imm_eor
-        # ---------- ADC / SBC ----------
-        t[0x69] = self._imm_adc
-        t[0x65] = op_adc(M_dp); t[0x75] = op_adc(M_dpx)
-        t[0x6D] = op_adc(M_abs); t[0x7D] = op_adc(M_absx); t[0x79] = op_adc(M_absy)
-        t[0x6F] = op_adc(M_absl); t[0x7F] = op_adc(M_abslx)
-        t[0x61] = op_adc(M_inddx); t[0x71] = op_adc(M_inddy); t[0x72] = op_adc(M_indd)
-        t[0x67] = op_adc(M_ildp); t[0x77] = op_adc(M_ildpy)
-        t[0x63] = op_adc(M_sr); t[0x73] = op_adc(M_sry)
-        t[0xE9] = self._imm_sbc
-        t[0xE5] = op_sbc(M_dp); t[0xF5] = op_sbc(M_dpx)
-        t[0xED] = op_sbc(M_abs); t[0xFD] = op_sbc(M_absx); t[0xF9] = op_sbc(M_absy)
-        t[0xEF] = op_sbc(M_absl); t[0xFF] = op_sbc(M_abslx)
-        t[0xE1] = op_sbc(M_inddx); t[0xF1] = op_sbc(M_inddy); t[0xF2] = op_sbc(M_indd)
-        t[0xE7] = op_sbc(M_ildp); t[0xF7] = op_sbc(M_ildpy)
-        t[0xE3] = op_sbc(M_sr); t[0xF3] = op_sbc(M_sry)
-        # ---------- CMP / CPX / CPY ----------
-        t[0xC9] = self._imm_cmp
-        t[0xC5] = op_cmp(M_dp); t[0xD5] = op_cmp(M_dpx)
-        t[0xCD] = op_cmp(M_abs); t[0xDD] = op_cmp(M_absx); t[0xD9] = op_cmp(M_absy)
-        t[0xCF] = op_cmp(M_absl); t[0xDF] = op_cmp(M_abslx)
-        t[0xC1] = op_cmp(M_inddx); t[0xD1] = op_cmp(M_inddy); t[0xD2] = op_cmp(M_indd)
-        t[0xC7] = op_cmp(M_ildp); t[0xD7] = op_cmp(M_ildpy)
-        t[0xC3] = op_cmp(M_sr); t[0xD3] = op_cmp(M_sry)
-        t[0xE0] = self._imm_cpx
-        t[0xE4] = op_cpx(M_dp); t[0xEC] = op_cpx(M_abs)
-        t[0xC0] = self._imm_cpy
-        t[0xC4] = op_cpy(M_dp); t[0xCC] = op_cpy(M_abs)
-        # ---------- BIT ----------
-        t[0x89] = self._imm_bit
-        t[0x24] = op_bit(M_dp); t[0x34] = op_bit(M_dpx)
-        t[0x2C] = op_bit(M_abs); t[0x3C] = op_bit(M_absx)
-        # ---------- shifts / RMW ----------
-        t[0x0A] = acc(_asl); t[0x4A] = acc(_lsr)
-        t[0x2A] = acc(_rol); t[0x6A] = acc(_ror)
-        t[0x06] = rmw(M_dp, _asl); t[0x16] = rmw(M_dpx, _asl)
-        t[0x0E] = rmw(M_abs, _asl); t[0x1E] = rmw(M_absx, _asl)
-        t[0x46] = rmw(M_dp, _lsr); t[0x56] = rmw(M_dpx, _lsr)
-        t[0x4E] = rmw(M_abs, _lsr); t[0x5E] = rmw(M_absx, _lsr)
-        t[0x26] = rmw(M_dp, _rol); t[0x36] = rmw(M_dpx, _rol)
-        t[0x2E] = rmw(M_abs, _rol); t[0x3E] = rmw(M_absx, _rol)
-        t[0x66] = rmw(M_dp, _ror); t[0x76] = rmw(M_dpx, _ror)
-        t[0x6E] = rmw(M_abs, _ror); t[0x7E] = rmw(M_absx, _ror)
-        t[0x1A] = acc(_inc); t[0x3A] = acc(_dec)
-        t[0xE6] = rmw(M_dp, _inc); t[0xF6] = rmw(M_dpx, _inc)
-        t[0xEE] = rmw(M_abs, _inc); t[0xFE] = rmw(M_absx, _inc)
-        t[0xC6] = rmw(M_dp, _dec); t[0xD6] = rmw(M_dpx, _dec)
-        t[0xCE] = rmw(M_abs, _dec); t[0xDE] = rmw(M_absx, _dec)
-        t[0x04] = rmw(M_dp, _tsb); t[0x0C] = rmw(M_abs, _tsb)
-        t[0x14] = rmw(M_dp, _trb); t[0x1C] = rmw(M_abs, _trb)
-        # ---------- INX/INY/DEX/DEY ----------
-        t[0xE8] = self._inx; t[0xC8] = self._iny
-        t[0xCA] = self._dex; t[0x88] = self._dey
-        # ---------- transfers ----------
-        t[0xAA] = self._tax; t[0xA8] = self._tay
-        t[0x8A] = self._txa; t[0x98] = self._tya
-        t[0xBA] = self._tsx; t[0x9A] = self._txs
-        t[0x9B] = self._txy; t[0xBB] = self._tyx
-        t[0x5B] = self._tcd; t[0x7B] = self._tdc
-        t[0x1B] = self._tcs; t[0x3B] = self._tsc
-        t[0xEB] = self._xba
-        # ---------- stack ----------
-        t[0x48] = self._pha; t[0x68] = self._pla
-        t[0xDA] = self._phx; t[0xFA] = self._plx
-        t[0x5A] = self._phy; t[0x7A] = self._ply
-        t[0x08] = self._php; t[0x28] = self._plp
-        t[0x8B] = self._phb; t[0xAB] = self._plb
-        t[0x0B] = self._phd; t[0x2B] = self._pld
-        t[0x4B] = self._phk
-        t[0xF4] = self._pea; t[0xD4] = self._pei; t[0x62] = self._per
-        # ---------- flags ----------
-        t[0x18] = self._clc; t[0x38] = self._sec
-        t[0x58] = self._cli; t[0x78] = self._sei
-        t[0xB8] = self._clv; t[0xD8] = self._cld; t[0xF8] = self._sed
-        t[0xC2] = self._rep; t[0xE2] = self._sep; t[0xFB] = self._xce
-        # ---------- branches ----------
-        t[0x90] = self._bcc; t[0xB0] = self._bcs
-        t[0xD0] = self._bne; t[0xF0] = self._beq
-        t[0x10] = self._bpl; t[0x30] = self._bmi
-        t[0x50] = self._bvc; t[0x70] = self._bvs
-        t[0x80] = self._bra; t[0x82] = self._brl
-        # ---------- jumps / calls ----------
-        t[0x4C] = self._jmp_abs; t[0x6C] = self._jmp_ind
-        t[0x7C] = self._jmp_indx; t[0x5C] = self._jml_abs
-        t[0xDC] = self._jml_ind
-        t[0x20] = self._jsr_abs; t[0xFC] = self._jsr_indx
-        t[0x22] = self._jsl; t[0x60] = self._rts
-        t[0x6B] = self._rtl; t[0x40] = self._rti
-        # ---------- block moves ----------
-        t[0x54] = self._mvn; t[0x44] = self._mvp
-        # ---------- misc ----------
-        t[0xEA] = self._nop; t[0x42] = self._wdm
-        t[0xDB] = self._stp; t[0xCB] = self._wai
-        t[0x00] = self._brk; t[0x02] = self._cop
-        self.table = t
-
-    # ----- immediate handlers (need M/X-sized fetch) -----
-    def _imm_a_lda(self):
-        if self.m8:
-            self.a = (self.a & 0xFF00) | self.fb()
-            self.set_zn(self.a, True)
-        else:
-            self.a = self.fw()
-            self.set_zn(self.a, False)
-
-    def _imm_x_ldx(self):
-        if self.x8:
-            self.x = self.fb()
-            self.set_zn(self.x, True)
-        else:
-            self.x = self.fw()
-            self.set_zn(self.x, False)
-
-    def _imm_x_ldy(self):
-        if self.x8:
-            self.y = self.fb()
-            self.set_zn(self.y, True)
-        else:
-            self.y = self.fw()
-            self.set_zn(self.y, False)
-
-    def _imm_m(self):
-        return self.fb() if self.m8 else self.fw()
-
-    def _imm_and(self):
-        v = self._imm_m()
-        if self.m8:
-            self.a = (self.a & 0xFF00) | ((self.a & v) & 0xFF)
-            self.set_zn(self.a, True)
-        else:
-            self.a &= v
-            self.set_zn(self.a, False)
-
-    def _imm_ora(self):
-        v = self._imm_m()
-        if self.m8:
-            self.a = (self.a & 0xFF00) | ((self.a | v) & 0xFF)
-            self.set_zn(self.a, True)
-        else:
-            self.a |= v
-            self.set_zn(self.a, False)
+        def acc(fn):
+            def f():
+                cpu.a = (cpu.a & KEEP) | (fn(cpu.a & MW) & MW)
+            return f
 
-    def _imm_eor(self):
-        v = self._imm_m()
-        if self.m8:
-            self.a = (self.a & 0xFF00) | ((self.a ^ v) & 0xFF)
-            self.set_zn(self.a, True)
+        for op, fn in ((0x00, asl), (0x40, lsr), (0x20, rol), (0x60, ror)):
+            t[op | 0x0A] = acc(fn)
+            t[op | 0x06] = rmw(dp, fn); t[op | 0x16] = rmw(dp_x, fn)
+            t[op | 0x0E] = rmw(ab, fn); t[op | 0x1E] = rmw(ab_x, fn)
+        t[0x1A] = acc(inc); t[0x3A] = acc(dec)
+        t[0xE6] = rmw(dp, inc); t[0xF6] = rmw(dp_x, inc)
+        t[0xEE] = rmw(ab, inc); t[0xFE] = rmw(ab_x, inc)
+        t[0xC6] = rmw(dp, dec); t[0xD6] = rmw(dp_x, dec)
+        t[0xCE] = rmw(ab, dec); t[0xDE] = rmw(ab_x, dec)
+        t[0x04] = rmw(dp, tsb); t[0x0C] = rmw(ab, tsb)
+        t[0x14] = rmw(dp, trb); t[0x1C] = rmw(ab, trb)
+
+        # --- INX/INY/DEX/DEY ---
+        def inx():
+            v = cpu.x = (cpu.x + 1) & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def iny():
+            v = cpu.y = (cpu.y + 1) & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def dex():
+            v = cpu.x = (cpu.x - 1) & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def dey():
+            v = cpu.y = (cpu.y - 1) & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        t[0xE8] = inx; t[0xC8] = iny; t[0xCA] = dex; t[0x88] = dey
+
+        # --- transfers (width per destination register) ---
+        def tax():
+            v = cpu.x = cpu.a & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def tay():
+            v = cpu.y = cpu.a & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def txa():
+            v = cpu.a = (cpu.a & KEEP) | (cpu.x & MW)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
+
+        def tya():
+            v = cpu.a = (cpu.a & KEEP) | (cpu.y & MW)
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
+
+        def tsx():
+            v = cpu.x = cpu.sp & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def txy():
+            v = cpu.y = cpu.x & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        def tyx():
+            v = cpu.x = cpu.y & XW
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
+
+        if e:
+            def txs():
+                cpu.sp = 0x0100 | (cpu.x & 0xFF)
+
+            def tcs():
+                cpu.sp = 0x0100 | (cpu.a & 0xFF)
         else:
-            self.a ^= v
-            self.set_zn(self.a, False)
+            def txs():
+                cpu.sp = cpu.x & 0xFFFF
 
-    def _imm_adc(self):
-        self._adc(self._imm_m())
+            def tcs():
+                cpu.sp = cpu.a & 0xFFFF
 
-    def _imm_sbc(self):
-        self._sbc(self._imm_m())
+        def tcd():
+            v = cpu.d = cpu.a & 0xFFFF
+            cpu.p = (cpu.p & NZN) | ZN16[v]
 
-    def _imm_cmp(self):
-        self._cmp(self.a, self._imm_m(), self.m8)
+        def tdc():
+            v = cpu.a = cpu.d & 0xFFFF
+            cpu.p = (cpu.p & NZN) | ZN16[v]
 
-    def _imm_cpx(self):
-        v = self.fb() if self.x8 else self.fw()
-        self._cmp(self.x, v, self.x8)
+        def tsc():
+            v = cpu.a = cpu.sp & 0xFFFF
+            cpu.p = (cpu.p & NZN) | ZN16[v]
 
-    def _imm_cpy(self):
-        v = self.fb() if self.x8 else self.fw()
-        self._cmp(self.y, v, self.x8)
+        def xba():
+            a = cpu.a
+            hi = (a >> 8) & 0xFF
+            cpu.a = ((a & 0xFF) << 8) | hi
+            cpu.p = (cpu.p & NZN) | ZN8[hi]   # flags from the new low byte
 
-    def _imm_bit(self):
-        v = self._imm_m()
-        m = 0xFF if self.m8 else 0xFFFF
-        self.p = (self.p & ~Z) | (Z if (self.a & v & m) == 0 else 0)
+        t[0xAA] = tax; t[0xA8] = tay; t[0x8A] = txa; t[0x98] = tya
+        t[0xBA] = tsx; t[0x9A] = txs; t[0x9B] = txy; t[0xBB] = tyx
+        t[0x5B] = tcd; t[0x7B] = tdc; t[0x1B] = tcs; t[0x3B] = tsc
+        t[0xEB] = xba
 
-    # ----- index inc/dec -----
-    def _inx(self):
-        if self.x8:
-            self.x = (self.x + 1) & 0xFF; self.set_zn(self.x, True)
-        else:
-            self.x = (self.x + 1) & 0xFFFF; self.set_zn(self.x, False)
+        # --- stack ---
+        def pha():
+            push_m(cpu.a)
 
-    def _iny(self):
-        if self.x8:
-            self.y = (self.y + 1) & 0xFF; self.set_zn(self.y, True)
-        else:
-            self.y = (self.y + 1) & 0xFFFF; self.set_zn(self.y, False)
+        def pla():
+            v = cpu.a = (cpu.a & KEEP) | pop_m()
+            cpu.p = (cpu.p & NZN) | ZNM[v & MW]
 
-    def _dex(self):
-        if self.x8:
-            self.x = (self.x - 1) & 0xFF; self.set_zn(self.x, True)
-        else:
-            self.x = (self.x - 1) & 0xFFFF; self.set_zn(self.x, False)
+        def phx():
+            push_x(cpu.x)
 
-    def _dey(self):
-        if self.x8:
-            self.y = (self.y - 1) & 0xFF; self.set_zn(self.y, True)
-        else:
-            self.y = (self.y - 1) & 0xFFFF; self.set_zn(self.y, False)
+        def plx():
+            v = cpu.x = pop_x()
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
 
-    # ----- transfers (width per destination register) -----
-    def _tax(self):
-        if self.x8:
-            self.x = self.a & 0xFF; self.set_zn(self.x, True)
-        else:
-            self.x = self.a & 0xFFFF; self.set_zn(self.x, False)
+        def phy():
+            push_x(cpu.y)
 
-    def _tay(self):
-        if self.x8:
-            self.y = self.a & 0xFF; self.set_zn(self.y, True)
-        else:
-            self.y = self.a & 0xFFFF; self.set_zn(self.y, False)
+        def ply():
+            v = cpu.y = pop_x()
+            cpu.p = (cpu.p & NZN) | ZNX[v & XW]
 
-    def _txa(self):
-        if self.m8:
-            self.a = (self.a & 0xFF00) | (self.x & 0xFF); self.set_zn(self.a, True)
-        else:
-            self.a = self.x & 0xFFFF; self.set_zn(self.a, False)
+        def php():
+            push_b(cpu.p)
 
-    def _tya(self):
-        if self.m8:
-            self.a = (self.a & 0xFF00) | (self.y & 0xFF); self.set_zn(self.a, True)
-        else:
-            self.a = self.y & 0xFFFF; self.set_zn(self.a, False)
+        def narrow():
+            """After P changed: emulation forces M/X, and X=1 drops the high
+            bytes of the index registers. The next handler is another table's."""
+            if e:
+                cpu.p |= M | X
+            if cpu.p & X:
+                cpu.x &= 0xFF
+                cpu.y &= 0xFF
+            return SWITCH
 
-    def _tsx(self):
-        if self.x8:
-            self.x = self.sp & 0xFF; self.set_zn(self.x, True)
-        else:
-            self.x = self.sp & 0xFFFF; self.set_zn(self.x, False)
+        def plp():
+            cpu.p = pop_b()
+            return narrow()
 
-    def _txs(self):
-        if self.e:
-            self.sp = 0x0100 | (self.x & 0xFF)
-        else:
-            self.sp = self.x & 0xFFFF
+        def phb():
+            push_b(cpu.dbr)
 
-    def _txy(self):
-        if self.x8:
-            self.y = self.x & 0xFF; self.set_zn(self.y, True)
-        else:
-            self.y = self.x & 0xFFFF; self.set_zn(self.y, False)
+        def plb():
+            v = cpu.dbr = pop_b()
+            cpu.p = (cpu.p & NZN) | ZN8[v]
 
-    def _tyx(self):
-        if self.x8:
-            self.x = self.y & 0xFF; self.set_zn(self.x, True)
-        else:
-            self.x = self.y & 0xFFFF; self.set_zn(self.x, False)
+        def phd():
+            push_w(cpu.d)
 
-    def _tcd(self):
-        self.d = self.a & 0xFFFF; self.set_zn(self.d, False)
+        def pld():
+            v = cpu.d = pop_w()
+            cpu.p = (cpu.p & NZN) | ZN16[v]
 
-    def _tdc(self):
-        self.a = self.d & 0xFFFF; self.set_zn(self.a, False)
+        def phk():
+            push_b(cpu.pbr)
 
-    def _tcs(self):
-        if self.e:
-            self.sp = 0x0100 | (self.a & 0xFF)
-        else:
-            self.sp = self.a & 0xFFFF
+        def pea():
+            push_w(fw())
 
-    def _tsc(self):
-        self.a = self.sp & 0xFFFF; self.set_zn(self.a, False)
+        def pei():
+            push_w(rw(dp()))
 
-    def _xba(self):
-        lo = self.a & 0xFF
-        hi = (self.a >> 8) & 0xFF
-        self.a = (lo << 8) | hi
-        self.set_zn(hi, True)        # flags from new low byte (old high)
+        def per():
+            rel = fw()
+            push_w((cpu.pc + rel) & 0xFFFF)
 
-    # ----- stack -----
-    def _pha(self):
-        if self.m8:
-            self.push_b(self.a)
-        else:
-            self.push_w(self.a)
+        t[0x48] = pha; t[0x68] = pla; t[0xDA] = phx; t[0xFA] = plx
+        t[0x5A] = phy; t[0x7A] = ply; t[0x08] = php; t[0x28] = plp
+        t[0x8B] = phb; t[0xAB] = plb; t[0x0B] = phd; t[0x2B] = pld
+        t[0x4B] = phk; t[0xF4] = pea; t[0xD4] = pei; t[0x62] = per
 
-    def _pla(self):
-        if self.m8:
-            self.a = (self.a & 0xFF00) | self.pop_b(); self.set_zn(self.a, True)
-        else:
-            self.a = self.pop_w(); self.set_zn(self.a, False)
-
-    def _phx(self):
-        if self.x8:
-            self.push_b(self.x)
-        else:
-            self.push_w(self.x)
-
-    def _plx(self):
-        if self.x8:
-            self.x = self.pop_b(); self.set_zn(self.x, True)
-        else:
-            self.x = self.pop_w(); self.set_zn(self.x, False)
-
-    def _phy(self):
-        if self.x8:
-            self.push_b(self.y)
-        else:
-            self.push_w(self.y)
-
-    def _ply(self):
-        if self.x8:
-            self.y = self.pop_b(); self.set_zn(self.y, True)
-        else:
-            self.y = self.pop_w(); self.set_zn(self.y, False)
-
-    def _php(self):
-        self.push_b(self.p)
-
-    def _plp(self):
-        self.p = self.pop_b()
-        if self.e:
-            self.p |= M | X
-        if self.p & X:                # narrowing index regs drops high bytes
-            self.x &= 0xFF
-            self.y &= 0xFF
-
-    def _phb(self):
-        self.push_b(self.dbr)
+        # --- flags ---
+        def clear(bit):
+            def f():
+                cpu.p &= ~bit
+            return f
 
-    def _plb(self):
-        self.dbr = self.pop_b(); self.set_zn(self.dbr, True)
+        def set_(bit):
+            def f():
+                cpu.p |= bit
+            return f
 
-    def _phd(self):
-        self.push_w(self.d)
+        def rep():
+            cpu.p &= ~fb()
+            if e:
+                cpu.p |= M | X
+            return SWITCH
+
+        def sep():
+            cpu.p |= fb()
+            return narrow()
+
+        def xce():
+            carry = cpu.p & C
+            cpu.p = (cpu.p & ~C) | (C if cpu.e else 0)
+            cpu.e = 1 if carry else 0
+            if cpu.e:
+                cpu.p |= M | X
+                cpu.sp = 0x0100 | (cpu.sp & 0xFF)
+                cpu.x &= 0xFF
+                cpu.y &= 0xFF
+            return SWITCH
+
+        t[0x18] = clear(C); t[0x38] = set_(C)
+        t[0x58] = clear(I); t[0x78] = set_(I)
+        t[0xB8] = clear(V); t[0xD8] = clear(D); t[0xF8] = set_(D)
+        t[0xC2] = rep; t[0xE2] = sep; t[0xFB] = xce
+
+        # --- branches ---
+        def branch(bit, want):
+            def f():
+                pc = cpu.pc
+                a = (cpu.pbr << 16) | pc
+                pc = (pc + 1) & 0xFFFF
+                if (cpu.p & bit) == want:
+                    off = hrb(a) if io[a >> 8] else mem[a]
+                    pc = (pc + off - ((off & 0x80) << 1)) & 0xFFFF
+                elif io[a >> 8]:
+                    hrb(a)                 # the hooks still see the fetch
+                cpu.pc = pc
+            return f
 
-    def _pld(self):
-        self.d = self.pop_w(); self.set_zn(self.d, False)
+        def bra():
+            off = fb()
+            cpu.pc = (cpu.pc + off - ((off & 0x80) << 1)) & 0xFFFF
+
+        def brl():
+            rel = fw()
+            cpu.pc = (cpu.pc + rel - ((rel & 0x8000) << 1)) & 0xFFFF
+
+        t[0x90] = branch(C, 0); t[0xB0] = branch(C, C)
+        t[0xD0] = branch(Z, 0); t[0xF0] = branch(Z, Z)
+        t[0x10] = branch(N, 0); t[0x30] = branch(N, N)
+        t[0x50] = branch(V, 0); t[0x70] = branch(V, V)
+        t[0x80] = bra; t[0x82] = brl
+
+        # --- jumps / calls ---
+        def jmp_abs():
+            cpu.pc = fw()
+
+        def jmp_ind():
+            cpu.pc = rw(fw())              # (abs) reads from bank 0
+
+        def jmp_indx():
+            cpu.pc = rw((cpu.pbr << 16) | ((fw() + cpu.x) & 0xFFFF))
+
+        def jml_abs():
+            target = fw()
+            cpu.pbr = fb()
+            cpu.pc = target
+
+        def jml_ind():                     # JML [abs]
+            p = fw()
+            cpu.pc = rw(p)
+            cpu.pbr = rb((p + 2) & 0xFFFF)
+
+        def jsr_abs():
+            target = fw()
+            push_w((cpu.pc - 1) & 0xFFFF)
+            cpu.pc = target
+
+        def jsr_indx():                    # JSR (abs,x)
+            ptr = fw()
+            push_w((cpu.pc - 1) & 0xFFFF)
+            cpu.pc = rw((cpu.pbr << 16) | ((ptr + cpu.x) & 0xFFFF))
+
+        def jsl():
+            target = fw()
+            bank = fb()
+            push_b(cpu.pbr)
+            push_w((cpu.pc - 1) & 0xFFFF)
+            cpu.pc = target
+            cpu.pbr = bank
+
+        def rts():
+            cpu.pc = (pop_w() + 1) & 0xFFFF
+
+        def rtl():
+            cpu.pc = (pop_w() + 1) & 0xFFFF
+            cpu.pbr = pop_b()
+
+        def rti():
+            cpu.p = pop_b()
+            if e:
+                cpu.p |= M | X
+                cpu.pc = pop_w()
+            else:
+                cpu.pc = pop_w()
+                cpu.pbr = pop_b()
+            if cpu.p & X:
+                cpu.x &= 0xFF
+                cpu.y &= 0xFF
+            return SWITCH
+
+        t[0x4C] = jmp_abs; t[0x6C] = jmp_ind; t[0x7C] = jmp_indx
+        t[0x5C] = jml_abs; t[0xDC] = jml_ind
+        t[0x20] = jsr_abs; t[0xFC] = jsr_indx; t[0x22] = jsl
+        t[0x60] = rts; t[0x6B] = rtl; t[0x40] = rti
+
+        # --- block moves (MVN/MVP): A = count-1, X src, Y dst; one byte
+        #     per execution, re-executing until A wraps ---
+        def move(step):
+            def f():
+                dbank = fb()
+                sbank = fb()
+                cpu.dbr = dbank
+                wb((dbank << 16) | (cpu.y & 0xFFFF), rb((sbank << 16) | (cpu.x & 0xFFFF)))
+                cpu.x = (cpu.x + step) & XW
+                cpu.y = (cpu.y + step) & XW
+                cpu.a = (cpu.a - 1) & 0xFFFF
+                if cpu.a != 0xFFFF:
+                    cpu.pc = (cpu.pc - 3) & 0xFFFF
+            return f
 
-    def _phk(self):
-        self.push_b(self.pbr)
+        t[0x54] = move(1); t[0x44] = move(-1)
 
-    def _pea(self):
-        self.push_w(self.fw())
+        # --- misc ---
+        def nop():
+            pass
 
-    def _pei(self):
-        self.push_w(self.rw(self._dp()))
+        def wdm():
+            imm = fb()
+            if cpu.wdm_hook is not None:
+                cpu.wdm_hook(cpu, imm)
+            return WDM_BIT | imm
 
-    def _per(self):
-        rel = self.fw()
-        self.push_w((self.pc + rel) & 0xFFFF)
+        def stp():
+            cpu.halted = True
+            return SWITCH
 
-    # ----- flags -----
-    def _clc(self): self.p &= ~C
-    def _sec(self): self.p |= C
-    def _cli(self): self.p &= ~I
-    def _sei(self): self.p |= I
-    def _clv(self): self.p &= ~V
-    def _cld(self): self.p &= ~D
-    def _sed(self): self.p |= D
+        # no interrupts in the harness: a stray WAI halts, so it is visible
+        wai = stp
 
-    def _rep(self):
-        m = self.fb()
-        self.p &= ~m
-        if self.e:
-            self.p |= M | X
-
-    def _sep(self):
-        m = self.fb()
-        self.p |= m
-        if self.p & X:
-            self.x &= 0xFF
-            self.y &= 0xFF
-
-    def _xce(self):
-        carry = self.p & C
-        newe = 1 if carry else 0
-        self.p = (self.p & ~C) | (C if self.e else 0)
-        self.e = newe
-        if self.e:
-            self.p |= M | X
-            self.sp = 0x0100 | (self.sp & 0xFF)
-            self.x &= 0xFF
-            self.y &= 0xFF
-
-    # ----- branches -----
-    def _branch(self, take):
-        off = self.fb()
-        if off & 0x80:
-            off -= 0x100
-        if take:
-            self.pc = (self.pc + off) & 0xFFFF
-
-    def _bcc(self): self._branch(not (self.p & C))
-    def _bcs(self): self._branch(self.p & C)
-    def _bne(self): self._branch(not (self.p & Z))
-    def _beq(self): self._branch(self.p & Z)
-    def _bpl(self): self._branch(not (self.p & N))
-    def _bmi(self): self._branch(self.p & N)
-    def _bvc(self): self._branch(not (self.p & V))
-    def _bvs(self): self._branch(self.p & V)
-    def _bra(self): self._branch(True)
-
-    def _brl(self):
-        rel = self.fw()
-        if rel & 0x8000:
-            rel -= 0x10000
-        self.pc = (self.pc + rel) & 0xFFFF
-
-    # ----- jumps / calls -----
-    def _jmp_abs(self):
-        self.pc = self.fw()
-
-    def _jmp_ind(self):
-        p = self.fw()
-        self.pc = self.rw(p)         # (abs) reads from bank 0
-
-    def _jmp_indx(self):
-        p = (self.fw() + self.x) & 0xFFFF
-        self.pc = self.rw((self.pbr << 16) | p)
-
-    def _jml_abs(self):
-        self.pc = self.fw()
-        self.pbr = self.fb()
-
-    def _jml_ind(self):                # JML [abs]
-        p = self.fw()
-        self.pc = self.rw(p)
-        self.pbr = self.rb((p + 2) & 0xFFFF)
-
-    def _jsr_abs(self):
-        target = self.fw()
-        ret = (self.pc - 1) & 0xFFFF
-        self.push_w(ret)
-        self.pc = target
-
-    def _jsr_indx(self):               # JSR (abs,x)
-        target_ptr = self.fw()
-        ret = (self.pc - 1) & 0xFFFF
-        self.push_w(ret)
-        p = (target_ptr + self.x) & 0xFFFF
-        self.pc = self.rw((self.pbr << 16) | p)
-
-    def _jsl(self):
-        lo = self.fb(); mid = self.fb(); bank = self.fb()
-        ret = (self.pc - 1) & 0xFFFF
-        self.push_b(self.pbr)
-        self.push_w(ret)
-        self.pc = lo | (mid << 8)
-        self.pbr = bank
-
-    def _rts(self):
-        self.pc = (self.pop_w() + 1) & 0xFFFF
-
-    def _rtl(self):
-        self.pc = (self.pop_w() + 1) & 0xFFFF
-        self.pbr = self.pop_b()
-
-    def _rti(self):
-        self.p = self.pop_b()
-        if self.e:
-            self.p |= M | X
-            self.pc = self.pop_w()
-        else:
-            self.pc = self.pop_w()
-            self.pbr = self.pop_b()
-        if self.p & X:
-            self.x &= 0xFF; self.y &= 0xFF
-
-    # ----- block moves (MVN/MVP): A = count-1, X src, Y dst ----------
-    def _mvn(self):
-        dbank = self.fb(); sbank = self.fb()
-        self.dbr = dbank
-        # transfer one byte per execution, decrementing PC if more remain
-        src = (sbank << 16) | (self.x & 0xFFFF)
-        dst = (dbank << 16) | (self.y & 0xFFFF)
-        self.wb(dst, self.rb(src))
-        self.x = (self.x + 1) & 0xFFFF
-        self.y = (self.y + 1) & 0xFFFF
-        self.a = (self.a - 1) & 0xFFFF
-        if self.a != 0xFFFF:
-            self.pc = (self.pc - 3) & 0xFFFF   # re-execute MVN
-        if self.x8:
-            self.x &= 0xFF; self.y &= 0xFF
-
-    def _mvp(self):
-        dbank = self.fb(); sbank = self.fb()
-        self.dbr = dbank
-        src = (sbank << 16) | (self.x & 0xFFFF)
-        dst = (dbank << 16) | (self.y & 0xFFFF)
-        self.wb(dst, self.rb(src))
-        self.x = (self.x - 1) & 0xFFFF
-        self.y = (self.y - 1) & 0xFFFF
-        self.a = (self.a - 1) & 0xFFFF
-        if self.a != 0xFFFF:
-            self.pc = (self.pc - 3) & 0xFFFF
-        if self.x8:
-            self.x &= 0xFF; self.y &= 0xFF
-
-    # ----- misc -----
-    def _nop(self):
-        pass
-
-    def _wdm(self):
-        imm = self.fb()
-        if self.wdm_hook is not None:
-            self.wdm_hook(self, imm)
-
-    def _stp(self):
-        self.halted = True
-
-    def _wai(self):
-        # no interrupts in the harness; treat as halt so a stray WAI is visible
-        self.halted = True
-
-    def _brk(self):
-        self.fb()                    # signature byte
-        self.push_w(self.pc)
-        self.push_b(self.p)
-        self.p |= I
-        if self.e:
-            self.pc = self.rw(0xFFFE)
-        else:
-            self.push_b(self.pbr); self.pbr = 0
-            self.pc = self.rw(0xFFE6)
-
-    def _cop(self):
-        self.fb()
-        self.push_w(self.pc)
-        self.push_b(self.p)
-        self.p |= I
-        if self.e:
-            self.pc = self.rw(0xFFF4)
-        else:
-            self.push_b(self.pbr); self.pbr = 0
-            self.pc = self.rw(0xFFE4)
+        def interrupt(native_vec, emu_vec):
+            def f():
+                fb()                       # signature byte
+                push_w(cpu.pc)
+                push_b(cpu.p)
+                cpu.p |= I
+                if e:
+                    cpu.pc = rw(emu_vec)
+                else:
+                    push_b(cpu.pbr)
+                    cpu.pbr = 0
+                    cpu.pc = rw(native_vec)
+            return f
 
-    def _op_brk(self):
-        # default-table placeholder (overwritten); real BRK is _brk
-        self._brk()
+        t[0xEA] = nop; t[0x42] = wdm; t[0xDB] = stp; t[0xCB] = wai
+        t[0x00] = interrupt(0xFFE6, 0xFFFE); t[0x02] = interrupt(0xFFE4, 0xFFF4)
+        return [f or t[0x00] for f in t]
 
 
 # --------------------------------------------------------------------------
 # self-test: a tiny program exercising width switches, math, branches, JSR,
 # block move and a WDM trap.  `python cpu65816.py` should print "SELFTEST OK".
 # --------------------------------------------------------------------------
-if __name__ == "__main__":
+def selftest():
     cpu = CPU65816()
     trapped = []
     cpu.wdm_hook = lambda c, imm: trapped.append(imm)
@@ -1171,4 +1034,65 @@ if __name__ == "__main__":
     if cpu2.mem[0x1100:0x1104] != b"\xDE\xAD\xBE\xEF":
         print("FAIL mvn:", cpu2.mem[0x1100:0x1104].hex()); ok = False
 
+    # run_until: stop on an address (not executed) and after a WDM signature
+    cpu3 = CPU65816(io=())
+    cpu3.mem[0x8000:0x8000 + len(prog)] = prog
+    cpu3.reset(pc=0x8000)
+    if cpu3.run_until(pc=0x8007) != 4 or cpu3.pc != 0x8007 or cpu3.a != 0x1234:
+        print("FAIL run_until pc:", hex(cpu3.pc), hex(cpu3.a)); ok = False
+    n = cpu3.run_until(wdm=(0x99,))
+    if cpu3.pc != len(prog) - 1 + 0x8000 or cpu3.halted or cpu3.cycles != 4 + n:
+        print("FAIL run_until wdm:", hex(cpu3.pc), cpu3.halted); ok = False
+    return ok
+
+
+def bench(seconds=2.0):
+    """Instructions per second on a loop of the kernel's bread and butter:
+    16-bit loads/stores through DP and DBR, indexed stores, compares and
+    branches, JSR/RTS, with an I/O window in bank 0 that it never touches."""
+    prog = bytes([
+        0x18, 0xFB,              # CLC XCE
+        0xC2, 0x30,              # REP #$30
+        # outer:
+        0xA2, 0x00, 0x00,        # LDX #0
+        # inner:
+        0xA5, 0x10,              # LDA $10
+        0x18,                    # CLC
+        0x69, 0x01, 0x00,        # ADC #1
+        0x85, 0x10,              # STA $10
+        0x9D, 0x00, 0x30,        # STA $3000,X
+        0x20, 0x00, 0x90,        # JSR $9000
+        0xE8, 0xE8,              # INX INX
+        0xE0, 0x00, 0x01,        # CPX #$100
+        0xD0, 0xEC,              # BNE inner
+        0x80, 0xE7,              # BRA outer
+    ])
+    sub = bytes([0xE2, 0x20, 0xAD, 0x00, 0x20, 0xC2, 0x20, 0x60])   # SEP LDA REP RTS
+    result = []
+    for how, io in (("step, hooks everywhere", None),
+                    ("step", [(0x00C000, 0x00C0FF)]),
+                    ("run_until", [(0x00C000, 0x00C0FF)])):
+        cpu = CPU65816(read_hook=lambda a: None, write_hook=lambda a, v: False,
+                       io=io)
+        cpu.mem[0x8000:0x8000 + len(prog)] = prog
+        cpu.mem[0x9000:0x9000 + len(sub)] = sub
+        cpu.reset(pc=0x8000)
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < seconds:
+            if how == "run_until":
+                cpu.run_until(max_steps=20000)
+            else:
+                for _ in range(20000):
+                    cpu.step()
+        result.append(cpu.cycles / (time.perf_counter() - t0))
+        print("%-24s %9.0f instructions/s  (%.1fx)"
+              % (how, result[-1], result[-1] / result[0]))
+
+
+if __name__ == "__main__":
+    if "--bench" in sys.argv:
+        bench()
+        sys.exit(0)
+    ok = selftest()
     print("SELFTEST OK" if ok else "SELFTEST FAILED")
+    sys.exit(0 if ok else 1)
@@ -13,15 +13,20 @@ emulator install. It drives cpu65816.CPU65816:
   * intercepts the soft-switch page ($C0xx) - keyboard latch, NEWVIDEO,
     seeded mouse/vbl - and leaves the firmware pages otherwise as RAM,
   * renders the Super Hi-Res framebuffer (bank $E1) to a PNG: 200 rows x
-    160 bytes, 4bpp, high-nibble-left, palette line 0 at $E1:9E00.
+    160 bytes, 4bpp, high-nibble-left, palette line 0 at $E1:9E00,
+  * boots once per disk image: the machine at the first frame marker (CPU,
+    16 MB of memory, the disk image, the soft-switch/mouse/DOC models) is
+    saved to build/snap/, keyed by the image's hash and this harness + core,
+    and every later boot() of the same image restores it instead of running.
+    Delete build/snap/ (or pass snapdir=None / --no-snapshot) to boot afresh.
 
 M0 usage:
     python iigs/harness.py build/unodos_iigs.po build/m0.png
 M1 will add a wait/shot/key/mouse script runner over the same Harness.
 """
+import hashlib
+import os
 import sys
-import struct
-import zlib
 
 from cpu65816 import CPU65816, C
 
@@ -31,6 +36,22 @@ FW_PAGE = 0xC000 + (SLOT << 8)  # $C500
 DRV_OFF = 0x0A                 # driver entry offset within the firmware page
 DRV_ENTRY = FW_PAGE + DRV_OFF  # $C50A
 
+# the soft-switch pages the hooks serve; everything else is plain RAM to the core
+IO_WINDOWS = [(0x00_C000, 0x00_C0FF), (0xE0_C000, 0xE0_C0FF)]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPDIR = os.path.join(HERE, "build", "snap")
+sys.path.insert(0, os.path.join(HERE, "..", "tools"))
+import fbconv  # noqa: E402
+import snapfile  # noqa: E402
+
+CPU_STATE = ("a", "x", "y", "sp", "d", "pc", "pbr", "dbr", "p", "e",
+             "halted", "cycles")
+# the harness's device models, as far as the kernel can observe them
+DEVICE_STATE = ("newvideo", "kbd", "mouse_fifo", "mouse_btn", "cmd_x", "cmd_y",
+                "vbl", "frame", "_frame_flag", "doc_regs", "doc_ram",
+                "doc_addr", "doc_ctl", "doc_writes")
+
 SHR_PIX = 0xE1_2000
 SHR_SCB = 0xE1_9D00
 SHR_PAL = 0xE1_9E00
@@ -40,9 +61,11 @@ COLS = 320
 
 
 class Harness:
-    def __init__(self, image_path, writeback=None):
+    def __init__(self, image_path, writeback=None, snapdir=SNAPDIR):
         self.image = bytearray(open(image_path, "rb").read())
+        self.image_sha = hashlib.sha256(self.image).hexdigest()
         self.writeback = writeback
+        self.snapdir = snapdir
         self.newvideo = 0x00
         self.kbd = 0x00            # $C000 keyboard data (bit7 = key ready)
         # ADB mouse model: a FIFO of signed (dx,dy) delta bytes + a button bit.
@@ -60,7 +83,7 @@ class Harness:
         self.doc_ctl = 0
         self.doc_writes = []      # log of (register, value) writes
         self.cpu = CPU65816(read_hook=self._read, write_hook=self._write,
-                            wdm_hook=self._wdm)
+                            wdm_hook=self._wdm, io=IO_WINDOWS)
         self._install_firmware()
 
     # ---------------------------------------------------------- firmware
@@ -181,17 +204,18 @@ class Harness:
         return n
 
     def boot(self, max_steps=4_000_000):
-        """Run until the first main-loop frame marker (desktop is up)."""
+        """Run until the first main-loop frame marker (desktop is up) - or
+        restore the machine as it was there the last time this image booted."""
+        path = self._snap_path(max_steps)
+        if path and self.load_snapshot(path):
+            return
         self._run_to_frame(max_steps)
+        if path:
+            self.save_snapshot(path)
 
     def _run_to_frame(self, max_steps=4_000_000):
         self._frame_flag = False
-        n = 0
-        cpu = self.cpu
-        while not self._frame_flag and not cpu.halted and n < max_steps:
-            cpu.step()
-            n += 1
-        return n
+        return self.cpu.run_until(wdm=(0x02,), max_steps=max_steps)
 
     def frames(self, count=1):
         """Advance `count` full main-loop iterations."""
@@ -199,6 +223,49 @@ class Harness:
             self._run_to_frame()      # consume the pending marker
             self._run_to_frame()      # run one full body to the next marker
 
+    # ------------------------------------------------------- snapshots
+    def snapshot(self):
+        """The whole machine as plain data (picklable, shares nothing)."""
+        state = {"cpu": dict((k, getattr(self.cpu, k)) for k in CPU_STATE),
+                 "mem": bytes(self.cpu.mem), "image": bytes(self.image)}
+        for k in DEVICE_STATE:
+            v = getattr(self, k)
+            state[k] = bytes(v) if isinstance(v, bytearray) else \
+                list(v) if isinstance(v, list) else v
+        return state
+
+    def restore(self, state):
+        for k, v in state["cpu"].items():
+            setattr(self.cpu, k, v)
+        self.cpu.mem[:] = state["mem"]          # in place: the core binds mem
+        self.image[:] = state["image"]
+        for k in DEVICE_STATE:
+            v = state[k]
+            setattr(self, k, bytearray(v) if isinstance(v, bytes) else
+                    list(v) if isinstance(v, list) else v)
+
+    def _snap_path(self, max_steps):
+        if not self.snapdir:
+            return None
+        h = hashlib.sha256(self.image_sha.encode())
+        for src in ("harness.py", "cpu65816.py"):    # a changed rig boots anew
+            with open(os.path.join(HERE, src), "rb") as f:
+                h.update(f.read())
+        h.update(b"boot %d" % max_steps)
+        return os.path.join(self.snapdir, "boot-%s.snap" % h.hexdigest()[:32])
+
+    def save_snapshot(self, path):
+        snapfile.save(path, self.snapshot())
+
+    def load_snapshot(self, path):
+        """Restore from `path`; False (and the machine untouched) if there is
+        no usable snapshot there."""
+        state = snapfile.load(path)
+        if state is None:
+            return False
+        self.restore(state)
+        return True
+
     # ------------------------------------------------------- input scripting
     def key(self, ascii_code):
         """Inject one keypress and let the kernel consume + process it."""
@@ -294,54 +361,25 @@ class Harness:
             g = (w >> 4) & 0x0F
             b = w & 0x0F
             pal.append((r * 17, g * 17, b * 17))
-        # 320x200 -> RGB rows (palette line 0 for every scanline at M0)
-        rows = []
-        for y in range(ROWS):
-            base = SHR_PIX + y * ROWBYTES
-            row = bytearray()
-            for bx in range(ROWBYTES):
-                byte = m[base + bx]
-                for nib in ((byte >> 4) & 0x0F, byte & 0x0F):
-                    row += bytes(pal[nib])
-            rows.append(bytes(row))
-        _write_png(out_path, rows, COLS, ROWS, scale)
+        # 320x200 4bpp -> index -> scaled RGB (palette line 0 for every scanline at M0)
+        idx = fbconv.chunky4(m[SHR_PIX:SHR_PIX + ROWS * ROWBYTES])
+        fbconv.write_png(out_path, COLS * scale, ROWS * scale,
+                         fbconv.palette(fbconv.scale(idx, COLS, ROWS, scale), pal), level=9)
         print(f"wrote {out_path} ({COLS*scale}x{ROWS*scale}, "
               f"{self.cpu.cycles} instrs)")
 
 
-def _write_png(path, rgb_rows, w, h, scale=1):
-    """Minimal truecolor PNG writer (stdlib zlib only, no PIL)."""
-    def chunk(tag, data):
-        c = struct.pack(">I", len(data)) + tag + data
-        return c + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
-
-    sw, sh = w * scale, h * scale
-    raw = bytearray()
-    for y in range(h):
-        src = rgb_rows[y]
-        line = bytearray()
-        for x in range(w):
-            line += src[x * 3:x * 3 + 3] * scale
-        for _ in range(scale):
-            raw.append(0)               # filter type 0
-            raw += line
-    png = b"\x89PNG\r\n\x1a\n"
-    png += chunk(b"IHDR", struct.pack(">IIBBBBB", sw, sh, 8, 2, 0, 0, 0))
-    png += chunk(b"IDAT", zlib.compress(bytes(raw), 9))
-    png += chunk(b"IEND", b"")
-    open(path, "wb").write(png)
-
-
 def main():
     if len(sys.argv) < 3:
         print("usage: harness.py <image.po> <out.png|script.script> "
-              "[--writeback out.po] [--frames N]")
+              "[--writeback out.po] [--frames N] [--no-snapshot]")
         return 1
     image, out = sys.argv[1], sys.argv[2]
     wb = None
     if "--writeback" in sys.argv:
         wb = sys.argv[sys.argv.index("--writeback") + 1]
-    h = Harness(image, writeback=wb)
+    h = Harness(image, writeback=wb,
+                snapdir=None if "--no-snapshot" in sys.argv else SNAPDIR)
 
     if out.endswith(".script"):           # M1+ script: boot, drive, shot(s)
         h.boot()
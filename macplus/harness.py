@@ -14,6 +14,19 @@ Plays the part of the Mac Plus ROM around a Unicorn (QEMU) 68000 core:
     RTE surfaces as QEMU EXCP 0x100 and is popped here, symmetrically.
   - Framebuffer: 512x342x1 at ScrnBase, dumped as PNG.
 
+Checkpoints (tools/ucsnap.py): the machine is the RAM, the full Unicorn CPU
+context and the device model below (VIA/SCC/keyboard state, the interrupt
+context stack, the disk image as _Write left it). Every script opens with the
+same `wait 90` of boot-block loading and AUTOTEST setup, so the machine after
+a script's leading wait is saved under build/snap/ (named for the disk, the
+wait and this harness) and every later script on the same disk
+restores it instead of booting; --no-snapshot (or --trace) boots for real,
+and a --resume run neither restores nor saves one.
+`checkpoint PATH` saves the machine at any point of a script, and --resume
+PATH starts the script from such a file (or a build/snap/ one) instead of
+the Start Manager, so an A/B run can skip straight to the scene under test.
+A checkpoint only resumes on the disk image it was taken from.
+
 Script on stdin (one command per line, # comments):
   wait N            run N vblank ticks
   shot NAME         screenshot to <artdir>/NAME.png
@@ -23,14 +36,22 @@ Script on stdin (one command per line, # comments):
   dblclick X Y      two clicks inside the double-click window
   key K             press+release (a-z, 0-9, enter, esc, space, tab,
                     backspace, up, down, left, right)
+  checkpoint PATH   save the machine to PATH (a --resume file)
   quit              finish
 
-Usage: harness.py <disk.dsk> <artdir> [--trace] < script
+Usage: harness.py <disk.dsk> <artdir> [--trace] [--no-snapshot] [--resume CHECKPOINT] < script
 """
-import os, struct, sys, zlib
+import os, struct, sys
 from unicorn import *
 from unicorn.m68k_const import *
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+import ucsnap                                              # noqa: E402
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPDIR = os.path.join(HERE, "build", "snap")
+
 RAM_SIZE   = 0x100000               # 1MB Mac Plus
 SCRN       = RAM_SIZE - 0x5900      # $0FA700, the real 1MB screen base
 SCRW, SCRH, ROWB = 512, 342, 64
@@ -58,23 +79,17 @@ SCANS = {
 ARROWS = {'up':0x0D,'down':0x08,'left':0x06,'right':0x02,    # keypad page
           'clr':0x07}                                        # Clr = F1/save ($50)
 
-
-def png_gray(path, w, h, getpix):
-    rows = b""
-    for y in range(h):
-        rows += b"\x00" + bytes(getpix(y))
-    def chunk(tag, data):
-        c = tag + data
-        return struct.pack(">I", len(data)) + c + struct.pack(">I", zlib.crc32(c))
-    hdr = struct.pack(">IIBBBBB", w, h, 8, 0, 0, 0, 0)
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", hdr) +
-                chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b""))
+# the Mac attributes a checkpoint carries besides RAM and the CPU context
+DEVICE_STATE = ("via_ifr", "via_ier", "via_acr", "via_sr", "btn", "x2", "y2",
+                "dcd_x", "dcd_y", "scc_ptr", "kb_queue", "kb_events",
+                "kb_attn", "kb_cmd", "kb_stash", "pend1", "pend2", "ctx_stack",
+                "rte_flag", "slices", "pc", "vars", "disk")
 
 
 class Mac:
     def __init__(self, disk_path, artdir, trace=False):
         self.disk = bytearray(open(disk_path, "rb").read())
+        self.disk_key = ucsnap.image_key(bytes(self.disk))
         self.artdir = artdir
         self.trace = trace
         os.makedirs(artdir, exist_ok=True)
@@ -82,9 +97,6 @@ class Mac:
         mu = self.mu = Uc(UC_ARCH_M68K, UC_MODE_BIG_ENDIAN)
         mu.ctl_set_cpu_model(UC_CPU_M68K_M68000)
         mu.mem_map(0, RAM_SIZE)
-        mu.mem_map(SCCR_PAGE, 0x1000)
-        mu.mem_map(SCCW_PAGE, 0x1000)
-        mu.mem_map(VIA_BASE, 0x2000)
 
         # --- device state
         self.via_ifr = 0
@@ -110,14 +122,13 @@ class Mac:
         self.slices = 0
 
         mu.hook_add(UC_HOOK_INTR, self._intr)
-        mu.hook_add(UC_HOOK_MEM_READ, self._via_r, begin=VIA_BASE,
-                    end=VIA_BASE + 0x2000 - 1)
-        mu.hook_add(UC_HOOK_MEM_WRITE, self._via_w, begin=VIA_BASE,
-                    end=VIA_BASE + 0x2000 - 1)
-        mu.hook_add(UC_HOOK_MEM_READ, self._scc_r, begin=SCCR_PAGE,
-                    end=SCCR_PAGE + 0xFFF)
-        mu.hook_add(UC_HOOK_MEM_WRITE, self._scc_w, begin=SCCW_PAGE,
-                    end=SCCW_PAGE + 0xFFF)
+        # The VIA and SCC are MMIO pages, not RAM under a memory hook: any
+        # UC_HOOK_MEM_READ/WRITE, however narrow its range, sends every load
+        # and store the 68000 makes through QEMU's slow path to be checked
+        # against it, which cost more than half the run time.
+        mu.mmio_map(VIA_BASE, 0x2000, self._via_r, None, self._via_w, None)
+        mu.mmio_map(SCCR_PAGE, 0x1000, self._scc_r, None, None, None)
+        mu.mmio_map(SCCW_PAGE, 0x1000, None, None, self._scc_w, None)
 
         # --- Start Manager
         mu.mem_write(0x824, struct.pack(">I", SCRN))      # ScrnBase
@@ -139,11 +150,12 @@ class Mac:
         self.vars = None            # discovered from the UDM1 header
 
     # ------------------------------------------------------------ devices
-    def _via_reg(self, addr):
-        return (addr - (VIA_BASE | 0x1FE)) >> 9
+    # (offsets are from the start of each MMIO page)
+    def _via_reg(self, off):
+        return (off - 0x1FE) >> 9
 
-    def _via_r(self, uc, access, addr, size, value, user):
-        r = self._via_reg(addr)
+    def _via_r(self, uc, off, size, user):
+        r = self._via_reg(off)
         v = 0
         if r == 0:                  # ORB
             v = (0 if self.btn else 8) | (self.x2 << 4) | (self.y2 << 5)
@@ -156,10 +168,10 @@ class Mac:
             v = self.via_ifr | (0x80 if (self.via_ifr & self.via_ier & 0x7F) else 0)
         elif r == 14:
             v = self.via_ier | 0x80
-        uc.mem_write(addr, bytes([v & 0xFF]))
+        return v & 0xFF
 
-    def _via_w(self, uc, access, addr, size, value, user):
-        r = self._via_reg(addr)
+    def _via_w(self, uc, off, size, value, user):
+        r = self._via_reg(off)
         v = value & 0xFF
         if r == 10:                 # SR write (faithful M0110 contract,
             self.via_ifr &= ~0x04   # mirrors Mini vMac KBRDEMDV/VIAEMDEV)
@@ -187,22 +199,22 @@ class Mac:
             else:
                 self.via_ier &= ~(v & 0x7F)
 
-    def _scc_ch(self, addr):
+    def _scc_ch(self, off):
         # +0/+4 = channel B ctl/data, +2/+6 = channel A (read base $9FFFF8)
-        return 0 if (addr & 2) else 1   # 0 = A, 1 = B
+        return 0 if (off & 2) else 1    # 0 = A, 1 = B
 
-    def _scc_r(self, uc, access, addr, size, value, user):
-        ch = self._scc_ch(addr)
+    def _scc_r(self, uc, off, size, user):
+        ch = self._scc_ch(off)
         ptr = self.scc_ptr[ch]
         self.scc_ptr[ch] = 0
         v = 0
         if ptr == 0:                # RR0: DCD in bit 3, TX empty bit 2
             dcd = self.dcd_x if ch == 0 else self.dcd_y
             v = (dcd << 3) | 0x04
-        uc.mem_write(addr, bytes([v]))
+        return v
 
-    def _scc_w(self, uc, access, addr, size, value, user):
-        ch = self._scc_ch(addr)
+    def _scc_w(self, uc, off, size, value, user):
+        ch = self._scc_ch(off)
         v = value & 0xFF
         if self.scc_ptr[ch] == 0:
             reg = v & 7
@@ -371,6 +383,40 @@ class Mac:
         while self.slices < target:
             self.run_slice()
 
+    def boot_tick(self, n, snapdir=SNAPDIR):
+        """tick(n) from power-on - or restore the machine as it was after the
+        same n ticks of the same disk the last time. Only a machine that
+        started at power-on forks here: anything else is not a boot."""
+        if self.slices:
+            self.tick(n)
+            return
+        name = ucsnap.image_key(self.disk_key.encode(), os.path.abspath(__file__),
+                                b"wait %d" % n)
+        path = os.path.join(snapdir, "boot-%s.snap" % name[:32])
+        if self.load_checkpoint(path, quiet=True):
+            return
+        self.tick(n)
+        self.save_checkpoint(path)
+
+    # ------------------------------------------------------------ checkpoints
+    def save_checkpoint(self, path):
+        ucsnap.save(path, self.mu, [(0, RAM_SIZE)], self.disk_key,
+                    dict((k, getattr(self, k)) for k in DEVICE_STATE))
+
+    def load_checkpoint(self, path, quiet=False):
+        """Restore from `path`; False (machine untouched) if it holds no
+        checkpoint of this disk, which is an error unless `quiet`."""
+        state, why = ucsnap.load(path, self.disk_key)
+        if state is None:
+            if quiet:
+                return False
+            raise SystemExit(f"--resume: {why}")
+        ucsnap.restore(self.mu, state)
+        for k, v in state["dev"].items():
+            setattr(self, k, v)
+        print(f"[harness] restored {os.path.basename(path)} ({self.slices} slices)")
+        return True
+
     def _find_vars(self):
         if self.vars is None:
             hdr = self.mu.mem_read(KERNBASE + 4, 8)
@@ -437,29 +483,34 @@ class Mac:
     # ------------------------------------------------------------ output
     def shot(self, name):
         fb = self.mu.mem_read(SCRN, SCRH * ROWB)
-        def row(y):
-            out = bytearray()
-            base = y * ROWB
-            for b in fb[base:base + ROWB]:
-                for bit in range(7, -1, -1):
-                    out.append(0 if (b >> bit) & 1 else 255)
-            return out
         path = os.path.join(self.artdir, name + ".png")
-        png_gray(path, SCRW, SCRH, row)
+        fbconv.write_png(path, SCRW, SCRH, fbconv.gray(fbconv.mono(fb), (255, 0)), gray=True)
         print(f"[shot] {path}")
 
 
 def main():
-    args = [a for a in sys.argv[1:] if a != "--trace"]
-    trace = "--trace" in sys.argv
+    argv = sys.argv[1:]
+    resume = None
+    if "--resume" in argv:
+        i = argv.index("--resume")
+        resume = argv[i + 1]
+        del argv[i:i + 2]
+    trace = "--trace" in argv
+    snap = not trace and not resume and "--no-snapshot" not in argv
+    args = [a for a in argv if a not in ("--trace", "--no-snapshot")]
     disk, artdir = args[0], args[1]
     mac = Mac(disk, artdir, trace)
+    if resume:
+        mac.load_checkpoint(resume)
+    first = True
     for line in sys.stdin:
         line = line.split("#")[0].strip()
         if not line:
             continue
         cmd, *rest = line.split()
-        if cmd == "wait":
+        if cmd == "wait" and first and snap:
+            mac.boot_tick(int(rest[0]))
+        elif cmd == "wait":
             mac.tick(int(rest[0]))
         elif cmd == "shot":
             mac.shot(rest[0])
@@ -478,11 +529,15 @@ def main():
             a = int(rest[0], 16)
             v = struct.unpack(">H", bytes(mac.mu.mem_read(a, 2)))[0]
             print(f"[peek] {a:#x} = {v} ({v:#x})")
+        elif cmd == "checkpoint":
+            mac.save_checkpoint(rest[0])
+            print(f"[checkpoint] {rest[0]}")
         elif cmd == "quit":
             break
         else:
             raise SystemExit(f"unknown command: {cmd}")
-    print("[harness] done")
+        first = False
+    print("[harness] done (%d slices, ~%d instrs)" % (mac.slices, mac.slices * SLICE))
 
 
 if __name__ == "__main__":
@@ -29,15 +29,22 @@ Rendering: the 32x30 nametable is composed through pattern table 0 and the
 background palette at $3F00 (NES master-palette indices -> RGB) to a 256x240 PNG.
 The attribute table is all zeros (one palette), matching the port.
 
+Boot snapshot: as in the Apple II and C64 harnesses, a script's leading
+`frames N` is a fork point. The machine after the boot steps and those N
+frames (MPU registers, the 64K, VRAM + palette, the $2006 pointer and latch,
+the APU write count) is saved under build/snap/, keyed by the ROM, N, the
+frame budget and this harness, and a later run of the same ROM restores it
+instead of running. --no-snapshot (or --trace) runs it for real.
+
 Script on stdin (one command per line, # comments):
   frames N      run N emulated frames (one NMI each)
   shot NAME     screenshot the composed nametable to <artdir>/NAME.png
   assert apu>0  fail unless the APU has been written at least once
   quit          finish
 
-Usage: harness.py <rom.nes> <artdir> [--trace] [--frames-instrs N] < script
+Usage: harness.py <rom.nes> <artdir> [--trace] [--frames-instrs N] [--no-snapshot] < script
 """
-import os, struct, sys, zlib
+import hashlib, os, sys
 from py65.devices.mpu6502 import MPU
 from py65.memory import ObservableMemory
 
@@ -46,6 +53,15 @@ from py65.memory import ObservableMemory
 # ~ a few thousand 6502 instructions; the rest of the budget is the wait_vbl
 # spin, which is harmless. Generous so no frame is ever truncated mid-redraw.
 FRAME_INSTRS = 60000
+# boot: run past sei/cld/txs and the RAM-clear before the first NMI.
+BOOT_INSTRS = 4000
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SNAPDIR = os.path.join(HERE, "build", "snap")
+sys.path.insert(0, os.path.join(HERE, "..", "tools"))
+import fbconv                                              # noqa: E402
+import snapfile                                            # noqa: E402
+MPU_STATE = ("pc", "a", "x", "y", "sp", "p", "processorCycles")
 
 # The NES master palette (2C02), 64 entries, RGB. Standard Mesen-ish values.
 NES_PALETTE = [
@@ -68,18 +84,6 @@ NES_PALETTE = [
 ]
 
 
-def png_rgb(path, w, h, getrow):
-    rows = b"".join(b"\x00" + bytes(getrow(y)) for y in range(h))
-
-    def chunk(tag, data):
-        c = tag + data
-        return struct.pack(">I", len(data)) + c + struct.pack(">I", zlib.crc32(c))
-    hdr = struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", hdr) +
-                chunk(b"IDAT", zlib.compress(rows, 6)) + chunk(b"IEND", b""))
-
-
 class NES:
     def __init__(self, rom_path, artdir, trace=False):
         self.artdir = artdir
@@ -87,6 +91,7 @@ class NES:
         os.makedirs(artdir, exist_ok=True)
 
         data = open(rom_path, "rb").read()
+        self.rom_sha = hashlib.sha256(data).hexdigest()
         assert data[:4] == b"NES\x1a", "not an iNES file"
         prg_banks = data[4]
         prg = data[16:16 + prg_banks * 16384]
@@ -94,7 +99,9 @@ class NES:
         self.chr = data[chr_off:chr_off + 8192]
         assert len(self.chr) >= 4096, "no CHR pattern table 0"
 
-        self.mem = ObservableMemory()
+        # the 64K itself, so a snapshot copies it without firing the I/O hooks
+        self.ram = [0] * 0x10000
+        self.mem = ObservableMemory(subject=self.ram)
         # NROM-256: 32 KB PRG straight to $8000 (mirror if a 16 KB image).
         if len(prg) == 16384:
             prg = prg + prg
@@ -183,27 +190,70 @@ class NES:
             self._nmi()
             self.step(budget)
 
-    # ---- output ----
-    def _tile_pixel(self, tile, x, y):
-        base = tile * 16
-        p0 = self.chr[base + y]
-        p1 = self.chr[base + 8 + y]
-        return ((p1 >> (7 - x)) & 1) << 1 | ((p0 >> (7 - x)) & 1)
+    def boot(self, n=0, budget=FRAME_INSTRS, snapdir=None):
+        """The boot steps, then n frames. With a snapdir, restore the machine
+        as it was after the same boot of the same ROM the last time."""
+        path = None
+        if snapdir:
+            h = hashlib.sha256(self.rom_sha.encode())
+            with open(os.path.abspath(__file__), "rb") as f:
+                h.update(f.read())
+            h.update(b"frames %d x %d" % (n, budget))
+            path = os.path.join(snapdir, "boot-%s.snap" % h.hexdigest()[:32])
+            if self.load_snapshot(path):
+                return
+        self.step(BOOT_INSTRS)
+        self.frames(n, budget)
+        if path:
+            self.save_snapshot(path)
+
+    # ---- snapshots ----
+    def snapshot(self):
+        """The machine as plain data (picklable, shares nothing)."""
+        return {"mpu": dict((k, getattr(self.mpu, k)) for k in MPU_STATE),
+                "ram": bytes(self.ram), "vram": bytes(self.vram),
+                "pal": bytes(self.pal), "ppu_addr": self.ppu_addr,
+                "ppu_latch_hi": self.ppu_latch_hi,
+                "apu_writes": self.apu_writes, "steps": self.steps}
+
+    def restore(self, state):
+        for k, v in state["mpu"].items():
+            setattr(self.mpu, k, v)
+        self.ram[:] = state["ram"]
+        self.vram[:] = state["vram"]
+        self.pal[:] = state["pal"]
+        self.ppu_addr = state["ppu_addr"]
+        self.ppu_latch_hi = state["ppu_latch_hi"]
+        self.apu_writes = state["apu_writes"]
+        self.steps = state["steps"]
+
+    def save_snapshot(self, path):
+        snapfile.save(path, self.snapshot())
+
+    def load_snapshot(self, path):
+        """Restore from `path`; False (machine untouched) if nothing usable
+        is there."""
+        state = snapfile.load(path)
+        if state is None:
+            return False
+        self.restore(state)
+        print("[harness] boot restored from %s (%d steps)"
+              % (os.path.basename(path), state["steps"]))
+        return True
 
+    # ---- output ----
     def shot(self, name):
         pal_rgb = [NES_PALETTE[self.pal[i] & 0x3F] for i in range(4)]
-
-        def getrow(y):
-            out = bytearray()
-            cellrow = y >> 3
-            ty = y & 7
+        # per scanline, each of the 32 cells' two pattern-table bitplane bytes
+        p0, p1 = bytearray(32 * 240), bytearray(32 * 240)
+        for y in range(240):
+            row = (y >> 3) * 32
             for cx in range(32):
-                tile = self.vram[cellrow * 32 + cx]
-                for tx in range(8):
-                    out += bytes(pal_rgb[self._tile_pixel(tile, tx, ty)])
-            return out
+                base = self.vram[row + cx] * 16 + (y & 7)
+                p0[y * 32 + cx] = self.chr[base]
+                p1[y * 32 + cx] = self.chr[base + 8]
         path = os.path.join(self.artdir, name + ".png")
-        png_rgb(path, 256, 240, getrow)
+        fbconv.write_png(path, 256, 240, fbconv.palette(fbconv.planar((p0, p1)), pal_rgb))
         print("[shot] %s" % path)
 
 
@@ -215,16 +265,17 @@ def main():
         i = argv.index("--frames-instrs")
         budget = int(argv[i + 1])
         del argv[i:i + 2]
+    snap = not trace and "--no-snapshot" not in argv
     args = [a for a in argv if not a.startswith("--")]
     rom, artdir = args[0], args[1]
     nes = NES(rom, artdir, trace)
-    # boot: run past sei/cld/txs and the RAM-clear before the first NMI.
-    nes.step(4000)
-    for line in sys.stdin:
-        line = line.split("#")[0].strip()
-        if not line:
-            continue
-        parts = line.split()
+    script = [line.split("#")[0].split() for line in sys.stdin]
+    script = [parts for parts in script if parts]
+    if snap and script and script[0][0] == "frames":
+        nes.boot(int(script.pop(0)[1]), budget, SNAPDIR)
+    else:
+        nes.boot()
+    for parts in script:
         cmd, rest = parts[0], parts[1:]
         if cmd == "frames":
             nes.frames(int(rest[0]), budget)
@@ -43,6 +43,9 @@ import json, os, socket, subprocess, sys, time
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(HERE)
+sys.path.insert(0, os.path.join(HERE, "tools"))
+import ppm2png                                # read_ppm/write_png, stdlib only
+import screencap                              # settled screendumps, no sleep-polling
 
 OVMF_CODE = "/usr/share/OVMF/OVMF_CODE_4M.fd"
 OVMF_VARS = "/usr/share/OVMF/OVMF_VARS_4M.fd"
@@ -150,12 +153,12 @@ def drag(q, x0, y0, x1, y1, steps=8):
 def shot(q, tag):
     os.makedirs(OUTDIR, exist_ok=True)
     ppm = "%s/%s.ppm" % (OUTDIR, tag)
-    q.cmd("screendump", filename=ppm)
-    time.sleep(0.4)
-    subprocess.run([sys.executable, "tools/ppm2png.py", ppm, "%s/%s.png" % (OUTDIR, tag)],
-                   check=True)
+    screencap.dump(q, ppm)
+    w, h, rgb = ppm2png.map_ppm(ppm)
+    ppm2png.write_png("%s/%s.png" % (OUTDIR, tag), w, h, rgb)
     os.remove(ppm)
-    print("shot: %s/%s.png" % (OUTDIR, tag), flush=True)
+    print("shot: %s/%s.png (%.0f ms)" % (OUTDIR, tag, screencap.last_ms()),
+          flush=True)
 
 
 def wait_splash(q, timeout=30):
@@ -167,17 +170,8 @@ def wait_splash(q, timeout=30):
     t0 = time.time()
     while time.time() - t0 < timeout:
         try:
-            q.cmd("screendump", filename=probe)
-            time.sleep(0.25)
-            with open(probe, "rb") as f:
-                if f.readline().strip() != b"P6":
-                    raise ValueError
-                line = f.readline()
-                while line.startswith(b"#"):
-                    line = f.readline()
-                w, h = map(int, line.split())
-                f.readline()
-                px = f.read()
+            screencap.dump(q, probe, timeout=5.0)
+            w, h, px = ppm2png.map_ppm(probe)
             o = (10 * w + 10) * 3                     # a corner pixel
             r, g, b = px[o], px[o + 1], px[o + 2]
             if b > 34 and b > r + 12 and g < 90:      # the navy backdrop
@@ -305,7 +299,7 @@ def count_menu_rows(q, expect, probe="_rows", tries=3):
             key(q, "down", gap=0.09)                  # each open starts at 0
         time.sleep(1.2)                               # see SETTLE above
         path = "%s/%s%s.ppm" % (OUTDIR, probe, tag)
-        q.cmd("screendump", filename=path); time.sleep(0.4)
+        screencap.dump(q, path)
         combo(q, "ctrl", "esc"); time.sleep(0.4)
         data = frame_above_taskbar(path)
         os.remove(path)
@@ -1048,6 +1042,7 @@ def main():
             except Exception as e:
                 print("!! scene %s failed: %r" % (name, e), flush=True)
     finally:
+        print(screencap.summary(), flush=True)
         try:
             q.cmd("quit")
         except Exception:
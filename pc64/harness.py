@@ -25,17 +25,30 @@ into shots/*.png at each step.
   python3 harness.py usbhid_mods  usb stack gate: the HID modifier byte reaches
                                 uno_usb_hid_mods() as a live level (same build).
 """
-import json, os, socket, subprocess, sys, time
+import atexit, json, os, socket, subprocess, sys, time
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 os.chdir(HERE)
 sys.path.insert(0, os.path.join(HERE, "tools"))
 import ppm2png                                # read_ppm/write_png, stdlib only
+import framediff                              # FRAMES questions, NumPy optional
+import screencap                              # settled screendumps, no sleep-polling
 
 OVMF_CODE = "/usr/share/OVMF/OVMF_CODE_4M.fd"
 OVMF_VARS = "/usr/share/OVMF/OVMF_VARS_4M.fd"
-QMP_SOCK  = "/tmp/unodos-pc64-qmp.sock"   # NOT under build/: a Windows-mounted
+QMP_SOCK  = os.environ.get("UNO_QMP_SOCK", "/tmp/unodos-pc64-qmp.sock")
+                                          # NOT under build/: a Windows-mounted
                                           # drvfs tree cannot host unix sockets
+VARS_FD   = os.path.join(os.environ.get("UNO_SCRATCH", "build"), "vars.fd")
+SHOTS     = os.environ.get("UNO_SHOTS", "shots")   # tools/gates.py: one per gate
+
+# PNG artifacts are encoded off the capture path (ppm2png.PngWriter), so a
+# scenario is never waiting on zlib between two keystrokes. Level 9 bought a
+# few percent of size for several times the CPU on every shot; 6 is zlib's own
+# default. HARNESS_PNG_LEVEL=9 for shots that get committed.
+PNG = ppm2png.PngWriter(level=int(os.environ.get("HARNESS_PNG_LEVEL", "6")))
+atexit.register(PNG.flush)
+atexit.register(lambda: screencap.LOG and print(screencap.summary()))
 
 
 class Qmp:
@@ -137,10 +150,7 @@ def probe_scale(img, wh):
 
 def probe_screen(q):
     global SCREEN_W, SCREEN_H, SCALE
-    ppm = "shots/_probe.ppm"
-    screendump(q, ppm)
-    w, h, rgb = ppm2png.read_ppm(ppm)
-    os.remove(ppm)
+    w, h, rgb = capture(q, "_probe")
     SCREEN_W, SCREEN_H = w, h
     SCALE = probe_scale(rgb, (w, h))
     print("screen: %dx%d (guest fb %dx%d, zoom %dx)"
@@ -167,38 +177,17 @@ def click(q, x, y):
     mouse_btn(q, False)
 
 
-def screendump(q, ppm, tries=60):
-    """QMP screendump is ASYNCHRONOUS: it returns as soon as the request is
-    queued, and QEMU writes the file on its next graphic update. A fixed sleep
-    therefore sometimes reads a file that is empty or half written, which
-    decodes as an all-BLACK frame - and a black frame passes or fails whatever
-    the shot was asserting for reasons that have nothing to do with the guest.
-    Delete first, then wait for the size to settle above zero."""
-    try:
-        os.remove(ppm)
-    except OSError:
-        pass
-    q.cmd("screendump", filename=ppm)
-    last = -1
-    for _ in range(tries):
-        time.sleep(0.15)
-        try:
-            n = os.path.getsize(ppm)
-        except OSError:
-            continue
-        if n and n == last:
-            return
-        last = n
-    raise RuntimeError("screendump never settled: " + ppm)
+def capture(q, tag):
+    """One settled frame -> (w, h, rgb), never via a file we read back: through
+    a pipe when screencap can use one, else a view over the mapped PPM. `tag`
+    only names the shot."""
+    return screencap.frame(q)
 
 
 def shot(q, tag):
-    ppm = "shots/%s.ppm" % tag
-    screendump(q, ppm)
-    subprocess.run([sys.executable, "tools/ppm2png.py", ppm, "shots/%s.png" % tag],
-                   check=True)
-    os.remove(ppm)
-    print("shot: shots/%s.png" % tag)
+    w, h, rgb = capture(q, tag)
+    PNG.put("%s/%s.png" % (SHOTS, tag), w, h, rgb)
+    print("shot: %s/%s.png (%.0f ms)" % (SHOTS, tag, screencap.last_ms()))
 
 
 # ---- window-manager scenarios (docs/WM-MODERN-SPEC.md) --------------------
@@ -230,43 +219,29 @@ def start_app(q, n, wait=1.8):
     time.sleep(wait)
 
 
-# Frames are compared in memory, stdlib only (Pillow is optional on this tree,
-# which is why ppm2png.py exists at all). grab() keeps the raw RGB alongside
-# the PNG so a scenario can assert on regions without decoding it again.
+# Frames are compared in memory (Pillow is optional on this tree, which is why
+# ppm2png.py exists at all). grab() keeps the raw RGB alongside the PNG so a
+# scenario can assert on regions without decoding it again. The questions
+# themselves live in tools/framediff.py: vectorised with NumPy when it is
+# installed, whole-row bytes compares when it is not - the per-pixel loops
+# they replace cost seconds per assertion at 1280x800.
 FRAMES = {}
 
 
-def grab(q, tag):
-    """screendump + convert (as shot()) and remember the raw RGB for diffing."""
-    ppm = "shots/%s.ppm" % tag
-    screendump(q, ppm)
-    w, h, rgb = ppm2png.read_ppm(ppm)
-    ppm2png.write_png("shots/%s.png" % tag, w, h, rgb)
-    os.remove(ppm)
-    FRAMES[tag] = (w, h, rgb)
-    print("shot: shots/%s.png" % tag)
+def grab(q, tag, keep=True):
+    """capture (as shot()) and remember the raw RGB for diffing. keep=False is
+    for probe frames nobody will look at: they are never encoded at all."""
+    w, h, rgb = capture(q, tag)
+    FRAMES[tag] = framediff.Frame(w, h, rgb)
+    if keep:
+        PNG.put("%s/%s.png" % (SHOTS, tag), w, h, rgb)
+        print("shot: %s/%s.png (%.0f ms)" % (SHOTS, tag, screencap.last_ms()))
     return w, h
 
 
 def diff_frac(tag_a, tag_b, box):
     """Fraction of pixels differing between two frames inside box (l,t,r,b)."""
-    wa, ha, ra = FRAMES[tag_a]
-    wb, hb, rb = FRAMES[tag_b]
-    if (wa, ha) != (wb, hb):
-        return 1.0
-    l, t, r, b = box
-    l = max(0, l); t = max(0, t); r = min(wa, r); b = min(ha, b)
-    if r <= l or b <= t:
-        return 0.0
-    n = 0
-    for y in range(t, b):
-        row = y * wa * 3
-        for x in range(l, r):
-            i = row + x * 3
-            if (abs(ra[i] - rb[i]) + abs(ra[i + 1] - rb[i + 1]) +
-                    abs(ra[i + 2] - rb[i + 2])) > 24:
-                n += 1
-    return n / float((r - l) * (b - t))
+    return framediff.diff_frac(FRAMES[tag_a], FRAMES[tag_b], box)
 
 
 # diff_frac answers "did this region change"; a drag test also has to answer
@@ -274,58 +249,23 @@ def diff_frac(tag_a, tag_b, box):
 # the geometry helpers that go with it. Same rule: only ever between two frames
 # of the same run.
 
-def in_any(rects, x, y):
-    for r in rects or ():
-        if r[0] <= x < r[0] + r[2] and r[1] <= y < r[1] + r[3]:
-            return True
-    return False
+in_any = framediff.in_any
 
 
 def diff_bbox(tag_a, tag_b, thresh=24, ignore=None):
     """Bounding box (x, y, w, h) of the pixels that differ between two grabbed
     frames, or None. `ignore` is a list of rects that always change and would
     otherwise swallow the answer: the taskbar (its clock ticks) and, in a debug
-    build, the perf HUD across the top."""
-    wa, ha, ra = FRAMES[tag_a]
-    wb, hb, rb = FRAMES[tag_b]
-    if (wa, ha) != (wb, hb):
-        return None
-    xs0, ys0, xs1, ys1 = wa, ha, -1, -1
-    for y in range(0, ha, 2):                     # every other row: 4x cheaper
-        row = y * wa * 3
-        for x in range(0, wa, 2):
-            i = row + x * 3
-            if (abs(ra[i] - rb[i]) + abs(ra[i + 1] - rb[i + 1]) +
-                    abs(ra[i + 2] - rb[i + 2])) < thresh:
-                continue
-            if in_any(ignore, x, y):
-                continue
-            if x < xs0: xs0 = x
-            if x > xs1: xs1 = x
-            if y < ys0: ys0 = y
-            if y > ys1: ys1 = y
-    if xs1 < 0:
-        return None
-    return (xs0, ys0, xs1 - xs0 + 1, ys1 - ys0 + 1)
+    build, the perf HUD across the top. Sampled on every other row and column:
+    a window edge is never one pixel wide."""
+    return framediff.diff_bbox(FRAMES[tag_a], FRAMES[tag_b], thresh, ignore)
 
 
 def uniform(tag, x, y, bw, bh, thresh=24):
     """Is every pixel of this box the same colour as its top-left? True over
     bare wallpaper (the gradient moves far less than `thresh` across a small
     box), false over an icon, a label or window chrome."""
-    w, h, img = FRAMES[tag]
-    if x < 0 or y < 0 or x + bw > w or y + bh > h:
-        return False
-    i0 = (y * w + x) * 3
-    r0, g0, b0 = img[i0], img[i0 + 1], img[i0 + 2]
-    for yy in range(y, y + bh, 2):
-        row = yy * w * 3
-        for xx in range(x, x + bw, 2):
-            i = row + xx * 3
-            if (abs(img[i] - r0) + abs(img[i + 1] - g0) +
-                    abs(img[i + 2] - b0)) >= thresh:
-                return False
-    return True
+    return framediff.uniform(FRAMES[tag], x, y, bw, bh, thresh)
 
 
 def find_bare(tag, y0, y1, need=200):
@@ -337,25 +277,7 @@ def find_bare(tag, y0, y1, need=200):
     clickable CELL is far wider than the glyph and label drawn in it, so a press
     in the blank part of a cell still launches the app. A run at least `need` px
     wide cannot be a gap between icons in one column, so it is past the grid."""
-    w, h, _ = FRAMES[tag]
-    nb = w // 8
-    bare = [True] * nb
-    for xb in range(nb):
-        for y in range(y0, y1 - 8, 8):
-            if not uniform(tag, xb * 8, y, 8, 8):
-                bare[xb] = False
-                break
-    best, run = None, 0
-    for xb in range(nb + 1):
-        if xb < nb and bare[xb]:
-            run += 1
-            continue
-        if run * 8 >= need and (best is None or run * 8 > best[1]):
-            best = ((xb - run) * 8, run * 8)
-        run = 0
-    if not best:
-        return None
-    return best[0] + best[1] // 2, (y0 + y1) // 2
+    return framediff.find_bare(FRAMES[tag], y0, y1, need)
 
 
 def win_title_y(desk_tag, open_tag, box, probe=90):
@@ -497,14 +419,11 @@ class Mouse:
         asserts on a drag."""
         self.home()
         time.sleep(0.4)
-        grab(self.q, "_ptr_a")
+        grab(self.q, "_ptr_a", keep=False)
         self.to(SCREEN_W // 2, SCREEN_H // 2)
         time.sleep(0.4)
-        grab(self.q, "_ptr_b")
-        moved = diff_bbox("_ptr_a", "_ptr_b", ignore=noise_bands()) is not None
-        for t in ("_ptr_a", "_ptr_b"):
-            os.remove("shots/%s.png" % t)
-        return moved
+        grab(self.q, "_ptr_b", keep=False)
+        return diff_bbox("_ptr_a", "_ptr_b", ignore=noise_bands()) is not None
 
 
 REQUIRE_EDGE = os.environ.get("WM_REQUIRE_EDGE", "0") != "0"
@@ -2190,7 +2109,7 @@ def qemu_argv(extra=None, log="build/ovmf.log", pointer="tablet"):
     argv = [
         "qemu-system-x86_64", "-machine", "q35", "-m", "256",
         "-drive", "if=pflash,format=raw,readonly=on,file=" + OVMF_CODE,
-        "-drive", "if=pflash,format=raw,file=build/vars.fd",
+        "-drive", "if=pflash,format=raw,file=" + VARS_FD,
         "-drive", disk_arg,
         "-device", "qemu-xhci",
         "-nic", "none",
@@ -3067,7 +2986,7 @@ def start_qemu(extra=None, log="build/ovmf.log", pointer="tablet"):
     """Boot one QEMU and connect QMP. Returns (proc, Qmp). A scenario that needs
     a REBOOT (session restore) calls this twice; build/esp is the same vvfat
     tree both times, so what the guest wrote survives the power cycle."""
-    subprocess.run(["cp", OVMF_VARS, "build/vars.fd"], check=True)
+    subprocess.run(["cp", OVMF_VARS, VARS_FD], check=True)
     if os.path.exists(QMP_SOCK):
         os.remove(QMP_SOCK)
     qemu = subprocess.Popen(qemu_argv(extra, log, pointer))
@@ -3133,7 +3052,7 @@ def main():
         return ssh_app()                       # ditto: it owns its own sshd                     # ditto: it boots twice
     if len(sys.argv) > 1 and sys.argv[1] == "unoapps":
         return unoapps()                       # ditto: URC, it owns its boot
-    subprocess.run(["cp", OVMF_VARS, "build/vars.fd"], check=True)
+    subprocess.run(["cp", OVMF_VARS, VARS_FD], check=True)
     if os.path.exists(QMP_SOCK):
         os.remove(QMP_SOCK)
     argv = qemu_argv()
@@ -11,12 +11,14 @@ content: enough loud 100 ms windows, with a plausible dominant frequency.
   python3 tools/audio_test.py ac97     -device AC97
   python3 tools/audio_test.py both     the two above, in sequence
 """
-import os, struct, subprocess, sys, time
+import os, subprocess, sys, time
 
 HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 os.chdir(HERE)
 sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "tools"))
 from harness import Qmp, keys, QMP_SOCK, OVMF_CODE, OVMF_VARS
+import audiolib                                            # noqa: E402
 
 
 def boot_and_play(mode):
@@ -75,36 +77,16 @@ def boot_and_play(mode):
 
 def analyze(wav):
     """Return (loud_windows, seconds, dom_hz of the loudest window)."""
-    with open(wav, "rb") as f:
-        data = f.read()
-    assert data[:4] == b"RIFF" and data[8:12] == b"WAVE", "not a wav"
-    pos, rate, chans, samples = 12, 44100, 2, b""
-    while pos + 8 <= len(data):
-        cid, sz = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
-        body = data[pos + 8:pos + 8 + sz]
-        if cid == b"fmt ":
-            chans, rate = struct.unpack("<HI", body[2:8])
-        elif cid == b"data":
-            samples = body
-        pos += 8 + sz + (sz & 1)
-    n = len(samples) // 2
-    mono = [struct.unpack_from("<h", samples, i * 2 * chans)[0]
-            for i in range(n // chans)]
-    win = rate // 10                              # 100 ms windows
-    loud, best, best_rms = 0, None, 0
-    for w in range(len(mono) // win):
-        seg = mono[w * win:(w + 1) * win]
-        rms = (sum(s * s for s in seg) / win) ** 0.5
-        if rms > 500:
-            loud += 1
-            if rms > best_rms:
-                best_rms, best = rms, seg
+    w = audiolib.read(wav)
+    mono = w.channel(0)
+    win = w.rate // 10                            # 100 ms windows
+    env = audiolib.rms_windows(mono, win)
+    loud = [k for k, r in enumerate(env) if r > 500]
     dom = 0
-    if best:
-        zc = sum(1 for i in range(1, len(best))
-                 if (best[i - 1] < 0) != (best[i] < 0))
-        dom = zc * 10 / 2                          # crossings/100ms -> Hz
-    return loud, len(mono) / rate, dom
+    if loud:
+        best = max(loud, key=lambda k: env[k])    # the first, on a tie
+        dom = audiolib.crossings(mono, win)[best] * 10 / 2  # crossings/100ms -> Hz
+    return len(loud), w.seconds, dom
 
 
 def run(mode):
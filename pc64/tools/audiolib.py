@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""audiolib - the audio gates' capture analysis, without a Python loop per
+sample.
+
+audio_test, music_test, game_audio_test, duum_audio_test and the s06 demo
+scene (demo_common.wav_measure) all judge the WAV QEMU's wav audiodev wrote,
+and each had its own copy of the same two halves: a RIFF walk, then one
+struct.unpack_from per sample into a list, then RMS / zero-crossing / Goertzel
+loops over that list. A minute of 44.1 kHz stereo is 2.6 million unpacks
+before the first question is asked, and the questions walk it again. Here the
+capture is read once and every answer is a reduction:
+
+  * with NumPy, a channel is a strided int16 view of the data chunk (no copy)
+    and the windowed RMS, zero crossings and Goertzel energies are array
+    operations over a (windows, n) reshape of it - Goertzel as its closed
+    form, the magnitude of one DFT bin, for all windows at once;
+  * without it (NumPy is optional on this tree, as in framediff.py), a channel
+    is an array('h') slice and the sums go through map() over operator
+    functions - C iteration, not a Python frame per sample.
+
+Both paths return what the gates' own loops returned: windows are whole
+(a short tail is dropped unless asked for), crossings are counted inside a
+window only, and loud runs bridge gaps the way game_audio_test always did.
+
+read() also keeps what only demo_common's reader knew: a capture whose QEMU
+was killed before it could patch the header says data size 0, and the real
+samples are the rest of the file.
+
+    w = read("build/music_wav.wav")            # w.rate, w.chans, w.frames
+    x = w.channel(0)                           # or w.mix(): (L + R) // 2
+    env = rms_windows(x, w.rate // 10)         # per 100 ms
+    zc = crossings(x, w.rate // 10)
+    tones(w.mix(), w.rate, n, (440, 1234))     # [{hz: (share, level)}]
+    loud_runs(env, 100, 500, bridge=0.6)       # [[t0, t1, [window]]]
+
+    audiolib.py CAPTURE.wav [MS]    a summary, and how long the analysis took
+"""
+import array, math, operator, struct, sys, time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Wav(object):
+    """One PCM capture: its format and the raw data chunk, trimmed to whole
+    frames."""
+
+    __slots__ = ("rate", "chans", "bits", "body", "_all")
+
+    def __init__(self, rate, chans, bits, body):
+        self.rate, self.chans, self.bits = rate, max(1, chans), bits
+        step = self.chans * bits // 8 if bits else self.chans
+        self.body = body[:len(body) // step * step]
+        self._all = None
+
+    @property
+    def frames(self):
+        return len(self.body) // (self.chans * self.bits // 8)
+
+    @property
+    def seconds(self):
+        return self.frames / float(self.rate) if self.rate else 0.0
+
+    def _samples(self):
+        if self.bits != 16:
+            raise ValueError("expected s16 PCM, got %d-bit" % self.bits)
+        if self._all is None:
+            if np is not None:
+                self._all = np.frombuffer(self.body, "<i2").reshape(-1, self.chans)
+            else:
+                a = array.array("h", self.body)
+                if sys.byteorder == "big":
+                    a.byteswap()
+                self._all = a
+        return self._all
+
+    def channel(self, c=0):
+        """Channel `c` (the last one, for a mono capture asked for its right)."""
+        c = min(c, self.chans - 1)
+        s = self._samples()
+        return s[:, c] if np is not None else s[c::self.chans]
+
+    def mix(self):
+        """(L + R) // 2 per frame, as duum_audio_test's Goertzel input."""
+        l, r = self.channel(0), self.channel(1)
+        if np is not None:
+            return (l.astype(np.int32) + r) // 2
+        return array.array("i", map(operator.floordiv,
+                                    map(operator.add, l, r), [2] * len(l)))
+
+
+def read(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        raise ValueError("%s is not a RIFF/WAVE file" % path)
+    pos, rate, chans, bits, body = 12, 44100, 2, 16, b""
+    while pos + 8 <= len(data):
+        cid = data[pos:pos + 4]
+        sz = struct.unpack("<I", data[pos + 4:pos + 8])[0]
+        blob = data[pos + 8:pos + 8 + sz]
+        if cid == b"fmt ":
+            chans, rate = struct.unpack("<HI", blob[2:8])
+            bits = struct.unpack("<H", blob[14:16])[0]
+        elif cid == b"data":
+            # QEMU's wav backend patches the size in on clean exit; if it was
+            # killed the header says 0 and the real payload is the tail.
+            body = blob if sz else data[pos + 8:]
+            if not sz:
+                break
+        pos += 8 + sz + (sz & 1)
+    return Wav(rate, chans, bits, body)
+
+
+# ---- per-window measures ----------------------------------------------------
+def _rows(x, n):
+    """The whole n-sample windows of a NumPy channel, as a (windows, n) array."""
+    k = len(x) // n
+    return np.ascontiguousarray(x[:k * n]).reshape(k, n)
+
+
+def _chunks(x, n, partial=False):
+    end = len(x) if partial else len(x) // n * n
+    return (x[a:a + n] for a in range(0, end, n))
+
+
+def rms(x):
+    if np is not None:
+        v = np.asarray(x, np.int64)
+        return (int(np.dot(v, v)) / max(1, len(x))) ** 0.5
+    return (sum(map(operator.mul, x, x)) / max(1, len(x))) ** 0.5
+
+
+def peak(x):
+    if not len(x):
+        return 0
+    if np is not None:
+        return int(np.abs(np.asarray(x, np.int32)).max())
+    return max(max(x), -min(x))
+
+
+def rms_windows(x, n, partial=False):
+    """RMS of each n-sample window; with `partial`, of the short tail too."""
+    if np is None:
+        return [(sum(map(operator.mul, seg, seg)) / len(seg)) ** 0.5
+                for seg in _chunks(x, n, partial)]
+    v = _rows(x, n).astype(np.int64)
+    out = (((v * v).sum(axis=1) / float(n)) ** 0.5).tolist()
+    if partial and len(x) % n:
+        out.append(rms(x[len(x) // n * n:]))
+    return out
+
+
+def crossings(x, n):
+    """Sign changes inside each n-sample window (negative vs not, as the
+    gates counted them: the pair straddling two windows is in neither)."""
+    if np is not None:
+        neg = _rows(x, n) < 0
+        return (neg[:, 1:] != neg[:, :-1]).sum(axis=1).tolist()
+    out = []
+    for seg in _chunks(x, n):
+        neg = list(map((0).__gt__, seg))
+        out.append(sum(map(operator.ne, neg[1:], neg[:-1])))
+    return out
+
+
+# ---- tones ------------------------------------------------------------------
+def _goertzel_loop(seg, rate, hz):
+    w = 2.0 * math.cos(2.0 * math.pi * hz / rate)
+    s1 = s2 = 0.0
+    power = 0.0
+    for s in seg:
+        v = s / 32768.0
+        s0 = v + w * s1 - s2
+        s2, s1 = s1, s0
+        power += v * v
+    return max(0.0, s1 * s1 + s2 * s2 - w * s1 * s2), power
+
+
+def _verdict(mag, power, n):
+    level = 2.0 * math.sqrt(mag) / n
+    if power <= 1e-9:
+        return 0.0, level
+    return mag / (power * n / 4.0), level
+
+
+def goertzel(seg, rate, hz):
+    """(share, level) at one frequency over one window.
+
+    `share` is the magnitude divided by the window's own power - 'how much of
+    what is here is THIS tone'; `level` is the plain amplitude - 'is this tone
+    here AT ALL' (see duum_audio_test for why both)."""
+    return tones(seg, rate, len(seg), (hz,))[0][hz] if len(seg) else (0.0, 0.0)
+
+
+def tones(x, rate, n, hzs, only=None):
+    """goertzel() at every frequency in `hzs` for each n-sample window (or
+    just the window numbers in `only`): a list of {hz: (share, level)}, None
+    for a window that was not asked about."""
+    count = len(x) // n
+    want = range(count) if only is None else only
+    out = [None] * count
+    if np is None:
+        for k in want:
+            seg = x[k * n:(k + 1) * n]
+            out[k] = dict((hz, _verdict(*_goertzel_loop(seg, rate, hz), n=n))
+                          for hz in hzs)
+        return out
+    want = list(want)
+    if not want:
+        return out
+    v = _rows(x, n)[want] / 32768.0
+    power = (v * v).sum(axis=1)
+    t = np.arange(n)
+    res = {}
+    for hz in hzs:
+        ph = 2.0 * math.pi * hz / rate * t
+        re, im = v @ np.cos(ph), v @ np.sin(ph)
+        res[hz] = re * re + im * im     # the Goertzel magnitude, |DFT bin|^2
+    for i, k in enumerate(want):
+        out[k] = dict((hz, _verdict(float(res[hz][i]), float(power[i]), n))
+                      for hz in hzs)
+    return out
+
+
+def band_energy(x, rate, n, bands):
+    """Energy in each (lo_hz, hi_hz) band for each n-sample window, from the
+    window's DFT: a list of [energy per band]. Without NumPy the bins are
+    Goertzel loops, so keep `n` modest there."""
+    bins = [[b for b in range(n // 2 + 1) if lo <= b * rate / float(n) < hi]
+            for lo, hi in bands]
+    if np is not None:
+        spec = np.abs(np.fft.rfft(_rows(x, n) / 32768.0, axis=1)) ** 2
+        return [[float(row[bs].sum()) for bs in bins] for row in spec]
+    # at rate=n, frequency b is exactly DFT bin b
+    return [[sum(_goertzel_loop(seg, n, b)[0] for b in bs) for bs in bins]
+            for seg in _chunks(x, n)]
+
+
+# ---- onsets -----------------------------------------------------------------
+def loud_runs(env, ms, floor, bridge=0.0):
+    """Stretches of windows louder than `floor`, as [t0_s, t1_s, [window]].
+
+    A gap of up to `bridge` seconds does not end a run: a score rests between
+    phrases, and without the bridge one tune reads as several. A run's start
+    is an onset (onsets())."""
+    runs = []
+    for w, r in enumerate(env):
+        if r <= floor:
+            continue
+        t0, t1 = w * ms / 1000.0, (w + 1) * ms / 1000.0
+        if runs and t0 - runs[-1][1] <= bridge:
+            runs[-1][1] = t1
+            runs[-1][2].append(w)
+        else:
+            runs.append([t0, t1, [w]])
+    return runs
+
+
+def onsets(env, ms, floor, bridge=0.0):
+    """When sound starts: the first second of each loud run."""
+    return [r[0] for r in loud_runs(env, ms, floor, bridge)]
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    ms = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    t0 = time.perf_counter()
+    w = read(sys.argv[1])
+    x = w.channel(0)
+    n = max(1, w.rate * ms // 1000)
+    env = rms_windows(x, n)
+    zc = crossings(x, n)
+    loud = [k for k, r in enumerate(env) if r > 500]
+    runs = loud_runs(env, ms, 500, bridge=0.6)
+    dt = time.perf_counter() - t0
+    print("%s: %d Hz x %d, %.1f s, peak %d, rms %.0f"
+          % (sys.argv[1], w.rate, w.chans, w.seconds, peak(x), rms(x)))
+    print("  %d of %d %d ms windows loud; %d run(s) starting at %s"
+          % (len(loud), len(env), ms, len(runs),
+             ", ".join("%.1fs" % r[0] for r in runs[:8]) or "-"))
+    if loud:
+        k = max(loud, key=lambda i: env[i])
+        print("  loudest window %.1fs: ~%d Hz by zero crossings"
+              % (k * ms / 1000.0, zc[k] * 1000.0 / ms / 2))
+    print("  analysed in %.1f ms (%s)" % (dt * 1000, "numpy" if np is not None
+                                         else "array"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
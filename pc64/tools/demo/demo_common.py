@@ -15,9 +15,9 @@ Three capture paths live here:
   QMP screendump  - s01 only. The shell (and therefore unostream) does not
                     exist until late in boot, so a cold boot HAS to be
                     photographed from outside. screendump settles slowly and
-                    is not synchronous in QEMU 8.2, so shot() polls the PPM
-                    until it is complete (docs_shots.py:170-192 does the same
-                    thing for the same reason).
+                    is not synchronous in QEMU 8.2, so screendump() waits for
+                    QEMU to finish the file through tools/screencap.py, the
+                    helper harness.py and docs_shots.py share.
   audiodev wav    - s06 only. The gates this borrows from (tools/audio_test.py,
                     tools/music_test.py) exist to prove sound; the DEMO
                     harnesses all pass `-audiodev none`, which is why s06 has
@@ -27,10 +27,15 @@ Three capture paths live here:
 Isolation matters: another scenes.py run may be live on 127.0.0.1:5399 with
 /tmp/remote_disk.img. Nothing here touches those names or ports.
 """
-import json, math, os, socket, struct, subprocess, time
+import json, math, os, socket, subprocess, sys, time
 
 HERE  = os.path.dirname(os.path.abspath(__file__))
 TOOLS = os.path.dirname(HERE)
+sys.path.insert(0, TOOLS)
+import audiolib                                # noqa: E402
+import diskcache                               # noqa: E402
+import fatimg                                  # noqa: E402
+import screencap                               # noqa: E402
 PC64  = os.path.dirname(TOOLS)
 REPO  = os.path.dirname(PC64)
 OUT   = os.path.join(HERE, "out")
@@ -158,57 +163,41 @@ def build_fat_disk(disk, fat, debug_cfg, extra=(), skip=(), ordered_dir=None,
                    (it has been both a debug and a production tree inside one
                    afternoon), so a scene that needs a known build brings one.
       mkdirs       directories to create before `extra` copies into them.
+
+    `fat` is unused since the volume is written straight into `disk`
+    (tools/fatimg.py); it stays so the scenes' calls need not change. The
+    disk comes out of tools/diskcache.py when none of the inputs above (nor
+    the ESP tree's files) changed since it was last authored.
     """
     esp = esp or ESP
-    disk_sectors = mib * 2048
-    with open(disk, "wb") as f:
-        f.truncate(disk_sectors * SECTOR)
-    quiet(["sgdisk", "--zap-all", disk])
-    quiet(["sgdisk", "-n", "1:2048:0", "-t", "1:EF00", "-c", "1:" + label, disk])
-    part_start = 2048
-    part_sectors = disk_sectors - part_start - 2048
-    with open(fat, "wb") as f:
-        f.truncate(part_sectors * SECTOR)
-    quiet(["mformat", "-i", fat, "-F", "-T", str(part_sectors), "::"])
-
-    skip = set(skip)
     od_name = ordered_dir[0] if ordered_dir else None
-    for root, dirs, files in os.walk(esp):
-        rel = os.path.relpath(root, esp).replace(os.sep, "/")
-        if od_name and (rel == od_name or rel.startswith(od_name + "/")):
-            continue
-        if rel != ".":
-            quiet(["mmd", "-i", fat, "::/" + rel])
-        for fn in files:
-            r = fn if rel == "." else rel + "/" + fn
-            if r in skip:
-                continue
-            quiet(["mcopy", "-i", fat, "-o", os.path.join(root, fn), "::/" + r])
-    if ordered_dir:
-        name, names = ordered_dir
-        quiet(["mmd", "-i", fat, "::/" + name])
-        for n in names:
-            src = os.path.join(esp, name, n)
+
+    def author(path):
+        vol = fatimg.esp_volume(mib, label=label)
+        vol.add_tree(esp, skip=skip, prune=[od_name] if od_name else ())
+        if ordered_dir:
+            name, names = ordered_dir
+            vol.mkdir(name)
+            for n in names:
+                src = os.path.join(esp, name, n)
+                if os.path.exists(src):
+                    vol.add_file("%s/%s" % (name, n), src=src)
+        for d in mkdirs:                       # directories `extra` copies into
+            vol.mkdir(d)
+        for src, dst in extra:
             if os.path.exists(src):
-                quiet(["mcopy", "-i", fat, "-o", src, "::/%s/%s" % (name, n)])
-    for d in mkdirs:                           # directories `extra` copies into
-        quiet(["mmd", "-i", fat, "::/" + d])
-    for src, dst in extra:
-        if os.path.exists(src):
-            quiet(["mcopy", "-i", fat, "-o", src, dst])
-
-    cfgp = fat + ".cfg"
-    with open(cfgp, "w", newline="\r\n") as f:
-        f.write(debug_cfg)
-    quiet(["mcopy", "-i", fat, "-o", cfgp, "::/DEBUG.CFG"])
-
-    with open(fat, "rb") as pf, open(disk, "r+b") as df:
-        df.seek(part_start * SECTOR)
-        while True:
-            b = pf.read(MIB)
-            if not b:
-                break
-            df.write(b)
+                vol.add_file(dst, src=src)
+        vol.add_file("DEBUG.CFG",
+                     data=debug_cfg.replace("\n", "\r\n").encode())
+        fatimg.gpt_disk(path, vol, mib, name=label)
+
+    parts = {"what": "demo", "esp": diskcache.tree_stamp(esp),
+             "cfg": debug_cfg, "skip": sorted(skip), "mib": mib,
+             "label": label, "ordered": ordered_dir, "mkdirs": list(mkdirs),
+             "extra": [(src, dst, diskcache.file_stamp(src)
+                        if os.path.exists(src) else None)
+                       for src, dst in extra]}
+    diskcache.fetch(disk, parts, author, sources=[os.path.abspath(__file__)])
     return disk
 
 
@@ -263,8 +252,8 @@ def ppm_read(path):
 
     QEMU 8.2's screendump is not synchronous over QMP: the command returns and
     the file is filled in afterwards, so a naive read gets a header with half a
-    frame behind it. Every caller polls this until it stops returning None -
-    which is exactly what docs_shots.py:170-192 does, and why.
+    frame behind it. screendump() below waits for the write before it reads;
+    this still refuses a short file rather than trusting that.
     """
     try:
         with open(path, "rb") as f:
@@ -298,18 +287,19 @@ def screendump(q, path, tries=12, gap=0.06):
     """One settled screendump. Returns (w, h, px, t) or None.
 
     `t` is stamped when the frame was seen COMPLETE, which is the only wall
-    clock we can honestly attach to it.
+    clock we can honestly attach to it. Completion is QEMU closing the file
+    (screencap: inotify, or a `gap` poll where there is none) rather than a
+    re-parse per `gap`; `tries` * `gap` stays the budget.
     """
     try:
-        q.cmd("screendump", filename=path)
-    except Exception:                          # noqa: BLE001
+        screencap.dump(q, path, timeout=tries * gap, gap=gap)
+    except Exception:                          # noqa: BLE001 - QMP gone, or late
         return None
-    for _ in range(tries):
-        r = ppm_read(path)
-        if r:
-            return r[0], r[1], r[2], time.time()
-        time.sleep(gap)
-    return None
+    t = time.time()
+    r = ppm_read(path)
+    if not r:
+        return None
+    return r[0], r[1], r[2], t
 
 
 # ---------------------------------------------------------------------------
@@ -392,65 +382,26 @@ def probe(path):
 # ---------------------------------------------------------------------------
 # wav measurement (s06's proof that the guest really made a noise)
 # ---------------------------------------------------------------------------
-def wav_read(path):
-    """(rate, channels, bits, samples-as-int16-list-of-frames) for a PCM wav."""
-    with open(path, "rb") as f:
-        data = f.read()
-    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
-        raise RuntimeError("%s is not a RIFF/WAVE file" % path)
-    pos, rate, chans, bits, body = 12, 44100, 2, 16, b""
-    while pos + 8 <= len(data):
-        cid = data[pos:pos + 4]
-        sz = struct.unpack("<I", data[pos + 4:pos + 8])[0]
-        blob = data[pos + 8:pos + 8 + sz]
-        if cid == b"fmt ":
-            chans, rate = struct.unpack("<HI", blob[2:8])
-            bits = struct.unpack("<H", blob[14:16])[0]
-        elif cid == b"data":
-            # QEMU's wav backend patches the size in on clean exit; if it was
-            # killed the header says 0 and the real payload is the tail.
-            body = blob if sz else data[pos + 8:]
-        pos += 8 + sz + (sz & 1)
-        if sz == 0 and cid == b"data":
-            break
-    return rate, chans, bits, body
-
-
 def wav_measure(path, win_ms=50):
     """Duration / rate / peak / RMS, plus the per-window RMS envelope.
 
     Returned in dBFS as well as raw, because "the wav exists" and "the wav has
     audio in it" are different claims and only the second one is the check.
     """
-    rate, chans, bits, body = wav_read(path)
-    assert bits == 16, "expected s16 wav, got %d-bit" % bits
-    nf = len(body) // (2 * chans)
-    peak = 0
-    sq = 0
+    w = audiolib.read(path)
+    assert w.bits == 16, "expected s16 wav, got %d-bit" % w.bits
+    x = w.channel(0)
+    nf = w.frames
+    rate = w.rate
     win = max(1, int(rate * win_ms / 1000.0))
-    env = []
-    wsq = 0
-    wn = 0
-    for i in range(nf):
-        v = struct.unpack_from("<h", body, i * 2 * chans)[0]
-        a = -v if v < 0 else v
-        if a > peak:
-            peak = a
-        sq += v * v
-        wsq += v * v
-        wn += 1
-        if wn == win:
-            env.append((wsq / float(wn)) ** 0.5)
-            wsq = 0
-            wn = 0
-    if wn:
-        env.append((wsq / float(wn)) ** 0.5)
-    rms = (sq / float(nf)) ** 0.5 if nf else 0.0
+    peak = audiolib.peak(x)
+    rms = audiolib.rms(x)
+    env = audiolib.rms_windows(x, win, partial=True)
 
     def db(x):
         return -999.0 if x <= 0 else round(20.0 * math.log10(x / 32768.0), 2)
 
-    return {"path": path, "rate": rate, "channels": chans, "bits": bits,
+    return {"path": path, "rate": rate, "channels": w.chans, "bits": w.bits,
             "frames": nf, "seconds": round(nf / float(rate), 2) if rate else 0,
             "peak": peak, "peak_dbfs": db(peak),
             "rms": round(rms, 1), "rms_dbfs": db(rms),
@@ -47,26 +47,13 @@ for _dg in "123456":                    # weapon select
 
 # ---------------------------------------------------------------------------
 def build_disk():
-    """RQ.build_disk(), then overwrite its DEBUG.CFG with the demo keys:
-    remote dial-out (so the guest connects to our URC listener), nonet (skip
-    the net self-test, the stack still comes up), nostress/noshutdown (kill the
-    fuzz + auto power-off), nohud (hide the red perf overlay - the boot log
-    prints hud_len=0)."""
-    RQ.build_disk()
-    cfg = "/tmp/duum_demo.cfg"
-    with open(cfg, "w", newline="\r\n") as f:
-        f.write("remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\nnohud\n"
-                % URC_PORT)
-    subprocess.run(["mcopy", "-i", RQ.FAT, "-o", cfg, "::/DEBUG.CFG"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    part_start = 2048
-    with open(RQ.FAT, "rb") as pf, open(RQ.DISK, "r+b") as df:
-        df.seek(part_start * 512)
-        while True:
-            b = pf.read(1 << 20)
-            if not b:
-                break
-            df.write(b)
+    """RQ.build_disk() with the demo keys as its DEBUG.CFG: remote dial-out (so
+    the guest connects to our URC listener), nonet (skip the net self-test, the
+    stack still comes up), nostress/noshutdown (kill the fuzz + auto
+    power-off), nohud (hide the red perf overlay - the boot log prints
+    hud_len=0)."""
+    RQ.build_disk(cfg_text="remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\n"
+                           "nohud\n" % URC_PORT)
 
 
 def boot_qemu():
@@ -62,18 +62,8 @@ def dlg(what, row=0, w=None, h=None):
 
 
 def build_disk():
-    RQ.build_disk()
-    cfg = "/tmp/poster.cfg"
-    with open(cfg, "w", newline="\r\n") as f:
-        f.write("remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\nnohud\n" % URC_PORT)
-    subprocess.run(["mcopy", "-i", RQ.FAT, "-o", cfg, "::/DEBUG.CFG"], check=True)
-    with open(RQ.FAT, "rb") as pf, open(RQ.DISK, "r+b") as df:
-        df.seek(2048 * 512)
-        while True:
-            b = pf.read(1 << 20)
-            if not b:
-                break
-            df.write(b)
+    RQ.build_disk(cfg_text="remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\n"
+                           "nohud\n" % URC_PORT)
 
 
 def boot_qemu():
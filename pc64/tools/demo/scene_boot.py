@@ -64,6 +64,7 @@ from demo_common import (PROBE, ESP, VID_W, VID_H, OVMF_CODE,               # no
                          Qmp, Beats, build_fat_disk, screendump, frame_stats,
                          sig_diff, encode_concat, probe, clean_outputs, sh,
                          send_key)
+import screencap                                                             # noqa: E402
 
 # The demo stick's keys (pc64/tools/demo/deploy.sh) minus `remote=`: s01 drives
 # nothing, so there is no receiver to dial and an unanswered dial is just noise.
@@ -580,6 +581,7 @@ def main(argv):
           "capture_seconds": round(t_last - t_first, 2),
           "capture_fps": round(fps_real, 2),
           "screendump_sizes": ["%dx%d" % s for s in sizes],
+          "screendump_latency": screencap.summary(),
           "panel": ("%dx%d" % gop) if gop[0] else "qemu-default",
           "desktop": ("%dx%d" % (gop[0] // 2, gop[1] // 2)) if gop[0] else None,
           "panel_is_2x_desktop": dbl or None,
@@ -9,8 +9,17 @@ of many small moves, ~0.5-1.0 s settles between beats), then `stream stop`.
 
     python3 scenes.py --scene s02          one scene
     python3 scenes.py --all                the whole spine, one boot
+    python3 scenes.py --all -j 4           sharded over 4 QEMUs (0 = what fits)
     python3 scenes.py --list               what exists
 
+`-j N` splits the scenes over N lanes, each its own boot with its own disks,
+VARS, URC port and QMP socket (the same env-driven isolation gates.py uses),
+so re-shooting the film costs about the longest lane instead of the sum. The
+staging (stage_office/wad/sdk/vm) runs ONCE, here, before any lane starts;
+the lanes only read build/esp. Each lane records its scenes in SCENES order
+- the `py` rule below holds per boot - and writes the same files a single
+boot would, so stitch.py and mux_vo.py cannot tell the difference.
+
 Per scene, into out/:
     s<NN>.mp4            the recording (stream_recv -> ffmpeg)
     s<NN>.timing.jsonl   per-frame arrival log (stream_recv)
@@ -18,7 +27,7 @@ Per scene, into out/:
     s<NN>.png/.stats.json  final canvas + counters (stream_recv)
 
 Run under WSL after `UNO_DEBUG=1 ./build.sh` (qemu-system-x86_64, OVMF,
-sgdisk, mtools, ffmpeg - the remote_qemu.py toolchain).
+ffmpeg - the remote_qemu.py toolchain).
 
 The traps this encodes (do not relearn them):
   - the injected-pointer queue is 32 deep with a 2-frame dwell: sweep moves
@@ -44,6 +53,7 @@ sys.path.insert(0, HERE)
 
 from unoauto_remote import UnoAutoLink          # noqa: E402
 from stream_recv import StreamReceiver, write_png  # noqa: E402
+import fatimg                                   # noqa: E402
 
 # remote_qemu is the QEMU path ONLY. On the metal driver host (devbuntu) there
 # is no OVMF, no mtools and no build tree, and importing it there used to be a
@@ -57,6 +67,7 @@ except Exception:                               # noqa: BLE001
 OUT    = os.path.join(HERE, "out")             # --out-dir overrides
 PROBE  = os.path.join(OUT, "probe")            # dev screenshots (not deliverables)
 SPORT0 = 5460                                  # first stream port; +1 per scene
+LANE_PORT0 = 5700                              # lane k's URC port: +10 * k
 
 # ---- mode ------------------------------------------------------------------
 # "qemu"  : boot the DEBUG image here, guest reaches the receiver at 10.0.2.2.
@@ -256,41 +267,18 @@ def build_diskB(docs):
     has no scroll offset), so a big document like small.ppt is unreachable
     from the crowded ESP root - a two-file DOCS volume puts it at row 0.
     Same GPT+ESP recipe RQ.build_disk uses for the boot disk."""
-    SECTOR, MIB = 512, 1 << 20
-    disk_sectors = 96 * 2048
-    with open(RQ.DISK2, "wb") as f:
-        f.truncate(disk_sectors * SECTOR)
-    subprocess.run(["sgdisk", "--zap-all", RQ.DISK2],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    subprocess.run(["sgdisk", "-n", "1:2048:0", "-t", "1:EF00", "-c", "1:DOCS",
-                    RQ.DISK2], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    part_start = 2048
-    part_sectors = disk_sectors - part_start - 2048
-    fat = "/tmp/demo_docs_fat.img"
-    with open(fat, "wb") as f:
-        f.truncate(part_sectors * SECTOR)
-    subprocess.run(["mformat", "-i", fat, "-v", "DOCS", "-F",
-                    "-T", str(part_sectors), "::"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    vol = fatimg.esp_volume(96, label="DOCS")
     for src in docs:
-        subprocess.run(["mcopy", "-i", fat, "-o", src,
-                        "::/" + os.path.basename(src).upper()],
-                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    with open(fat, "rb") as pf, open(RQ.DISK2, "r+b") as df:
-        df.seek(part_start * SECTOR)
-        while True:
-            b = pf.read(MIB)
-            if not b:
-                break
-            df.write(b)
+        vol.add_file(os.path.basename(src).upper(), src=src)
+    fatimg.gpt_disk(RQ.DISK2, vol, 96, name="DOCS")
 
 
 def build_disk(docs_for_b=None):
-    """RQ.build_disk(), then our DEBUG.CFG (same keys + noshutdown) mcopy'd
-    over the one it wrote. Keeping RQ's builder authoritative for the disk
-    geometry means this file cannot drift from the harness everyone else
-    boots. Disk B becomes the DOCS volume (or blank) - either way
-    deterministic, so a stale TESTVOL from a prior gate never leaks in."""
+    """RQ.build_disk() with our DEBUG.CFG (same keys + noshutdown) in place of
+    its own. Keeping RQ's builder authoritative for the disk geometry means
+    this file cannot drift from the harness everyone else boots. Disk B
+    becomes the DOCS volume (or blank) - either way deterministic, so a stale
+    TESTVOL from a prior gate never leaks in."""
     if docs_for_b:
         build_diskB(docs_for_b)
     else:
@@ -298,10 +286,9 @@ def build_disk(docs_for_b=None):
             os.unlink(RQ.DISK2)
         except OSError:
             pass
-    RQ.build_disk()
     # THIS is where the harness's DEBUG.CFG is authored, and the only place a
     # key survives: RQ.build_disk() writes its own DEBUG.CFG into the FAT
-    # image, so a key added to build/esp by hand is silently overwritten.
+    # volume, so a key added to build/esp by hand is silently overwritten.
     #   nostress  - the fuzz driver's real off switch (it would otherwise open
     #               a random app every few frames and fight the choreography)
     #   noshutdown- belt-and-braces on the stress auto power-off
@@ -311,21 +298,8 @@ def build_disk(docs_for_b=None):
     #               that HUD into every frame. Telemetry is still collected;
     #               only the on-screen readout goes. (pc64/DEBUG.md; the boot
     #               log prints `hud_len=0 (HUD DISABLED)`.)
-    cfg = os.path.join(os.path.dirname(RQ.DISK), "demo_debug.cfg")
-    with open(cfg, "w", newline="\r\n") as f:
-        f.write("remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\nnohud\n"
-                % RQ.PORT)
-    subprocess.run(["mcopy", "-i", RQ.FAT, "-o", cfg, "::/DEBUG.CFG"],
-                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    # re-splice the FAT image into the disk (build_disk already dd'd it once)
-    part_start = 2048
-    with open(RQ.FAT, "rb") as pf, open(RQ.DISK, "r+b") as df:
-        df.seek(part_start * 512)
-        while True:
-            b = pf.read(1 << 20)
-            if not b:
-                break
-            df.write(b)
+    RQ.build_disk(cfg_text="remote=10.0.2.2:%d\nnonet\nnostress\nnoshutdown\n"
+                           "nohud\n" % RQ.PORT)
 
 
 # ---------------------------------------------------------------------------
@@ -2227,6 +2201,89 @@ SCENES = [
 ]
 
 
+def scene_cost(name):
+    """Seconds the last take of `name` ran (its stream's first to last frame,
+    from the .stats.json it left in OUT), or a minute for a scene never shot."""
+    try:
+        with open(os.path.join(OUT, name + ".stats.json")) as f:
+            st = json.load(f)
+        return max(1.0, st["t_last"] - st["t_first"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return 60.0
+
+
+def shard(want, n):
+    """Deal the scenes onto n lanes, longest first onto the least loaded.
+    Each lane then records its share in SCENES order."""
+    lanes = [[] for _ in range(n)]
+    load = [0.0] * n
+    for name in sorted(want, key=scene_cost, reverse=True):
+        k = load.index(min(load))
+        lanes[k].append(name)
+        load[k] += scene_cost(name)
+    order = [nm for nm, _ in SCENES]
+    return [sorted(l, key=order.index) for l in lanes if l]
+
+
+def run_sharded(a, want, staged):
+    """Record `want` over a.jobs lanes at once; returns (the per-scene
+    results in SCENES order, how many lanes failed). Every lane is this script
+    again, on its share of the scenes, told the staging is done
+    (UNO_DEMO_STAGED)."""
+    import tempfile
+    import gates
+    if DEMO_KVM:                                # a KVM guest is -m 3072
+        gates.MB_PER_GUEST = 3072
+    jobs = a.jobs if a.jobs > 0 else gates.lanes_available()
+    lanes = shard(want, max(1, jobs))
+    logs = os.path.join(OUT, "lanes")
+    os.makedirs(logs, exist_ok=True)
+    print("sharded: %d scene(s) over %d lane(s)" % (len(want), len(lanes)))
+    procs = []
+    for k, names in enumerate(lanes):
+        scratch = tempfile.mkdtemp(prefix="unodos-scenes%d-" % k)
+        env = dict(os.environ, UNO_SCRATCH=scratch,
+                   URC_PORT=str(LANE_PORT0 + 10 * k),
+                   UNO_QMP_SOCK=os.path.join(scratch, "qmp.sock"),
+                   UNO_SHOTS=os.path.join(PROBE, "lane%d" % k),
+                   UNO_DEMO_STAGED=json.dumps(staged))
+        wav = os.environ.get("UNO_DEMO_WAV")
+        if wav:                                 # one capture sink per guest
+            root, ext = os.path.splitext(wav)
+            env["UNO_DEMO_WAV"] = "%s-lane%d%s" % (root, k, ext)
+        res = os.path.join(logs, "lane%d.json" % k)
+        argv = [sys.executable, os.path.abspath(__file__), "--out-dir", OUT,
+                "--min-width", str(a.min_width), "--results", res]
+        for nm in names:
+            argv += ["--scene", nm]
+        if a.with_net:
+            argv.append("--with-net")
+        log = open(os.path.join(logs, "lane%d.log" % k), "w")
+        print("  lane %d (URC %d): %s" % (k, LANE_PORT0 + 10 * k, " ".join(names)))
+        procs.append((k, names, scratch, res, log,
+                      subprocess.Popen(argv, env=env, stdout=log,
+                                       stderr=subprocess.STDOUT)))
+    results, failed = {}, 0
+    for k, names, scratch, res, log, p in procs:
+        rc = p.wait()
+        failed += rc != 0
+        log.close()
+        shutil.rmtree(scratch, True)
+        try:
+            with open(res) as f:
+                got = json.load(f)
+        except (OSError, ValueError):
+            got = []
+        for r in got:
+            results[r["scene"]] = r
+        for nm in names:
+            if nm not in results:
+                results[nm] = {"scene": nm, "error": "lane %d exited %d "
+                               "(see %s)" % (k, rc, log.name)}
+        print("  lane %d done (exit %d)" % (k, rc))
+    return [results[nm] for nm, _ in SCENES if nm in results], failed
+
+
 def main(argv):
     global MODE, METAL_PORT, STREAM_HOST, OUT, PROBE
     ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
@@ -2251,6 +2308,10 @@ def main(argv):
     ap.add_argument("--out-dir", metavar="DIR",
                     help="where the recordings go (default tools/demo/out); "
                          "use a fresh directory to keep an earlier cut intact")
+    ap.add_argument("-j", "--jobs", type=int, default=1, metavar="N",
+                    help="QEMU lanes to shard the scenes over (default 1: one "
+                         "boot; 0: as many as this host holds)")
+    ap.add_argument("--results", help=argparse.SUPPRESS)   # a lane's report
     a = ap.parse_args(argv)
     names = [n for n, _ in SCENES]
     if a.list:
@@ -2275,14 +2336,30 @@ def main(argv):
         ap.error("remote_qemu is unavailable (no QEMU/OVMF on this host?) - "
                  "this host can only drive --metal")
 
+    if a.jobs != 1 and MODE == "metal":
+        ap.error("--jobs shards QEMU lanes; there is one metal box")
+
     d = Demo()
     if MODE == "qemu":
-        d.office_staged = stage_office()
-        d.wad_staged = stage_wad()
-        d.sdk_staged = stage_sdk()
-        d.vm_staged = stage_vm()
-        print("staged: office=%s wad=%s sdk=%s vm=%s" %
-              (d.office_staged, d.wad_staged, d.sdk_staged, d.vm_staged))
+        if os.environ.get("UNO_DEMO_STAGED"):    # a lane: already staged
+            staged = json.loads(os.environ["UNO_DEMO_STAGED"])
+        else:
+            staged = {"office": stage_office(), "wad": stage_wad(),
+                      "sdk": stage_sdk(), "vm": stage_vm()}
+            print("staged: office=%s wad=%s sdk=%s vm=%s" %
+                  (staged["office"], staged["wad"], staged["sdk"],
+                   staged["vm"]))
+        d.office_staged, d.wad_staged = staged["office"], staged["wad"]
+        d.sdk_staged, d.vm_staged = staged["sdk"], staged["vm"]
+        if a.jobs != 1 and len(want) > 1:
+            t0 = time.time()
+            results, failed = run_sharded(a, want, staged)
+            print("\ntotal: %.1f min wall (%.1f min of scenes)"
+                  % ((time.time() - t0) / 60.0,
+                     sum(r.get("dur", 0) for r in results) / 60.0))
+            for r in results:
+                print(json.dumps(r))
+            return 1 if failed else 0
     else:
         # Nothing is staged on metal: the stick already carries DOOM1.WAD,
         # DOCS\ and the rest, and the office documents are pushed to the RAM
@@ -2313,6 +2390,9 @@ def main(argv):
             d.reset()
     finally:
         d.stop()
+        if a.results:
+            with open(a.results, "w") as f:
+                json.dump(results, f, indent=1)
     print("\ntotal: %.1f min" % ((time.time() - t0) / 60.0))
     for r in results:
         print(json.dumps(r))
@@ -15,21 +15,42 @@ Alongside the mp4 it writes:
     out.png            the final canvas (cursor included - the guest
                        composites it before encoding)
     out.stats.json     frames/keyframes/deltas/bytes/decode_errors/segments/
-                       geometry + first/last arrival times
+                       geometry + first/last arrival times, and "pipeline":
+                       per-stage counters (below)
 
 A hello arriving MID-stream (first byte 0x55, never a frame type) is a stream
 reset - the desktop resolution changed. The current mp4 segment is finalized
 and a new file suffixed -2 (-3, ...) is started on the new geometry.
 
-stdlib only; the QOI decoder is reused from tools/unoauto_remote.py.
+The work is three threads joined by bounded queues, so a slow decode or a
+full ffmpeg pipe never stalls the socket (which would fill the guest's send
+window and throttle the guest itself - it paces on what it can send):
+
+  receive   recv_into one of a pool of payload buffers; stamps the arrival
+  decode    QOI-decodes and composites onto the one canvas, then copies the
+            frame into one of a pool of frame buffers
+  encode    writes frames into ffmpeg, the timing log, and the segments
+
+Buffers go back to their pool once the next stage is done with them, so memory
+is bounded by the queue depths (QUEUE_DEPTH frames of w*h*4 at most). A stage
+that fails stops the other two. stats.json's "pipeline" reports, per stage,
+how many items it handled, its busy time and per-item ms (mean/max), the time
+it spent blocked handing items on, and the depth of the queue in front of it
+(mean/max against its capacity) - plus the arrival-to-ffmpeg latency.
+
+stdlib only; the QOI decoder and the compositor are reused from
+tools/unoauto_remote.py.
 """
-import argparse, json, os, socket, struct, subprocess, sys, time
+import argparse, json, os, queue, socket, struct, subprocess, sys, threading
+import time
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, os.path.dirname(HERE))          # pc64/tools
-from unoauto_remote import qoi_decode              # noqa: E402
+from unoauto_remote import Compositor              # noqa: E402
 
 TILE = 32
+QUEUE_DEPTH = 8                  # frames between stages (each way)
+RCVBUF = 4 << 20                 # socket receive buffer: a burst of keyframes
 
 
 def write_png(path, w, h, rgba):
@@ -53,6 +74,40 @@ def write_png(path, w, h, rgba):
         f.write(png)
 
 
+class _Stage:
+    """One pipeline stage's counters, and the queue that feeds it."""
+
+    def __init__(self, name, depth=QUEUE_DEPTH):
+        self.name = name
+        self.q = queue.Queue(depth) if depth else None
+        self.items = 0
+        self.busy = self.blocked = 0.0
+        self.ms_max = 0.0
+        self.depth_sum = self.depth_max = self.puts = 0
+
+    def did(self, t0):
+        dt = time.perf_counter() - t0
+        self.items += 1
+        self.busy += dt
+        self.ms_max = max(self.ms_max, dt * 1000.0)
+
+    def sample(self):
+        d = self.q.qsize()
+        self.puts += 1
+        self.depth_sum += d
+        self.depth_max = max(self.depth_max, d)
+
+    def stats(self):
+        out = {"items": self.items, "busy_s": round(self.busy, 3),
+               "ms_mean": round(self.busy * 1000.0 / max(1, self.items), 2),
+               "ms_max": round(self.ms_max, 2),
+               "blocked_s": round(self.blocked, 3)}
+        if self.q is not None:
+            out["queue"] = {"cap": self.q.maxsize, "max": self.depth_max,
+                            "mean": round(self.depth_sum / max(1, self.puts), 2)}
+        return out
+
+
 class StreamReceiver:
     """Accept one unostream connection and record it. Counters are public so a
     gate can assert on them: frames, keyframes, deltas, bytes_rx,
@@ -71,17 +126,35 @@ class StreamReceiver:
         self._seg_frames = 0
         self.t_first = self.t_last = None
         self.w = self.h = self.fps = self.scale = 0
-        self.canvas = None
+        self._comp = None
         self.connected = False
         self.error = None
         self._srv = None
         self._ff = None
         self._timing = None
+        self._abort = threading.Event()
+        self._fail = None                          # first stage error
+        self._recv = _Stage("receive", 0)
+        self._dec = _Stage("decode")
+        self._enc = _Stage("encode")
+        self._payloads = queue.Queue()             # free payload buffers
+        for _ in range(QUEUE_DEPTH + 2):
+            self._payloads.put(bytearray(64 << 10))
+        self._framebufs = queue.Queue()            # free frame buffers
+        self._nframebufs = 0
+        self._lat_sum = self._lat_max = 0.0
+
+    @property
+    def canvas(self):
+        """The live canvas (RGBA bytearray), None before the first hello."""
+        return self._comp.canvas if self._comp else None
 
     # ---- lifecycle ---------------------------------------------------------
     def listen(self):
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # before listen(), so the window scale offered at accept covers it
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RCVBUF)
         s.bind((self.host, self.port))
         s.listen(1)
         self._srv = s
@@ -113,28 +186,67 @@ class StreamReceiver:
 
     # ---- wire --------------------------------------------------------------
     @staticmethod
-    def _recv_exact(conn, n):
-        buf = b""
-        while len(buf) < n:
-            part = conn.recv(n - len(buf))
-            if not part:
-                return None                        # EOF
-            buf += part
+    def _recv_into(conn, view, n):
+        """Fill view[:n] from the socket; False at EOF."""
+        got = 0
+        while got < n:
+            k = conn.recv_into(view[got:n], n - got)
+            if not k:
+                return False                       # EOF
+            got += k
+        return True
+
+    def _put(self, stage, item, owner):
+        """Hand `item` to `stage`, charging any wait to `owner`; gives up
+        (RuntimeError) if another stage has failed meanwhile."""
+        t0 = time.perf_counter()
+        while True:
+            if self._abort.is_set():
+                raise RuntimeError(self._fail or "pipeline stopped")
+            try:
+                stage.q.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        owner.blocked += time.perf_counter() - t0
+        stage.sample()
+
+    def _next(self, stage):
+        """The next item for `stage`; None at the end or once a stage failed."""
+        while not self._abort.is_set():
+            try:
+                return stage.q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        return None
+
+    def _take(self, pool, owner):
+        t0 = time.perf_counter()
+        while True:
+            if self._abort.is_set():
+                raise RuntimeError(self._fail or "pipeline stopped")
+            try:
+                buf = pool.get(timeout=0.2)
+                break
+            except queue.Empty:
+                continue
+        owner.blocked += time.perf_counter() - t0
         return buf
 
     def _seg_path(self):
         base, ext = os.path.splitext(self.out)
         return self.out if self.segments == 1 else "%s-%d%s" % (base, self.segments, ext)
 
-    def _start_segment(self):
+    def _start_segment(self, w, h, fps):
         self.segments += 1
         self._seg_first = self._seg_last = None
         self._seg_frames = 0
+        self._seg_fps = fps
         path = self._seg_path()
         cmd = [self.ffmpeg, "-y", "-loglevel", "error",
                "-f", "rawvideo", "-pixel_format", "rgba",
-               "-video_size", "%dx%d" % (self.w, self.h),
-               "-framerate", str(self.fps or 30), "-i", "-",
+               "-video_size", "%dx%d" % (w, h),
+               "-framerate", str(fps or 30), "-i", "-",
                "-c:v", "libx264", "-preset", "veryfast", "-crf", "18",
                "-pix_fmt", "yuv420p", path]
         try:
@@ -143,7 +255,7 @@ class StreamReceiver:
             raise RuntimeError("cannot spawn ffmpeg (%s): %s" % (self.ffmpeg, e))
         if self.verbose:
             print("stream_recv: segment %d -> %s (%dx%d @ %d fps)"
-                  % (self.segments, path, self.w, self.h, self.fps))
+                  % (self.segments, path, w, h, fps))
 
     def _retime_segment(self, path):
         """Rewrite the segment's timestamps to the rate frames ACTUALLY
@@ -166,7 +278,7 @@ class StreamReceiver:
         n, t0, t1 = self._seg_frames, self._seg_first, self._seg_last
         if n < 2 or t0 is None or t1 is None or t1 <= t0:
             return
-        nominal = float(self.fps or 30)
+        nominal = float(self._seg_fps or 30)
         measured = (n - 1) / (t1 - t0)
         if measured <= 0 or abs(measured - nominal) / nominal <= 0.02:
             return                                 # already honest
@@ -205,17 +317,16 @@ class StreamReceiver:
             self._ff = None
             self._retime_segment(path)
 
-    def _hello(self, blob):
+    @staticmethod
+    def _hello(blob):
+        """(w, h, fps, scale) from a 16-byte hello."""
         if blob[:4] != b"UNSM":
             raise RuntimeError("bad hello magic %r" % blob[:4])
         ver, _pad, fps, scale = blob[4], blob[5], blob[6], blob[7]
         w, h = struct.unpack("<HH", blob[8:12])
         if ver != 1:
             raise RuntimeError("unknown protocol version %d" % ver)
-        self._close_segment()                      # mid-stream hello = reset
-        self.w, self.h, self.fps, self.scale = w, h, fps, scale
-        self.canvas = bytearray(w * h * 4)
-        self._start_segment()
+        return w, h, fps, scale
 
     def _apply_delta(self, payload):
         if not payload:
@@ -227,58 +338,111 @@ class StreamReceiver:
         strip_len = len(payload) - 2 * nch
         if strip_len < 14 + 8:
             raise RuntimeError("delta payload too small for its manifest")
-        strip = qoi_decode(payload[:strip_len])
         man = payload[strip_len:]
         idx = [man[i * 2] | (man[i * 2 + 1] << 8) for i in range(nch)]
-        cols = (self.w + TILE - 1) // TILE
-        for i, t in enumerate(idx):
-            col, row = t % cols, t // cols
-            dx, dy = col * TILE, row * TILE
-            vw, vh = min(TILE, self.w - dx), min(TILE, self.h - dy)
-            for yy in range(max(0, vh)):
-                so = ((i * TILE + yy) * TILE) * 4
-                do = ((dy + yy) * self.w + dx) * 4
-                self.canvas[do:do + vw * 4] = strip[so:so + vw * 4]
+        self._comp.delta(payload[:strip_len], idx, (self.w + TILE - 1) // TILE,
+                         TILE, TILE)
 
     def _run(self, conn):
+        """The receive stage, on the caller's thread; decode and encode run
+        on their own and are joined before this returns."""
+        workers = [threading.Thread(target=self._stage, args=(fn,), daemon=True)
+                   for fn in (self._decode_loop, self._encode_loop)]
+        for t in workers:
+            t.start()
+        err = None
+        try:
+            self._receive(conn)
+        except RuntimeError as e:                  # desync: still encode what came
+            err = e
+        finally:
+            try:                                   # end of stream, downstream
+                self._put(self._dec, None, self._recv)
+            except RuntimeError:
+                pass
+            for t in workers:
+                t.join()
+        if self._fail:                             # a stage failed first
+            raise RuntimeError(self._fail)
+        if err:
+            raise err
+
+    def _stop(self, e):
+        if self._fail is None:
+            self._fail = str(e)
+        self._abort.set()
+
+    def _stage(self, loop):
+        # Whatever ends a stage has to stop the pipeline: a stage that just
+        # died would leave the others polling their queues forever. The
+        # failure reaches serve_once() as the RuntimeError _run() raises.
+        try:
+            loop()
+        except RuntimeError as e:
+            self._stop(e)
+        except Exception as e:                     # OSError, struct.error, ...
+            self._stop("%s in %s: %s" % (type(e).__name__, loop.__name__, e))
+
+    def _receive(self, conn):
+        hdr = bytearray(16)
+        hv = memoryview(hdr)
         first = True
         while True:
-            b0 = self._recv_exact(conn, 1)
-            if b0 is None:
+            if not self._recv_into(conn, hv, 1):
                 return                             # clean EOF
-            if b0[0] == 0x55:                      # 'U': a (re)hello
-                rest = self._recv_exact(conn, 15)
-                if rest is None:
+            t0 = time.perf_counter()
+            if hdr[0] == 0x55:                     # 'U': a (re)hello
+                if not self._recv_into(conn, hv[1:], 15):
                     return
                 self.bytes_rx += 16
-                self._hello(b0 + rest)
+                geo = self._hello(hdr)
+                self._recv.did(t0)
+                self._put(self._dec, ("hello",) + geo, self._recv)
                 first = False
                 continue
             if first:
-                raise RuntimeError("stream did not start with a hello (got 0x%02x)" % b0[0])
-            if b0[0] not in (0, 1):
-                raise RuntimeError("bad frame type 0x%02x (desync)" % b0[0])
-            hdr = self._recv_exact(conn, 7)
-            if hdr is None:
+                raise RuntimeError("stream did not start with a hello (got 0x%02x)" % hdr[0])
+            if hdr[0] not in (0, 1):
+                raise RuntimeError("bad frame type 0x%02x (desync)" % hdr[0])
+            if not self._recv_into(conn, hv[1:], 7):
                 return
-            (plen,) = struct.unpack("<I", hdr[3:7])
-            payload = self._recv_exact(conn, plen) if plen else b""
-            if payload is None:
+            typ = hdr[0]
+            (plen,) = struct.unpack_from("<I", hdr, 4)
+            buf = self._take(self._payloads, self._recv)
+            if len(buf) < plen:
+                buf = bytearray(max(plen, 2 * len(buf)))
+            if plen and not self._recv_into(conn, memoryview(buf), plen):
                 return
             now = time.time()
             self.bytes_rx += 8 + plen
             if self.t_first is None:
                 self.t_first = now
             self.t_last = now
-            if self._seg_first is None:
-                self._seg_first = now
-            self._seg_last = now
+            self._recv.did(t0)
+            self._put(self._dec, ("frame", typ, buf, plen, now), self._recv)
+
+    def _decode_loop(self):
+        while True:
+            item = self._next(self._dec)
+            if item is None:
+                self._put(self._enc, None, self._dec)
+                return
+            t0 = time.perf_counter()
+            if item[0] == "hello":                 # mid-stream hello = reset
+                _, w, h, fps, scale = item
+                self.w, self.h, self.fps, self.scale = w, h, fps, scale
+                self._comp = Compositor()
+                self._comp.seed(w, h, bytes(w * h * 4))
+                self._dec.did(t0)
+                self._put(self._enc, ("hello", w, h, fps), self._dec)
+                continue
+            _, typ, buf, plen, now = item
+            payload = memoryview(buf)[:plen]
             try:
-                if b0[0] == 0:
-                    rgba = qoi_decode(payload)
-                    if len(rgba) != self.w * self.h * 4:
+                if typ == 0:
+                    if plen < 14 or struct.unpack(">II", payload[4:12]) != (self.w, self.h):
                         raise RuntimeError("keyframe size mismatch")
-                    self.canvas = bytearray(rgba)
+                    self._comp.keyframe(payload)
                     self.keyframes += 1
                 else:
                     self._apply_delta(payload)
@@ -287,17 +451,65 @@ class StreamReceiver:
                 self.decode_errors += 1
                 if self.verbose:
                     print("stream_recv: decode error on frame %d: %s" % (self.frames, e))
+                self._payloads.put(buf)
+                self._dec.did(t0)
+                self._put(self._enc, ("skip", now), self._dec)
                 continue
+            self._payloads.put(buf)
             self.frames += 1
+            fb = self._framebuf()
+            fb[:] = self._comp.canvas
+            self._dec.did(t0)
+            self._put(self._enc, ("frame", fb, now, self.frames - 1, 8 + plen, typ),
+                      self._dec)
+
+    def _framebuf(self):
+        """A free frame buffer of the current size: reused once the encoder is
+        done with it, new until QUEUE_DEPTH + 2 exist, else wait for one."""
+        size = self.w * self.h * 4
+        while True:
+            try:
+                fb = self._framebufs.get_nowait()
+            except queue.Empty:
+                if self._nframebufs < QUEUE_DEPTH + 2:
+                    self._nframebufs += 1
+                    return bytearray(size)
+                fb = self._take(self._framebufs, self._dec)
+            if len(fb) == size:
+                return fb
+            self._nframebufs -= 1                  # from before a resize
+
+    def _encode_loop(self):
+        while True:
+            item = self._next(self._enc)
+            if item is None:
+                return
+            t0 = time.perf_counter()
+            if item[0] == "hello":
+                self._close_segment()
+                self._start_segment(*item[1:])
+                self._enc.did(t0)
+                continue
+            now = item[2] if item[0] == "frame" else item[1]
+            if self._seg_first is None:
+                self._seg_first = now
+            self._seg_last = now
+            if item[0] == "skip":
+                continue
+            _, fb, now, i, nbytes, typ = item
             self._seg_frames += 1
             if self._ff:
                 try:
-                    self._ff.stdin.write(self.canvas)
+                    self._ff.stdin.write(fb)
                 except (OSError, BrokenPipeError) as e:
                     raise RuntimeError("ffmpeg pipe broke: %s" % e)
-            self._timing.write(json.dumps({"i": self.frames - 1, "t": now,
-                                           "bytes": 8 + plen, "type": b0[0],
-                                           "seg": self.segments}) + "\n")
+            self._framebufs.put(fb)
+            self._timing.write(json.dumps({"i": i, "t": now, "bytes": nbytes,
+                                           "type": typ, "seg": self.segments}) + "\n")
+            lat = time.time() - now
+            self._lat_sum += lat
+            self._lat_max = max(self._lat_max, lat)
+            self._enc.did(t0)
 
     # ---- teardown ----------------------------------------------------------
     def _finish(self):
@@ -313,7 +525,14 @@ class StreamReceiver:
                  "decode_errors": self.decode_errors, "segments": self.segments,
                  "w": self.w, "h": self.h, "fps": self.fps, "scale": self.scale,
                  "t_first": self.t_first, "t_last": self.t_last,
-                 "error": self.error}
+                 "error": self.error,
+                 "pipeline": {"receive": self._recv.stats(),
+                              "decode": self._dec.stats(),
+                              "encode": self._enc.stats(),
+                              "latency_ms": {
+                                  "mean": round(self._lat_sum * 1000.0
+                                                / max(1, self._enc.items), 1),
+                                  "max": round(self._lat_max * 1000.0, 1)}}}
         with open(base + ".stats.json", "w") as f:
             json.dump(stats, f, indent=2)
         if self._srv:
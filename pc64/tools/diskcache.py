@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+"""diskcache - reuse built test disks when nothing that went into them changed.
+
+Every gate authors a 96 MiB GPT + FAT32 disk from build/esp before it boots,
+and nearly every run authors the SAME disk: the ESP tree, the DEBUG.CFG text
+and the extra files are what they were last time. So a disk is keyed by what
+went into it -
+
+  * the ESP tree: every path, size and mtime (UNO_DISKCACHE_HASH=content
+    digests file contents instead, for trees whose mtimes are not trusted);
+  * the DEBUG.CFG text, and whatever else shapes the volume (label, size,
+    skip list, ordered_dir, ...);
+  * each extra file, by path, size and mtime;
+  * the code that writes the volume: fatimg.py, this file, and the caller's
+    own module (the `sources` it passes), by content - a fix to the image
+    builder must not keep serving disks the old one wrote -
+
+and kept under that key in a cache directory. A hit costs a stat per ESP file
+and a clone; a miss authors the disk once, into the cache.
+
+The cached base is never booted. Each run gets its own copy of it:
+
+  reflink  FICLONE: a copy-on-write clone, instant and the same raw format, on
+           btrfs / XFS / bcachefs. Nothing a caller does has to change.
+  qcow2    otherwise, if the caller can boot a qcow2 (overlay=True): an
+           overlay backed by the base, which is just as instant. fetch()
+           returns "qcow2" and remote_qemu.qemu_argv() picks that up.
+  copy     otherwise: a sparse copy (only the allocated extents of the base are
+           read and written - a few MiB, not 96).
+
+The cache holds UNO_DISKCACHE_MAX disks (default 8), evicted least recently
+used; a hit bumps the base's mtime. A base that a live qcow2 overlay still
+reads from is never evicted: the process that made the overlay holds a shared
+lock on <key>.users until it exits, and evict() skips any disk whose lock it
+cannot take exclusively. UNO_DISKCACHE=0 turns it off (every disk
+authored in place, as before); UNO_DISKCACHE=<dir> moves it from
+~/.cache/unodos/disks.
+
+  diskcache.py            list the cache, most recent first
+  diskcache.py --clear    empty it
+"""
+import errno, fcntl, hashlib, json, os, shutil, subprocess, sys, time
+
+FICLONE = 0x40049409
+SETTING = os.environ.get("UNO_DISKCACHE", "")
+ROOT = SETTING if SETTING not in ("", "0", "1") else os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "unodos", "disks")
+MAX = int(os.environ.get("UNO_DISKCACHE_MAX", "8"))
+CONTENT = os.environ.get("UNO_DISKCACHE_HASH") == "content"
+HERE = os.path.dirname(os.path.abspath(__file__))
+BUILDER = (os.path.join(HERE, "fatimg.py"), os.path.abspath(__file__))
+_HELD = []                 # open <key>.users files: bases our overlays read
+
+
+def file_stamp(path, content=CONTENT):
+    """One file's identity: size and mtime, or its content digest."""
+    st = os.stat(path)
+    if not content:
+        return "%d %d" % (st.st_size, st.st_mtime_ns)
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return "%d %s" % (st.st_size, h.hexdigest())
+
+
+def tree_stamp(top, content=CONTENT):
+    """Digest of a tree's shape: every relative path with its file_stamp."""
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(top):
+        dirs.sort()
+        rel = os.path.relpath(root, top)
+        h.update(("d %s\n" % rel).encode())
+        for fn in sorted(files):
+            h.update(("%s %s\n" % (os.path.join(rel, fn), file_stamp(
+                os.path.join(root, fn), content))).encode())
+    return h.hexdigest()
+
+
+def key(parts, sources=()):
+    """The cache key for a disk described by the JSON-able `parts` and
+    written by the code in BUILDER + `sources`."""
+    code = [(os.path.basename(p), file_stamp(p, content=True))
+            for p in BUILDER + tuple(sources)]
+    return hashlib.sha256(json.dumps([parts, code], sort_keys=True).encode()
+                          ).hexdigest()[:32]
+
+
+def _try_lock(path):
+    """`path` opened and locked exclusively, or None if someone holds it."""
+    f = open(path, "a")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        f.close()
+        return None
+    return f
+
+
+def _reflink(src, dst):
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            return True
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL,
+                               errno.ENOTTY, errno.EBADF):
+                raise
+    os.remove(dst)
+    return False
+
+
+def _sparse_copy(src, dst):
+    """Copy only the data extents of `src`; the holes stay holes."""
+    size = os.path.getsize(src)
+    with open(src, "rb") as s, open(dst, "wb") as d:
+        d.truncate(size)
+        fi, fo = s.fileno(), d.fileno()
+        at = 0
+        while at < size:
+            try:
+                at = os.lseek(fi, at, os.SEEK_DATA)
+                end = os.lseek(fi, at, os.SEEK_HOLE)
+            except OSError as e:
+                if e.errno != errno.ENXIO:     # ENXIO: no data past `at`
+                    raise
+                break
+            while at < end:
+                n = os.copy_file_range(fi, fo, end - at, at, at)
+                if not n:
+                    break
+                at += n
+
+
+def _overlay(base, dst):
+    subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2", "-F", "raw",
+                    "-b", base, dst], check=True)
+
+
+def materialize(base, dest, overlay=False):
+    """Give `dest` its own copy of `base`; returns the format it is in."""
+    if os.path.lexists(dest):
+        os.remove(dest)
+    if _reflink(base, dest):
+        return "raw"
+    if overlay and shutil.which("qemu-img"):
+        _overlay(base, dest)
+        return "qcow2"
+    _sparse_copy(base, dest)
+    return "raw"
+
+
+def evict(root=None, keep=None):
+    """Drop the least recently used disks beyond the cache's size."""
+    root = root or ROOT
+    keep = MAX if keep is None else keep
+    try:
+        names = [f for f in os.listdir(root) if f.endswith(".img")]
+    except OSError:
+        return []
+    # another lane may evict (or be mid-author of) any of these right now
+    aged = []
+    for f in names:
+        p = os.path.join(root, f)
+        try:
+            aged.append((os.stat(p).st_mtime, p))
+        except OSError:
+            continue
+    aged.sort(reverse=True)
+    gone = []
+    for _, p in aged[keep:]:
+        # being authored/cloned (.lock), or backing a live overlay (.users)
+        held = [_try_lock(p[:-4] + ext) for ext in (".lock", ".users")]
+        if all(held):
+            for q in (p, p[:-4] + ".json", p[:-4] + ".lock", p[:-4] + ".users"):
+                try:
+                    os.remove(q)
+                except OSError:
+                    pass
+            gone.append(p)
+        for f in held:
+            if f:
+                f.close()
+    return gone
+
+
+def fetch(dest, parts, build, overlay=False, verbose=True, sources=()):
+    """The disk described by `parts` at `dest`. On a miss `build(path)` authors
+    it into the cache first; with the cache off it authors `dest` directly.
+    `sources` are the caller's files that shape the disk (its author code).
+    Returns the format of `dest`: "raw", or "qcow2" for an overlay, whose base
+    stays pinned against evict() for as long as this process runs."""
+    if SETTING == "0":
+        build(dest)
+        return "raw"
+    os.makedirs(ROOT, exist_ok=True)
+    k = key(parts, sources)
+    base = os.path.join(ROOT, k + ".img")
+    t0 = time.time()
+    # One author per key: a second lane asking for the same disk waits for
+    # the first to finish and then hits, instead of building it again.
+    with open(os.path.join(ROOT, k + ".lock"), "w") as lk:
+        fcntl.flock(lk, fcntl.LOCK_EX)
+        hit = os.path.exists(base)
+        if hit:
+            os.utime(base)
+        else:
+            part = base + ".%d.part" % os.getpid()
+            build(part)
+            os.replace(part, base)
+            with open(base[:-4] + ".json", "w") as f:
+                json.dump({"parts": parts, "built": time.time(),
+                           "build_s": round(time.time() - t0, 2)}, f, indent=2)
+        fmt = materialize(base, dest, overlay)
+        if fmt == "qcow2":
+            users = open(os.path.join(ROOT, k + ".users"), "a")
+            fcntl.flock(users, fcntl.LOCK_SH)
+            _HELD.append(users)
+    if not hit:
+        evict()
+    if verbose:
+        print("diskcache: %s %s -> %s (%s, %.2fs)"
+              % ("hit" if hit else "built", k[:12], dest, fmt,
+                 time.time() - t0))
+    return fmt
+
+
+def main():
+    if "--clear" in sys.argv:
+        shutil.rmtree(ROOT, True)
+        print("diskcache: cleared %s" % ROOT)
+        return 0
+    try:
+        names = sorted((f for f in os.listdir(ROOT) if f.endswith(".img")),
+                       key=lambda f: -os.stat(os.path.join(ROOT, f)).st_mtime)
+    except OSError:
+        names = []
+    print("diskcache: %s (%d of %d)" % (ROOT, len(names), MAX))
+    for f in names:
+        p = os.path.join(ROOT, f)
+        st = os.stat(p)
+        try:
+            with open(p[:-4] + ".json") as m:
+                meta = json.load(m)
+        except (OSError, ValueError):
+            meta = {}
+        print("  %s  %s  %5.1f MiB used  %s" % (
+            f[:12], time.strftime("%Y-%m-%d %H:%M", time.localtime(st.st_mtime)),
+            st.st_blocks * 512 / (1 << 20),
+            (meta.get("parts") or {}).get("what", "")))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
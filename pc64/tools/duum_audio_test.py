@@ -28,11 +28,12 @@ before this landed:
 The square voice cannot fake any of it: it only sounds when uno_seq_beep is
 called, and this test never calls it.
 """
-import os, struct, subprocess, sys, time, math
+import os, struct, subprocess, sys, time
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 sys.path.insert(0, os.path.dirname(HERE))
+import audiolib                                             # noqa: E402
 import remote_qemu as RQ                                    # noqa: E402
 from unoauto_remote import UnoAutoLink                      # noqa: E402
 
@@ -75,64 +76,21 @@ def smf_note(midi=69, hits=20, gap=96, division=96):
 
 
 # ---- capture analysis -------------------------------------------------------
-def read_wav(path):
-    with open(path, "rb") as f:
-        data = f.read()
-    assert data[:4] == b"RIFF" and data[8:12] == b"WAVE", "not a wav"
-    pos, rate, chans, body = 12, 44100, 2, b""
-    while pos + 8 <= len(data):
-        cid, sz = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
-        chunk = data[pos + 8:pos + 8 + sz]
-        if cid == b"fmt ":
-            chans, rate = struct.unpack("<HI", chunk[2:8])
-        elif cid == b"data":
-            body = chunk
-        pos += 8 + sz + (sz & 1)
-    step = 2 * chans
-    n = len(body) // step
-    left = [0] * n
-    right = [0] * n
-    for i in range(n):
-        left[i] = struct.unpack_from("<h", body, i * step)[0]
-        right[i] = struct.unpack_from("<h", body, i * step + (2 if chans > 1 else 0))[0]
-    return rate, left, right
-
-
-def goertzel(seg, rate, hz):
-    """(share, level) at one frequency.
-
-    `share` is the magnitude divided by the window's own power - 'how much of
-    what is here is THIS tone', which is what identifies a stage.  `level` is
-    the plain amplitude, which is what answers 'is this tone here AT ALL'.
-    The two questions need different numbers: a loud effect mixed over the
-    score takes almost all of the share while the score's own level is
-    unchanged, so a share test alone reads a working mixer as a failure."""
-    w = 2.0 * math.cos(2.0 * math.pi * hz / rate)
-    s1 = s2 = 0.0
-    power = 0.0
-    for s in seg:
-        v = s / 32768.0
-        s0 = v + w * s1 - s2
-        s2, s1 = s1, s0
-        power += v * v
-    mag = s1 * s1 + s2 * s2 - w * s1 * s2
-    if mag < 0.0:
-        mag = 0.0
-    level = 2.0 * math.sqrt(mag) / len(seg)
-    if power <= 1e-9:
-        return 0.0, level
-    return mag / (power * len(seg) / 4.0), level
-
-
-def windows(rate, left, right, ms=100):
-    n = int(rate * ms / 1000)
-    for w in range(len(left) // n):
-        a, b = w * n, (w + 1) * n
-        yield w * ms / 1000.0, left[a:b], right[a:b]
-
-
-def rms(seg):
-    return (sum(s * s for s in seg) / max(1, len(seg))) ** 0.5
+# audiolib.tones() answers two questions per tone and window.  `share` is the
+# magnitude over the window's own power - 'how much of what is here is THIS
+# tone', which is what identifies a stage.  `level` is the plain amplitude,
+# which is what answers 'is this tone here AT ALL'.  They need different
+# numbers: a loud effect mixed over the score takes almost all of the share
+# while the score's own level is unchanged, so a share test alone reads a
+# working mixer as a failure.
+WIN_MS = 100
+
+
+def windows(wav, ms=WIN_MS):
+    """(n, left RMS, right RMS) per ms-long window of a capture."""
+    n = int(wav.rate * ms / 1000)
+    return (n, audiolib.rms_windows(wav.channel(0), n),
+            audiolib.rms_windows(wav.channel(1), n))
 
 
 # ---- the guest side ---------------------------------------------------------
@@ -244,18 +202,18 @@ def drive_duum(link):
 
 
 def analyse():
-    rate, left, right = read_wav(WAV)
-    print("  captured %.1f s at %d Hz" % (len(left) / float(rate), rate))
+    wav = audiolib.read(WAV)
+    print("  captured %.1f s at %d Hz" % (wav.seconds, wav.rate))
     hits = {1234: [], 1700: [], 2300: [], 440: []}
     levels = []                      # (t, level440, level1234) per loud window
-    for t, l, r in windows(rate, left, right):
-        if rms(l) < 300 and rms(r) < 300:
-            continue
-        mono = [(a + b) // 2 for a, b in zip(l, r)]
-        e = dict((hz, goertzel(mono, rate, hz)) for hz in hits)
+    n, lr, rr = windows(wav)
+    loud = [w for w in range(len(lr)) if not (lr[w] < 300 and rr[w] < 300)]
+    tones = audiolib.tones(wav.mix(), wav.rate, n, hits, only=loud)
+    for w in loud:
+        t, e = w * WIN_MS / 1000.0, tones[w]
         for hz in hits:
             if e[hz][0] > 0.25:
-                hits[hz].append((t, rms(l), rms(r)))
+                hits[hz].append((t, lr[w], rr[w]))
         levels.append((t, e[440][1], e[1234][1]))
 
     # Present-at-all floors, taken from this recording rather than guessed: a
@@ -339,12 +297,10 @@ def drive_nosnd(link):
 
 
 def analyse_duum():
-    rate, left, right = read_wav(WAV)
-    print("  captured %.1f s at %d Hz" % (len(left) / float(rate), rate))
-    loud = 0
-    for t, l, r in windows(rate, left, right):
-        if rms(l) > 400 or rms(r) > 400:
-            loud += 1
+    wav = audiolib.read(WAV)
+    print("  captured %.1f s at %d Hz" % (wav.seconds, wav.rate))
+    n, lr, rr = windows(wav)
+    loud = sum(1 for l, r in zip(lr, rr) if l > 400 or r > 400)
     print("  %d loud 100 ms window(s)" % loud)
     check(loud >= 20, "Duum kept the DAC busy (score + effects)",
           "%d windows" % loud)
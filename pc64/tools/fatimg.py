@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""fatimg - author a FAT32 volume (and the GPT around it) in-process.
+
+Every test disk used to be made by shelling out: sgdisk twice, mformat, then
+one mmd or mcopy per directory and file of build/esp, then the FAT image
+copied into the disk 1 MiB at a time. With a few hundred ESP files that is a
+few hundred processes and several seconds per boot, and it needs mtools on the
+box at all. Here the whole tree is described first (mkdir / add_file /
+add_tree, which cost a stat each), then laid out and written in one pass:
+
+  * clusters are handed out in the order things were added, each file one
+    contiguous run, so the data region is written front to back;
+  * file data is streamed from the source with os.pwrite straight to its place
+    in the target - a disk image at the partition offset, or any writable
+    buffer (mkbios builds its image in a bytearray);
+  * the FAT, both copies, and the directories are written once, at the end,
+    when every chain is known.
+
+A directory lists in the order its entries were added, exactly as mmd/mcopy
+created them - FAT has no sort, and demo_common's ordered_dir depends on that.
+Adding a path that already exists replaces the file in its slot (mcopy -o).
+
+The volume is what mformat -F makes: 512-byte sectors, 32 reserved, two FATs,
+FSInfo at 1 and the backup boot sector at 6, root directory at cluster 2, and
+Microsoft's default cluster size for the volume size. Names that are not
+already upper-case 8.3 get VFAT long-name entries and a ~N short alias, as
+mcopy gives them. The target is assumed zero-filled (a fresh truncate, or a new
+bytearray); nothing outside the structures written here is touched.
+
+  fatimg.py ESP_DIR OUT.img [MIB]    a GPT disk holding ESP_DIR, like build_disk
+"""
+import array, os, struct, sys, time, uuid, zlib
+
+SECTOR = 512
+RESERVED = 32
+NFATS = 2
+EOC = 0x0FFFFFFF
+CHUNK = 1 << 20
+
+ESP_TYPE = uuid.UUID("C12A7328-F81F-11D2-BA4B-00A0C93EC93B")
+GPT_ENTRIES, GPT_ENTRY = 128, 128
+
+_SHORT_OK = set(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789$%'-_@~`!(){}^#&")
+
+
+def cluster_sectors(sectors):
+    """Microsoft's default FAT32 cluster size for a volume of `sectors`."""
+    for limit, spc in ((532480, 1), (16777216, 8), (33554432, 16),
+                       (67108864, 32)):
+        if sectors <= limit:
+            return spc
+    return 64
+
+
+def _fat_time(t):
+    lt = time.localtime(t)
+    if lt.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    return ((lt.tm_hour << 11) | (lt.tm_min << 5) | (lt.tm_sec // 2),
+            ((lt.tm_year - 1980) << 9) | (lt.tm_mon << 5) | lt.tm_mday)
+
+
+def _is_short(name):
+    """Already a valid upper-case 8.3 name (no long entry needed)?"""
+    if name in (".", ".."):
+        return True
+    base, _, ext = name.partition(".")
+    if not base or len(base) > 8 or len(ext) > 3 or "." in ext:
+        return False
+    raw = (base + ext).encode("ascii", "replace")
+    return all(c in _SHORT_OK for c in raw)
+
+
+def _short_basis(name):
+    """The upper-case 8.3 basis of a long name, and whether it was lossy."""
+    stem = name.lstrip(".")
+    base, ext = stem.rsplit(".", 1) if "." in stem else (stem, "")
+
+    def clean(s):
+        out, lossy = [], False
+        for ch in s.upper():
+            if ch in " .":
+                lossy = True
+                continue
+            b = ch.encode("ascii", "replace")
+            if len(b) != 1 or b[0] not in _SHORT_OK:
+                out.append("_")
+                lossy = True
+            else:
+                out.append(ch)
+        return "".join(out), lossy
+
+    b, lb = clean(base)
+    e, le = clean(ext)
+    lossy = lb or le or len(b) > 8 or len(e) > 3 or stem != name
+    return b[:8] or "_", e[:3], lossy
+
+
+def _pack83(base, ext):
+    return (base.ljust(8) + ext.ljust(3)).encode("ascii")
+
+
+def _checksum(n83):
+    s = 0
+    for c in n83:
+        s = (((s & 1) << 7) + (s >> 1) + c) & 0xFF
+    return s
+
+
+def _lfn_entries(name, n83):
+    """The VFAT long-name slots for `name`, in on-disk order."""
+    u = name.encode("utf-16-le")
+    chars = [u[i:i + 2] for i in range(0, len(u), 2)]
+    if len(chars) % 13:
+        chars.append(b"\0\0")
+    while len(chars) % 13:
+        chars.append(b"\xff\xff")
+    n = len(chars) // 13
+    cs = _checksum(n83)
+    out = []
+    for i in range(n):
+        part = chars[i * 13:(i + 1) * 13]
+        e = bytearray(32)
+        e[0] = (i + 1) | (0x40 if i == n - 1 else 0)
+        e[1:11] = b"".join(part[0:5])
+        e[11], e[12], e[13] = 0x0F, 0, cs
+        e[14:26] = b"".join(part[5:11])
+        e[28:32] = b"".join(part[11:13])
+        out.append(bytes(e))
+    return out[::-1]
+
+
+class _Node(object):
+    __slots__ = ("name", "n83", "lfn", "src", "data", "size", "mtime",
+                 "kids", "cluster", "nclus")
+
+    def __init__(self, name, n83, lfn, mtime):
+        self.name, self.n83, self.lfn, self.mtime = name, n83, lfn, mtime
+        self.src = self.data = self.kids = None
+        self.size = self.cluster = self.nclus = 0
+
+    @property
+    def is_dir(self):
+        return self.kids is not None
+
+
+class FatImage(object):
+    """A FAT32 volume of `sectors`, described then written with write()."""
+
+    def __init__(self, sectors, label="UNODOS", heads=255, spt=63, hidden=0,
+                 serial=None):
+        self.sectors = sectors
+        self.spc = cluster_sectors(sectors)
+        self.cbytes = self.spc * SECTOR
+        # fatgen103's FAT-size formula, for FAT32 (no fixed root region)
+        self.fatsz = -(-(sectors - RESERVED) // ((256 * self.spc + NFATS) // 2))
+        self.data_lba = RESERVED + NFATS * self.fatsz
+        self.clusters = (sectors - self.data_lba) // self.spc
+        if self.clusters < 65525:
+            raise ValueError("fatimg: %d sectors is too small for FAT32"
+                             % sectors)
+        self.label = label.upper()[:11]
+        self.heads, self.spt, self.hidden = heads, spt, hidden
+        self.serial = serial if serial is not None else (
+            int(time.time() * 1000) & 0xFFFFFFFF)
+        self.root = _Node("", b"", [], time.time())
+        self.root.kids = {}
+
+    # -- description ---------------------------------------------------------
+    def _parts(self, path):
+        if path.startswith("::"):
+            path = path[2:]
+        return [p for p in path.replace("\\", "/").split("/") if p]
+
+    def _child(self, d, name, mtime):
+        """The entry `name` in directory node `d`, created if missing."""
+        key = name.upper()
+        if key in d.kids:
+            return d.kids[key]
+        if _is_short(name) and name == name.upper():
+            base, _, ext = name.partition(".")
+            n83, lfn = _pack83(base, ext), []
+        else:
+            base, ext, lossy = _short_basis(name)
+            taken = set(k.n83 for k in d.kids.values())
+            n83 = _pack83(base, ext)
+            i = 1
+            while lossy or n83 in taken:
+                tail = "~%d" % i
+                n83 = _pack83(base[:8 - len(tail)] + tail, ext)
+                lossy = False
+                i += 1
+            lfn = _lfn_entries(name, n83)
+        node = _Node(name, n83, lfn, mtime)
+        d.kids[key] = node
+        return node
+
+    def mkdir(self, path, mtime=None):
+        """Create `path` (and any missing parents); returns its node."""
+        d = self.root
+        for p in self._parts(path):
+            d = self._child(d, p, mtime or time.time())
+            if d.kids is None:
+                if d.src is not None or d.data is not None:
+                    raise ValueError("fatimg: %s is a file" % path)
+                d.kids = {}
+        return d
+
+    def add_file(self, path, src=None, data=None):
+        """File at `path` from host file `src` or the bytes `data`. An existing
+        file of that name is replaced in place, like mcopy -o."""
+        parts = self._parts(path)
+        d = self.mkdir("/".join(parts[:-1]))
+        mtime = os.stat(src).st_mtime if src else time.time()
+        node = self._child(d, parts[-1], mtime)
+        if node.is_dir:
+            raise ValueError("fatimg: %s is a directory" % path)
+        node.src, node.data, node.mtime = src, data, mtime
+        node.size = os.path.getsize(src) if src else len(data)
+        return node
+
+    def add_tree(self, top, dest="", skip=(), prune=()):
+        """Every directory and file under host dir `top`, in os.walk order,
+        into `dest`. `skip` are top-relative file paths and `prune` top-relative
+        directories (forward slashes) left out."""
+        skip, prune = set(skip), set(prune)
+        for root, dirs, files in os.walk(top):
+            rel = os.path.relpath(root, top).replace(os.sep, "/")
+            rel = "" if rel == "." else rel
+            dirs[:] = [x for x in dirs
+                       if (rel + "/" + x).lstrip("/") not in prune]
+            at = (dest.rstrip("/") + "/" + rel).strip("/")
+            if rel:
+                self.mkdir(at, os.stat(root).st_mtime)
+            for fn in files:
+                r = (rel + "/" + fn).lstrip("/")
+                if r not in skip:
+                    self.add_file(at + "/" + fn, src=os.path.join(root, fn))
+
+    # -- layout --------------------------------------------------------------
+    def _dir_slots(self, d):
+        n = 0 if d is self.root else 2
+        if d is self.root and self.label:
+            n += 1
+        return n + sum(1 + len(k.lfn) for k in d.kids.values())
+
+    def _layout(self):
+        """Give every directory and file its run of clusters, in add order."""
+        order = []
+        nxt = [2]
+
+        def take(node, nbytes):
+            node.nclus = max(1, -(-nbytes // self.cbytes)) if nbytes or \
+                node.is_dir else 0
+            node.cluster = nxt[0] if node.nclus else 0
+            nxt[0] += node.nclus
+            order.append(node)
+
+        def walk(d):
+            take(d, self._dir_slots(d) * 32)
+            files = [k for k in d.kids.values() if not k.is_dir]
+            for f in files:
+                take(f, f.size)
+            for k in d.kids.values():
+                if k.is_dir:
+                    walk(k)
+
+        walk(self.root)
+        if nxt[0] - 2 > self.clusters:
+            raise ValueError("fatimg: tree needs %d clusters, volume has %d"
+                             % (nxt[0] - 2, self.clusters))
+        return order, nxt[0]
+
+    def _entry(self, n83, attr, cluster, size, mtime):
+        t, dte = _fat_time(mtime)
+        return n83 + struct.pack("<BBBHHHHHHHI", attr, 0, 0, t, dte, dte,
+                                 cluster >> 16, t, dte, cluster & 0xFFFF, size)
+
+    def _dir_bytes(self, d, parent):
+        out = bytearray()
+        if d is self.root:
+            if self.label:
+                out += self._entry(self.label.ljust(11).encode("ascii"), 0x08,
+                                   0, 0, d.mtime)
+        else:
+            out += self._entry(b".          ", 0x10, d.cluster, 0, d.mtime)
+            up = 0 if parent is self.root else parent.cluster
+            out += self._entry(b"..         ", 0x10, up, 0, parent.mtime)
+        for k in d.kids.values():
+            for e in k.lfn:
+                out += e
+            out += self._entry(k.n83, 0x10 if k.is_dir else 0x20,
+                               k.cluster, 0 if k.is_dir else k.size, k.mtime)
+        out += bytes(d.nclus * self.cbytes - len(out))
+        return bytes(out)
+
+    def _boot(self, free, nxt):
+        b = bytearray(SECTOR)
+        b[0:3] = b"\xEB\x58\x90"
+        b[3:11] = b"UNODOS  "
+        struct.pack_into("<HBHBHHBHHHII", b, 11, SECTOR, self.spc, RESERVED,
+                         NFATS, 0, 0, 0xF8, 0, self.spt, self.heads,
+                         self.hidden, self.sectors)
+        struct.pack_into("<IHHIHH", b, 36, self.fatsz, 0, 0, 2, 1, 6)
+        b[64], b[66] = 0x80, 0x29
+        struct.pack_into("<I", b, 67, self.serial)
+        b[71:82] = (self.label or "NO NAME").ljust(11).encode("ascii")
+        b[82:90] = b"FAT32   "
+        b[510:512] = b"\x55\xAA"
+        fsi = bytearray(SECTOR)
+        struct.pack_into("<I", fsi, 0, 0x41615252)
+        struct.pack_into("<III", fsi, 484, 0x61417272, free, nxt)
+        struct.pack_into("<I", fsi, 508, 0xAA550000)
+        res = bytearray(RESERVED * SECTOR)
+        for at in (0, 6):
+            res[at * SECTOR:(at + 1) * SECTOR] = b
+            res[(at + 1) * SECTOR:(at + 2) * SECTOR] = fsi
+            res[(at + 3) * SECTOR - 2:(at + 3) * SECTOR] = b"\x55\xAA"
+        return bytes(res)
+
+    # -- writing -------------------------------------------------------------
+    def write(self, target, offset=0):
+        """Write the volume at byte `offset` of `target`: an open fd (os.pwrite)
+        or a writable buffer (bytearray, mmap). Returns the clusters used."""
+        if isinstance(target, int):
+            def put(at, data):
+                mv = memoryview(data)
+                while mv:
+                    n = os.pwrite(target, mv, offset + at)
+                    mv = mv[n:]
+        else:
+            def put(at, data):
+                target[offset + at:offset + at + len(data)] = data
+
+        order, nxt = self._layout()
+        fat = array.array("I", bytes(4 * (self.clusters + 2)))
+        fat[0], fat[1] = 0x0FFFFFF8, EOC
+        parents = {}
+        for node in order:
+            if node.is_dir:
+                for k in node.kids.values():
+                    parents[id(k)] = node
+            if not node.nclus:
+                continue
+            c, n = node.cluster, node.nclus
+            fat[c:c + n - 1] = array.array("I", range(c + 1, c + n))
+            fat[c + n - 1] = EOC
+            at = (self.data_lba + (c - 2) * self.spc) * SECTOR
+            if node.is_dir:
+                put(at, self._dir_bytes(node, parents.get(id(node))))
+            elif node.data is not None:
+                put(at, node.data)
+            else:
+                with open(node.src, "rb") as f:
+                    done = 0
+                    while done < node.size:
+                        chunk = f.read(min(CHUNK, node.size - done))
+                        if not chunk:
+                            raise IOError("fatimg: %s shrank while copying"
+                                          % node.src)
+                        put(at + done, chunk)
+                        done += len(chunk)
+        if sys.byteorder != "little":
+            fat.byteswap()
+        raw = fat.tobytes()
+        for i in range(NFATS):
+            put((RESERVED + i * self.fatsz) * SECTOR, raw)
+        put(0, self._boot(self.clusters + 2 - nxt, nxt))
+        return nxt - 2
+
+
+def _gpt_header(lba, alt, entries_lba, last_usable, disk_guid, entries_crc):
+    h = bytearray(92)
+    h[0:8] = b"EFI PART"
+    struct.pack_into("<IIIIQQQQ", h, 8, 0x00010000, 92, 0, 0, lba, alt, 34,
+                     last_usable)
+    h[56:72] = disk_guid.bytes_le
+    struct.pack_into("<QIII", h, 72, entries_lba, GPT_ENTRIES, GPT_ENTRY,
+                     entries_crc)
+    struct.pack_into("<I", h, 16, zlib.crc32(bytes(h)) & 0xFFFFFFFF)
+    return bytes(h) + bytes(SECTOR - 92)
+
+
+def write_gpt(fd, sectors, first, last, name="UNODOS"):
+    """Protective MBR plus primary and backup GPT holding one ESP partition at
+    LBAs first..last, as `sgdisk -n 1:first:0 -t 1:EF00 -c 1:NAME` lays out."""
+    mbr = bytearray(SECTOR)
+    mbr[446:462] = struct.pack("<B3sB3sII", 0, b"\x00\x02\x00", 0xEE,
+                               b"\xff\xff\xff", 1,
+                               min(sectors - 1, 0xFFFFFFFF))
+    mbr[510:512] = b"\x55\xAA"
+    ent = bytearray(GPT_ENTRIES * GPT_ENTRY)
+    ent[0:16] = ESP_TYPE.bytes_le
+    ent[16:32] = uuid.uuid4().bytes_le
+    struct.pack_into("<QQQ", ent, 32, first, last, 0)
+    ent[56:128] = name.encode("utf-16-le")[:72].ljust(72, b"\0")
+    crc = zlib.crc32(bytes(ent)) & 0xFFFFFFFF
+    guid = uuid.uuid4()
+    n_ent = GPT_ENTRIES * GPT_ENTRY // SECTOR
+    os.pwrite(fd, bytes(mbr), 0)
+    os.pwrite(fd, _gpt_header(1, sectors - 1, 2, sectors - 34, guid, crc),
+              SECTOR)
+    os.pwrite(fd, bytes(ent), 2 * SECTOR)
+    os.pwrite(fd, bytes(ent), (sectors - 1 - n_ent) * SECTOR)
+    os.pwrite(fd, _gpt_header(sectors - 1, 1, sectors - 1 - n_ent,
+                              sectors - 34, guid, crc),
+              (sectors - 1) * SECTOR)
+
+
+def gpt_disk(path, vol, mib, part_start=2048, name="UNODOS"):
+    """A fresh `mib` MiB disk at `path`: GPT, one ESP partition at
+    `part_start`, and FatImage `vol` written into it."""
+    sectors = mib * 2048
+    if part_start + vol.sectors > sectors - 34:
+        raise ValueError("fatimg: volume does not fit the disk")
+    with open(path, "wb") as f:
+        f.truncate(sectors * SECTOR)
+        write_gpt(f.fileno(), sectors, part_start,
+                  part_start + vol.sectors - 1, name)
+        vol.write(f.fileno(), part_start * SECTOR)
+    return path
+
+
+def esp_volume(mib, part_start=2048, label="UNODOS"):
+    """The FatImage the pc64 test disks use: the partition runs from
+    `part_start` to the last 1 MiB boundary, as sgdisk aligned it."""
+    return FatImage(mib * 2048 - part_start - 2048, label=label)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(2)
+    mib = int(sys.argv[3]) if len(sys.argv) > 3 else 96
+    t0 = time.time()
+    v = esp_volume(mib)
+    v.add_tree(sys.argv[1])
+    gpt_disk(sys.argv[2], v, mib)
+    print("%s: %d MiB, %d clusters of %d bytes, %.2fs"
+          % (sys.argv[2], mib, v.clusters, v.cbytes, time.time() - t0))
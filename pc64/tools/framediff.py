@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Frame analysis for the pc64 harness: the region diffs a WM scenario asserts
+on, without a Python loop per pixel.
+
+harness.py used to answer diff_frac / diff_bbox / uniform / find_bare with
+nested per-pixel loops over the raw screendump bytes. At the 1280x800 GOP mode
+that is a million iterations per question, and a scenario asks dozens - find_bare
+alone asked uniform() once per 8x8 block. Here each question is one pass:
+
+  * with NumPy, the frame is an (h, w, 3) uint8 view and every answer is a
+    handful of array operations;
+  * without it (NumPy is optional on this tree, as Pillow is), the frame stays a
+    packed RGB buffer and rows are compared a whole row at a time as `bytes`.
+    Rows that match exactly - nearly all of them between two frames of one run
+    - are skipped without looking at a pixel; only the rows that differ are
+    walked per pixel.
+
+Both paths return exactly what the old loops returned, including their
+sampling (diff_bbox and uniform look at every other row and column) and their
+comparison edges (`> 24` for diff_frac, `>= thresh` for the others).
+
+  framediff.py a.ppm b.ppm      diff fraction and changed bbox of two dumps
+"""
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class Frame:
+    """One screendump: size plus the packed RGB rows, and the array view when
+    NumPy is present. Unpacks as (w, h, rgb) so code written against the old
+    FRAMES tuples keeps working."""
+
+    __slots__ = ("w", "h", "rgb", "px")
+
+    def __init__(self, w, h, rgb):
+        self.w, self.h, self.rgb = w, h, rgb
+        self.px = None
+        if np is not None:
+            # frombuffer does not copy: over a memory-mapped dump the view IS
+            # the file. Deltas are widened per question, on the region asked.
+            self.px = np.frombuffer(rgb, dtype=np.uint8,
+                                    count=w * h * 3).reshape(h, w, 3)
+
+    def __iter__(self):
+        return iter((self.w, self.h, self.rgb))
+
+    def row(self, y, l=0, r=None):
+        """Bytes of row y, columns l..r (exclusive)."""
+        r = self.w if r is None else r
+        i = y * self.w * 3
+        return bytes(self.rgb[i + l * 3:i + r * 3])
+
+
+def _dist(a, b):
+    """Per-pixel sum of absolute channel deltas, (h, w) int."""
+    return np.abs(a.astype(np.int16) - b).sum(axis=-1)
+
+
+def _row_hits(ra, rb, base, xs, thresh):
+    """Pure-Python tail: the xs in one row whose pixel distance is >= thresh."""
+    out = []
+    for x in xs:
+        i = base + x * 3
+        if (abs(ra[i] - rb[i]) + abs(ra[i + 1] - rb[i + 1]) +
+                abs(ra[i + 2] - rb[i + 2])) >= thresh:
+            out.append(x)
+    return out
+
+
+def diff_frac(fa, fb, box, thresh=24):
+    """Fraction of pixels differing by more than `thresh` inside box (l,t,r,b)."""
+    if (fa.w, fa.h) != (fb.w, fb.h):
+        return 1.0
+    l, t, r, b = box
+    l = max(0, l); t = max(0, t); r = min(fa.w, r); b = min(fa.h, b)
+    if r <= l or b <= t:
+        return 0.0
+    if fa.px is not None:
+        n = int((_dist(fa.px[t:b, l:r], fb.px[t:b, l:r]) > thresh).sum())
+    else:
+        n = 0
+        ra, rb, stride = fa.rgb, fb.rgb, fa.w * 3
+        for y in range(t, b):
+            if fa.row(y, l, r) == fb.row(y, l, r):
+                continue
+            n += len(_row_hits(ra, rb, y * stride, range(l, r), thresh + 1))
+    return n / float((r - l) * (b - t))
+
+
+def _ignored(rects, w, h):
+    """Boolean (h, w) mask of the ignore rects (x, y, w, h)."""
+    m = np.zeros((h, w), dtype=bool)
+    for rx, ry, rw, rh in rects or ():
+        m[max(0, ry):max(0, ry + rh), max(0, rx):max(0, rx + rw)] = True
+    return m
+
+
+def in_any(rects, x, y):
+    for r in rects or ():
+        if r[0] <= x < r[0] + r[2] and r[1] <= y < r[1] + r[3]:
+            return True
+    return False
+
+
+def diff_bbox(fa, fb, thresh=24, ignore=None):
+    """Bounding box (x, y, w, h) of the pixels that differ between two frames,
+    sampled on even rows and columns, outside the `ignore` rects; or None."""
+    if (fa.w, fa.h) != (fb.w, fb.h):
+        return None
+    w, h = fa.w, fa.h
+    if fa.px is not None:
+        hit = _dist(fa.px[::2, ::2], fb.px[::2, ::2]) >= thresh
+        if ignore:
+            hit &= ~_ignored(ignore, w, h)[::2, ::2]
+        ys = np.flatnonzero(hit.any(axis=1))
+        if not len(ys):
+            return None
+        xs = np.flatnonzero(hit.any(axis=0))
+        x0, x1 = int(xs[0]) * 2, int(xs[-1]) * 2
+        y0, y1 = int(ys[0]) * 2, int(ys[-1]) * 2
+        return (x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+    xs0, ys0, xs1, ys1 = w, h, -1, -1
+    ra, rb, stride = fa.rgb, fb.rgb, w * 3
+    for y in range(0, h, 2):
+        if fa.row(y) == fb.row(y):
+            continue
+        xs = [x for x in _row_hits(ra, rb, y * stride, range(0, w, 2), thresh)
+              if not in_any(ignore, x, y)]
+        if not xs:
+            continue
+        xs0 = min(xs0, xs[0]); xs1 = max(xs1, xs[-1])
+        ys0 = min(ys0, y); ys1 = y
+    if xs1 < 0:
+        return None
+    return (xs0, ys0, xs1 - xs0 + 1, ys1 - ys0 + 1)
+
+
+def uniform(f, x, y, bw, bh, thresh=24):
+    """Is every sampled pixel of this box within `thresh` of its top-left?"""
+    if x < 0 or y < 0 or x + bw > f.w or y + bh > f.h:
+        return False
+    if f.px is not None:
+        box = f.px[y:y + bh:2, x:x + bw:2]
+        return not bool((_dist(box, f.px[y, x]) >= thresh).any())
+    i0 = (y * f.w + x) * 3
+    ref = bytes(f.rgb[i0:i0 + 3])
+    same = [bytes([c]) * len(range(x, x + bw, 2)) for c in ref]
+    stride = f.w * 3
+    for yy in range(y, y + bh, 2):
+        row = f.row(yy, x, x + bw)
+        if all(row[c::6] == same[c] for c in range(3)):
+            continue                            # every sample exactly the reference
+        for xx in range(x, x + bw, 2):
+            i = yy * stride + xx * 3
+            if (abs(f.rgb[i] - ref[0]) + abs(f.rgb[i + 1] - ref[1]) +
+                    abs(f.rgb[i + 2] - ref[2])) >= thresh:
+                return False
+    return True
+
+
+def bare_columns(f, y0, y1, thresh=24):
+    """Per 8-px column block: is every 8x8 block from y0 down to y1 - 8 uniform?"""
+    nb = f.w // 8
+    ys = list(range(y0, y1 - 8, 8))
+    if not ys:
+        return [True] * nb
+    if ys[0] < 0 or ys[-1] + 8 > f.h:
+        return [False] * nb                     # uniform() refuses an out-of-frame box
+    if f.px is None:
+        return [all(uniform(f, xb * 8, y, 8, 8, thresh) for y in ys)
+                for xb in range(nb)]
+    # Gather the (block row, sample row, block col, sample col) grid in one go:
+    # 4x4 samples per block at offsets 0, 2, 4, 6, compared to the block's
+    # own top-left sample.
+    rows = (np.array(ys)[:, None] + np.arange(0, 8, 2)).ravel()
+    s = f.px[rows][:, 0:nb * 8:2].reshape(len(ys), 4, nb, 4, 3)
+    busy = (_dist(s, s[:, :1, :, :1]) >= thresh).any(axis=(1, 3))
+    return (~busy.any(axis=0)).tolist()
+
+
+def widest_run(flags):
+    """(start, length) of the longest run of True, the first on a tie; (0, 0)
+    when there is none."""
+    best, run = (0, 0), 0
+    for i, ok in enumerate(list(flags) + [False]):
+        if ok:
+            run += 1
+            continue
+        if run > best[1]:
+            best = (i - run, run)
+        run = 0
+    return best
+
+
+def find_bare(f, y0, y1, need=200):
+    """Centre of the widest run (>= need px) of bare-wallpaper columns across
+    the band y0..y1, or None."""
+    best = widest_run(bare_columns(f, y0, y1))
+    if best[1] * 8 < need:
+        return None
+    return best[0] * 8 + best[1] * 8 // 2, (y0 + y1) // 2
+
+
+if __name__ == "__main__":
+    import ppm2png
+    a, b = (Frame(*ppm2png.read_ppm(p)) for p in sys.argv[1:3])
+    print("diff %.4f  bbox %s" % (diff_frac(a, b, (0, 0, a.w, a.h)),
+                                   diff_bbox(a, b)))
@@ -23,11 +23,12 @@ that returns cleanly into a dead backend sounds exactly like silence.
                                  the waka blips borrowing the voice on top
                                  (music_note_on)
 """
-import os, struct, subprocess, sys, time
+import os, subprocess, sys, time
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 sys.path.insert(0, os.path.dirname(HERE))
+import audiolib                                             # noqa: E402
 import remote_qemu as RQ                                    # noqa: E402
 from unoauto_remote import UnoAutoLink                      # noqa: E402
 
@@ -44,25 +45,7 @@ def check(cond, what, detail=""):
         fails.append(what)
 
 
-def read_wav(path):
-    with open(path, "rb") as f:
-        data = f.read()
-    assert data[:4] == b"RIFF" and data[8:12] == b"WAVE", "not a wav"
-    pos, rate, chans, body = 12, 44100, 2, b""
-    while pos + 8 <= len(data):
-        cid, sz = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
-        chunk = data[pos + 8:pos + 8 + sz]
-        if cid == b"fmt ":
-            chans, rate = struct.unpack("<HI", chunk[2:8])
-        elif cid == b"data":
-            body = chunk
-        pos += 8 + sz + (sz & 1)
-    step = 2 * chans
-    return rate, [struct.unpack_from("<h", body, i * step)[0]
-                  for i in range(len(body) // step)]
-
-
-def loud_runs(rate, mono, ms=100, floor=500, bridge=0.6):
+def loud_runs(wav, ms=100, floor=500, bridge=0.6):
     """Sustained stretches above `floor`, as (start_s, end_s, [pitch Hz]).
 
     Windows are BRIDGED across gaps of up to `bridge` seconds.  A score is not
@@ -79,21 +62,11 @@ def loud_runs(rate, mono, ms=100, floor=500, bridge=0.6):
     multi-second run carrying several distinct pitches, and the boot chime is
     the short one at the start.
     """
-    n = rate * ms // 1000
-    runs = []
-    for w in range(len(mono) // n):
-        seg = mono[w * n:(w + 1) * n]
-        r = (sum(s * s for s in seg) / n) ** 0.5
-        if r <= floor:
-            continue
-        t0, t1 = w * ms / 1000.0, (w + 1) * ms / 1000.0
-        zc = sum(1 for i in range(1, len(seg)) if (seg[i - 1] < 0) != (seg[i] < 0))
-        if runs and t0 - runs[-1][1] <= bridge:
-            runs[-1][1] = t1
-            runs[-1][2].append(int(zc * 10 / 2))
-        else:
-            runs.append([t0, t1, [int(zc * 10 / 2)]])
-    return runs
+    mono = wav.channel(0)
+    n = wav.rate * ms // 1000
+    zc = audiolib.crossings(mono, n)
+    return [[t0, t1, [int(zc[w] * 10 / 2) for w in ws]] for t0, t1, ws in
+            audiolib.loud_runs(audiolib.rms_windows(mono, n), ms, floor, bridge)]
 
 
 def boot(wav):
@@ -156,9 +129,9 @@ def main():
     if not os.path.exists(WAV):
         print("FAIL: no wav captured")
         return 1
-    rate, mono = read_wav(WAV)
-    runs = [r for r in loud_runs(rate, mono) if r[1] - r[0] >= HOLD * 0.5]
-    print("captured %.1fs, %d sustained run(s)" % (len(mono) / rate, len(runs)))
+    wav = audiolib.read(WAV)
+    runs = [r for r in loud_runs(wav) if r[1] - r[0] >= HOLD * 0.5]
+    print("captured %.1fs, %d sustained run(s)" % (wav.seconds, len(runs)))
     for a, b, pit in runs:
         print("    %6.1f - %6.1f s   %d distinct pitch bands"
               % (a, b, len(set(p // 20 for p in pit))))
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""gates - run the pc64 QEMU gates side by side, each in its own lane.
+
+Every gate here is a standalone script that boots its own QEMU, and until now
+they only ran one after another: they all wrote /tmp/unodos-remote-*.img, all
+listened on URC port 5399, all shared build/vars.fd, /tmp/unodos-pc64-qmp.sock
+and shots/. Two at once would overwrite each other's disks and the second guest
+would dial the first gate's listener.
+
+A lane is what a gate needs to be alone on this machine, handed over in the
+environment remote_qemu, snapvm, urcui and harness.py read at start:
+
+  UNO_SCRATCH    a private scratch dir: the built disks and the gate's own
+                 copy of OVMF VARS (boot_qemu copies it in)
+  URC_PORT       a private URC port (5500 + 10 * lane)
+  UNO_QMP_SOCK   a private QMP socket, in the scratch dir
+  UNO_SHOTS      REPORT/<gate>/shots, so screenshots never collide
+  URC_SNAPROOT   with URC_SNAPSHOT set: the lane's own snapvm snapshot, in
+                 a directory that outlives the gate (snaproot()/lane<N>)
+
+The scratch dir is thrown away after every gate, but a boot snapshot is only
+worth taking if the next gate resumes it. So each lane keeps one snapshot
+outside its scratch, stamped with the lane's fixed URC port: the first gate
+in a lane takes it and every later gate there (and the next gates.py run)
+resumes it.
+
+Lanes that can run at once are bounded by both CPU (one QEMU TCG thread plus
+the gate per two cores) and memory (~768 MB per guest, from MemAvailable), so a
+laptop does not swap itself into timeouts. Gates that cannot be isolated this
+way run EXCLUSIVE - one at a time, after the parallel batch:
+
+  * harness.py scenarios: they build into and boot build/esp and
+    build/unodos-uefi.img, which every scenario shares;
+  * a gate script that pins its own port or /tmp paths (guard_qemu.py, the
+    `PORT = 8099` browser gates, netsock_qemu.py's `P1, P2 = 5501, 5502`,
+    ...) rather than taking them from remote_qemu. PINNED spots these as any
+    upper-case module constant assigned bare 4-5 digit literals, which also
+    catches the odd sample rate: a false hit only costs that gate its lane.
+
+Each gate's output goes to REPORT/<gate>/log.txt; REPORT/report.json is the
+matrix (exit code, pass, seconds, log, shots, lane) plus the wall time against
+the sum of the gate times. The exit code is the number of failed gates.
+
+  gates.py                         every QEMU gate script in tools/
+  gates.py remote_qemu.py uofile_urc.py harness.py:wm_a harness.py:mouse
+  gates.py -j 4 --timeout 900 --report /tmp/gates
+  gates.py --list                  what would run, and which lane kind
+"""
+import argparse, concurrent.futures, json, os, re, shutil, subprocess, sys
+import tempfile, threading, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PC64 = os.path.dirname(HERE)
+
+PORT_BASE = 5500
+MB_PER_GUEST = 768
+PINNED = re.compile(r'^[A-Z][A-Z0-9_]*(?:\s*,\s*[A-Z][A-Z0-9_]*)*\s*=\s*'
+                    r'\d{4,5}(?:\s*,\s*\d{4,5})*\s*(?:#|$)|"/tmp/', re.M)
+
+
+class Gate(object):
+    def __init__(self, name):
+        self.name = name
+        if name.startswith("harness.py:"):
+            self.argv = [sys.executable, os.path.join(PC64, "harness.py"),
+                         name.split(":", 1)[1]]
+            self.exclusive = True
+        else:
+            path = os.path.join(HERE, name)
+            self.argv = [sys.executable, path]
+            with open(path) as f:
+                self.exclusive = bool(PINNED.search(f.read()))
+
+    @property
+    def tag(self):
+        return self.name.replace("harness.py:", "harness-").replace(".py", "")
+
+
+def discover():
+    """Every tools/ gate script: the *_qemu.py and *_urc.py rigs, and the
+    *_test.py ones that boot through remote_qemu."""
+    out = []
+    for fn in sorted(os.listdir(HERE)):
+        if re.search(r"_(qemu|urc)\.py$", fn):
+            out.append(fn)
+        elif fn.endswith("_test.py"):
+            with open(os.path.join(HERE, fn)) as f:
+                if "remote_qemu" in f.read():
+                    out.append(fn)
+    return out
+
+
+def snaproot():
+    """Where the per-lane snapshots live: the URC_SNAPSHOT directory if one
+    was named, else URC_SNAPROOT, else unodos-snap in the system temp dir
+    (not build/: see snapvm on the QMP socket)."""
+    want = os.environ.get("URC_SNAPSHOT", "")
+    if want and want != "1":
+        return os.path.abspath(want)
+    return os.environ.get("URC_SNAPROOT",
+                          os.path.join(tempfile.gettempdir(), "unodos-snap"))
+
+
+def lanes_available():
+    """How many guests this host can hold at once: CPU and memory bound."""
+    cpu = max(1, (os.cpu_count() or 2) // 2)
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    mem = int(line.split()[1]) // 1024 // MB_PER_GUEST
+                    return max(1, min(cpu, mem))
+    except OSError:
+        pass
+    return cpu
+
+
+class Runner(object):
+    def __init__(self, report, timeout):
+        self.report = report
+        self.timeout = timeout
+        self.free = []                        # lane numbers not in use
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def run(self, gate, lane):
+        out = os.path.join(self.report, gate.tag)
+        shots = os.path.join(out, "shots")
+        os.makedirs(shots, exist_ok=True)
+        scratch = tempfile.mkdtemp(prefix="unodos-lane%d-" % lane)
+        env = dict(os.environ,
+                   UNO_SCRATCH=scratch,
+                   URC_PORT=str(PORT_BASE + 10 * lane),
+                   UNO_QMP_SOCK=os.path.join(scratch, "qmp.sock"),
+                   UNO_SHOTS=shots)
+        if os.environ.get("URC_SNAPSHOT"):
+            env.update(URC_SNAPSHOT="1",
+                       URC_SNAPROOT=os.path.join(snaproot(), "lane%d" % lane))
+        log = os.path.join(out, "log.txt")
+        t0 = time.time()
+        with open(log, "w") as f:
+            try:
+                p = subprocess.run(gate.argv, cwd=PC64, env=env, stdout=f,
+                                   stderr=subprocess.STDOUT,
+                                   timeout=self.timeout)
+                rc = p.returncode
+            except subprocess.TimeoutExpired:
+                f.write("\ngates: TIMEOUT after %ds\n" % self.timeout)
+                rc = "timeout"
+        dt = time.time() - t0
+        shutil.rmtree(scratch, True)
+        r = {"rc": rc, "pass": rc == 0, "seconds": round(dt, 1),
+             "log": log, "lane": lane, "port": PORT_BASE + 10 * lane,
+             "exclusive": gate.exclusive,
+             "shots": sorted(os.listdir(shots))}
+        with self.lock:
+            self.results[gate.name] = r
+        print("%-4s %-32s %6.1fs  lane %d" % ("PASS" if r["pass"] else "FAIL",
+                                              gate.name, dt, lane), flush=True)
+        return r
+
+    def lane(self, gate):
+        with self.lock:
+            n = self.free.pop(0)
+        try:
+            return self.run(gate, n)
+        finally:
+            with self.lock:
+                self.free.append(n)
+                self.free.sort()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("gates", nargs="*",
+                    help="gate scripts in tools/, or harness.py:SCENARIO")
+    ap.add_argument("-j", "--jobs", type=int, default=0,
+                    help="parallel lanes (default: from cores and memory)")
+    ap.add_argument("--timeout", type=int, default=1200,
+                    help="seconds before a gate is killed")
+    ap.add_argument("--report", default=os.path.join(PC64, "build", "gates"))
+    ap.add_argument("--list", action="store_true")
+    a = ap.parse_args()
+
+    gates = [Gate(n) for n in (a.gates or discover())]
+    jobs = a.jobs or lanes_available()
+    if a.list:
+        for g in gates:
+            print("%-32s %s" % (g.name, "exclusive" if g.exclusive else "lane"))
+        return 0
+    if not os.path.exists(os.path.join(PC64, "build", "esp")):
+        print("FAIL: no build/esp (run UNO_DEBUG=1 ./build.sh first)")
+        return 1
+
+    os.makedirs(a.report, exist_ok=True)
+    r = Runner(a.report, a.timeout)
+    r.free = list(range(jobs))
+    par = [g for g in gates if not g.exclusive]
+    solo = [g for g in gates if g.exclusive]
+    print("gates: %d in %d lanes, %d exclusive" % (len(par), jobs, len(solo)))
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(jobs) as ex:
+        list(ex.map(r.lane, par))
+    for g in solo:
+        r.lane(g)
+    wall = time.time() - t0
+
+    res = r.results
+    failed = sorted(n for n, v in res.items() if not v["pass"])
+    serial = sum(v["seconds"] for v in res.values())
+    summary = {"gates": res, "lanes": jobs, "passed": len(res) - len(failed),
+               "failed": failed, "wall_s": round(wall, 1),
+               "serial_s": round(serial, 1)}
+    with open(os.path.join(a.report, "report.json"), "w") as f:
+        json.dump(summary, f, indent=2, sort_keys=True)
+    print("\ngates: %d/%d passed in %.0fs wall (%.0fs of gate time, %.1fx)"
+          % (summary["passed"], len(res), wall, serial,
+             serial / wall if wall else 0))
+    for n in failed:
+        print("  FAIL %s  (%s)" % (n, res[n]["log"]))
+    print("report: %s" % os.path.join(a.report, "report.json"))
+    return len(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
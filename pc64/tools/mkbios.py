@@ -34,12 +34,11 @@ Both are written over placeholder dwords located by scanning for the magic
 layout.
 """
 import os
-import shutil
 import struct
-import tempfile
-import subprocess
 import sys
 
+import fatimg
+
 SECTOR = 512
 STAGE2_SECTORS = 16
 KERNEL_LBA = 17
@@ -103,39 +102,25 @@ def mbr_entry(first_lba: int, sectors: int) -> bytes:
             + struct.pack("<II", first_lba, sectors))
 
 
-def mt_run(cmd):
-    """Run an mtools command, and SAY WHAT HAPPENED when it fails.
-
-    These used to run with check=True and both streams sent to DEVNULL, so a
-    failure surfaced as a bare CalledProcessError traceback naming the command
-    and nothing else - no "disk full", no "no such file", nothing to act on.
-    stdout stays discarded (mtools is chatty on success); stderr is captured and
-    put in the error, which is the only part anyone ever wanted.
-    """
-    r = subprocess.run(cmd, stdout=subprocess.DEVNULL,
-                       stderr=subprocess.PIPE, text=True)
-    if r.returncode:
-        raise SystemExit("mkbios: %s failed (exit %d)%s"
-                         % (" ".join(cmd), r.returncode,
-                            ": " + r.stderr.strip() if r.stderr.strip() else ""))
-
-
-def build_fat(esp_dir: str, sectors: int, out: str) -> None:
-    """Format a FAT32 volume of `sectors` and copy the whole build/esp tree in.
+def build_fat(esp_dir: str, sectors: int, img: bytearray, offset: int) -> None:
+    """Format a FAT32 volume of `sectors` at byte `offset` of `img` and copy
+    the whole build/esp tree in.
 
-    Same mtools path tools/mkuefi.py uses for the UEFI image, for the same
-    reason: the kernel's own FAT writer cannot be used to author the volume it
-    is going to be loaded from.
+    tools/fatimg.py authors it in-process, for the reason tools/mkuefi.py
+    gives for using mtools: the kernel's own FAT writer cannot be used to
+    author the volume it is going to be loaded from. Top-level entries go in
+    sorted order, each directory in walk order below that - what the old
+    `mcopy -s` per top-level name produced.
     """
-    if os.path.exists(out):
-        os.remove(out)
-    mt_run(["mformat", "-C", "-i", out, "-T", str(sectors),
-            "-h", "64", "-s", "32", "-F", "-v", "UNODOS", "::"])
+    vol = fatimg.FatImage(sectors, label="UNODOS", heads=64, spt=32)
     for name in sorted(os.listdir(esp_dir)):
         src = os.path.join(esp_dir, name)
-        cmd = (["mcopy", "-s", "-i", out, src, "::/"] if os.path.isdir(src)
-               else ["mcopy", "-i", out, src, "::/" + name])
-        mt_run(cmd)
+        if os.path.isdir(src):
+            vol.mkdir(name, os.stat(src).st_mtime)
+            vol.add_tree(src, dest=name)
+        else:
+            vol.add_file(name, src=src)
+    vol.write(img, offset)
 
 
 def patch(stage2: bytearray, kern_sectors: int, entry: int) -> None:
@@ -239,21 +224,10 @@ def main() -> int:
             img += b"\0" * (need - len(img))
 
         part_sectors = len(img) // SECTOR - RESERVED_SECTORS
-        # A scratch directory of our OWN. This used to be the fixed path
-        # /tmp/uno_bios_fat.img, which two builds running at once - normal on a
-        # box with several worktrees - would delete and re-create underneath
-        # each other. It presented as a random mcopy failing mid-build and
-        # passing on retry, with no message, because the mtools stderr was
-        # thrown away as well. Both halves are fixed; see mt_run().
-        scratch = tempfile.mkdtemp(prefix="uno-mkbios-")
-        try:
-            fat = os.path.join(scratch, "fat.img")
-            build_fat(esp_dir, part_sectors, fat)
-            with open(fat, "rb") as f:
-                data = f.read()
-        finally:
-            shutil.rmtree(scratch, ignore_errors=True)
-        img[RESERVED_SECTORS * SECTOR:RESERVED_SECTORS * SECTOR + len(data)] = data
+        # Written straight into the image: no scratch FAT file to share with a
+        # concurrent build (the fixed /tmp/uno_bios_fat.img once was), and no
+        # mtools to fail mid-build with its stderr thrown away.
+        build_fat(esp_dir, part_sectors, img, RESERVED_SECTORS * SECTOR)
         img[0x1BE:0x1CE] = mbr_entry(RESERVED_SECTORS, part_sectors)
         fat_note = "ESP/FAT32 at LBA %d (%d MiB), boots BIOS + UEFI" % (
             RESERVED_SECTORS, part_sectors // 2048)
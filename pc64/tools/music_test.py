@@ -24,7 +24,9 @@ import math, os, struct, subprocess, sys, time
 HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 os.chdir(HERE)
 sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "tools"))
 from harness import Qmp, keys, QMP_SOCK, OVMF_CODE, OVMF_VARS
+import audiolib                                            # noqa: E402
 
 MUSIC_MENU_INDEX = 6      # 7 native apps; Music is the last (APP_MUSIC)
 # what to play, and how to judge it. A single dominant frequency is the right
@@ -198,31 +200,17 @@ def shot(q, tag):
 def windows(wav):
     """Per-100 ms window: (rms, dominant Hz by zero crossings). Returns the
     list plus the capture length in seconds."""
-    with open(wav, "rb") as f:
-        data = f.read()
-    if data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+    try:
+        w = audiolib.read(wav)
+    except ValueError:
         return [], 0
-    pos, rate, chans, samples = 12, 44100, 2, b""
-    while pos + 8 <= len(data):
-        cid, sz = data[pos:pos + 4], struct.unpack("<I", data[pos + 4:pos + 8])[0]
-        body = data[pos + 8:pos + 8 + sz]
-        if cid == b"fmt ":
-            chans, rate = struct.unpack("<HI", body[2:8])
-        elif cid == b"data":
-            samples = body
-        pos += 8 + sz + (sz & 1)
-    if not samples:
+    if not w.frames:
         return [], 0
-    n = len(samples) // (2 * chans)
-    mono = [struct.unpack_from("<h", samples, i * 2 * chans)[0] for i in range(n)]
-    win = rate // 10
-    out = []
-    for w in range(len(mono) // win):
-        seg = mono[w * win:(w + 1) * win]
-        rms = (sum(s * s for s in seg) / win) ** 0.5
-        zc = sum(1 for i in range(1, len(seg)) if (seg[i - 1] < 0) != (seg[i] < 0))
-        out.append((rms, zc * 10 / 2))
-    return out, len(mono) / rate
+    mono = w.channel(0)
+    win = w.rate // 10
+    return ([(rms, zc * 10 / 2) for rms, zc in
+             zip(audiolib.rms_windows(mono, win), audiolib.crossings(mono, win))],
+            w.seconds)
 
 
 def run(which):
@@ -14,13 +14,13 @@ It proves the full discovery exchange over real broadcast:
   3. we send our own PROBE; the guest answers with an OFFER (role pc64) carrying
      its leased IP                                             (pc64 answers)
 
-Needs a debug build (UNO_DEBUG=1 ./build.sh) and WSL (qemu + OVMF + mtools).
+Needs a debug build (UNO_DEBUG=1 ./build.sh) and WSL (qemu + OVMF).
 Exit 0 iff all three are observed.
 """
 import os, sys, socket, struct, subprocess, threading, time
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
-import remote_qemu as rq         # reuse OVMF paths, disk geometry, mtools helpers
+import remote_qemu as rq         # reuse OVMF paths and the disk builder
 
 HOSTPORT, GUESTPORT = 5610, 5611          # UDP tunnel carrying raw Ethernet
 HOST_MAC  = bytes.fromhex("525400aabbcc")
@@ -33,7 +33,6 @@ URC_PORT  = 5099
 HOST_URC  = ("10.0.2.1", URC_PORT)        # the URC listener we advertise (= us, so
                                           # the guest can actually dial it on the hub)
 DISK = "/tmp/netdisc_disk.img"
-FAT  = "/tmp/netdisc_fat.img"
 
 
 # ---- checksums / frame helpers --------------------------------------------
@@ -213,41 +212,11 @@ class Peer:
 
 
 def build_disk():
-    cfg = "/tmp/netdisc_stress.cfg"
-    with open(cfg, "w", newline="\r\n") as f:
-        f.write("discover\nnonet\n")                    # arm discovery, skip boot net test
-    rq.DISK, rq.FAT = DISK, FAT                          # redirect rq's disk builder
-    orig = rq.build_disk.__globals__
-    # rq.build_disk writes its own cfg; replicate its geometry but our cfg:
-    SECTOR, MIB = 512, 1 << 20
-    disk_sectors = 96 * 2048
-    with open(DISK, "wb") as f: f.truncate(disk_sectors * SECTOR)
-    rq.sh(["sgdisk", "--zap-all", DISK], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    rq.sh(["sgdisk", "-n", "1:2048:0", "-t", "1:EF00", "-c", "1:UNODOS", DISK],
-          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    part_start = 2048; part_sectors = disk_sectors - part_start - 2048
-    with open(FAT, "wb") as f: f.truncate(part_sectors * SECTOR)
-    rq.sh(["mformat", "-i", FAT, "-F", "-T", str(part_sectors), "::"],
-          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    for root, dirs, files in os.walk(rq.ESP):
-        rel = os.path.relpath(root, rq.ESP)
-        if rel != ".":
-            rq.sh(["mmd", "-i", FAT, "::/" + rel.replace(os.sep, "/")],
-                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        for fn in files:
-            src = os.path.join(root, fn)
-            dst = "::/" + (fn if rel == "." else rel.replace(os.sep, "/") + "/" + fn)
-            rq.sh(["mcopy", "-i", FAT, "-o", src, dst], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    # MUST be DEBUG.CFG, not STRESS.CFG - the shipped DEBUG.CFG shadows the
-    # legacy name (dbg_cfg_read, pc64_stress.c), so a STRESS.CFG here is
-    # silently ignored.
-    rq.sh(["mcopy", "-i", FAT, "-o", cfg, "::/DEBUG.CFG"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    with open(FAT, "rb") as pf, open(DISK, "r+b") as df:
-        df.seek(part_start * SECTOR)
-        while True:
-            b = pf.read(MIB)
-            if not b: break
-            df.write(b)
+    # MUST land as DEBUG.CFG, not STRESS.CFG - the shipped DEBUG.CFG shadows
+    # the legacy name (dbg_cfg_read, pc64_stress.c), so a STRESS.CFG here is
+    # silently ignored. `discover` arms discovery, `nonet` skips the boot net
+    # test; the geometry is rq's own.
+    rq.build_disk(DISK, cfg_text="discover\nnonet\n")
 
 
 def boot_qemu():
@@ -1,15 +1,16 @@
 #!/usr/bin/env python3
 """Convert a binary PPM (P6) to PNG using only the stdlib (zlib), so the host
 shim's framebuffer dumps are viewable without PIL. Same minimal-PNG approach
-as the other ports' harnesses.
+as the other ports' harnesses. read_png and encode_png(indexed=True) are the
+other half, for docs/build_site.py's screenshot variants.
 
   ppm2png.py in.ppm out.png
 """
-import sys, zlib, struct
+import mmap, queue, struct, sys, threading, zlib
 
 
-def read_ppm(path):
-    data = open(path, "rb").read()
+def _header(data):
+    """(w, h, offset of the first pixel byte) of a P6 image."""
     assert data[:2] == b"P6", "not a P6 PPM"
     # parse header: P6 <w> <h> <maxval>, whitespace-separated, then one byte
     idx = 2
@@ -26,24 +27,159 @@ def read_ppm(path):
             idx += 1
         vals.append(int(data[start:idx]))
     w, h, _ = vals
-    idx += 1  # single whitespace after maxval
+    return w, h, idx + 1  # single whitespace after maxval
+
+
+def read_ppm(path):
+    data = open(path, "rb").read()
+    w, h, idx = _header(data)
     return w, h, data[idx:idx + w * h * 3]
 
 
-def write_png(path, w, h, rgb):
-    def chunk(tag, payload):
-        c = tag + payload
-        return struct.pack(">I", len(payload)) + c + struct.pack(">I", zlib.crc32(c) & 0xFFFFFFFF)
+def map_ppm(path):
+    """read_ppm without the read: the pixels come back as a read-only
+    memoryview straight over the mapped file, so nothing is copied until
+    somebody asks for bytes. The mapping outlives the file - a caller may
+    delete the PPM as soon as this returns (the harness does)."""
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    w, h, idx = _header(mm[:4096])
+    if len(mm) < idx + w * h * 3:
+        raise ValueError("short PPM: " + path)
+    return w, h, memoryview(mm)[idx:idx + w * h * 3]
 
-    raw = bytearray()
+
+def _chunk(tag, payload):
+    c = tag + payload
+    return struct.pack(">I", len(payload)) + c + struct.pack(">I", zlib.crc32(c) & 0xFFFFFFFF)
+
+
+def encode_png(w, h, rgb, level=9, indexed=False):
+    """The PNG bytes write_png writes. indexed=True stores an image of at most
+    256 colours - a UI screenshot usually is one - as a palette PNG: one byte
+    a pixel instead of three, and still lossless. More colours than that and
+    it is 8-bit RGB as usual."""
+    ctype, stride, pal = 2, w * 3, None
+    if indexed:
+        px = zip(rgb[0::3], rgb[1::3], rgb[2::3])
+        colours = set(px)
+        if len(colours) <= 256:
+            pal = sorted(colours)
+            index = {c: i for i, c in enumerate(pal)}
+            rgb = bytes(map(index.__getitem__, zip(rgb[0::3], rgb[1::3], rgb[2::3])))
+            ctype, stride = 3, w
+
+    # Rows stream into the compressor (filter type 0 each) rather than being
+    # gathered into a second full-frame buffer first.
+    z = zlib.compressobj(level)
+    idat = []
     for y in range(h):
-        raw.append(0)                       # filter type 0
-        raw += rgb[y * w * 3:(y + 1) * w * 3]
+        idat.append(z.compress(b"\x00"))
+        idat.append(z.compress(rgb[y * stride:(y + 1) * stride]))
+    idat.append(z.flush())
     png = b"\x89PNG\r\n\x1a\n"
-    png += chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))  # 8-bit RGB
-    png += chunk(b"IDAT", zlib.compress(bytes(raw), 9))
-    png += chunk(b"IEND", b"")
-    open(path, "wb").write(png)
+    png += _chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, ctype, 0, 0, 0))
+    if pal:
+        png += _chunk(b"PLTE", bytes(v for c in pal for v in c))
+    png += _chunk(b"IDAT", b"".join(idat))
+    png += _chunk(b"IEND", b"")
+    return png
+
+
+def write_png(path, w, h, rgb, level=9):
+    open(path, "wb").write(encode_png(w, h, rgb, level))
+
+
+def read_png(path):
+    """(w, h, rgb) of an 8-bit RGB or 8-bit palette PNG, non-interlaced - what
+    write_png and the capture tools produce. Anything else (alpha, 16-bit,
+    packed palettes, Adam7) raises ValueError: the caller has no use for a
+    lossy guess."""
+    data = open(path, "rb").read()
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("not a PNG: " + path)
+    at, idat, plte, hdr = 8, [], None, None
+    while at < len(data):
+        n, tag = struct.unpack(">I4s", data[at:at + 8])
+        body = data[at + 8:at + 8 + n]
+        if tag == b"IHDR":
+            hdr = struct.unpack(">IIBBBBB", body)
+        elif tag == b"PLTE":
+            plte = body
+        elif tag == b"IDAT":
+            idat.append(body)
+        elif tag == b"IEND":
+            break
+        at += 12 + n
+    w, h, depth, ctype, _, _, interlace = hdr
+    if depth != 8 or interlace or ctype not in (2, 3) or (ctype == 3 and not plte):
+        raise ValueError("unsupported PNG (depth %d, type %d): %s" % (depth, ctype, path))
+    bpp = 3 if ctype == 2 else 1
+    stride = w * bpp
+    raw = zlib.decompress(b"".join(idat))
+    out = bytearray(stride * h)
+    prev = bytearray(stride)
+    for y in range(h):
+        f, row = raw[y * (stride + 1)], raw[y * (stride + 1) + 1:(y + 1) * (stride + 1)]
+        cur = bytearray(row)
+        if f == 2:
+            cur = bytearray((a + b) & 255 for a, b in zip(row, prev))
+        elif f in (1, 3, 4):
+            for x in range(stride):
+                a = cur[x - bpp] if x >= bpp else 0
+                b = prev[x]
+                if f == 1:
+                    p = a
+                elif f == 3:
+                    p = (a + b) >> 1
+                else:
+                    c = prev[x - bpp] if x >= bpp else 0
+                    pa, pb, pc = abs(b - c), abs(a - c), abs(a + b - 2 * c)
+                    p = a if pa <= pb and pa <= pc else b if pb <= pc else c
+                cur[x] = (cur[x] + p) & 255
+        elif f:
+            raise ValueError("bad PNG filter %d: %s" % (f, path))
+        out[y * stride:(y + 1) * stride] = cur
+        prev = cur
+    if ctype == 3:
+        out = b"".join(plte[i * 3:i * 3 + 3] for i in out)
+    return w, h, bytes(out)
+
+
+class PngWriter:
+    """write_png on a background thread, so a capture loop hands a frame off
+    and goes straight back to driving the guest. zlib releases the GIL while
+    it compresses, so the encode really does overlap the caller.
+
+    put() never blocks for long (the queue is bounded only to cap memory);
+    flush() waits for everything queued so far and re-raises the first write
+    error, so a broken artifact cannot pass silently."""
+
+    def __init__(self, level=9, depth=8):
+        self.level = level
+        self.q = queue.Queue(depth)
+        self.err = None
+        self.t = threading.Thread(target=self._run, daemon=True)
+        self.t.start()
+
+    def _run(self):
+        while True:
+            path, w, h, rgb = self.q.get()
+            try:
+                write_png(path, w, h, rgb, self.level)
+            except Exception as e:                # noqa: BLE001
+                self.err = self.err or e
+            finally:
+                self.q.task_done()
+
+    def put(self, path, w, h, rgb):
+        self.q.put((path, w, h, rgb))
+
+    def flush(self):
+        self.q.join()
+        if self.err:
+            e, self.err = self.err, None
+            raise e
 
 
 if __name__ == "__main__":
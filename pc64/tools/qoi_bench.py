@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""qoi_bench - how many frames a second unoauto_remote.qoi_decode keeps up with.
+
+    python3 tools/qoi_bench.py [SECONDS]
+
+The screen stream is 30 fps at up to 1280x800, and every frame of it goes
+through qoi_decode on the host (screen_grab, screen_stream, the recorders,
+demo/stream_recv.py). This encodes one synthetic desktop per size - a
+gradient wallpaper and a few windows of busy "text", so the op mix has runs,
+index hits, DIFF/LUMA and literal pixels like a real frame - with mkicon's
+encoder, then times the decoder on it:
+
+  py      the pure-Python loop (what a host without a C compiler gets)
+  c       the kernel's pc64_qoi.c built for the host, into a fresh buffer
+  c+buf   the same into one reused caller buffer, as the stream readers do
+
+Each decode is checked against the source pixels before it is timed.
+"""
+import os, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import mkicon                                              # noqa: E402
+import unoauto_remote as U                                 # noqa: E402
+
+
+def desktop(w, h):
+    px = bytearray(w * h * 4)
+    for y in range(h):
+        row = b"".join(bytes((40 + y * 60 // h, 80 + x * 40 // w, 140, 255))
+                       for x in range(w))
+        px[y * w * 4:(y + 1) * w * 4] = row
+    seed = 12345
+    for k in range(6):
+        x0, y0 = (k * 97) % (w - 300), (k * 61) % (h - 200)
+        for y in range(y0, y0 + 160):
+            for x in range(x0, x0 + 260):
+                o = (y * w + x) * 4
+                seed = (seed * 1103515245 + 12345) & 0x7FFFFFFF
+                if y < y0 + 18:
+                    c = (30, 60, 120, 255)
+                elif seed % 13 == 0:
+                    c = (seed & 255, (seed >> 8) & 255, (seed >> 16) & 255, 255)
+                else:
+                    c = (235, 235, 235, 255)
+                px[o:o + 4] = bytes(c)
+    return bytes(px)
+
+
+def rate(fn, secs):
+    fn()
+    n, t0 = 0, time.perf_counter()
+    while time.perf_counter() - t0 < secs:
+        fn()
+        n += 1
+    return n / (time.perf_counter() - t0)
+
+
+def main():
+    secs = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    c = U._qoi_c()
+    print("C decoder: %s" % ("pc64_qoi.c, host build" if c else "unavailable"))
+    for w, h in ((640, 400), (1280, 800)):
+        px = desktop(w, h)
+        q = mkicon.qoi_encode(w, h, px)
+        buf = bytearray(w * h * 4)
+        U._qoi_decode_py(q, buf, 0, len(buf))
+        if bytes(buf) != px:
+            print("FAIL %dx%d: the Python decoder disagrees with the source"
+                  % (w, h))
+            return 1
+        line = "%4dx%-4d %5d KiB  py %6.1f fps" % (
+            w, h, len(q) // 1024,
+            rate(lambda: U._qoi_decode_py(q, buf, 0, len(buf)), secs))
+        if c:
+            if U.qoi_decode(q) != px:
+                print("FAIL %dx%d: the C decoder disagrees" % (w, h))
+                return 1
+            line += "   c %7.1f fps   c+buf %7.1f fps" % (
+                rate(lambda: U.qoi_decode(q), secs),
+                rate(lambda: U.qoi_decode(q, buf), secs))
+        print(line)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
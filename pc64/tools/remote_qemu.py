@@ -10,38 +10,52 @@ and proves the round trip:
   4. host -> pc64 `launch 0` then `probe` shows a window (DRIVE)
 
 Requires a debug build first:  UNO_DEBUG=1 ./build.sh
-Run under WSL (needs qemu-system-x86_64, sgdisk, mformat/mcopy, OVMF), so that
-the guest's SLIRP 10.0.2.2 maps to this process's loopback.  Exit 0 iff all
-four checks pass.
+Run under WSL (needs qemu-system-x86_64 and OVMF; the disk is authored
+in-process by fatimg.py), so that the guest's SLIRP 10.0.2.2 maps to this
+process's loopback.  Exit 0 iff all four checks pass.
 """
 import os, sys, subprocess, time, threading
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 from unoauto_remote import UnoAutoLink
+import diskcache, fatimg
 
 ESP  = os.path.join(HERE, "..", "build", "esp")
-DISK  = "/tmp/remote_disk.img"
-DISK2 = "/tmp/remote_disk2.img"     # a SECOND blank disk for the partition/format e2e
-FAT   = "/tmp/remote_fat.img"
+# One gate at a time owns these by default. tools/gates.py runs several at once
+# by handing each its own UNO_SCRATCH directory and URC_PORT; a gate that reads
+# RQ.DISK / RQ.PORT (rather than copying the literals) is isolated for free.
+SCRATCH = os.environ.get("UNO_SCRATCH", "/tmp")
+DISK  = os.path.join(SCRATCH, "remote_disk.img")
+DISK2 = os.path.join(SCRATCH, "remote_disk2.img")   # a SECOND blank disk for the partition/format e2e
 OVMF_CODE = "/usr/share/OVMF/OVMF_CODE_4M.fd"
 OVMF_VARS = "/usr/share/OVMF/OVMF_VARS_4M.fd"
-VARS = "/tmp/remote_vars.fd"
+VARS = os.path.join(SCRATCH, "remote_vars.fd")
 SECTOR, MIB = 512, 1 << 20
-PORT = 5399
+DISK_MIB = 96
+DISK_FMT = {}        # disk path -> "raw" / "qcow2", as build_disk() left it
+PORT = int(os.environ.get("URC_PORT", "5399"))
 
 
 def sh(a, **k): return subprocess.run(a, **k)
 
 
-def build_disk():
-    cfg = os.path.join(os.path.dirname(DISK), "remote_stress.cfg")
+def build_disk(disk=None, disk2=None, cfg_text=None, overlay=False):
+    """The boot disk (GPT + the ESP tree + our DEBUG.CFG) at DISK, and a blank
+    disk B at DISK2 if there is none. The paths default to the module's own;
+    snapvm.py passes its base images instead. `cfg_text` replaces the DEBUG.CFG
+    written here (the demos add nostress/nohud; netdisc arms `discover`).
+
+    The disk comes out of diskcache.py when the ESP and the config are what
+    they were last time. `overlay=True` lets it be a qcow2 overlay of the
+    cached base where a reflink is not possible - only for callers that boot
+    through qemu_argv(), which reads the format back from DISK_FMT. Returns
+    the format."""
+    disk, disk2 = disk or DISK, disk2 or DISK2
     # remote=<host>:<port> arms the dev-PC link; `nonet` skips the slow boot
     # net test (the link brings the NIC up itself); no `poweroff` so the guest
     # stays up for us to drive.
-    with open(cfg, "w", newline="\r\n") as f:
-        f.write("remote=10.0.2.2:%d\nnonet\n" % PORT)
-    disk_sectors = 96 * 2048
-    with open(DISK, "wb") as f: f.truncate(disk_sectors * SECTOR)
+    if cfg_text is None:
+        cfg_text = "remote=10.0.2.2:%d\nnonet\n" % PORT
     # DISK B BELONGS HERE, NOT IN main().
     #
     # boot_qemu() passes `-drive file=DISK2` unconditionally, so a caller that
@@ -55,48 +69,41 @@ def build_disk():
     # once and every urcui gate works until /tmp is cleared, which on a WSL box
     # is every reboot. Creating it here makes the two entry points equivalent,
     # which is the only reason the bug could exist.
-    if not os.path.exists(DISK2):
-        with open(DISK2, "wb") as f: f.truncate(128 * MIB)   # blank disk B
-    sh(["sgdisk", "--zap-all", DISK], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    sh(["sgdisk", "-n", "1:2048:0", "-t", "1:EF00", "-c", "1:UNODOS", DISK],
-       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    part_start = 2048
-    part_sectors = disk_sectors - part_start - 2048
-    with open(FAT, "wb") as f: f.truncate(part_sectors * SECTOR)
-    sh(["mformat", "-i", FAT, "-F", "-T", str(part_sectors), "::"],
-       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    for root, dirs, files in os.walk(ESP):
-        rel = os.path.relpath(root, ESP)
-        if rel != ".":
-            sh(["mmd", "-i", FAT, "::/" + rel.replace(os.sep, "/")],
-               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        for fn in files:
-            src = os.path.join(root, fn)
-            dst = "::/" + (fn if rel == "." else rel.replace(os.sep, "/") + "/" + fn)
-            sh(["mcopy", "-i", FAT, "-o", src, dst],
-               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    # The debug/test config was renamed STRESS.CFG -> DEBUG.CFG (2026-07-26) and
-    # the build now SHIPS a DEBUG.CFG, which shadows any STRESS.CFG (dbg_cfg_read
-    # reads DEBUG.CFG first). So the harness config must be written as DEBUG.CFG,
-    # overwriting the shipped one, or `remote=`/`nonet` are never seen.
-    sh(["mcopy", "-i", FAT, "-o", cfg, "::/DEBUG.CFG"],
-       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    with open(FAT, "rb") as pf, open(DISK, "r+b") as df:
-        df.seek(part_start * SECTOR)
-        while True:
-            b = pf.read(MIB)
-            if not b: break
-            df.write(b)
-
-
-def boot_qemu():
-    sh(["cp", OVMF_VARS, VARS])
+    if not os.path.exists(disk2):
+        with open(disk2, "wb") as f: f.truncate(128 * MIB)   # blank disk B
+
+    def author(path):
+        vol = fatimg.esp_volume(DISK_MIB)
+        vol.add_tree(ESP)
+        # The debug/test config was renamed STRESS.CFG -> DEBUG.CFG (2026-07-26)
+        # and the build now SHIPS a DEBUG.CFG, which shadows any STRESS.CFG
+        # (dbg_cfg_read reads DEBUG.CFG first). So the harness config must be
+        # written as DEBUG.CFG, overwriting the shipped one, or `remote=` /
+        # `nonet` are never seen.
+        vol.add_file("::/DEBUG.CFG",
+                     data=cfg_text.replace("\n", "\r\n").encode())
+        fatimg.gpt_disk(path, vol, DISK_MIB)
+
+    parts = {"what": "remote_qemu", "esp": diskcache.tree_stamp(ESP),
+             "cfg": cfg_text, "mib": DISK_MIB}
+    fmt = diskcache.fetch(disk, parts, author, overlay,
+                          sources=[os.path.abspath(__file__)])
+    DISK_FMT[os.path.abspath(disk)] = fmt
+    return fmt
+
+
+def qemu_argv(disk=None, disk2=None, vars_=None, fmt="raw"):
+    """boot_qemu()'s command line. A snapshot resume needs the SAME machine
+    with the writable drives swapped for qcow2 overlays (`fmt`), so the
+    device list lives here once rather than in two places that can drift."""
+    disk, disk2, vars_ = disk or DISK, disk2 or DISK2, vars_ or VARS
+    dfmt = DISK_FMT.get(os.path.abspath(disk), fmt)
     cmd = [
         "qemu-system-x86_64", "-machine", "q35", "-m", "512", "-cpu", "max",
         "-drive", "if=pflash,format=raw,readonly=on,file=" + OVMF_CODE,
-        "-drive", "if=pflash,format=raw,file=" + VARS,
-        "-drive", "format=raw,file=" + DISK,
-        "-drive", "format=raw,file=" + DISK2,     # blank; the disk verbs partition/format it
+        "-drive", "if=pflash,format=%s,file=%s" % (fmt, vars_),
+        "-drive", "format=%s,file=%s" % (dfmt, disk),
+        "-drive", "format=%s,file=%s" % (fmt, disk2),   # blank; the disk verbs partition/format it
         # URC_HOSTFWD appends slirp forwards, e.g. "udp::5514-:514". Slirp is
         # outbound-only by default: the guest can reach the host at 10.0.2.2,
         # and the host cannot reach the guest AT ALL without a forward. A test
@@ -110,7 +117,31 @@ def boot_qemu():
     if os.environ.get("URC_DBGCON"):
         cmd += ["-debugcon", "file:" + os.environ["URC_DBGCON"],
                 "-global", "isa-debugcon.iobase=0x402"]
-    return subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+    return cmd
+
+
+def snapshot(want=None):
+    """The snapvm.Snapshot a gate should resume from, or None to cold-boot.
+
+    `want` (or URC_SNAPSHOT when it is not given) is a snapshot directory, or
+    "1" for the default one. A missing or stale snapshot is TAKEN here, which
+    boots the image and listens on PORT itself - so call this BEFORE the
+    gate's own UnoAutoLink.listen(), never after."""
+    want = want or os.environ.get("URC_SNAPSHOT")
+    if not want:
+        return None
+    import snapvm
+    return snapvm.ensure(None if want in ("1", True) else want)
+
+
+def boot_qemu(snapshot=None):
+    """Cold-boot the image build_disk() wrote, or - given a Snapshot from
+    snapshot() - resume that saved machine on copy-on-write overlays. Either
+    way the guest dials PORT; a resumed one re-dials within ~5 s."""
+    if snapshot is not None:
+        return snapshot.resume()
+    sh(["cp", OVMF_VARS, VARS])
+    return subprocess.Popen(qemu_argv(), stderr=subprocess.DEVNULL)
 
 
 def main():
@@ -118,14 +149,16 @@ def main():
         print("FAIL: no debug build at build/esp (run UNO_DEBUG=1 ./build.sh)")
         return 1
 
+    snap = snapshot()                        # URC_SNAPSHOT=1: resume, don't boot
     logs = []
     link = UnoAutoLink("127.0.0.1", PORT)
     link.on_log(lambda ch, t: logs.append((ch, t)))
     link.listen()
 
-    build_disk()
-    with open(DISK2, "wb") as f: f.truncate(128 * MIB)   # a blank 128 MB disk B
-    q = boot_qemu()
+    if snap is None:
+        build_disk(overlay=True)
+        with open(DISK2, "wb") as f: f.truncate(128 * MIB)   # a blank 128 MB disk B
+    q = boot_qemu(snap)
     ok = True
 
     def check(cond, label, detail=""):
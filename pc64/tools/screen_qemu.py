@@ -19,7 +19,7 @@ import os, sys, time
 HERE = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, HERE)
 import remote_qemu as rq              # reuse build_disk / boot_qemu / globals
-from unoauto_remote import UnoAutoLink, qoi_decode
+from unoauto_remote import UnoAutoLink, Compositor
 
 
 def save_ppm(path, w, h, rgba):
@@ -77,7 +77,6 @@ def main():
         try:
             time.sleep(1.0)                       # let the desktop settle
             W1, H1, base = link.screen_grab(1, timeout=25)   # seed the snapshot + canvas
-            canvas = bytearray(base)
             u = link.screen_grab_delta(1, timeout=25)        # a delta vs that snapshot
             check(not u["keyframe"], "grab delta returns a delta (snapshot exists)",
                   "nch=%d" % u.get("nch", -1))
@@ -93,17 +92,10 @@ def main():
             # Composite exactly this delta onto the seeded canvas (client<->device
             # lockstep), then compare to a fresh full grab. A placement bug would
             # corrupt large regions; a live clock/cursor drifts only a few pixels.
-            if u["nch"] > 0:
-                strip = qoi_decode(u["qoi"])      # tw x (nch*th) RGBA
-                tw, th, cols = u["tw"], u["th"], u["cols"]
-                for i, t in enumerate(u["idx"]):
-                    col, row = t % cols, t // cols
-                    dx, dy = col * tw, row * th
-                    vw, vh = min(tw, W1 - dx), min(th, H1 - dy)
-                    for yy in range(max(0, vh)):
-                        so = ((i * th + yy) * tw) * 4
-                        do = ((dy + yy) * W1 + dx) * 4
-                        canvas[do:do + vw * 4] = strip[so:so + vw * 4]
+            comp = Compositor()
+            comp.seed(W1, H1, base)
+            comp.apply(u)
+            canvas = comp.canvas
             W2, H2, full2 = link.screen_grab(1, timeout=25)
             check((W2, H2) == (W1, H1), "dims stable across grabs", "%dx%d" % (W2, H2))
             if (W2, H2) == (W1, H1):
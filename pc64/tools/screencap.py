@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""Settled QMP screendumps without sleep-polling - the one helper harness.py,
+docs_shots.py and demo/demo_common.py share.
+
+QMP `screendump` is ASYNCHRONOUS: the command returns once the request is
+queued and QEMU writes the file on its next graphic update. Every caller used
+to find out when it had finished by sleeping and looking again (size settled,
+or the PPM re-parses complete), which costs at least one sleep per shot and
+gives up when the guest is slow to repaint. This waits on the write itself:
+
+  fifo     frame() only. The dump target is a named pipe we are already
+           reading, so the pixels go QEMU -> pipe -> memory and never touch
+           disk; the frame is done when the header's w*h*3 bytes have arrived.
+  inotify  dump() to a real file: IN_CLOSE_WRITE on the target's directory is
+           QEMU closing the finished file. A drvfs (Windows-mounted) tree may
+           never deliver the event, so the completeness check below still runs
+           between wakeups as a backstop.
+  poll     no inotify (not Linux, or no libc symbol): re-check the file at a
+           short interval until the header's w*h*3 bytes are all there.
+
+UNO_SCREENCAP=fifo|inotify|poll forces a mode; the default is the first of
+those that works here, and a FIFO that times out once is not tried again in
+this process (the frame is retaken through a file). Every shot's latency -
+request to complete frame - lands in LOG; summary() is the line a gate prints.
+
+  screencap.py QMP_SOCK OUT.ppm    one settled dump through a running QEMU
+"""
+import ctypes, ctypes.util, os, select, struct, sys, tempfile, threading, time
+
+import ppm2png
+
+FORCE = os.environ.get("UNO_SCREENCAP", "")
+LOG = []                                    # (path, mode, seconds) per shot
+
+IN_CLOSE_WRITE = 0x00000008
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def _libc():
+    try:
+        lib = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+                          use_errno=True)
+        lib.inotify_init1, lib.inotify_add_watch
+        return lib
+    except (OSError, AttributeError):
+        return None
+
+
+class _Watch:
+    """One inotify descriptor watching a directory for IN_CLOSE_WRITE."""
+
+    def __init__(self, lib, path):
+        self.fd = lib.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        if lib.inotify_add_watch(self.fd, os.fsencode(path), IN_CLOSE_WRITE) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch " + path)
+
+    def drain(self):
+        """Names closed-after-write since the last call."""
+        names = []
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except BlockingIOError:
+                return names
+            i = 0
+            while i + 16 <= len(data):
+                _, _, _, n = struct.unpack_from("iIII", data, i)
+                names.append(data[i + 16:i + 16 + n].rstrip(b"\0").decode(
+                    "utf-8", "replace"))
+                i += 16 + n
+
+    def wait(self, slice_):
+        select.select([self.fd], [], [], slice_)
+
+
+_LIB = _libc() if sys.platform.startswith("linux") else None
+_WATCHES = {}
+_FIFO_DIR = None
+_FIFO_OK = FORCE in ("", "fifo") and hasattr(os, "mkfifo")
+
+
+def _watch(d):
+    if FORCE == "poll" or _LIB is None:
+        return None
+    if d not in _WATCHES:
+        try:
+            _WATCHES[d] = _Watch(_LIB, d)
+        except OSError:
+            _WATCHES[d] = None
+    return _WATCHES[d]
+
+
+def complete(path):
+    """True when the file holds a whole P6 frame (header's w*h*3 included)."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(4096)
+            w, h, off = ppm2png._header(head)
+            return os.fstat(f.fileno()).st_size >= off + w * h * 3
+    except (OSError, ValueError, IndexError, AssertionError):
+        return False
+
+
+def _note(path, mode, t0):
+    dt = time.time() - t0
+    LOG.append((path, mode, dt))
+    return dt
+
+
+def dump(q, path, timeout=9.0, gap=0.05):
+    """screendump to `path` and return once QEMU has written all of it.
+    Returns the latency in seconds; raises RuntimeError on timeout."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    d = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path)
+    w = _watch(d)
+    if w:
+        w.drain()                              # events from earlier shots
+    t0 = time.time()
+    q.cmd("screendump", filename=path)
+    while time.time() - t0 < timeout:
+        if w:
+            w.wait(0.1)
+            if name in w.drain() and complete(path):
+                return _note(path, "inotify", t0)
+        else:
+            time.sleep(gap)
+        if complete(path):                     # the backstop, or the only way
+            return _note(path, "inotify" if w else "poll", t0)
+    raise RuntimeError("screendump never completed: " + path)
+
+
+def _read_fifo(fd, out, deadline):
+    """Read one P6 frame from the pipe into out[0] = (w, h, view)."""
+    head = bytearray()
+    try:
+        while True:
+            left = deadline - time.time()
+            if left <= 0 or not select.select([fd], [], [], left)[0]:
+                return
+            head += os.read(fd, 65536)
+            try:
+                w, h, off = ppm2png._header(bytes(head[:4096]))
+                break
+            except (ValueError, IndexError, AssertionError):
+                continue                       # header still arriving
+        buf = bytearray(off + w * h * 3)
+        n = min(len(head), len(buf))
+        buf[:n] = head[:n]
+        mv = memoryview(buf)
+        while n < len(buf):
+            left = deadline - time.time()
+            if left <= 0 or not select.select([fd], [], [], left)[0]:
+                return
+            got = os.readv(fd, [mv[n:]])
+            if not got:
+                return
+            n += got
+        out[0] = (w, h, mv[off:])
+    except OSError:
+        return
+
+
+def frame(q, timeout=9.0):
+    """One settled frame in memory: (w, h, rgb). Through a FIFO when this
+    host and QEMU allow it, otherwise dump() to a scratch file and map it."""
+    global _FIFO_DIR, _FIFO_OK
+    if _FIFO_OK:
+        if _FIFO_DIR is None:
+            _FIFO_DIR = tempfile.mkdtemp(prefix="unodos-screencap-")
+        fifo = os.path.join(_FIFO_DIR, "%d.ppm" % len(LOG))
+        os.mkfifo(fifo)
+        # O_RDWR: QEMU's open-for-write never blocks waiting for a reader, and
+        # the pipe never reports EOF before QEMU has even opened it.
+        fd = os.open(fifo, os.O_RDWR)
+        out = [None]
+        t0 = time.time()
+        rd = threading.Thread(target=_read_fifo,
+                              args=(fd, out, t0 + timeout), daemon=True)
+        rd.start()
+        try:
+            q.cmd("screendump", filename=fifo)
+            rd.join(timeout + 1)
+        finally:
+            # Unlinked first: a QEMU that only now gets round to the write
+            # creates a stray file instead of blocking on a reader-less pipe.
+            os.remove(fifo)
+            os.close(fd)
+        if out[0]:
+            _note(fifo, "fifo", t0)
+            return out[0]
+        _FIFO_OK = False
+        print("screencap: no frame through the FIFO in %.0fs; using files"
+              % timeout)
+    if _FIFO_DIR is None:
+        _FIFO_DIR = tempfile.mkdtemp(prefix="unodos-screencap-")
+    path = os.path.join(_FIFO_DIR, "frame.ppm")
+    dump(q, path, timeout)
+    w, h, rgb = ppm2png.map_ppm(path)
+    os.remove(path)
+    return w, h, rgb
+
+
+def last_ms():
+    return LOG[-1][2] * 1000 if LOG else 0.0
+
+
+def summary():
+    """One line for a gate's log: how many shots, how long they waited."""
+    if not LOG:
+        return "screencap: no shots"
+    ts = sorted(t for _, _, t in LOG)
+    modes = sorted(set(m for _, m, _ in LOG))
+    return ("screencap: %d shots (%s), mean %.0f ms, median %.0f ms, max %.0f ms"
+            % (len(ts), "/".join(modes), 1000 * sum(ts) / len(ts),
+               1000 * ts[len(ts) // 2], 1000 * ts[-1]))
+
+
+class _Qmp(object):
+    """Just enough QMP for the command line: dump() only calls cmd(). Not
+    harness.Qmp - importing harness chdir()s into pc64/, and OUT.ppm is
+    relative to where this was run."""
+    def __init__(self, path):
+        import socket
+        self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.s.connect(path)
+        self.f = self.s.makefile("rb")
+        self.f.readline()                      # greeting
+        self.cmd("qmp_capabilities")
+
+    def cmd(self, name, **args):
+        import json
+        msg = {"execute": name}
+        if args:
+            msg["arguments"] = args
+        self.s.sendall(json.dumps(msg).encode() + b"\n")
+        while True:
+            r = json.loads(self.f.readline())
+            if "return" in r or "error" in r:
+                return r
+
+
+if __name__ == "__main__":
+    dt = dump(_Qmp(sys.argv[1]), sys.argv[2])
+    print("%s complete after %.0f ms" % (sys.argv[2], dt * 1000))
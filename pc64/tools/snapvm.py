@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""snapvm - boot the pc64 DEBUG image once, save the machine, and start every
+URC gate from the save instead of from OVMF.
+
+Every gate built on remote_qemu pays the same cold boot (OVMF, the ESP, the
+shell, the URC dial-in: 20-40 s) before it asserts anything. Nothing in that
+boot is what the gate is testing, so it is paid once here:
+
+  take     build_disk() into the snapshot directory, boot it, wait for the
+           guest's HELLO, then hang up the link and wait for the guest to see
+           it go (it drops back to "retry every ~5 s"), stop the CPU and
+           migrate the whole machine to a file. The raw disk images are now
+           frozen at exactly the instant the RAM was.
+  resume   per gate: a qcow2 overlay over each frozen image (boot disk, blank
+           disk B, OVMF VARS), so whatever the gate writes lands in ITS overlay
+           and the base never changes; then the same qemu_argv() with
+           `-incoming` reading the saved state and a QMP socket of its own.
+           The state was saved with the CPU stopped, so QEMU loads it paused;
+           resume() waits on QMP for the load to finish and sends `cont`.
+           The guest wakes up in its retry loop and dials the gate's
+           listener within ~5 s.
+
+Why hang up before saving: a TCP connection cannot be carried into a new QEMU
+(slirp's host socket is gone), and a guest that wakes up believing it is still
+linked waits for a timeout before it re-dials. Saving it already down means the
+re-dial is the guest's ordinary next retry.
+
+Why an external state file and not `savevm`: internal snapshots live inside a
+qcow2 image and are invisible through a backing file, so they cannot be shared
+by per-gate overlays - each gate would need a private copy of the whole image.
+
+The snapshot is stamped with the ESP tree (paths, sizes, mtimes), the URC port
+and the URC_HOSTFWD / URC_DBGCON settings that shape the machine; ensure()
+retakes it whenever any of those change. It lives under remote_qemu's scratch
+directory (/tmp unless UNO_SCRATCH says otherwise), not build/: a
+Windows-mounted tree cannot host the QMP socket (see harness.QMP_SOCK).
+
+Opt in from a gate:
+    URC_SNAPSHOT=1 python3 tools/remote_qemu.py    (or any UrcUi gate)
+    UrcUi(snapshot="1")                            (in code)
+
+  snapvm.py            take the snapshot if it is missing or stale
+  snapvm.py --retake   take it regardless
+  snapvm.py --info     print the stamp it was taken against
+"""
+import atexit, json, os, shlex, shutil, socket, subprocess, sys, tempfile, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.dirname(HERE))
+
+import diskcache                                           # noqa: E402
+import remote_qemu as RQ                                   # noqa: E402
+from unoauto_remote import UnoAutoLink                     # noqa: E402
+
+ROOT = os.environ.get("URC_SNAPROOT", os.path.join(RQ.SCRATCH, "unodos-snap"))
+LINK_DROP = 3.0            # s for the guest to notice the host hung up
+LOAD_WAIT = 120.0          # s for an incoming QEMU to load the saved state
+
+
+class Qmp(object):
+    """The few QMP commands snapvm sends. Not harness.Qmp: importing harness
+    chdir()s into pc64/, starts its PNG writer thread and registers atexit
+    hooks, none of which a gate that only wants a snapshot should get."""
+    def __init__(self, path, timeout=30.0):
+        deadline = time.time() + timeout
+        while True:
+            try:
+                self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self.s.connect(path)
+                break
+            except OSError:
+                self.s.close()
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+        self.f = self.s.makefile("rb")
+        self.f.readline()                      # greeting
+        self.cmd("qmp_capabilities")
+
+    def cmd(self, name, **args):
+        msg = {"execute": name}
+        if args:
+            msg["arguments"] = args
+        self.s.sendall(json.dumps(msg).encode() + b"\n")
+        while True:
+            line = self.f.readline()
+            if not line:
+                raise RuntimeError("snapvm: QMP closed during %s" % name)
+            r = json.loads(line)
+            if "return" in r or "error" in r:
+                return r
+
+    def close(self):
+        self.s.close()
+
+
+def esp_stamp(esp=None):
+    """Digest of the ESP tree's shape: every path, size and mtime."""
+    return diskcache.tree_stamp(esp or RQ.ESP, content=False)
+
+
+class Snapshot(object):
+    def __init__(self, root=None):
+        self.root = os.path.abspath(root or ROOT)
+        self.disk = os.path.join(self.root, "disk.img")
+        self.disk2 = os.path.join(self.root, "disk2.img")
+        self.vars = os.path.join(self.root, "vars.fd")
+        self.state = os.path.join(self.root, "vm.state")
+        self.meta = os.path.join(self.root, "meta.json")
+        self.qmp = os.path.join(self.root, "qmp.sock")
+
+    def stamp(self):
+        return {"esp": esp_stamp(), "port": RQ.PORT,
+                "hostfwd": os.environ.get("URC_HOSTFWD", ""),
+                "dbgcon": bool(os.environ.get("URC_DBGCON"))}
+
+    def info(self):
+        try:
+            with open(self.meta) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def fresh(self):
+        m = self.info()
+        return (m is not None and os.path.exists(self.state) and
+                m.get("stamp") == self.stamp())
+
+    def take(self, boot_wait=180.0, verbose=True):
+        """Cold-boot once and save the machine at the URC retry loop."""
+        if os.path.exists(self.root):
+            shutil.rmtree(self.root)
+        os.makedirs(self.root)
+        t0 = time.time()
+        RQ.build_disk(self.disk, self.disk2)
+        shutil.copyfile(RQ.OVMF_VARS, self.vars)
+        link = UnoAutoLink("127.0.0.1", RQ.PORT)
+        link.listen(discover=False)
+        cmd = RQ.qemu_argv(self.disk, self.disk2, self.vars) + [
+            "-qmp", "unix:%s,server,nowait" % self.qmp]
+        p = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+        try:
+            if not (link.wait_connected(boot_wait) and link.wait_hello(30.0)):
+                raise SystemExit("snapvm: the guest never dialled in - "
+                                 "is this the DEBUG build?")
+            t_up = time.time()
+            time.sleep(2.0)                    # the same settle UrcUi gives a boot
+            link.close()
+            time.sleep(LINK_DROP)
+            q = Qmp(self.qmp)
+            q.cmd("stop")
+            part = self.state + ".part"
+            r = q.cmd("migrate", uri="exec:cat > " + shlex.quote(part))
+            if "error" in r:
+                raise RuntimeError("snapvm: migrate refused: %r" % r["error"])
+            while True:
+                st = q.cmd("query-migrate").get("return", {}).get("status")
+                if st == "completed":
+                    break
+                if st in ("failed", "cancelled"):
+                    raise RuntimeError("snapvm: migration " + st)
+                time.sleep(0.2)
+            q.cmd("quit")
+            p.wait(timeout=30)
+            os.replace(part, self.state)
+        finally:
+            link.close()
+            if p.poll() is None:
+                p.kill()
+        with open(self.meta, "w") as f:
+            json.dump({"stamp": self.stamp(), "taken": time.time(),
+                       "boot_s": round(t_up - t0, 1)}, f, indent=2)
+        if verbose:
+            print("snapvm: saved %s (cold boot to HELLO took %.1fs)"
+                  % (self.root, t_up - t0))
+        return self
+
+    def overlays(self, workdir):
+        """Fresh qcow2 overlays over the frozen images: (disk, disk2, vars)."""
+        out = []
+        for base in (self.disk, self.disk2, self.vars):
+            ov = os.path.join(workdir, os.path.basename(base) + ".qcow2")
+            subprocess.run(["qemu-img", "create", "-q", "-f", "qcow2",
+                            "-F", "raw", "-b", base, ov], check=True)
+            out.append(ov)
+        return out
+
+    def resume(self, workdir=None):
+        """Start a QEMU from the saved machine, on overlays in `workdir` (by
+        default a fresh temp dir, removed at exit). Returns the Popen, like
+        remote_qemu.boot_qemu()."""
+        if not os.path.exists(self.state):
+            raise SystemExit("snapvm: no snapshot at %s (run tools/snapvm.py)"
+                             % self.root)
+        if workdir is None:
+            workdir = tempfile.mkdtemp(prefix="unodos-gate-")
+            atexit.register(shutil.rmtree, workdir, True)
+        disk, disk2, vars_ = self.overlays(workdir)
+        qmp = os.path.join(workdir, "qmp.sock")
+        cmd = RQ.qemu_argv(disk, disk2, vars_, fmt="qcow2") + [
+            "-incoming", "exec:cat " + shlex.quote(self.state),
+            "-qmp", "unix:%s,server,nowait" % qmp]
+        p = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+        try:
+            self._cont(qmp, p)
+        except BaseException:
+            p.kill()
+            raise
+        return p
+
+    @staticmethod
+    def _cont(qmp, p):
+        """Wait for the incoming QEMU to finish loading, then run it: take()
+        stopped the CPU before migrating, and that runstate came along."""
+        q = Qmp(qmp)
+        try:
+            deadline = time.time() + LOAD_WAIT
+            while True:
+                if p.poll() is not None:
+                    raise RuntimeError("snapvm: QEMU exited (%d) loading the "
+                                       "snapshot" % p.returncode)
+                st = q.cmd("query-status").get("return", {}).get("status")
+                if st not in ("inmigrate", "prelaunch", None):
+                    break
+                if time.time() > deadline:
+                    raise RuntimeError("snapvm: snapshot not loaded after %ds "
+                                       "(status %s)" % (LOAD_WAIT, st))
+                time.sleep(0.1)
+            if st != "running":
+                r = q.cmd("cont")
+                if "error" in r:
+                    raise RuntimeError("snapvm: cont refused: %r" % r["error"])
+        finally:
+            q.close()
+
+
+def ensure(root=None):
+    """The snapshot at `root`, taken first if it is missing or stale."""
+    s = Snapshot(root)
+    if not s.fresh():
+        print("snapvm: %s snapshot - booting once to take it"
+              % ("stale" if s.info() else "no"))
+        s.take()
+    return s
+
+
+def main():
+    s = Snapshot()
+    if "--info" in sys.argv:
+        print(json.dumps(s.info(), indent=2))
+        print("fresh" if s.fresh() else "stale")
+        return 0
+    if not os.path.exists(os.path.join(RQ.ESP, "APPS", "PYRT.UNO")):
+        print("FAIL: no debug build at build/esp (run UNO_DEBUG=1 ./build.sh)")
+        return 1
+    if "--retake" in sys.argv or not s.fresh():
+        s.take()
+    else:
+        print("snapvm: %s is fresh" % s.root)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
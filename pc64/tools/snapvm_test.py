@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Gate for snapvm.py: a resumed snapshot must be a running guest that dials in.
+
+Every URC_SNAPSHOT gate leans on one promise - start QEMU from the saved
+machine and the guest re-dials the gate's listener within a few seconds. When
+that breaks (a restored guest left paused, a stale state file QEMU refuses),
+each of those gates fails the same vague way: "the guest never dialled in".
+This checks the promise by itself, twice over the same snapshot, so a resume
+that dirtied the frozen base images is caught too:
+
+  1. snapvm.ensure() has (or takes) a fresh snapshot for this lane's port
+  2. a resume dials in and sends HELLO
+  3. a second resume from the same files does it again
+
+Requires a debug build first:  UNO_DEBUG=1 ./build.sh
+Exit 0 iff every check passes.
+"""
+import os, sys, time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+import remote_qemu as RQ                                   # noqa: E402
+import snapvm                                              # noqa: E402
+from unoauto_remote import UnoAutoLink                     # noqa: E402
+
+DIAL_WAIT = 60.0           # s: a resumed guest re-dials on its ~5 s retry
+
+
+def main():
+    if not os.path.exists(os.path.join(RQ.ESP, "APPS", "PYRT.UNO")):
+        print("FAIL: no debug build at build/esp (run UNO_DEBUG=1 ./build.sh)")
+        return 1
+    ok = True
+
+    def check(cond, label, detail=""):
+        nonlocal ok
+        print(("PASS" if cond else "FAIL") + " " + label + (("  " + detail) if detail else ""))
+        ok = ok and bool(cond)
+
+    snap = snapvm.ensure()                   # may boot + listen itself: first
+    check(snap.fresh(), "snapshot is fresh", snap.root)
+    for n in (1, 2):
+        link = UnoAutoLink("127.0.0.1", RQ.PORT)
+        link.listen(discover=False)
+        t0 = time.time()
+        p = None
+        try:
+            p = snap.resume()
+            up = link.wait_connected(DIAL_WAIT) and link.wait_hello(30.0)
+            check(up, "resume %d: guest dialled in and sent HELLO" % n,
+                  "%.1fs" % (time.time() - t0))
+        except (RuntimeError, SystemExit) as e:
+            check(False, "resume %d: guest dialled in and sent HELLO" % n, str(e))
+        finally:
+            link.close()
+            if p is not None and p.poll() is None:
+                p.kill()
+                p.wait()
+    print("snapvm_test: %s" % ("PASS" if ok else "FAIL"))
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
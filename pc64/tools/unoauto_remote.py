@@ -24,49 +24,218 @@ Two ways to use it:
 QEMU: from a SLIRP guest the host is 10.0.2.2, so set remote=10.0.2.2:<port>.
 Plaintext, LAN-only by intent - do not expose the port to untrusted networks.
 """
-import socket, threading, itertools, sys
+import socket, threading, itertools, os, sys, time
+from collections import deque
 from contextlib import contextmanager
 
 
-def qoi_decode(data):
+# QOI op tables: what each DIFF / LUMA op byte adds to r, g, b. Looked up once
+# per op instead of re-deriving the fields from the byte every pixel.
+_QOI_DIFF = [(((op >> 4) & 3) - 2, ((op >> 2) & 3) - 2, (op & 3) - 2)
+             for op in range(64)]
+_QOI_LUMA = [((b2 >> 4) & 0x0F) - 8 for b2 in range(256)]
+_QOI_C = None                   # the C decoder, once _qoi_c() has looked
+
+
+def _qoi_c():
+    """The kernel's own decoder (pc64_qoi.c) built for the host and loaded with
+    ctypes, or False. Built once per source revision into the temp dir; needs a
+    C compiler and a pc64 checkout next to this file. UNO_QOI=py skips it."""
+    global _QOI_C
+    if _QOI_C is not None:
+        return _QOI_C
+    _QOI_C = False
+    import ctypes, hashlib, os, shutil, subprocess, tempfile
+    if os.environ.get("UNO_QOI") == "py":
+        return _QOI_C
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                       "pc64_qoi.c")
+    cc = shutil.which("cc") or shutil.which("gcc")
+    if not (cc and os.path.exists(src)):
+        return _QOI_C
+    with open(src, "rb") as f:
+        tag = hashlib.sha1(f.read()).hexdigest()[:12]
+    so = os.path.join(tempfile.gettempdir(), "unodos-qoi-%s.so" % tag)
+    try:
+        if not os.path.exists(so):
+            tmp = "%s.%d" % (so, os.getpid())
+            subprocess.run([cc, "-O2", "-shared", "-fPIC", "-o", tmp, src],
+                           check=True, capture_output=True)
+            os.replace(tmp, so)
+        lib = ctypes.CDLL(so)
+    except (OSError, subprocess.CalledProcessError):
+        return _QOI_C
+    fn = lib.uno_qoi_decode
+    fn.restype = ctypes.c_int
+    fn.argtypes = [ctypes.c_char_p, ctypes.c_long, ctypes.c_void_p,
+                   ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p]
+    _QOI_C = (ctypes, fn)
+    return _QOI_C
+
+
+def _qoi_decode_py(data, out, o, total):
+    """Decode the op stream into out[o:o + total]. Per pixel this is one table
+    lookup and one 4-byte slice store; a run (and a chain of runs) is ONE slice
+    store of the repeated pixel, and the index table holds ready-made pixels."""
+    import struct
+    pack = struct.Struct("4B").pack
+    diff, luma = _QOI_DIFF, _QOI_LUMA
+    zero = (b"\0\0\0\0", 0, 0, 0, 0)
+    idx = [zero] * 64
+    r, g, b, a = 0, 0, 0, 255
+    px = pack(r, g, b, a)
+    p, end = 14, len(data) - 8
+    stop = o + total
+    while o < stop:
+        if p >= end:                             # stream short: hold the pixel
+            out[o:stop] = px * ((stop - o) >> 2)
+            break
+        op = data[p]; p += 1
+        if op < 0x40:                            # INDEX
+            ent = idx[op]
+            px, r, g, b, a = ent
+            idx[(r * 3 + g * 5 + b * 7 + a * 11) & 63] = ent
+            out[o:o + 4] = px; o += 4
+            continue
+        if op < 0x80:                            # DIFF
+            dr, dg, db = diff[op & 0x3F]
+            r = (r + dr) & 0xFF; g = (g + dg) & 0xFF; b = (b + db) & 0xFF
+        elif op < 0xC0:                          # LUMA
+            b2 = data[p]; p += 1
+            vg = (op & 0x3F) - 32
+            r = (r + vg + luma[b2]) & 0xFF
+            g = (g + vg) & 0xFF
+            b = (b + vg + (b2 & 0x0F) - 8) & 0xFF
+        elif op < 0xFE:                          # RUN (length has a -1 bias)
+            n = (op & 0x3F) + 1
+            while p < end and 0xC0 <= data[p] < 0xFE:
+                n += (data[p] & 0x3F) + 1; p += 1
+            n = min(n * 4, stop - o)
+            out[o:o + n] = px * (n >> 2); o += n
+            idx[(r * 3 + g * 5 + b * 7 + a * 11) & 63] = (px, r, g, b, a)
+            continue
+        elif op == 0xFE:                         # RGB
+            r, g, b = data[p], data[p + 1], data[p + 2]; p += 3
+        else:                                    # RGBA
+            r, g, b, a = data[p], data[p + 1], data[p + 2], data[p + 3]; p += 4
+        px = pack(r, g, b, a)
+        idx[(r * 3 + g * 5 + b * 7 + a * 11) & 63] = (px, r, g, b, a)
+        out[o:o + 4] = px; o += 4
+
+
+def qoi_decode(data, out=None, offset=0):
     """Decode a QOI byte string to raw RGBA (4 bytes/pixel), matching the encoder
-    in pc64/unoauto_screen.c. Used by `UnoAutoLink.screen_grab`. Pure-Python."""
+    in pc64/unoauto_screen.c. Used by `UnoAutoLink.screen_grab` and the screen
+    stream / record readers.
+
+    Returns `bytes`, or - given a writable buffer `out` - decodes into
+    out[offset:offset + w*h*4] and returns `out`, so a stream reader can reuse
+    one buffer for every frame. The kernel's C decoder (pc64_qoi.c, built on
+    first use) does the work when this host can build it; otherwise it is the
+    pure-Python loop above. Both give the same pixels; a truncated stream goes
+    to the Python loop, which holds the last pixel to the end as it always has.
+    """
     import struct
     if data[:4] != b"qoif":
         raise ValueError("not a QOI stream")
     w, h, _ch, _cs = struct.unpack(">IIBB", data[4:14])
-    out = bytearray(w * h * 4)
-    idx = [(0, 0, 0, 0)] * 64
-    r, g, b, a = 0, 0, 0, 255
-    p, end, o = 14, len(data) - 8, 0
     total = w * h * 4
-    while o < total:
-        if p < end:
-            op = data[p]; p += 1
-            if op == 0xFE:                       # RGB
-                r, g, b = data[p], data[p + 1], data[p + 2]; p += 3
-            elif op == 0xFF:                     # RGBA
-                r, g, b, a = data[p], data[p + 1], data[p + 2], data[p + 3]; p += 4
-            elif (op & 0xC0) == 0x00:            # INDEX
-                r, g, b, a = idx[op & 0x3F]
-            elif (op & 0xC0) == 0x40:            # DIFF
-                r = (r + ((op >> 4) & 3) - 2) & 0xFF
-                g = (g + ((op >> 2) & 3) - 2) & 0xFF
-                b = (b + (op & 3) - 2) & 0xFF
-            elif (op & 0xC0) == 0x80:            # LUMA
-                b2 = data[p]; p += 1
-                vg = (op & 0x3F) - 32
-                r = (r + vg - 8 + ((b2 >> 4) & 0x0F)) & 0xFF
-                g = (g + vg) & 0xFF
-                b = (b + vg - 8 + (b2 & 0x0F)) & 0xFF
-            else:                                # RUN (length has a -1 bias)
-                for _ in range((op & 0x3F) + 1):
-                    out[o:o + 4] = bytes((r, g, b, a)); o += 4
-                idx[(r * 3 + g * 5 + b * 7 + a * 11) & 63] = (r, g, b, a)
+    ret = out
+    if out is None:
+        out = bytearray(total)
+    elif len(out) - offset < total:
+        raise ValueError("qoi_decode: buffer holds %d bytes, frame needs %d"
+                         % (len(out) - offset, total))
+    c = _qoi_c() if total >= 4096 else False
+    done = False
+    if c:
+        ctypes, fn = c
+        src = data if isinstance(data, bytes) else bytes(data)
+        try:
+            dst = (ctypes.c_char * total).from_buffer(out, offset)
+        except TypeError:                        # read-only or not a buffer
+            dst = None
+        if dst is not None:
+            # n stops at the 8-byte end marker, as the Python loop's does
+            done = fn(src, len(src) - 8, ctypes.addressof(dst), w, h, None,
+                      None) == 0
+            del dst                              # release the buffer export
+    if not done:
+        _qoi_decode_py(data, out, offset, total)
+    return bytes(out) if ret is None else ret
+
+
+class Compositor:
+    """The client end of the screen stream: ONE canvas, updated in place.
+
+    A keyframe decodes straight into the canvas and a delta decodes its strip
+    into one reused scratch buffer, then blits each tile row through
+    memoryviews - no per-row `bytes` temporaries. frame() hands out a read-only
+    view of the canvas, so following a stream costs nothing per frame beyond
+    the pixels that changed; a caller that keeps a frame past the next update
+    asks for a copy. The view tracks the canvas, and a size change allocates a
+    new canvas, so views already handed out stay valid (they show the old one).
+
+    Mirrors the C# client's canvas compositor, as screen_stream and
+    screen_record_frames always have."""
+
+    def __init__(self):
+        self.w = self.h = 0
+        self.canvas = None                  # bytearray, w*h RGBA
+        self._strip = bytearray()           # the last delta strip, decoded
+
+    def _size(self, w, h):
+        if (w, h) != (self.w, self.h) or self.canvas is None:
+            self.w, self.h = w, h
+            self.canvas = bytearray(w * h * 4)
+
+    def seed(self, w, h, rgba):
+        """Start from a frame the caller already has (a screen_grab)."""
+        self._size(w, h)
+        self.canvas[:] = rgba
+
+    def keyframe(self, qoi):
+        import struct
+        w, h = struct.unpack(">II", bytes(qoi[4:12]))
+        self._size(w, h)
+        qoi_decode(qoi, self.canvas)
+
+    def delta(self, qoi, idx, cols, tw, th, w=None, h=None):
+        """Blit a `tw` x (len(idx)*`th`) strip of changed tiles, tile i of the
+        strip to grid cell idx[i] (`cols` to a row), clipped at the edges."""
+        if self.canvas is None or (w is not None and (w, h) != (self.w, self.h)):
+            raise RuntimeError("delta with no matching canvas (seed with a full grab first)")
+        if not idx:
+            return
+        need = tw * th * len(idx) * 4
+        if len(self._strip) < need:
+            self._strip = bytearray(need)
+        qoi_decode(qoi, self._strip)
+        src, dst = memoryview(self._strip), memoryview(self.canvas)
+        W, H, pitch, span = self.w, self.h, self.w * 4, tw * 4
+        for i, t in enumerate(idx):
+            dx, dy = (t % cols) * tw, (t // cols) * th
+            n = min(tw, W - dx) * 4
+            if n <= 0:
                 continue
-            idx[(r * 3 + g * 5 + b * 7 + a * 11) & 63] = (r, g, b, a)
-        out[o:o + 4] = bytes((r, g, b, a)); o += 4
-    return bytes(out)
+            so, do = i * th * span, (dy * W + dx) * 4
+            for _ in range(min(th, H - dy)):
+                dst[do:do + n] = src[so:so + n]
+                so += span
+                do += pitch
+
+    def apply(self, u):
+        """Apply one screen_grab_delta() update."""
+        if u["keyframe"]:
+            self.keyframe(u["qoi"])
+        else:
+            self.delta(u["qoi"], u["idx"], u["cols"], u["tw"], u["th"],
+                       u["w"], u["h"])
+
+    def frame(self, copy=False):
+        """(w, h, rgba): a read-only view of the canvas, or a bytes copy."""
+        c = self.canvas
+        return self.w, self.h, bytes(c) if copy else memoryview(c).toreadonly()
 
 
 class _SerialStream:
@@ -286,21 +455,84 @@ class UnoAutoLink:
         return False
 
     def _command_once(self, verb, *args, timeout=5.0):
+        return self._collect(self._issue(verb, *args), timeout)
+
+    def _issue(self, verb, *args):
+        """Send one CMD without waiting for it; _collect() waits. Everything in
+        between may issue more - the reader thread matches RSPs by id."""
         rid = str(next(self._ids))
-        rec = {"lines": [], "ev": threading.Event(), "err": False}
+        rec = {"lines": [], "ev": threading.Event(), "err": False,
+               "verb": verb}
         with self._lock:
             self._pending[rid] = rec
         payload = " ".join([verb] + [str(a) for a in args])
         self._raw("CMD %s %s" % (rid, payload))
+        return rid, rec
+
+    def _collect(self, sent, timeout=5.0):
+        rid, rec = sent
         ok = rec["ev"].wait(timeout)
         with self._lock:
             self._pending.pop(rid, None)
         if not ok:
-            raise TimeoutError("no response to %r" % verb)
+            raise TimeoutError("no response to %r" % rec["verb"])
         if rec["err"]:
             raise RuntimeError("\n".join(rec["lines"]) or "error")
         return rec["lines"]
 
+    # ---- windowed transfers -------------------------------------------------
+    # A push or a screen pull is thousands of slices, and one command at a time
+    # pays a full round trip - plus the device's wait for its next poll - per
+    # 2.8 KB. With a window the next slices are already in the device's receive
+    # queue when it answers one, so the link stays busy. Slices are answered in
+    # order (the device runs one connection's commands in arrival order), and
+    # a slice that timed out or came back wrong is sent again on its own.
+    WINDOW = int(os.environ.get("URC_WINDOW", "8"))          # puts in flight
+    READ_WINDOW = int(os.environ.get("URC_READ_WINDOW", "3"))
+    last_transfer = None     # {what, bytes, seconds, slices, retries, window, kib_s}
+
+    def _pipeline(self, keys, cmd, check, window, timeout, retries=2,
+                  done=None):
+        """Run `cmd(key)` -> (verb, args...) for every key with up to `window`
+        commands in flight, and return ({key: check(key, lines)}, retries).
+
+        A TimeoutError, or a ValueError from `check` (a short or garbled
+        reply), re-sends THAT key, up to `retries` times each; an `err` reply is
+        a real answer and raises at once. `done(key, result)` runs as each key
+        completes: in key order until one is re-sent, which then completes
+        after the keys that were in flight behind it."""
+        todo, fly, out, tries = deque(keys), deque(), {}, {}
+        window = max(1, int(window))
+        try:
+            while todo or fly:
+                while todo and len(fly) < window:
+                    k = todo.popleft()
+                    fly.append((k, self._issue(*cmd(k))))
+                k, sent = fly.popleft()
+                try:
+                    out[k] = check(k, self._collect(sent, timeout))
+                except (TimeoutError, ValueError):
+                    tries[k] = tries.get(k, 0) + 1
+                    if tries[k] > retries:
+                        raise
+                    todo.appendleft(k)
+                    continue
+                if done:
+                    done(k, out[k])
+        finally:
+            with self._lock:                  # abandoned slices: drop their
+                for _, (rid, _) in fly:       # late replies on the floor
+                    self._pending.pop(rid, None)
+        return out, sum(tries.values())
+
+    def _transferred(self, what, nbytes, t0, slices, retries, window):
+        dt = max(time.time() - t0, 1e-6)
+        self.last_transfer = {"what": what, "bytes": nbytes,
+                              "seconds": round(dt, 3), "slices": slices,
+                              "retries": retries, "window": window,
+                              "kib_s": round(nbytes / 1024.0 / dt, 1)}
+        return self.last_transfer
+
     # convenience wrappers over the command language
     def probe(self, **k):
         """Return the PROBE snapshot as dicts: kind/state/v1/v2/name.
@@ -412,25 +644,53 @@ class UnoAutoLink:
                         "name": name, "driver": driver, "raw": l})
         return out
 
-    def push_file(self, vol, path, local_path, chunk=2700, timeout=10.0, progress=None):
+    def push_file(self, vol, path, local_path, chunk=2700, timeout=10.0, progress=None,
+                  window=None):
         """A/B OS update: stream local_path to <vol>:<path> in `put` chunks, then
         finalize+verify. Returns True iff the device reports `verified`. Raises on
         any per-chunk error (the target is only written at finalize, so a failed
-        push never corrupts it)."""
+        push never corrupts it).
+
+        Up to `window` puts (default WINDOW) are in flight at once; a put reply is
+        a few bytes, so that many never crowds the device's reply buffer. The
+        chunk at offset 0 goes first and alone: it (re)starts the device's
+        staging session, so it must land before any other chunk and is never
+        re-sent after one. A timed-out chunk is simply re-sent - a put writes its
+        bytes at its offset, so a second copy is harmless. window=1 is the old
+        one-at-a-time push. The throughput is left in `last_transfer`."""
         import base64
         with open(local_path, "rb") as f:
             data = f.read()
         total = len(data)
-        off = 0
-        while off < total:
-            piece = data[off:off + chunk]
-            b64 = base64.b64encode(piece).decode("ascii")
-            r = self.command("put", vol, path, format(off, "x"), b64, timeout=timeout)
-            if not r or int(r[0]) != len(piece):
-                raise RuntimeError("put failed at offset 0x%x: %r" % (off, r))
-            off += len(piece)
+        window = window or self.WINDOW
+        t0 = time.time()
+
+        def cmd(off):
+            b64 = base64.b64encode(data[off:off + chunk]).decode("ascii")
+            return ("put", vol, path, format(off, "x"), b64)
+
+        def check(off, r):
+            want = len(data[off:off + chunk])
+            if not r or not r[0].isdigit() or int(r[0]) != want:
+                raise ValueError("put failed at offset 0x%x: %r" % (off, r))
+            return want
+
+        sent = [0]
+
+        def done(off, n):
+            sent[0] += n
             if progress:
-                progress(off, total)
+                progress(sent[0], total)
+
+        offs = list(range(0, total, chunk))
+        retried = 0
+        for keys, win in ((offs[:1], 1), (offs[1:], window)):
+            try:
+                retried += self._pipeline(keys, cmd, check, win, timeout,
+                                          done=done)[1]
+            except ValueError as e:
+                raise RuntimeError(str(e))
+        self._transferred("push", total, t0, len(offs), retried, window)
         # Finalize does one on-device uno_fs_write of the whole staged buffer; a
         # multi-MB write over firmware BlockIO can take a while, so allow well
         # past the per-chunk timeout.
@@ -541,20 +801,60 @@ class UnoAutoLink:
         return (int(p[0]), int(p[1])) if len(p) >= 2 else (0, 0)
 
     SCREEN_READ_LEN = 2880               # matches SCREEN_READ_MAX on the device
-
-    def _screen_pull(self, n, to=15.0):
-        """Pull `n` staged bytes with bounded `screen read <off> <len>` slices
-        (a whole frame is far too big for one URC response)."""
+    # Raw bytes of `read` replies allowed in flight. The device appends a
+    # whole reply to its 8 KB send buffer before draining it (and drops what
+    # does not fit), so pipelined reads share that buffer: 4320 bytes are 5.8
+    # KB of base64, which leaves room for the LOG lines that interleave.
+    READ_INFLIGHT = 4320
+
+    def _read_slices(self, sub, n, to, window, what, short_ok=False):
+        """Pull `n` bytes with windowed `screen <sub...> read <off> <len>`
+        slices and reassemble them in order. The slice shrinks with the window
+        (in 360-byte base64 lines) so the window's replies all fit the device's
+        send buffer; window=1 is the old full-size, one-at-a-time pull. With
+        `short_ok` an empty slice ends the data (a ring shorter than asked);
+        otherwise it is an error."""
         import base64
+        window = max(1, int(window or self.READ_WINDOW))
+        step = self.SCREEN_READ_LEN if window == 1 else max(
+            360, min(self.SCREEN_READ_LEN, self.READ_INFLIGHT // window // 360 * 360))
+        t0 = time.time()
+
+        def cmd(off):
+            return ("screen",) + sub + ("read", format(off, "x"), min(step, n - off))
+
+        def check(off, rd):
+            try:
+                part = base64.b64decode("".join(rd), validate=True)
+            except ValueError:
+                raise ValueError("screen read garbled at off %d" % off)
+            if len(part) > min(step, n - off) or (
+                    part and len(part) < min(step, n - off) and not short_ok):
+                raise ValueError("screen read short at off %d" % off)
+            return part
+
+        offs = list(range(0, n, step))
+        try:
+            got, retried = self._pipeline(offs, cmd, check, window, to)
+        except ValueError as e:
+            raise RuntimeError(str(e))
         buf = bytearray()
-        while len(buf) < n:
-            rd = self.command("screen", "read", format(len(buf), "x"),
-                              self.SCREEN_READ_LEN, timeout=to)
-            part = base64.b64decode("".join(rd))
+        for off in offs:
+            part = got[off]
             if not part:
-                raise RuntimeError("screen read returned nothing at off %d" % len(buf))
+                if short_ok:
+                    break
+                raise RuntimeError("screen read returned nothing at off %d" % off)
             buf += part
-        return bytes(buf[:n])
+            if len(part) < min(step, n - off):
+                break
+        self._transferred(what, len(buf), t0, len(offs), retried, window)
+        return bytes(buf)
+
+    def _screen_pull(self, n, to=15.0, window=None):
+        """Pull `n` staged bytes with bounded `screen read <off> <len>` slices
+        (a whole frame is far too big for one URC response)."""
+        return self._read_slices((), n, to, window, "screen")
 
     def screen_grab(self, scale=1, **k):
         """`screen grab [scale]` stages a full frame on the device and returns its
@@ -599,31 +899,17 @@ class UnoAutoLink:
             return u
         raise RuntimeError("unknown screen reply: %r" % r[0])
 
-    def screen_stream(self, state, scale=1, **k):
-        """Apply one `screen grab delta` update to `state` (a dict; pass {} to
-        start) and return (w, h, rgba) of the reconstructed full frame. Mirrors
-        the C# client's canvas compositor: a keyframe replaces the canvas, a delta
-        blits only its changed tiles."""
+    def screen_stream(self, state, scale=1, copy=False, **k):
+        """Apply one `screen grab delta` update to `state` - a Compositor, or a
+        dict (pass {} to start; it keeps its Compositor under "comp") - and
+        return (w, h, rgba) of the reconstructed full frame. rgba is a read-only
+        view of the canvas that the NEXT update overwrites; copy=True returns
+        bytes instead."""
         u = self.screen_grab_delta(scale, **k)
-        if u["keyframe"]:
-            state["w"], state["h"] = u["w"], u["h"]
-            state["rgba"] = bytearray(qoi_decode(u["qoi"]))
-            return u["w"], u["h"], bytes(state["rgba"])
-        if not state.get("rgba") or state.get("w") != u["w"] or state.get("h") != u["h"]:
-            raise RuntimeError("delta with no matching canvas (seed with a full grab first)")
-        if u["nch"] > 0:
-            strip = qoi_decode(u["qoi"])          # tw x (nch*th) RGBA
-            tw, th, cols = u["tw"], u["th"], u["cols"]
-            w, h, rgba = state["w"], state["h"], state["rgba"]
-            for i, t in enumerate(u["idx"]):
-                col, row = t % cols, t // cols
-                dx, dy = col * tw, row * th
-                vw, vh = min(tw, w - dx), min(th, h - dy)
-                for yy in range(max(0, vh)):
-                    so = ((i * th + yy) * tw) * 4
-                    do = ((dy + yy) * w + dx) * 4
-                    rgba[do:do + vw * 4] = strip[so:so + vw * 4]
-        return state["w"], state["h"], bytes(state["rgba"])
+        comp = state if isinstance(state, Compositor) else state.setdefault(
+            "comp", Compositor())
+        comp.apply(u)
+        return comp.frame(copy)
 
     # ---- server-side session capture (the device records on its own tick) --
     @staticmethod
@@ -652,28 +938,22 @@ class UnoAutoLink:
         """`screen record status` -> live status dict."""
         return self._rec_stat(self.command("screen", "record", "status", **k))
 
-    def screen_record_read_all(self, nbytes, **k):
-        """Pull the whole recorded ring (`nbytes` from the stop/status stat)."""
-        import base64
-        to = k.pop("timeout", 20.0)
-        buf = bytearray()
-        while len(buf) < nbytes:
-            rd = self.command("screen", "record", "read", format(len(buf), "x"),
-                              self.SCREEN_READ_LEN, timeout=to)
-            part = base64.b64decode("".join(rd))
-            if not part:
-                break
-            buf += part
-        return bytes(buf[:nbytes])
-
-    def screen_record_frames(self, stat, **k):
-        """Pull the ring described by `stat` and reconstruct every recorded frame
-        to raw RGBA. Returns a list of (w, h, rgba). Mirrors the client
-        compositor: a keyframe replaces the canvas, a delta blits its tiles."""
-        data = self.screen_record_read_all(stat.get("bytes", 0), **k)
+    def screen_record_read_all(self, nbytes, window=None, **k):
+        """Pull the whole recorded ring (`nbytes` from the stop/status stat). A
+        ring that turns out shorter ends the pull early, as it always has."""
+        return self._read_slices(("record",), nbytes, k.pop("timeout", 20.0),
+                                 window, "record", short_ok=True)
+
+    def screen_record_iter(self, stat, copy=False, **k):
+        """Pull the ring described by `stat` and yield every recorded frame as
+        (w, h, rgba), in order, through one Compositor: a keyframe replaces the
+        canvas, a delta blits its tiles. rgba is a read-only view that the next
+        frame overwrites (copy=True yields bytes), so writing a long recording
+        to disk or a pipe holds one frame, not all of them."""
+        data = memoryview(self.screen_record_read_all(stat.get("bytes", 0), **k))
         ew, eh, cols = stat["ew"], stat["eh"], stat["cols"]
         tw, th = stat["tw"], stat["th"]
-        frames, canvas, p = [], None, 0
+        comp, p, seeded = Compositor(), 0, False
         while p + 12 <= len(data):
             typ = data[p]
             nch = data[p + 2] | (data[p + 3] << 8)
@@ -683,24 +963,22 @@ class UnoAutoLink:
             pl = data[p:p + payload]
             p += payload
             if typ == 0:                                     # keyframe
-                canvas = bytearray(qoi_decode(pl))
+                comp.keyframe(pl)
+                seeded = True
             else:                                            # delta
-                if canvas is None:
+                if not seeded:
                     raise RuntimeError("delta before keyframe in recording")
                 if nch > 0 and strip > 0:
-                    st = qoi_decode(pl[:strip])
                     man = pl[strip:]
-                    idx = [man[i * 2] | (man[i * 2 + 1] << 8) for i in range(nch)]
-                    for i, t in enumerate(idx):
-                        col, row = t % cols, t // cols
-                        dx, dy = col * tw, row * th
-                        vw, vh = min(tw, ew - dx), min(th, eh - dy)
-                        for yy in range(max(0, vh)):
-                            so = ((i * th + yy) * tw) * 4
-                            do = ((dy + yy) * ew + dx) * 4
-                            canvas[do:do + vw * 4] = st[so:so + vw * 4]
-            frames.append((ew, eh, bytes(canvas)))
-        return frames
+                    comp.delta(pl[:strip], [man[i * 2] | (man[i * 2 + 1] << 8)
+                                            for i in range(nch)], cols, tw, th)
+            yield (ew, eh) + comp.frame(copy)[2:]
+
+    def screen_record_frames(self, stat, **k):
+        """Every recorded frame as a list of (w, h, rgba bytes) - for checks
+        that look back and forth across a short recording. A long one should
+        go through screen_record_iter instead."""
+        return list(self.screen_record_iter(stat, copy=True, **k))
 
     # ---- receiving --------------------------------------------------------
     def _accept_loop(self):
@@ -803,6 +1081,8 @@ def _cli(argv):
     ap.add_argument("--push", nargs=3, metavar=("VOL", "PATH", "LOCALFILE"),
                     help="wait for pc64 to dial in, push LOCALFILE to <vol>:<path>, then exit")
     ap.add_argument("--chunk", type=int, default=2700, help="push chunk size (raw bytes; fits the 4 KB device line buffer)")
+    ap.add_argument("--window", type=int, default=0,
+                    help="push puts in flight (default %d; 1 = one at a time)" % UnoAutoLink.WINDOW)
     ap.add_argument("--bootnext", type=int, metavar="N",
                     help="after --push, set BootNext=N (boot Boot#### N next reset)")
     ap.add_argument("--reboot", action="store_true", help="after --push, reboot the target")
@@ -878,10 +1158,14 @@ def _cli(argv):
                 last[0] = pct
                 sys.stdout.write("\r  %d%% (%d/%d)" % (pct, done, tot)); sys.stdout.flush()
         try:
-            ok = link.push_file(int(vol), path, localfile, chunk=a.chunk, progress=prog)
+            ok = link.push_file(int(vol), path, localfile, chunk=a.chunk, progress=prog,
+                                window=a.window or None)
         except Exception as e:  # noqa: BLE001
             print("\nFAIL: " + str(e)); link.close(); return 1
-        print("\n%s" % ("verified" if ok else "FAIL: not verified"))
+        t = link.last_transfer or {}
+        print("\n%s  (%.1f KiB/s, window %s, %s retried)" % (
+            "verified" if ok else "FAIL: not verified", t.get("kib_s", 0),
+            t.get("window"), t.get("retries", 0)))
         if ok and a.bootnext is not None:
             try:
                 link.bootnext(a.bootnext); print("BootNext=%d set" % a.bootnext)
@@ -222,7 +222,10 @@ class Box:
                 _, vol, path, local = parts
                 ok = link.push_file(int(vol), path, local, timeout=90.0,
                                     progress=lambda o, t: self.log("   push %d/%d" % (o, t)))
-                self.log("   push %s" % ("VERIFIED" if ok else "FAILED"))
+                t = link.last_transfer or {}
+                self.log("   push %s  (%.1f KiB/s, window %s, %s retried)"
+                         % ("VERIFIED" if ok else "FAILED", t.get("kib_s", 0),
+                            t.get("window"), t.get("retries", 0)))
                 return
             verb, _, rest = cmd.partition(" ")
             args = rest.split(" ") if rest else []
@@ -20,6 +20,11 @@ pc64 should import it rather than write a fourth tablet harness.
         ui.click(54, 66)                # OS framebuffer coords, not host
         ui.shot("menu_open")            # -> shots/<tag>.png
 
+BOOT ONCE FOR A WHOLE SUITE: `UrcUi(snapshot="1")`, or URC_SNAPSHOT=1 in the
+environment, resumes the machine tools/snapvm.py saved at the URC dial-in
+instead of cold-booting OVMF. Each gate runs on its own copy-on-write overlay,
+so what it writes to disk never reaches the next one.
+
 COORDINATES ARE THE OS FRAMEBUFFER'S (typically 640x400), not the host
 window's.  `ui.size()` reports them.
 
@@ -39,7 +44,7 @@ sys.path.insert(0, os.path.dirname(HERE))
 import remote_qemu as RQ
 from unoauto_remote import UnoAutoLink
 
-SHOTS = os.path.join(os.path.dirname(HERE), "shots")
+SHOTS = os.environ.get("UNO_SHOTS") or os.path.join(os.path.dirname(HERE), "shots")
 
 
 def _ppm(path, w, h, rgba):
@@ -52,11 +57,12 @@ def _ppm(path, w, h, rgba):
 
 
 class UrcUi(object):
-    def __init__(self, boot_wait=None, port=None):
+    def __init__(self, boot_wait=None, port=None, snapshot=None):
         self.qemu = None
         self.link = None
         self.boot_wait = boot_wait
         self.port = port or RQ.PORT
+        self.snapshot = snapshot
         self._w = self._h = 0
 
     # ---- lifecycle ---------------------------------------------------------
@@ -72,10 +78,12 @@ class UrcUi(object):
         esp = RQ.ESP
         if not os.path.isdir(esp):
             raise SystemExit("no build/esp - run ./build.sh first")
-        RQ.build_disk()
+        snap = RQ.snapshot(self.snapshot)     # taken (if stale) before we listen
+        if snap is None:
+            RQ.build_disk()
         self.link = UnoAutoLink(port=self.port)
         self.link.listen()
-        self.qemu = RQ.boot_qemu()
+        self.qemu = RQ.boot_qemu(snap)
         if not self.link.wait_connected(self.boot_wait or 180.0):
             raise SystemExit("the guest never dialled in - is this the DEBUG build?")
         self.link.wait_hello(30.0)
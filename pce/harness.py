@@ -40,22 +40,11 @@ The AUTOTEST ROMs drive the pad through the same input path; nothing is faked.
 
 Usage: python pce/harness.py <rom.pce> <out.png> [instr_millions]
 """
-import sys, struct, zlib
+import os, sys
 from py65.devices.mpu65c02 import MPU
 
-
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y * w * 3:(y + 1) * w * 3]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
 
 
 class HuMem:
@@ -148,7 +137,9 @@ def vce_rgb(v):                       # 9-bit VCE colour, GGG RRR BBB (real HuC6
 
 def render(mem, out_path):
     W, H = 256, 224
-    rgb = bytearray(W * H * 3)
+    # per scanline, each cell's four CG bitplane bytes (the low/high bytes of
+    # its two pattern words) plus its palette number as four constant planes
+    planes = [bytearray(32 * H) for _ in range(8)]
     for ty in range(28):
         for tx in range(32):
             entry = mem.vram[ty * 32 + tx]
@@ -158,19 +149,14 @@ def render(mem, out_path):
             for r in range(8):
                 w0 = mem.vram[(base + r) & 0x7FFF]
                 w1 = mem.vram[(base + 8 + r) & 0x7FFF]
-                py = ty * 8 + r
-                for x in range(8):
-                    bit = 7 - x
-                    color = (((w0 >> bit) & 1) | (((w0 >> (8 + bit)) & 1) << 1) |
-                             (((w1 >> bit) & 1) << 2) | (((w1 >> (8 + bit)) & 1) << 3))
-                    idx = 0 if color == 0 else pal * 16 + color
-                    rr, gg, bb = vce_rgb(mem.vce[idx])
-                    o = ((py) * W + tx * 8 + x) * 3
-                    rgb[o] = rr
-                    rgb[o + 1] = gg
-                    rgb[o + 2] = bb
-    write_png(out_path, W, H, rgb)
-
+                o = (ty * 8 + r) * 32 + tx
+                planes[0][o], planes[1][o] = w0 & 0xFF, (w0 >> 8) & 0xFF
+                planes[2][o], planes[3][o] = w1 & 0xFF, (w1 >> 8) & 0xFF
+                for k in range(4):
+                    planes[4 + k][o] = 0xFF if (pal >> k) & 1 else 0
+    # colour 0 of every palette is the shared backdrop, VCE entry 0
+    pal = [vce_rgb(mem.vce[i if i & 0x0F else 0]) for i in range(256)]
+    fbconv.write_png(out_path, W, H, fbconv.palette(fbconv.planar(planes), pal))
 
 def main():
     rom_path, out_path = sys.argv[1], sys.argv[2]
@@ -16,10 +16,13 @@ harness just:
 
 Usage: python pinephone/harness.py <unodos.bin> <out.png> [instr_millions]
 """
-import sys, struct, zlib, math
+import os, sys, struct, math
 from unicorn import Uc, UC_ARCH_ARM64, UC_MODE_ARM, UC_PROT_ALL, UC_HOOK_MEM_UNMAPPED
 from unicorn.arm64_const import UC_ARM64_REG_SP, UC_ARM64_REG_PC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+
 W, H = 480, 640
 LOAD     = 0x40080000
 DRAM     = 0x40000000
@@ -161,21 +164,6 @@ def sink_write(uc, offset, size, value, ud):
     pass
 
 
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    row = w * 3
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y*row:(y+1)*row]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
-
-
 def main():
     keys, wav, argv = parse_keys(sys.argv)
     rom_path, out_path = argv[1], argv[2]
@@ -203,7 +191,6 @@ def main():
     uc.mmio_map(0x01F03000, 0x1000, rsb_read,  None, sink_write, None)  # RSB + R_PWM
     uc.mem_write(LOAD, data)
     uc.reg_write(UC_ARM64_REG_SP, 0x40200000)
-    import os
     FS_PA, FS_SIZE = 0x40302000, 0x1000
     if storage and os.path.exists(storage):
         with open(storage,"rb") as f: uc.mem_write(FS_PA, f.read()[:FS_SIZE])
@@ -227,13 +214,7 @@ def main():
         ran += CHUNK
 
     fb = uc.mem_read(PINE_FB, W * H * 4)
-    rgb = bytearray(W * H * 3)
-    for i in range(W * H):
-        w = fb[i*4] | (fb[i*4+1] << 8) | (fb[i*4+2] << 16)
-        rgb[i*3]   = (w >> 16) & 0xFF
-        rgb[i*3+1] = (w >> 8) & 0xFF
-        rgb[i*3+2] = w & 0xFF
-    write_png(out_path, W, H, rgb)
+    fbconv.write_png(out_path, W, H, fbconv.xrgb8888(fb))
     print("wrote %s (%dx%d) after ~%dM instrs" % (out_path, W, H, ran // 1_000_000))
     if storage:
         with open(storage,"wb") as f: f.write(bytes(uc.mem_read(FS_PA, FS_SIZE)))
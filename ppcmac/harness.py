@@ -17,10 +17,13 @@ like every other fresh port, this verifies headlessly on a from-scratch core:
 
 Usage: python ppcmac/harness.py <unodos.bin> <out.png> [instr_millions]
 """
-import sys, struct, zlib, math
+import os, sys, struct, math
 from unicorn import Uc, UC_ARCH_PPC, UC_MODE_PPC32, UC_MODE_BIG_ENDIAN, UC_PROT_ALL, UC_HOOK_CODE, UC_HOOK_MEM_UNMAPPED
 from unicorn.ppc_const import UC_PPC_REG_3, UC_PPC_REG_5, UC_PPC_REG_PC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+
 W, H = 640, 480
 PITCH = W * 4
 LOAD     = 0x00100000
@@ -106,21 +109,6 @@ def parse_keys(argv):
     return seq, wav, rest
 
 
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    row = w * 3
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y*row:(y+1)*row]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
-
-
 def be32(uc, addr):
     return struct.unpack(">I", uc.mem_read(addr, 4))[0]
 
@@ -188,7 +176,6 @@ def main():
     uc.mem_write(LOAD, data)
     uc.mem_write(OF_ENTRY, struct.pack(">I", 0x4E800020))   # blr
     uc.reg_write(UC_PPC_REG_5, OF_ENTRY)                    # OF client entry in r5
-    import os
     FS_PA, FS_SIZE = 0x00402000, 0x1000
     if storage and os.path.exists(storage):
         with open(storage,"rb") as f: uc.mem_write(FS_PA, f.read()[:FS_SIZE])
@@ -215,12 +202,7 @@ def main():
         ran += CHUNK
 
     fb = uc.mem_read(FB_PA, W * H * 4)
-    rgb = bytearray(W * H * 3)
-    for i in range(W * H):
-        rgb[i*3]   = fb[i*4+1]   # R
-        rgb[i*3+1] = fb[i*4+2]   # G
-        rgb[i*3+2] = fb[i*4+3]   # B
-    write_png(out_path, W, H, rgb)
+    fbconv.write_png(out_path, W, H, fbconv.xrgb8888(fb, big_endian=True))
     print("wrote %s (%dx%d) after ~%dM instrs" % (out_path, W, H, ran // 1_000_000))
     if storage:
         with open(storage,"wb") as f: f.write(bytes(uc.mem_read(FS_PA, FS_SIZE)))
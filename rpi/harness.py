@@ -13,16 +13,22 @@ the kernel actually touches, and renders the resulting framebuffer to a PNG.
   * BCM system timer (0x3F003004): hand back a monotonically advancing 1MHz counter
     so wait_vblank paces one frame per loop (real hardware genuinely waits ~16 ms).
 
-PWM/clock writes (the Music tone path) land in a harmless RAM sink. The AUTOTEST
+Clock writes land in a harmless RAM sink, and so do PWM writes (the Music tone
+path) unless --audio is given. Then the PWM page is MMIO whose writes are only
+logged, and turned into audio events between run chunks, so --audio no longer
+costs a memory hook on every store. The AUTOTEST
 images drive the pad themselves; the harness only services MMIO and runs the budget.
 
 Usage: python rpi/harness.py <kernel8.img> <out.png> [instr_millions]
 """
-import sys, struct, zlib, math
+import os, sys, struct, math
 from unicorn import (Uc, UC_ARCH_ARM64, UC_MODE_ARM, UC_PROT_ALL,
-                     UC_HOOK_MEM_UNMAPPED, UC_HOOK_MEM_WRITE)
+                     UC_HOOK_MEM_UNMAPPED)
 from unicorn.arm64_const import UC_ARM64_REG_SP, UC_ARM64_REG_PC
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+
 W, H = 640, 480
 PITCH = W * 4
 LOAD     = 0x80000
@@ -33,8 +39,11 @@ FB_SIZE  = (W * H * 4 + 0xFFFF) & ~0xFFFF
 PERI_SINK_A_BASE = 0x3F100000  # clock + GPIO writes land here (ignored)
 PERI_SINK_A_SIZE = 0x00101000  # [0x3F100000, 0x3F201000)
 UART_PAGE  = 0x3F201000        # PL011 (input), emulated
-PERI_SINK_B_BASE = 0x3F202000  # PWM writes land here (ignored)
-PERI_SINK_B_SIZE = 0x000FE000  # [0x3F202000, 0x3F300000)
+PERI_SINK_B_BASE = 0x3F202000  # everything from the UART up to PWM (ignored)
+PERI_SINK_B_SIZE = 0x0000A000  # [0x3F202000, 0x3F20C000)
+PWM_PAGE   = 0x3F20C000        # PWM: a sink too, unless --audio logs its writes
+PERI_SINK_C_BASE = 0x3F20D000  # the rest of the low peripherals (ignored)
+PERI_SINK_C_SIZE = 0x000F3000  # [0x3F20D000, 0x3F300000)
 TIMER_PAGE = 0x3F003000
 MBOX_PAGE  = 0x3F00B000
 OFF_UART_DR = 0x3F201000 - UART_PAGE   # 0x00
@@ -82,6 +91,7 @@ USB_USAGE = {"w":0x1A, "a":0x04, "s":0x16, "d":0x07,
 
 state = {"pending_read": 0, "clock": 0, "keys": b"", "kidx": 0, "kcool": 0,
          "clo_reads": 0, "audio": [],     # audio: list of (frame, "freq"|"off", value)
+         "pwm": {}, "pwm_log": [],        # PWM registers; (clo_reads, off, value) writes
          "usbkeys": [], "uki": 0, "ukcool": 0, "setup": None, "usbreg": {}}
 
 
@@ -98,14 +108,27 @@ def note_name(freq):
 MAX_AUDIO_EVENTS = 48                  # ~one pass of the 30-note tune (then it loops)
 
 
-def audio_write_hook(uc, access, address, size, value, ud):
-    if len(state["audio"]) >= MAX_AUDIO_EVENTS:
-        return
-    frame = state["clo_reads"] // 2
-    if address == PWM_RNG1 and value > 0:
-        state["audio"].append((frame, "freq", PWM_CLK_HZ / value))
-    elif address == PWM_CTL and (value & 0x1) == 0:
-        state["audio"].append((frame, "off", 0))
+def pwm_read(uc, off, size, ud):
+    return state["pwm"].get(off, 0)
+
+
+def pwm_write(uc, off, size, value, ud):
+    # Only record the write here; drain_pwm() turns the log into audio events
+    # between emu_start chunks, off the emulator's hot path.
+    state["pwm"][off] = value
+    state["pwm_log"].append((state["clo_reads"], off, value))
+
+
+def drain_pwm():
+    log, state["pwm_log"] = state["pwm_log"], []
+    for clo, off, value in log:
+        if len(state["audio"]) >= MAX_AUDIO_EVENTS:
+            return
+        frame = clo // 2
+        if off == PWM_RNG1 - PWM_PAGE and value > 0:
+            state["audio"].append((frame, "freq", PWM_CLK_HZ / value))
+        elif off == PWM_CTL - PWM_PAGE and (value & 0x1) == 0:
+            state["audio"].append((frame, "off", 0))
 
 
 def write_wav(path, samples):
@@ -252,21 +275,6 @@ def usb_write(uc, offset, size, value, ud):
         usb_service_channel(uc)
 
 
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    row = w * 3
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y*row:(y+1)*row]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
-
-
 def service_mailbox(uc, value):
     """Parse the property message at (value & ~0xF) and fill FB base + pitch."""
     bufaddr = value & ~0xF
@@ -369,6 +377,11 @@ def main():
     uc.mem_map(FB_PA, FB_SIZE, UC_PROT_ALL)
     uc.mem_map(PERI_SINK_A_BASE, PERI_SINK_A_SIZE, UC_PROT_ALL)
     uc.mem_map(PERI_SINK_B_BASE, PERI_SINK_B_SIZE, UC_PROT_ALL)
+    uc.mem_map(PERI_SINK_C_BASE, PERI_SINK_C_SIZE, UC_PROT_ALL)
+    if wav:                              # only --audio needs to see the PWM writes
+        uc.mmio_map(PWM_PAGE, 0x1000, pwm_read, None, pwm_write, None)
+    else:
+        uc.mem_map(PWM_PAGE, 0x1000, UC_PROT_ALL)
     uc.mmio_map(UART_PAGE, 0x1000, uart_read, None, uart_write, None)
     uc.mmio_map(TIMER_PAGE, 0x1000, timer_read, None, timer_write, None)
     uc.mmio_map(MBOX_PAGE, 0x1000, mbox_read, None, mbox_write, None)
@@ -377,7 +390,6 @@ def main():
     uc.reg_write(UC_ARM64_REG_SP, 0x00200000)
 
     # preload the persisted USV1 disk so fs_init keeps it ("power on" with an SD card)
-    import os
     if storage and os.path.exists(storage):
         with open(storage, "rb") as f:
             uc.mem_write(FS_PA, f.read()[:FS_SIZE])
@@ -387,8 +399,6 @@ def main():
               % (address, size, uc.reg_read(UC_ARM64_REG_PC)))
         return False
     uc.hook_add(UC_HOOK_MEM_UNMAPPED, on_unmapped)
-    if wav:
-        uc.hook_add(UC_HOOK_MEM_WRITE, audio_write_hook, None, PWM_CTL, PWM_RNG1 + 4)
 
     CHUNK = 2_000_000
     pc = LOAD
@@ -401,21 +411,17 @@ def main():
             break
         pc = uc.reg_read(UC_ARM64_REG_PC)
         ran += CHUNK
+        drain_pwm()
 
     fb = uc.mem_read(FB_PA, W * H * 4)
-    rgb = bytearray(W * H * 3)
-    for i in range(W * H):
-        w = fb[i*4] | (fb[i*4+1] << 8) | (fb[i*4+2] << 16)
-        rgb[i*3]   = (w >> 16) & 0xFF
-        rgb[i*3+1] = (w >> 8) & 0xFF
-        rgb[i*3+2] = w & 0xFF
-    write_png(out_path, W, H, rgb)
+    fbconv.write_png(out_path, W, H, fbconv.xrgb8888(fb))
     print("wrote %s (%dx%d) after ~%dM instrs" % (out_path, W, H, ran // 1_000_000))
     if storage:                          # flush the USV1 disk back ("SD write-back")
         with open(storage, "wb") as f:
             f.write(bytes(uc.mem_read(FS_PA, FS_SIZE)))
         print("flushed FS -> %s" % storage)
     if wav:
+        drain_pwm()
         reconstruct_audio(wav)
 
 
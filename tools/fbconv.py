@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""fbconv - framebuffer -> RGB conversion and the one PNG writer every port
+harness shares.
+
+Each ROM-free harness ends the same way: read the emulated framebuffer, turn
+it into RGB, write a PNG. And each had its own copy of both halves - thirteen
+write_png/png_rgb/png_gray functions, and a decode loop that ran a Python
+frame per *pixel* (BGR555 on the GBA, XRGB8888 on the ARM boards, bitplanes on
+the Amiga, 2bpp tiles on the NES and WonderSwan, 4bpp chunky on the IIGS,
+1-bit on the Mac Plus and Apple II, two-colour cells on the C64 and VIC-20).
+A 640x480 dump was ~300K iterations of that loop, plus a copy of the image
+with the filter bytes spliced in before zlib saw any of it. Here a frame is a
+handful of whole-buffer operations:
+
+  * with NumPy, bits are unpacked with unpackbits, planes and nibbles are
+    shifted/OR'd as arrays;
+  * without it (NumPy stays optional on this tree, as in audiolib.py), bytes
+    are expanded through 256-entry tables with b"".join(map(...)), channels
+    are mapped with bytes.translate and interleaved by extended-slice
+    assignment, and planes are OR'd as big integers - C iteration every time.
+
+Every converter returns bytes, one per pixel for an index/grey image or three
+for RGB, so a harness doesn't care which path ran. The building blocks:
+
+    mono(bits, n=8, msb_first=True)    packed 1-bit -> 0/1 per pixel
+    planar([p0, p1, ...])              bitplanes (p0 = bit 0) -> index
+    two_colour(bits, fg, bg)           1-bit cells with per-byte fg/bg -> index
+    chunky4(buf)                       4bpp, high nibble first -> index
+    scale(idx, w, h, n)                nearest-neighbour n x n
+    palette(idx, [(r, g, b), ...])     index -> RGB
+    gray(idx, [level, ...])            index -> grey
+    bgr555(buf) / xrgb8888(buf, be)    direct-colour framebuffers -> RGB
+
+write_png() streams the rows through one zlib.compressobj at the caller's
+level (6 unless said otherwise); IDAT is cut every IDAT_MAX bytes of deflate
+output, so a screenshot - always far smaller - is one IDAT, byte-identical to
+what the harnesses' zlib.compress() copies wrote.
+
+    fbconv.py [--no-numpy]    time each conversion and a PNG write on synthetic frames
+"""
+import os, random, sys, tempfile, time, zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+IDAT_MAX = 256 * 1024
+
+_FIVE = bytes(c * 255 // 31 for c in range(32)) * 8     # 5-bit -> 8-bit, any byte
+_tables = {}
+
+
+def _table(key, build):
+    t = _tables.get(key)
+    if t is None:
+        t = _tables[key] = build()
+    return t
+
+
+def _u8(buf):
+    return np.frombuffer(bytes(buf), np.uint8)
+
+
+def _or(parts, n):
+    """Bytewise OR of equal-length byte strings (disjoint bits in practice)."""
+    acc = 0
+    for p in parts:
+        acc |= int.from_bytes(p, "big")
+    return acc.to_bytes(n, "big")
+
+
+# ---- indexed sources --------------------------------------------------------
+def mono(bits, n=8, msb_first=True):
+    """One 0/1 byte per pixel from packed 1-bit data, `n` pixels per byte
+    (the Apple II's hi-res is 7, LSB first; bit 7 is its colour shift)."""
+    if np is not None:
+        a = np.unpackbits(_u8(bits), bitorder="big" if msb_first else "little")
+        if n != 8:
+            a = a.reshape(-1, 8)[:, 8 - n:] if msb_first else a.reshape(-1, 8)[:, :n]
+        return a.tobytes()
+    order = range(n - 1, -1, -1) if msb_first else range(n)
+    t = _table(("mono", n, msb_first),
+               lambda: [bytes((b >> i) & 1 for i in order) for b in range(256)])
+    return b"".join(map(t.__getitem__, bits))
+
+
+def planar(planes):
+    """Index per pixel from bitplanes, MSB = leftmost: planes[k] holds bit k.
+    A constant plane (b"\\xff" or b"\\x00" per byte) folds a per-tile palette
+    number into the index."""
+    if np is not None:
+        idx = None
+        for k, p in enumerate(planes):
+            v = np.unpackbits(_u8(p)) << k
+            idx = v if idx is None else idx | v
+        return idx.tobytes()
+    cells = [mono(p) for p in planes]
+    n = len(cells[0])
+    # a 0/1 byte shifted left by k < 8 stays inside its own byte
+    return (sum(int.from_bytes(c, "big") << k for k, c in enumerate(cells))
+            .to_bytes(n, "big"))
+
+
+def two_colour(bits, fg, bg):
+    """Index per pixel from 1-bit cells (MSB first): a set bit takes that
+    byte's entry in `fg`, a clear one its entry in `bg`. Either may be an int
+    colour for the whole frame."""
+    n = len(bits)
+    fg = bytes([fg]) * n if isinstance(fg, int) else bytes(fg)
+    bg = bytes([bg]) * n if isinstance(bg, int) else bytes(bg)
+    if np is not None:
+        on = np.unpackbits(_u8(bits)).astype(bool)
+        return np.where(on, np.repeat(_u8(fg), 8), np.repeat(_u8(bg), 8)).tobytes()
+    rep = _table("rep8", lambda: [bytes([v]) * 8 for v in range(256)])
+    mask = mono(bits).translate(bytes([0, 255]) + bytes(254))
+    f = int.from_bytes(b"".join(map(rep.__getitem__, fg)), "big")
+    b = int.from_bytes(b"".join(map(rep.__getitem__, bg)), "big")
+    m = int.from_bytes(mask, "big")
+    return (b ^ ((f ^ b) & m)).to_bytes(n * 8, "big")
+
+
+def chunky4(buf):
+    """Index per pixel from packed 4bpp, the high nibble being the left pixel."""
+    if np is not None:
+        a = _u8(buf)
+        return np.stack((a >> 4, a & 15), axis=1).tobytes()
+    t = _table("chunky4", lambda: [bytes((b >> 4, b & 15)) for b in range(256)])
+    return b"".join(map(t.__getitem__, buf))
+
+
+def scale(idx, w, h, n):
+    """Nearest-neighbour n x n enlargement of a one-byte-per-pixel image."""
+    if n == 1:
+        return bytes(idx)
+    if np is not None:
+        return _u8(idx).reshape(h, w).repeat(n, axis=0).repeat(n, axis=1).tobytes()
+    t = _table(("rep", n), lambda: [bytes([v]) * n for v in range(256)])
+    return b"".join(b"".join(map(t.__getitem__, idx[y * w:(y + 1) * w])) * n
+                    for y in range(h))
+
+
+# ---- to RGB / grey ----------------------------------------------------------
+def palette(idx, pal):
+    """RGB bytes from an index image and up to 256 (r, g, b) entries; an index
+    past the end of `pal` is black. Three bytes.translate()s beat NumPy's
+    fancy-index here, so there is only the one path."""
+    pal = list(pal)[:256] + [(0, 0, 0)] * (256 - len(pal))
+    idx = bytes(idx)
+    out = bytearray(len(idx) * 3)
+    for c in range(3):
+        out[c::3] = idx.translate(bytes(e[c] for e in pal))
+    return bytes(out)
+
+
+def gray(idx, levels):
+    """Grey bytes from an index image through a table of up to 256 levels."""
+    levels = bytes(levels)
+    return bytes(idx).translate(levels + bytes(256 - len(levels)))
+
+
+def bgr555(buf):
+    """RGB from little-endian xBBBBBGGGGGRRRRR words (the GBA's Mode 3), each
+    5-bit channel widened as c * 255 // 31."""
+    if np is not None:
+        v = np.frombuffer(bytes(buf), "<u2")
+        five = np.frombuffer(_FIVE[:32], np.uint8)
+        return np.stack((five[v & 31], five[(v >> 5) & 31], five[(v >> 10) & 31]),
+                        axis=1).tobytes()
+    buf = bytes(buf)
+    lo, hi = buf[0::2], buf[1::2]
+    g = _or((lo.translate(bytes(b >> 5 for b in range(256))),
+             hi.translate(bytes((b & 3) << 3 for b in range(256)))), len(lo))
+    out = bytearray(len(lo) * 3)
+    out[0::3] = lo.translate(_FIVE)
+    out[1::3] = g.translate(_FIVE)
+    out[2::3] = hi.translate(bytes(_FIVE[(b >> 2) & 31] for b in range(256)))
+    return bytes(out)
+
+
+def xrgb8888(buf, big_endian=False):
+    """RGB from 32-bit xRGB pixels: B, G, R, x in memory on a little-endian
+    board (the Pi, the PinePhone), x, R, G, B on a big-endian one (the G4).
+    Plain strided slices - already C speed, NumPy has nothing to add."""
+    r, g, b = (1, 2, 3) if big_endian else (2, 1, 0)
+    n = len(buf) // 4
+    out = bytearray(n * 3)
+    out[0::3], out[1::3], out[2::3] = buf[r::4], buf[g::4], buf[b::4]
+    return bytes(out)
+
+
+# ---- PNG --------------------------------------------------------------------
+def _chunk(tag, data):
+    return (len(data).to_bytes(4, "big") + tag + data +
+            (zlib.crc32(tag + data) & 0xFFFFFFFF).to_bytes(4, "big"))
+
+
+def write_png(path, w, h, pixels, level=6, gray=False):
+    """Write `pixels` (h rows of w RGB triples, or of w grey bytes with
+    `gray`) as an 8-bit PNG, deflated at `level` row by row."""
+    ch = 1 if gray else 3
+    stride = w * ch
+    px = memoryview(pixels if isinstance(pixels, (bytes, bytearray)) else bytes(pixels))
+    assert len(px) >= stride * h, "short framebuffer: %d < %d" % (len(px), stride * h)
+    z = zlib.compressobj(level)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n" +
+                _chunk(b"IHDR", w.to_bytes(4, "big") + h.to_bytes(4, "big") +
+                       bytes((8, 0 if gray else 2, 0, 0, 0))))
+        out, size = [], 0
+        for y in range(h):
+            d = z.compress(b"\x00" + px[y * stride:(y + 1) * stride])
+            if d:
+                out.append(d)
+                size += len(d)
+                if size >= IDAT_MAX:
+                    f.write(_chunk(b"IDAT", b"".join(out)))
+                    out, size = [], 0
+        out.append(z.flush())
+        f.write(_chunk(b"IDAT", b"".join(out)) + _chunk(b"IEND", b""))
+
+
+# ---- bench ------------------------------------------------------------------
+def _bench(w=640, h=480):
+    rnd = random.Random(w * h).randbytes(w * h * 4)
+    pal = [(i, 255 - i, i * 7 & 255) for i in range(256)]
+    cases = [
+        ("xrgb8888", lambda: xrgb8888(rnd)),
+        ("bgr555", lambda: bgr555(rnd[:w * h * 2])),
+        ("planar x5", lambda: planar([rnd[k * w * h // 8:(k + 1) * w * h // 8]
+                                      for k in range(5)])),
+        ("two_colour", lambda: two_colour(rnd[:w * h // 8], rnd[-w * h // 8:], 6)),
+        ("chunky4 x2", lambda: scale(chunky4(rnd[:w * h // 8]), w // 2, h // 2, 2)),
+        ("mono 7 lsb", lambda: gray(mono(rnd[:w * h // 7], 7, False), (0, 255))),
+        ("palette", lambda: palette(rnd[:w * h], pal)),
+    ]
+    out = {}
+    for name, fn in cases:
+        t0 = time.perf_counter()
+        out[name] = fn()
+        print("  %-11s %6.1f ms" % (name, (time.perf_counter() - t0) * 1000))
+    fd, path = tempfile.mkstemp(suffix=".png")
+    os.close(fd)
+    try:
+        band = lambda y: b"".join(bytes([(x + y) & 15]) * 40 for x in range(w // 40))
+        ui = palette(b"".join(band(y) * 30 for y in range(h // 30)), pal)
+        for level in (1, 6, 9):
+            t0 = time.perf_counter()
+            write_png(path, w, h, ui, level)
+            print("  png %d      %6.1f ms  %d bytes" % (level, (time.perf_counter() - t0) * 1000,
+                                                       os.path.getsize(path)))
+    finally:
+        os.remove(path)
+    return out
+
+
+def main():
+    global np
+    args = sys.argv[1:]
+    if [a for a in args if a != "--no-numpy"]:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    have = np
+    if "--no-numpy" in args:
+        np = None
+    print("%s path, 640x480:" % ("numpy" if np is not None else "stdlib"))
+    ref = _bench()
+    if np is None or have is None:
+        return 0
+    np = None
+    print("stdlib path, 640x480:")
+    alt = _bench()
+    bad = [k for k in ref if ref[k] != alt[k]]
+    print("paths agree" if not bad else "PATHS DIFFER: %s" % ", ".join(bad))
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
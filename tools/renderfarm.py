@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+"""renderfarm - every headless AUTOTEST renderer in the family, at once,
+checked against a committed manifest of golden framebuffer hashes.
+
+HANDOFF-perf.md's rule for a redraw refactor is "render-verify it": build the
+AUTOTEST variant before and after, render both, `cmp`. Until now that meant
+one renderer CLI per port, run by hand, one at a time, against a baseline
+rebuilt from a git-stash each time. The baseline now lives in
+tools/renderfarm-golden.json: a hash for every framebuffer every renderer
+produces from every AUTOTEST build it can find. The whole verify loop is a
+build followed by this command:
+
+  * discovery: each port's builds are globbed where its build.sh puts them
+    (gba/build/unodos*.gba, rpi/build/kernel8*.img, nes/build/unodos*.nes,
+    amiga/build/UnoDOS68K_test, ...), so a build.sh target that has been
+    run is a job and one that has not is simply absent. The script-driven
+    harnesses (apple2, c64, macplus) run every tests/*.script against the
+    image the port's README names; iigs runs every tests/*.py.
+  * jobs: each render is its own Python process. Up to -j run at once (one
+    per CPU by default). Chained scripts (a --writeback or --storage image
+    that the *_persist script boots) start when the job they read has
+    finished. Every job works in its own scratch directory, so no shot in the
+    tree is overwritten.
+  * hashing: a shot's hash is over its decoded pixels and size, not over the
+    PNG file, so a harness that changes its zlib level stays green.
+  * the matrix: one row per port with its jobs, shots, pass/fail/new counts,
+    the wall time its renders took and the instructions they ran (parsed
+    from each renderer's own summary line). Each shot that is not a PASS is
+    listed under it, and so is every golden entry of those ports that was
+    not checked because its job did not run. The exit status is 1 on any
+    FAIL or renderer error, and when nothing rendered at all (every job
+    skipped): that is "NO RENDERS", never a PASS. A shot with no golden
+    hash is NEW; it is reported but does not fail.
+  * --update records the hashes of every job that finished cleanly as the
+    new golden entries, dropping entries for shots those jobs no longer
+    produce. Commit the manifest with the change that moved the pixels.
+  * --bench REV times the renderers instead: the same jobs, on the same
+    builds, once with the Python sources as of REV and once as they are on
+    disk, each from a fresh copy (no warm build/snap/), one render at a time
+    unless -j says otherwise. It prints each port's emulated MIPS both ways
+    and flags a port whose shots differ between the two.
+
+A port whose emulator core is not importable (py65, unicorn) is skipped
+with the reason, as is a script whose image has not been built.
+
+    python tools/renderfarm.py [PORT ...] [-j N] [--update|--bench REV] [--keep DIR] [--timeout S]
+"""
+import concurrent.futures, glob, hashlib, importlib.util, io, json, os, re
+import shutil, struct, subprocess, sys, tarfile, tempfile, time, zlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOLDEN = os.path.join(ROOT, "tools", "renderfarm-golden.json")
+TIMEOUT_S = 1800
+NES_FRAMES = 120            # as nes/README.md's headless example
+
+
+class Job(object):
+    def __init__(self, port, name, argv, needs, stdin=None, after=(),
+                 image=None, cwd=None):
+        self.port = port
+        self.name = name
+        self.argv = argv            # "{work}" is this job's scratch directory
+        self.needs = needs          # the module the renderer imports
+        self.stdin = stdin          # a script path, or the script itself
+        self.after = tuple(after)   # jobs (same port) whose output this reads
+        self.image = image          # must exist (or be made by `after`)
+        self.cwd = cwd
+        self.skip = None            # why it is not run
+        self.rc = None
+        self.error = ""
+        self.seconds = 0.0
+        self.instrs = 0
+        self.shots = {}             # shot name -> "WxH sha256"
+
+
+# ---- discovery --------------------------------------------------------------
+# port: (renderer, where build.sh puts its builds, the core it needs). The
+# renderer is called as `renderer BUILD OUT.png`.
+ROM_PORTS = [
+    ("gba", "gba/harness.py", "gba/build/unodos*.gba", "unicorn"),
+    ("ws", "ws/harness.py", "ws/build/unodos*.ws", "unicorn"),
+    ("rpi", "rpi/harness.py", "rpi/build/kernel8*.img", "unicorn"),
+    ("pinephone", "pinephone/harness.py", "pinephone/build/unodos*.bin", "unicorn"),
+    ("ppcmac", "ppcmac/harness.py", "ppcmac/build/unodos*.bin", "unicorn"),
+    ("vic20", "vic20/harness.py", "vic20/build/unodos*.prg", "py65"),
+    ("amiga", "amiga/uae/render.py", "amiga/build/UnoDOS68K_test", "unicorn"),
+]
+
+# port: (the image its scripts boot, {script: image} where one differs, the
+# core it needs). `harness.py IMAGE ARTDIR [flags] < tests/SCRIPT.script`.
+SCRIPT_PORTS = [
+    ("apple2", "build/unodos_apple2_test.dsk",
+     {"m3_sched": "build/unodos_sched.dsk"}, "py65"),
+    ("c64", "build/unodos_c64_test.prg", {}, "py65"),
+    ("macplus", "build/unodos_macplus.dsk",
+     {"m1": "build/unodos_macplus_test.dsk"}, "unicorn"),
+]
+
+# Scripts that hand a disk (or FS sidecar) to the next one: script -> (flag,
+# the file's name in the port's shared scratch, the script that boots it).
+CHAINS = {
+    "apple2": {"m2": ("--writeback", "written.dsk", "m2_persist"),
+               "files_delete": ("--writeback", "deleted.dsk",
+                                "files_delete_persist")},
+    "c64": {"m2": ("--storage", "fs.sav", "m2_persist")},
+}
+FLAGS = {("c64", "m1_ntsc"): ["--ntsc"]}
+
+
+def rel(path):
+    return os.path.relpath(path, ROOT)
+
+
+# Renderers and iigs tests are taken from `code` (ROOT, or a --bench copy of
+# the sources); builds, images and scripts always come from ROOT.
+def rom_jobs(port, renderer, pattern, needs, code=ROOT):
+    jobs = []
+    for build in sorted(glob.glob(os.path.join(ROOT, pattern))):
+        if not os.path.isfile(build):
+            continue
+        name = os.path.splitext(os.path.basename(build))[0]
+        jobs.append(Job(port, name, [sys.executable, os.path.join(code, renderer),
+                                     build, os.path.join("{work}", name + ".png")],
+                        needs))
+    if port == "nes":                   # `harness.py ROM ARTDIR < script`
+        for j in jobs:
+            j.argv[-1] = "{work}"
+            j.stdin = "frames %d\nshot %s\nquit\n" % (NES_FRAMES, j.name)
+    return jobs
+
+
+def script_jobs(port, image, images, needs, code=ROOT):
+    here = os.path.join(ROOT, port)
+    chains = CHAINS.get(port, {})
+    fed = dict((dst, (src, fname)) for src, (flag, fname, dst) in chains.items())
+    jobs = []
+    for script in sorted(glob.glob(os.path.join(here, "tests", "*.script"))):
+        name = os.path.splitext(os.path.basename(script))[0]
+        img = os.path.join(here, images.get(name, image))
+        argv = [sys.executable, os.path.join(code, port, "harness.py"), img, "{work}"]
+        after = ()
+        if name in chains:
+            flag, fname, _ = chains[name]
+            argv += [flag, os.path.join("{shared}", fname)]
+        if name in fed:
+            src, fname = fed[name]
+            if chains[src][0] == "--writeback":
+                argv[2] = img = os.path.join("{shared}", fname)
+            else:
+                argv += ["--storage", os.path.join("{shared}", fname)]
+            after = (src,)
+        argv += FLAGS.get((port, name), [])
+        jobs.append(Job(port, name, argv, needs, stdin=script, after=after,
+                        image=None if after else img))
+    return jobs
+
+
+def iigs_jobs(code=ROOT):
+    img = os.path.join(ROOT, "iigs", "build", "unodos_iigs.po")
+    # the tests write shots/ and build/ relative to where they run: the job's
+    # scratch directory, so iigs/shots is left alone
+    return [Job("iigs", os.path.splitext(os.path.basename(t))[0],
+                [sys.executable, t, img], None, image=img, cwd="{work}")
+            for t in sorted(glob.glob(os.path.join(code, "iigs", "tests", "*.py")))]
+
+
+def discover(code=ROOT):
+    ports = {}
+    for port, renderer, pattern, needs in ROM_PORTS:
+        ports[port] = rom_jobs(port, renderer, pattern, needs, code)
+    ports["nes"] = rom_jobs("nes", "nes/harness.py", "nes/build/unodos*.nes", "py65",
+                            code)
+    for port, image, images, needs in SCRIPT_PORTS:
+        ports[port] = script_jobs(port, image, images, needs, code)
+    ports["iigs"] = iigs_jobs(code)
+    return ports
+
+
+def mark_skips(ports):
+    for jobs in ports.values():
+        for j in jobs:
+            if j.needs and importlib.util.find_spec(j.needs) is None:
+                j.skip = "no %s module" % j.needs
+            elif j.image and not os.path.exists(j.image):
+                j.skip = "no %s (not built)" % rel(j.image)
+
+
+# ---- framebuffer hashes -----------------------------------------------------
+def _unfilter(ftype, line, prev, bpp):
+    if ftype == 1:
+        for i in range(bpp, len(line)):
+            line[i] = (line[i] + line[i - bpp]) & 0xFF
+    elif ftype == 2:
+        for i in range(len(line)):
+            line[i] = (line[i] + prev[i]) & 0xFF
+    elif ftype == 3:
+        for i in range(len(line)):
+            left = line[i - bpp] if i >= bpp else 0
+            line[i] = (line[i] + ((left + prev[i]) >> 1)) & 0xFF
+    elif ftype == 4:
+        for i in range(len(line)):
+            a = line[i - bpp] if i >= bpp else 0
+            b, c = prev[i], prev[i - bpp] if i >= bpp else 0
+            p = a + b - c
+            pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+            pred = a if pa <= pb and pa <= pc else b if pb <= pc else c
+            line[i] = (line[i] + pred) & 0xFF
+    else:
+        raise ValueError("bad PNG filter type %d" % ftype)
+
+
+def png_pixels(path):
+    """(width, height, colour type, palette + unfiltered pixel rows) of a
+    non-interlaced PNG - what the family's PNG writers all produce."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:8] != b"\x89PNG\r\n\x1a\n":
+        raise ValueError("%s is not a PNG" % path)
+    pos, idat, plte = 8, [], b""
+    w = h = depth = ctype = None
+    while pos + 8 <= len(data):
+        n, tag = struct.unpack(">I4s", data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + n]
+        pos += 12 + n
+        if tag == b"IHDR":
+            w, h, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", body)
+            if interlace:
+                raise ValueError("%s is interlaced" % path)
+        elif tag == b"PLTE":
+            plte = body
+        elif tag == b"IDAT":
+            idat.append(body)
+        elif tag == b"IEND":
+            break
+    raw = zlib.decompress(b"".join(idat))
+    chans = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[ctype]
+    bpp = max(1, chans * depth // 8)
+    stride = (w * chans * depth + 7) // 8
+    rows, prev = [], bytearray(stride)
+    for y in range(h):
+        at = y * (stride + 1)
+        line = bytearray(raw[at + 1:at + 1 + stride])
+        if raw[at]:
+            _unfilter(raw[at], line, prev, bpp)
+        rows.append(line)
+        prev = line
+    return w, h, ctype, plte + b"".join(rows)
+
+
+def shot_hash(path):
+    w, h, ctype, px = png_pixels(path)
+    return "%dx%d %s" % (w, h, hashlib.sha256(b"%d %d %d " % (w, h, ctype) + px)
+                         .hexdigest())
+
+
+# ---- running ----------------------------------------------------------------
+INSTRS = re.compile(r"(\d+)(M?) (?:instrs|steps)\b")
+
+
+def run_job(job, scratch, timeout):
+    work = os.path.join(scratch, job.port, job.name)
+    shared = os.path.join(scratch, job.port, "_shared")
+    os.makedirs(os.path.join(work, "build"), exist_ok=True)
+    os.makedirs(shared, exist_ok=True)
+    argv = [a.replace("{work}", work).replace("{shared}", shared) for a in job.argv]
+    feed = {"stdin": subprocess.DEVNULL}
+    if job.stdin and os.path.isfile(job.stdin):
+        with open(job.stdin, "rb") as f:
+            feed = {"input": f.read()}
+    elif job.stdin:
+        feed = {"input": job.stdin.encode()}
+    t = time.time()
+    try:
+        r = subprocess.run(argv, cwd=work if job.cwd else os.path.dirname(argv[1]),
+                           capture_output=True, timeout=timeout, **feed)
+        job.rc = r.returncode
+        out = r.stdout.decode("latin1") + r.stderr.decode("latin1")
+    except subprocess.TimeoutExpired:
+        job.rc, out = -1, "timed out after %ds" % timeout
+    job.seconds = time.time() - t
+    for n, mega in INSTRS.findall(out):
+        job.instrs = max(job.instrs, int(n) * (1_000_000 if mega else 1))
+    if job.rc:
+        tail = [l for l in out.strip().splitlines() if l.strip()]
+        job.error = tail[-1].strip() if tail else "exit %d" % job.rc
+    for path in sorted(glob.glob(os.path.join(work, "**", "*.png"), recursive=True)):
+        if not os.path.isfile(path):
+            continue
+        name = os.path.splitext(os.path.basename(path))[0]
+        try:
+            job.shots[name] = shot_hash(path)
+        except (ValueError, KeyError, zlib.error, struct.error) as e:
+            job.shots[name] = "unreadable (%s)" % e
+    return job
+
+
+def schedule(jobs, scratch, jobs_n, timeout):
+    """Run every job that is not skipped, `jobs_n` at a time, each after the
+    jobs named in its `after` (a job after a failed one is skipped)."""
+    key = lambda j: (j.port, j.name)
+    byname = dict((key(j), j) for j in jobs)
+    pending = [j for j in jobs if not j.skip]
+    running = {}
+    with concurrent.futures.ThreadPoolExecutor(jobs_n) as ex:
+        while pending or running:
+            for j in list(pending):
+                deps = [byname.get((j.port, d)) for d in j.after]
+                if any(d is not None and not d.skip and d.rc is None for d in deps):
+                    continue
+                pending.remove(j)
+                skipped = [d.skip for d in deps if d is not None and d.skip]
+                failed = [d.name for d in deps if d is not None and d.rc]
+                if skipped or failed:
+                    j.skip = skipped[0] if skipped else \
+                        "after %s, which failed" % ", ".join(failed)
+                    continue
+                running[ex.submit(run_job, j, scratch, timeout)] = j
+            if running:
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    f.result()
+                    running.pop(f)
+
+
+# ---- the verdict --------------------------------------------------------------
+def verdicts(job, golden):
+    """[(shot, status, detail)] for a job that ran: PASS / FAIL / NEW per shot
+    it produced, FAIL for a golden shot it no longer produces."""
+    out = []
+    prefix = "%s/%s/" % (job.port, job.name)
+    for shot, h in sorted(job.shots.items()):
+        want = golden.get(prefix + shot)
+        if want is None:
+            out.append((shot, "NEW", h))
+        elif want == h:
+            out.append((shot, "PASS", ""))
+        else:
+            out.append((shot, "FAIL", "%s, golden %s" % (h, want)))
+    for k in sorted(golden):
+        if k.startswith(prefix) and k[len(prefix):] not in job.shots:
+            out.append((k[len(prefix):], "FAIL", "not rendered (golden %s)"
+                        % golden[k]))
+    return out
+
+
+def fmt_instrs(n):
+    if not n:
+        return "-"
+    return "%.1fM" % (n / 1e6) if n >= 100_000 else str(n)
+
+
+def report(ports, golden, wall):
+    print("%-10s %4s %5s %5s %5s %5s %5s %5s %8s %9s"
+          % ("port", "jobs", "shots", "pass", "fail", "new", "err", "skip",
+             "wall", "instrs"))
+    bad = 0
+    notes, new = [], []
+    for port in ports:
+        jobs = ports[port]
+        ran = [j for j in jobs if j.rc is not None]
+        c = dict(PASS=0, FAIL=0, NEW=0)
+        shots = sum(len(j.shots) for j in ran)
+        for j in ran:
+            for shot, status, detail in verdicts(j, golden):
+                c[status] += 1
+                if status == "FAIL":
+                    notes.append("  %-4s %s/%s/%s  %s" % (status, port, j.name,
+                                                         shot, detail))
+            if j.rc:
+                notes.append("  ERR  %s/%s  %s" % (port, j.name, j.error))
+        err = sum(1 for j in ran if j.rc)
+        skip = [j for j in jobs if j.skip]
+        why = {}
+        for j in skip:
+            why.setdefault(j.skip, []).append(j.name)
+        for reason, names in why.items():
+            notes.append("  skip %s/%s  %s" % (port, names[0] if len(names) == 1
+                                               else "{%d jobs}" % len(names), reason))
+        if c["NEW"]:
+            new.append("%s %d" % (port, c["NEW"]))
+        if not jobs:
+            notes.append("  skip %s  no builds found" % port)
+        bad += c["FAIL"] + err
+        print("%-10s %4d %5d %5d %5d %5d %5d %5d %7.1fs %9s"
+              % (port, len(jobs), shots, c["PASS"], c["FAIL"], c["NEW"], err,
+                 len(skip), sum(j.seconds for j in ran),
+                 fmt_instrs(sum(j.instrs for j in ran))))
+    every = [j for js in ports.values() for j in js if j.rc is not None]
+    total = sum(j.seconds for j in every)
+    print("\n%d renders in %.1fs wall (%.1fs of render time, %.1fx)"
+          % (len(every), wall, total, total / wall if wall else 0))
+    if new:
+        notes.append("  NEW  %s: no golden hash yet (--update records them)"
+                     % ", ".join(new))
+    for job, n in unchecked(ports, golden, every):
+        notes.append("  --   %s  %d golden shot(s) not checked" % (job, n))
+    if notes:
+        print("\n" + "\n".join(notes))
+    if not every:
+        print("\nRENDERFARM NO RENDERS")
+        return None
+    print("\nRENDERFARM %s" % ("FAIL" if bad else "PASS"))
+    return bad
+
+
+def unchecked(ports, golden, ran):
+    """[(port/job, shots)] of the golden entries, for the ports asked for,
+    whose job did not run (skipped, or no longer discovered)."""
+    done = set("%s/%s/" % (j.port, j.name) for j in ran)
+    out = {}
+    for k in golden:
+        job = k.rsplit("/", 1)[0]
+        if k.split("/", 1)[0] in ports and job + "/" not in done:
+            out[job] = out.get(job, 0) + 1
+    return sorted(out.items())
+
+
+def update(ports, golden):
+    n = 0
+    for jobs in ports.values():
+        for j in jobs:
+            if j.rc != 0:
+                continue
+            prefix = "%s/%s/" % (j.port, j.name)
+            for k in [k for k in golden if k.startswith(prefix)]:
+                del golden[k]
+            for shot, h in j.shots.items():
+                golden[prefix + shot] = h
+                n += 1
+    part = GOLDEN + ".part"
+    with open(part, "w") as f:
+        json.dump(golden, f, indent=1, sort_keys=True)
+        f.write("\n")
+    os.replace(part, GOLDEN)
+    print("updated %s: %d shot(s)" % (rel(GOLDEN), n))
+
+
+# ---- --bench ----------------------------------------------------------------
+def code_tree(rev, ports, dest):
+    """Unpack the Python sources of `ports` and tools/ under `dest`: as of git
+    `rev`, or as they are on disk (tracked or not, minus ignored) for None."""
+    specs = [":(glob)%s/**/*.py" % p for p in ports] + [":(glob)tools/*.py"]
+    git = ["git", "-C", ROOT]
+    if rev:
+        tar = subprocess.run(git + ["archive", "--format=tar", rev, "--"] + specs,
+                             capture_output=True, check=True).stdout
+        with tarfile.open(fileobj=io.BytesIO(tar)) as t:
+            t.extractall(dest)
+        return
+    names = subprocess.run(git + ["ls-files", "-co", "--exclude-standard", "-z", "--"]
+                           + specs, capture_output=True, check=True).stdout
+    for name in filter(None, names.decode().split("\0")):
+        if os.path.isfile(os.path.join(ROOT, name)):
+            os.makedirs(os.path.dirname(os.path.join(dest, name)), exist_ok=True)
+            shutil.copy2(os.path.join(ROOT, name), os.path.join(dest, name))
+
+
+def mips(instrs, seconds):
+    return "%.1f" % (instrs / seconds / 1e6) if instrs and seconds else "-"
+
+
+def bench(want, rev, scratch, jobs_n, timeout):
+    runs = {}
+    for label, r in (("before", rev), ("after", None)):
+        tree = os.path.join(scratch, label)
+        code_tree(r, want, tree)
+        ports = discover(tree)
+        ports = dict((p, ports[p]) for p in want)
+        mark_skips(ports)
+        print("%s: %s" % (label, r or "working tree"))
+        schedule([j for js in ports.values() for j in js],
+                 os.path.join(tree, "_work"), jobs_n, timeout)
+        runs[label] = ports
+    print("\n%-10s %4s %9s %8s %6s %8s %6s %8s"
+          % ("port", "jobs", "instrs", rev[:8], "MIPS", "now", "MIPS", "speedup"))
+    notes = []
+    for port, after in runs["after"].items():
+        before = dict((j.name, j) for j in runs["before"].get(port, []))
+        pairs = [(before[j.name], j) for j in after
+                 if j.rc == 0 and j.name in before and before[j.name].rc == 0]
+        failed = [j.name for j in list(after) + list(before.values()) if j.rc]
+        if failed:
+            notes.append("  ERR  %s  %s" % (port, ", ".join(sorted(set(failed)))))
+        if not pairs:
+            continue
+        # the same job on the same build runs the same instructions: take the
+        # count from whichever side's renderer reports it
+        instrs = sum(a.instrs or b.instrs for b, a in pairs)
+        tb = sum(b.seconds for b, a in pairs)
+        ta = sum(a.seconds for b, a in pairs)
+        print("%-10s %4d %9s %7.1fs %6s %7.1fs %6s %7.2fx"
+              % (port, len(pairs), fmt_instrs(instrs), tb, mips(instrs, tb), ta,
+                 mips(instrs, ta), tb / ta if ta else 0))
+        moved = ["%s/%s" % (a.name, shot) for b, a in pairs
+                 for shot in sorted(set(a.shots) | set(b.shots))
+                 if a.shots.get(shot) != b.shots.get(shot)]
+        if moved:
+            notes.append("  DIFF %s  %s" % (port, ", ".join(moved)))
+    if notes:
+        print("\n" + "\n".join(notes))
+    return 1 if notes else 0
+
+
+def main():
+    argv = sys.argv[1:]
+    opts = {"-j": None, "--keep": None, "--timeout": TIMEOUT_S, "--bench": None}
+    for flag in list(opts):
+        if flag in argv:
+            i = argv.index(flag)
+            opts[flag] = argv[i + 1]
+            del argv[i:i + 2]
+    do_update = "--update" in argv
+    want = [a for a in argv if not a.startswith("-")]
+    if any(a.startswith("-") and a != "--update" for a in argv) or \
+            (do_update and opts["--bench"]):
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    ports = discover()
+    unknown = [p for p in want if p not in ports]
+    if unknown:
+        print("unknown port(s): %s (have: %s)" % (", ".join(unknown),
+                                                 ", ".join(ports)))
+        return 2
+    scratch = opts["--keep"] or tempfile.mkdtemp(prefix="renderfarm-")
+    if opts["--bench"]:
+        try:
+            return bench(want or list(ports), opts["--bench"], scratch,
+                         max(1, int(opts["-j"] or 1)), int(opts["--timeout"]))
+        finally:
+            if not opts["--keep"]:
+                shutil.rmtree(scratch, True)
+    if want:
+        ports = dict((p, ports[p]) for p in ports if p in want)
+    mark_skips(ports)
+    golden = {}
+    if os.path.exists(GOLDEN):
+        with open(GOLDEN) as f:
+            golden = json.load(f)
+    t0 = time.time()
+    try:
+        schedule([j for js in ports.values() for j in js], scratch,
+                 max(1, int(opts["-j"] or os.cpu_count() or 1)),
+                 int(opts["--timeout"]))
+    finally:
+        if not opts["--keep"]:
+            shutil.rmtree(scratch, True)
+    bad = report(ports, golden, time.time() - t0)
+    if bad is None:                 # nothing ran: not a pass, nothing to record
+        return 1
+    if do_update:
+        update(ports, golden)
+        return 0
+    return 1 if bad else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""snapfile - the on-disk form of a harness boot snapshot.
+
+The apple2, c64, nes, vic20 and iigs harnesses each turn their machine into
+plain data (registers, the memory image, the device models) and back; that
+part is theirs, because every machine is different. Getting it onto disk and
+back is the same everywhere, and was pasted into each of them: a pickle,
+zlib-compressed at level 1 (a snapshot is mostly zero RAM, and level 1 gets
+nearly all of that at a fraction of the cost), written to a .part file and
+renamed over the snapshot, so two lanes rendering the same image at once
+never see each other's half-written file. tools/ucsnap.py keeps its Unicorn
+checkpoints in the same format.
+
+    save(path, state)    write `state` atomically, making the directory
+    load(path)           the state, or None if nothing usable is there
+
+    snapfile.py SNAP [...]    print what each snapshot holds
+"""
+import os, pickle, sys, zlib
+
+
+def save(path, state):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part = "%s.%d.part" % (path, os.getpid())
+    with open(part, "wb") as f:
+        f.write(zlib.compress(pickle.dumps(state, 4), 1))
+    os.replace(part, path)
+
+
+def load(path):
+    try:
+        with open(path, "rb") as f:
+            return pickle.loads(zlib.decompress(f.read()))
+    except (OSError, zlib.error, pickle.UnpicklingError, EOFError,
+            AttributeError, ImportError):
+        return None
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    for path in sys.argv[1:]:
+        state = load(path)
+        if not isinstance(state, dict):
+            print("%s: not a snapshot" % path)
+            continue
+        print("%s: %s" % (path, ", ".join(
+            "%s[%d]" % (k, len(v)) if isinstance(v, (bytes, bytearray, list)) else k
+            for k, v in sorted(state.items()))))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""ucsnap - checkpoint files for the Unicorn harnesses (macplus, amiga).
+
+The py65 harnesses and the iigs core snapshot their machines by hand, because
+their CPUs are Python objects with a handful of fields. A Unicorn machine is
+three things, and each needs to be taken differently:
+
+  * the CPU: uc.context_save() is the whole QEMU CPU state, including the
+    lazy condition codes that reg_read(SR) only approximates (macplus's
+    _inject explains what losing them costs), and UcContext pickles as-is;
+  * memory: only the RAM regions the harness names. mem_regions() would
+    also list the MMIO pages, and reading those fires the device callbacks;
+  * the devices: whatever the harness models in Python, handed over as a
+    dict of plain data.
+
+A checkpoint file is a snapfile (tools/snapfile.py) of all three plus a
+`key`, the caller's hash of what the state is only valid for (at least the
+image the machine booted, see image_key), and the Unicorn version, since a
+context blob is only meaningful to the QEMU build that wrote it. load()
+refuses a file whose key or Unicorn version differs, so a stale checkpoint
+boots fresh (or fails loudly under --resume) instead of resuming somebody
+else's machine.
+
+    save(path, uc, regions, key, dev)    write a checkpoint atomically
+    load(path, key)                      the state dict, or None + why
+    restore(uc, state)                   put the RAM and CPU back; dev is the caller's
+
+    ucsnap.py CHECKPOINT [...]    describe checkpoint files
+"""
+import hashlib, sys
+
+import unicorn
+
+import snapfile
+
+MAGIC = "ucsnap1"
+
+
+def image_key(*parts):
+    """sha256 over `parts` (bytes, or str paths whose contents are read)."""
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            with open(part, "rb") as f:
+                part = f.read()
+        h.update(hashlib.sha256(part).digest())
+    return h.hexdigest()
+
+
+def save(path, uc, regions, key, dev):
+    """Checkpoint `uc` (its context and the RAM `regions`, a list of
+    (address, size)) with the harness device state `dev` to `path`."""
+    state = {"magic": MAGIC, "key": key, "unicorn": unicorn.__version__,
+             "ctx": uc.context_save(),
+             "mem": [(a, bytes(uc.mem_read(a, n))) for a, n in regions],
+             "dev": dev}
+    snapfile.save(path, state)
+
+
+def read(path):
+    """The raw state dict in `path`, or None if it is missing or not one."""
+    state = snapfile.load(path)
+    return state if isinstance(state, dict) and state.get("magic") == MAGIC else None
+
+
+def load(path, key):
+    """(state, None) if `path` holds a checkpoint for `key` on this Unicorn,
+    else (None, the reason)."""
+    state = read(path)
+    if state is None:
+        return None, "no checkpoint at %s" % path
+    if state["unicorn"] != unicorn.__version__:
+        return None, "%s was written by unicorn %s (this is %s)" % (
+            path, state["unicorn"], unicorn.__version__)
+    if state["key"] != key:
+        return None, "%s is for a different image" % path
+    return state, None
+
+
+def restore(uc, state):
+    """Write the checkpoint's RAM into `uc` (mapped the same way) and make
+    its CPU context current."""
+    for a, data in state["mem"]:
+        uc.mem_write(a, data)
+    uc.context_restore(state["ctx"])
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    for path in sys.argv[1:]:
+        state = read(path)
+        if state is None:
+            print("%s: not a checkpoint" % path)
+            continue
+        print("%s: key %s..., unicorn %s" % (path, state["key"][:16], state["unicorn"]))
+        for a, data in state["mem"]:
+            print("  ram  %08X +%X" % (a, len(data)))
+        print("  dev  %s" % ", ".join(sorted(state["dev"])))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,8 +13,14 @@
  *                         and assert the two digests are identical
  *   rebuild IN OUT        read IN, rebuild through the writer, write OUT
  *                         (the LibreOffice oracle then opens both)
- *   fuzz FILE SEED N      N mutations of FILE: open + walk each.  Must never
- *                         crash and must always terminate.
+ *   fuzz FILE SEED N [FIRST [SAVE]]
+ *                         N mutations of FILE: open + walk each.  Must never
+ *                         crash and must always terminate.  Mutations before
+ *                         FIRST are generated but not walked, and each one
+ *                         walked is first written to SAVE: that is how
+ *                         run_tests.py narrows a crashing shard down to the
+ *                         one mutation that did it.
+ *   repro FILE            walk FILE exactly as fuzz walks a mutation
  * ======================================================================== */
 #include "unodoc.h"
 #include <stdarg.h>
@@ -79,6 +85,16 @@ static unsigned char *slurp(const char *path, long *len)
     return b;
 }
 
+/* write one fuzz case to disk (fuzz ... FIRST SAVE), before it is walked, so
+ * it is there for run_tests.py even when the walk kills the process */
+static void spit(const char *path, const unsigned char *b, long n)
+{
+    FILE *f = fopen(path, "wb");
+    if (!f) return;
+    fwrite(b, 1, (size_t)n, f);
+    fclose(f);
+}
+
 /* ---- the canonical digest of a container ----------------------------------
  * Depth-first in child order, one line per entry: indent, name, type, size
  * and an FNV-1a of the payload.  Two containers with the same digest hold
@@ -737,11 +753,21 @@ int main(int argc, char **argv)
         free(r); free(b);
         return 0;
     }
+    if (argc >= 3 && strcmp(argv[1], "repro") == 0) {
+        long n = 0;
+        unsigned char *b = slurp(argv[2], &n);
+        if (!b) { printf("ERR: cannot read %s\n", argv[2]); return 2; }
+        printf("OK %s\n", walk_all(b, n) ? "opened" : "refused");
+        free(b);
+        return 0;
+    }
     if (argc >= 5 && strcmp(argv[1], "fuzz") == 0) {
         long n = 0;
         unsigned char *b = slurp(argv[2], &n);
         unsigned seed = (unsigned)strtoul(argv[3], 0, 10);
         long iters = strtol(argv[4], 0, 10), t;
+        long first = argc >= 6 ? strtol(argv[5], 0, 10) : 0;
+        const char *save = argc >= 7 ? argv[6] : 0;
         long opened = 0;
         if (!b || n < 512) { printf("ERR: cannot read %s\n", argv[2]); free(b); return 2; }
         for (t = 0; t < iters; t++) {
@@ -757,15 +783,17 @@ int main(int argc, char **argv)
                 seed = seed * 1103515245u + 12345u;
                 m[off] = (unsigned char)(seed >> 16);
             }
+            if (t < first) { free(m); continue; }
+            if (save) spit(save, m, n);
             opened += walk_all(m, n);
             free(m);
         }
-        printf("OK %ld mutations, %ld opened\n", iters, opened);
+        printf("OK %ld mutations, %ld opened\n", iters - first, opened);
         free(b);
         return 0;
     }
 
     printf("usage: cfbtest selftest | ls FILE | rt FILE | rebuild IN OUT"
-           " | fuzz FILE SEED N\n");
+           " | fuzz FILE SEED N [FIRST [SAVE]] | repro FILE\n");
     return 2;
 }
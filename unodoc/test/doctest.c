@@ -5,8 +5,11 @@
  *                      compare against LibreOffice's own text conversion
  *   info FILE          pieces, character count, and the raw control-character
  *                      histogram - what the piece table actually produced
- *   fuzz FILE SEED N   mutations through the container AND the document
- *                      reader.  Must never crash, never hang.
+ *   fuzz FILE SEED N [FIRST [SAVE]]
+ *                      mutations through the container AND the document
+ *                      reader.  Must never crash, never hang.  FIRST and
+ *                      SAVE are run_tests.py's crash bisection (cfbtest.c)
+ *   repro FILE         one saved mutation, walked the way fuzz walks it
  * ======================================================================== */
 #include "unodoc.h"
 #include <stdio.h>
@@ -34,6 +37,16 @@ static unsigned char *slurp(const char *path, long *len)
     return b;
 }
 
+/* write one fuzz case to disk (fuzz ... FIRST SAVE), before it is walked, so
+ * it is there for run_tests.py even when the walk kills the process */
+static void spit(const char *path, const unsigned char *b, long n)
+{
+    FILE *f = fopen(path, "wb");
+    if (!f) return;
+    fwrite(b, 1, (size_t)n, f);
+    fclose(f);
+}
+
 /* The container is chosen by ud_sniff, never by the file name, so ONE test
  * covers both formats: small.doc and small.docx are one document saved twice
  * and go through the same checks. */
@@ -54,6 +67,18 @@ static ud_doc *open_doc(const unsigned char *buf, long len, ud_src *src, ud_cfb
     return c ? ud_doc_open(c) : 0;
 }
 
+/* One fuzz case: the container, then the document reader over it.  1 if the
+ * document opened.  fuzz runs it on every mutation, repro on a saved one. */
+static int fuzz_one(const unsigned char *m, long n)
+{
+    ud_src src;
+    ud_cfb *c;
+    ud_doc *d = open_doc(m, n, &src, &c);
+    if (d) { (void)strlen(ud_doc_plain(d)); ud_doc_close(d); }
+    ud_cfb_close(c);
+    return d != 0;
+}
+
 /* ===========================================================================
  * selftest: a Word document assembled by hand, with FOUR text pieces in a
  * deliberate order.
@@ -563,17 +588,24 @@ int main(int argc, char **argv)
                    ooxml ? "on every run" : "through the Normal style we wrote");
         return bad;
     }
+    if (argc >= 3 && strcmp(argv[1], "repro") == 0) {
+        long n = 0;
+        unsigned char *b = slurp(argv[2], &n);
+        if (!b) { printf("ERR: cannot read %s\n", argv[2]); return 2; }
+        printf("OK %s\n", fuzz_one(b, n) ? "opened" : "refused");
+        free(b);
+        return 0;
+    }
     if (argc >= 5 && strcmp(argv[1], "fuzz") == 0) {
         long n = 0;
         unsigned char *b = slurp(argv[2], &n);
         unsigned seed = (unsigned)strtoul(argv[3], 0, 10);
         long iters = strtol(argv[4], 0, 10), t, opened = 0;
+        long first = argc >= 6 ? strtol(argv[5], 0, 10) : 0;
+        const char *save = argc >= 7 ? argv[6] : 0;
         if (!b || n < 512) { printf("ERR: cannot read %s\n", argv[2]); free(b); return 2; }
         for (t = 0; t < iters; t++) {
             unsigned char *m = (unsigned char *)malloc((size_t)n);
-            ud_src src;
-            ud_cfb *c;
-            ud_doc *d;
             int k, nmut;
             memcpy(m, b, (size_t)n);
             seed = seed * 1103515245u + 12345u;
@@ -585,15 +617,16 @@ int main(int argc, char **argv)
                 seed = seed * 1103515245u + 12345u;
                 m[off] = (unsigned char)(seed >> 16);
             }
-            d = open_doc(m, n, &src, &c);
-            if (d) { opened++; (void)strlen(ud_doc_plain(d)); ud_doc_close(d); }
-            ud_cfb_close(c);
+            if (t < first) { free(m); continue; }
+            if (save) spit(save, m, n);
+            opened += fuzz_one(m, n);
             free(m);
         }
-        printf("OK %ld mutations, %ld documents opened\n", iters, opened);
+        printf("OK %ld mutations, %ld documents opened\n", iters - first, opened);
         free(b);
         return 0;
     }
-    printf("usage: doctest text FILE | info FILE | fuzz FILE SEED N\n");
+    printf("usage: doctest text FILE | info FILE | fuzz FILE SEED N [FIRST [SAVE]]"
+           " | repro FILE\n");
     return 2;
 }
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""loserver - LibreOffice conversions for the unodoc oracle, without paying
+LibreOffice's startup once per file.
+
+run_tests.py asks LibreOffice for a flat-ODF or text rendering of every corpus
+file and of everything our writers produce, often more than once per file.
+`soffice --headless --convert-to` starts a whole office for each of those and
+throws it away, which is most of the wall time of the oracle stages. So:
+
+  * A Pool keeps `size` headless instances, each on its own profile (two
+    instances on one profile hand their work to each other) and listening on
+    a local pipe. Conversions go over the UNO bridge: load hidden, store
+    through the export filter `--convert-to` would have picked, close. An
+    instance that dies is restarted, and the conversion is retried once. One
+    that is still busy after TIMEOUT_S is killed, like the one-shot soffice
+    it replaces, and that conversion fails: a file that hangs the office
+    would only hang the fresh one too.
+  * Without the `uno` module (LibreOffice's Python bridge; Debian's
+    python3-uno) the pool still runs, one `--convert-to` process per
+    conversion. Each worker still has its own profile, so `warm()` still runs
+    `size` conversions at once.
+  * Every output is cached under the SHA-256 of the input bytes, the format
+    and the soffice binary itself (its path, size and mtime, so an upgraded
+    LibreOffice converts afresh). An unchanged corpus file is converted once,
+    ever, across runs. convert(fresh=True) bypasses the cache and does not
+    store into it - the oracle's determinism check converts the same bytes
+    twice on purpose.
+
+    pool = Pool(cache_dir, profile_root, size=3)
+    out = pool.convert("corpus/small.doc", "fodt")   # a file path, or None
+    pool.warm([(path, "fodt"), ...])                 # fill the cache, N at once
+    pool.close()
+
+    python3 loserver.py FILE FMT [FILE FMT ...]      convert, print the outputs
+"""
+import concurrent.futures, hashlib, os, queue, shutil, subprocess, sys
+import tempfile, threading, time
+
+try:
+    import uno
+    from com.sun.star.beans import PropertyValue
+    from com.sun.star.connection import NoConnectException
+    from com.sun.star.lang import DisposedException
+    from com.sun.star.uno import RuntimeException as UnoRuntimeException
+except ImportError:
+    uno = None
+
+# --convert-to's FORMAT strings, as the export filter (and filter options) the
+# bridge has to name itself: --convert-to picks them from the extension.
+FILTERS = {
+    "fodt": ("OpenDocument Text Flat XML", ""),
+    "fods": ("OpenDocument Spreadsheet Flat XML", ""),
+    "fodp": ("OpenDocument Presentation Flat XML", ""),
+    "txt:Text (encoded):UTF8": ("Text (encoded)", "UTF8"),
+}
+
+CONNECT_S = 60              # how long a new instance may take to listen
+TIMEOUT_S = 600             # one conversion, as the one-shot soffice had
+
+
+def ext_of(fmt):
+    """The output extension for a --convert-to FORMAT ("txt:..." -> "txt")."""
+    return fmt.split(":")[0]
+
+
+def soffice_stamp():
+    exe = shutil.which("soffice")
+    if not exe:
+        return "none"
+    exe = os.path.realpath(exe)
+    st = os.stat(exe)
+    return "%s %d %d" % (exe, st.st_size, st.st_mtime_ns)
+
+
+def _env(home):
+    env = dict(os.environ)
+    env["HOME"] = home                      # keep LO out of the real profile
+    env["SAL_USE_VCLPLUGIN"] = "svp"
+    return env
+
+
+class Instance(object):
+    """One LibreOffice with its own profile: a listening server when the
+    bridge is available, otherwise the profile a one-shot soffice uses."""
+
+    def __init__(self, root, n):
+        self.profile = os.path.join(root, str(n))
+        self.scratch = os.path.join(self.profile, "out")
+        self.pipe = "unodoc-%d-%d" % (os.getpid(), n)
+        self.proc = self.desktop = None
+        os.makedirs(self.scratch, exist_ok=True)
+
+    def _argv(self):
+        return ["soffice", "--headless", "--invisible", "--norestore",
+                "--nologo", "--nodefault",
+                "-env:UserInstallation=" + uno_url(self.profile)]
+
+    # ---- the bridge ----
+    def start(self):
+        self.proc = subprocess.Popen(
+            self._argv() + ["--accept=pipe,name=%s;urp;StarOffice.ComponentContext"
+                            % self.pipe],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+            env=_env(self.profile))
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext(
+            "com.sun.star.bridge.UnoUrlResolver", local)
+        deadline = time.time() + CONNECT_S
+        while True:
+            try:
+                ctx = resolver.resolve("uno:pipe,name=%s;urp;StarOffice.ComponentContext"
+                                       % self.pipe)
+                break
+            except NoConnectException:
+                if self.proc.poll() is not None or time.time() > deadline:
+                    self.stop()
+                    raise RuntimeError("soffice did not start listening on %s"
+                                       % self.pipe)
+                time.sleep(0.25)
+        self.desktop = ctx.ServiceManager.createInstanceWithContext(
+            "com.sun.star.frame.Desktop", ctx)
+
+    def stop(self):
+        if self.desktop is not None:
+            try:
+                self.desktop.terminate()
+            except Exception:                       # noqa: BLE001 - already gone
+                pass
+            self.desktop = None
+        if self.proc is not None:
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+                self.proc.wait()
+            self.proc = None
+
+    def _bridge(self, src, fmt, dst):
+        name, opts = FILTERS[fmt]
+        # the UNO calls below block for as long as the office takes; killing
+        # it is the only way to interrupt them (they then raise Disposed)
+        proc, hung = self.proc, threading.Event()
+        watchdog = threading.Timer(TIMEOUT_S, lambda: (hung.set(), proc.kill()))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            return self._load_store(src, name, opts, dst)
+        except Exception:                           # noqa: BLE001 - see below
+            if hung.is_set():
+                raise TimeoutError("soffice took over %ds on %s" % (TIMEOUT_S, src))
+            raise
+        finally:
+            watchdog.cancel()
+
+    def _load_store(self, src, name, opts, dst):
+        doc = self.desktop.loadComponentFromURL(
+            uno_url(src), "_blank", 0,
+            (_prop("Hidden", True), _prop("ReadOnly", True)))
+        if doc is None:
+            return False
+        try:
+            props = [_prop("FilterName", name), _prop("Overwrite", True)]
+            if opts:
+                props.append(_prop("FilterOptions", opts))
+            doc.storeToURL(uno_url(dst), tuple(props))
+        finally:
+            doc.close(True)
+        return True
+
+    # ---- one conversion, either way ----
+    def convert(self, src, fmt, dst):
+        """Convert `src` into the file `dst`; True if LibreOffice wrote it."""
+        if os.path.exists(dst):
+            os.remove(dst)
+        if uno is None or fmt not in FILTERS:
+            return self._oneshot(src, fmt, dst)
+        for attempt in (0, 1):
+            try:
+                if self.desktop is None:
+                    self.start()
+                return self._bridge(src, fmt, dst) and os.path.exists(dst)
+            except RuntimeError:                    # start() could not get one up
+                return False
+            except TimeoutError:
+                self.stop()                         # the next call starts afresh
+                return False
+            except (DisposedException, UnoRuntimeException):
+                # the office crashed or hung up under us: a fresh one gets
+                # the same file once, so one bad input cannot poison the rest
+                self.stop()
+                if attempt:
+                    return False
+            except Exception:                       # noqa: BLE001 - IOException etc.
+                return False
+        return False
+
+    def _oneshot(self, src, fmt, dst):
+        outdir = tempfile.mkdtemp(dir=self.scratch)
+        try:
+            subprocess.run(self._argv() + ["--convert-to", fmt, "--outdir", outdir, src],
+                           capture_output=True, text=True, env=_env(self.profile),
+                           timeout=TIMEOUT_S)
+            out = os.path.join(outdir, os.path.splitext(os.path.basename(src))[0]
+                               + "." + ext_of(fmt))
+            if not os.path.exists(out):
+                return False
+            os.replace(out, dst)
+            return True
+        except subprocess.TimeoutExpired:
+            return False
+        finally:
+            shutil.rmtree(outdir, True)
+
+
+def uno_url(path):
+    if uno is not None:
+        return uno.systemPathToFileUrl(os.path.abspath(path))
+    return "file://" + os.path.abspath(path)
+
+
+def _prop(name, value):
+    p = PropertyValue()
+    p.Name, p.Value = name, value
+    return p
+
+
+class Pool(object):
+    def __init__(self, cache, profiles, size=1):
+        self.cache = cache
+        self.size = max(1, size)
+        self.stamp = soffice_stamp()
+        self.idle = queue.Queue()
+        self.all = [Instance(profiles, n) for n in range(self.size)]
+        for inst in self.all:
+            self.idle.put(inst)
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+        os.makedirs(cache, exist_ok=True)
+
+    @property
+    def mode(self):
+        return "UNO bridge" if uno is not None else "soffice --convert-to"
+
+    def key(self, path, fmt):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        h.update(("\0%s\0%s" % (fmt, self.stamp)).encode())
+        return h.hexdigest()
+
+    def convert(self, path, fmt, fresh=False):
+        """The file LibreOffice makes of `path` in `fmt`, or None if it
+        refused. The returned path is the pool's: copy it, do not keep it (a
+        fresh one is this thread's until its next fresh conversion)."""
+        if not os.path.isfile(path):
+            return None
+        cached = os.path.join(self.cache, "%s.%s" % (self.key(path, fmt)[:40],
+                                                     ext_of(fmt)))
+        if not fresh and os.path.exists(cached):
+            with self.lock:
+                self.hits += 1
+            return cached
+        # Both copies are made before the instance goes back: its scratch
+        # file is the next caller's the moment it is idle, and the gate's
+        # stages convert side by side.
+        inst = self.idle.get()
+        try:
+            dst = os.path.join(inst.scratch, "conv." + ext_of(fmt))
+            ok = inst.convert(path, fmt, dst)
+            if ok:
+                out = cached
+                if fresh:
+                    out = os.path.join(self.cache, "fresh.%d.%s"
+                                       % (threading.get_ident(), ext_of(fmt)))
+                part = "%s.%d.part" % (out, threading.get_ident())
+                shutil.copyfile(dst, part)
+                os.replace(part, out)
+        finally:
+            self.idle.put(inst)
+        with self.lock:
+            self.misses += 1
+        return out if ok else None
+
+    def warm(self, jobs):
+        """Convert every (path, fmt) in `jobs` that is not cached yet, `size`
+        at a time, so the stage that asks for them next finds them cached."""
+        todo = [(p, f) for p, f in jobs if os.path.exists(p)]
+        if self.size == 1 or len(todo) < 2:
+            for p, f in todo:
+                self.convert(p, f)
+            return
+        with concurrent.futures.ThreadPoolExecutor(self.size) as ex:
+            list(ex.map(lambda j: self.convert(*j), todo))
+
+    def close(self):
+        for inst in self.all:
+            inst.stop()
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or len(args) % 2:
+        print(__doc__.strip().splitlines()[-1].strip())
+        return 2
+    here = os.path.dirname(os.path.abspath(__file__))
+    pool = Pool(os.path.join(here, "gen", "locache"),
+                os.path.join(here, "gen", "loprofile"), size=1)
+    try:
+        rc = 0
+        for path, fmt in zip(args[0::2], args[1::2]):
+            out = pool.convert(path, fmt)
+            print("%s -> %s" % (path, out or "REFUSED"))
+            rc |= out is None
+        return rc
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,8 +4,11 @@
  *   text FILE          every slide's text, for run_tests.py to compare
  *                      against LibreOffice's own extraction
  *   info FILE          slide count
- *   fuzz FILE SEED N   mutations through the container AND the presentation
- *                      reader.  Must never crash, never hang.
+ *   fuzz FILE SEED N [FIRST [SAVE]]
+ *                      mutations through the container AND the presentation
+ *                      reader.  Must never crash, never hang.  FIRST and
+ *                      SAVE are run_tests.py's crash bisection (cfbtest.c)
+ *   repro FILE         one saved mutation, walked the way fuzz walks it
  *   wtest              write a deck, read it back with OUR reader, assert
  *                      slides, text and shapes all survive (phase 5c)
  *   wfile FILE         write the demo deck to disk for the LibreOffice half
@@ -38,6 +41,16 @@ static unsigned char *slurp(const char *path, long *len)
     return b;
 }
 
+/* write one fuzz case to disk (fuzz ... FIRST SAVE), before it is walked, so
+ * it is there for run_tests.py even when the walk kills the process */
+static void spit(const char *path, const unsigned char *b, long n)
+{
+    FILE *f = fopen(path, "wb");
+    if (!f) return;
+    fwrite(b, 1, (size_t)n, f);
+    fclose(f);
+}
+
 /* Same rule as the other two tests: sniff the container, so small.ppt and
  * small.pptx - one deck saved twice - run through identical checks. */
 static ud_zip *g_zip;
@@ -57,6 +70,28 @@ static ud_ppt *open_ppt(const unsigned char *buf, long len, ud_src *src, ud_cfb
     return c ? ud_ppt_open(c) : 0;
 }
 
+/* One fuzz case: the container, then every slide's text and shapes.  1 if
+ * the presentation opened.  fuzz runs it on every mutation, repro on a
+ * saved one. */
+static int fuzz_one(const unsigned char *m, long n)
+{
+    ud_src src;
+    ud_cfb *c;
+    ud_ppt *p = open_ppt(m, n, &src, &c);
+    int opened = p != 0;
+    if (p) {
+        int i;
+        for (i = 0; i < ud_ppt_slides(p); i++) {
+            ud_shape sh[64];
+            (void)strlen(ud_ppt_slide_text(p, i));
+            (void)ud_ppt_slide_shapes(p, i, sh, 64);
+        }
+        ud_ppt_close(p);
+    }
+    ud_cfb_close(c);
+    return opened;
+}
+
 int main(int argc, char **argv)
 {
     ud_set_alloc(t_alloc, free);
@@ -167,17 +202,24 @@ int main(int argc, char **argv)
                    ooxml ? "" : " and 3 shapes");
         return bad;
     }
+    if (argc >= 3 && strcmp(argv[1], "repro") == 0) {
+        long n = 0;
+        unsigned char *b = slurp(argv[2], &n);
+        if (!b) { printf("ERR: cannot read %s\n", argv[2]); return 2; }
+        printf("OK %s\n", fuzz_one(b, n) ? "opened" : "refused");
+        free(b);
+        return 0;
+    }
     if (argc >= 5 && strcmp(argv[1], "fuzz") == 0) {
         long n = 0;
         unsigned char *b = slurp(argv[2], &n);
         unsigned seed = (unsigned)strtoul(argv[3], 0, 10);
         long iters = strtol(argv[4], 0, 10), t, opened = 0;
+        long first = argc >= 6 ? strtol(argv[5], 0, 10) : 0;
+        const char *save = argc >= 7 ? argv[6] : 0;
         if (!b || n < 512) { printf("ERR: cannot read %s\n", argv[2]); free(b); return 2; }
         for (t = 0; t < iters; t++) {
             unsigned char *m = (unsigned char *)malloc((size_t)n);
-            ud_src src;
-            ud_cfb *c;
-            ud_ppt *p;
             int k, nmut;
             memcpy(m, b, (size_t)n);
             seed = seed * 1103515245u + 12345u;
@@ -189,24 +231,16 @@ int main(int argc, char **argv)
                 seed = seed * 1103515245u + 12345u;
                 m[off] = (unsigned char)(seed >> 16);
             }
-            p = open_ppt(m, n, &src, &c);
-            if (p) {
-                int i;
-                opened++;
-                for (i = 0; i < ud_ppt_slides(p); i++) {
-                    ud_shape sh[64];
-                    (void)strlen(ud_ppt_slide_text(p, i));
-                    (void)ud_ppt_slide_shapes(p, i, sh, 64);
-                }
-                ud_ppt_close(p);
-            }
-            ud_cfb_close(c);
+            if (t < first) { free(m); continue; }
+            if (save) spit(save, m, n);
+            opened += fuzz_one(m, n);
             free(m);
         }
-        printf("OK %ld mutations, %ld presentations opened\n", iters, opened);
+        printf("OK %ld mutations, %ld presentations opened\n", iters - first, opened);
         free(b);
         return 0;
     }
-    printf("usage: ppttest text FILE | info FILE | fuzz FILE SEED N\n");
+    printf("usage: ppttest text FILE | info FILE | fuzz FILE SEED N [FIRST [SAVE]]"
+           " | repro FILE\n");
     return 2;
 }
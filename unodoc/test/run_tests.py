@@ -20,15 +20,40 @@ freestanding.  Five stages:
                 the oracle: it is a third party agreeing our container is
                 well formed.
   5. fuzz       thousands of mutations of each corpus file through the
-                reader.  Requirement: never crash, never hang.
+                reader.  Requirement: never crash, never hang.  Each file's
+                iterations are split into shards of SHARD, each from its own
+                seed, and every shard of every file runs at once up to
+                --jobs (default: one per core).  A crashing shard is bisected
+                to the one mutation that did it, which is minimised and kept
+                in gen/crashes/ with the sanitizer's report beside it.
+
+Every LibreOffice conversion goes through loserver.py: --lo=N long-lived
+instances (default up to 3) and a cache in gen/locache/ keyed by the input's
+hash, so only new or changed files cost a conversion.
+
+The four harnesses compile at once, and one whose sources and flags have not
+changed since its last build is not compiled at all (--rebuild forces it).
+The stages after build run as a graph (../unomedia/test/stagegraph.py): each
+starts as soon as what it reads exists - only "written doc" waits, on the
+selftest that writes its files - and its output is held and printed whole,
+in the order below. The fuzz stages run side by side but share --jobs
+processes between them. --serial runs one stage at a time, as it goes.
 
 Usage: python3 run_tests.py [filter-substring] [--force-corpus]
+                            [--jobs=N] [--fuzz-scale=X] [--lo=N]
+                            [--rebuild] [--serial]
+--fuzz-scale multiplies every fuzz stage's iteration count (4 = four times
+the mutations, in about the time one core took for the old count on a
+four-core box).
 Exit code 0 = green.
 """
-import os, re, shutil, subprocess, sys, time
+import concurrent.futures, os, re, shutil, subprocess, sys, threading, time
+import loserver
 
 HERE   = os.path.dirname(os.path.abspath(__file__))
 UD     = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(UD, "..", "unomedia", "test"))
+import stagegraph                                          # noqa: E402
 GEN    = os.path.join(HERE, "gen")
 CORPUS = os.path.join(HERE, "corpus")
 BIN    = os.path.join(GEN, "cfbtest")
@@ -36,6 +61,20 @@ XBIN   = os.path.join(GEN, "xlstest")
 DBIN   = os.path.join(GEN, "doctest")
 PBIN   = os.path.join(GEN, "ppttest")
 PROFILE = os.path.join(GEN, "loprofile")
+CRASHES = os.path.join(GEN, "crashes")
+LOCACHE = os.path.join(GEN, "locache")
+
+SHARD = 500                 # mutations per fuzz process
+JOBS = os.cpu_count() or 1  # fuzz processes at once (--jobs=N)
+FUZZ_SCALE = 1.0            # --fuzz-scale=X
+# JOBS fuzz processes at once across ALL the fuzz stages, which run together
+SLOTS = threading.BoundedSemaphore(JOBS)
+
+# The oracle's LibreOffice: a pool of long-lived instances and a conversion
+# cache keyed by input hash (loserver.py), started by main() when soffice is
+# on PATH. --lo=N sizes the pool.
+LO_SIZE = min(3, os.cpu_count() or 1)
+LO = None
 
 # build.sh's first-party sanitizer set, verbatim, plus ASan for the host.
 SAN = ["-fsanitize=address,undefined",
@@ -89,28 +128,16 @@ def run(args, timeout=300):
                           timeout=timeout, errors="replace")
 
 # ---- 1. build ---------------------------------------------------------------
-def build():
+def build(force=False):
     os.makedirs(GEN, exist_ok=True)
-    cmd = (["gcc", "-O1", "-g", "-std=c99", "-Wall", "-Wextra", "-Werror",
-            "-I", UD] + SAN + ["-o", BIN] +
-           [os.path.join(UD, s) for s in SRCS] +
-           [os.path.join(HERE, "cfbtest.c")])
     def gcc(out, srcs, main):
-        c = (["gcc", "-O1", "-g", "-std=c99", "-Wall", "-Wextra", "-Werror",
-              "-I", UD] + SAN + ["-o", out] +
-             [os.path.join(UD, x) for x in srcs] + [os.path.join(HERE, main)])
-        rr = run(c)
-        if rr.returncode:
-            print(rr.stdout + rr.stderr)
-            raise SystemExit("build failed: " + out)
-    r = run(cmd)
-    if r.returncode:
-        print(r.stdout + r.stderr)
-        raise SystemExit("build failed")
-    gcc(XBIN, XSRCS, "xlstest.c")
-    gcc(DBIN, DSRCS, "doctest.c")
-    gcc(PBIN, PSRCS, "ppttest.c")
-    print("build: ok")
+        return (["gcc", "-O1", "-g", "-std=c99", "-Wall", "-Wextra", "-Werror",
+                 "-I", UD] + SAN + ["-o", out] +
+                [os.path.join(UD, x) for x in srcs] + [os.path.join(HERE, main)])
+    stagegraph.build([gcc(BIN, SRCS, "cfbtest.c"),
+                      gcc(XBIN, XSRCS, "xlstest.c"),
+                      gcc(DBIN, DSRCS, "doctest.c"),
+                      gcc(PBIN, PSRCS, "ppttest.c")], force=force)
 
 # ---- 2. selftest ------------------------------------------------------------
 SELFTESTS = [
@@ -292,35 +319,47 @@ def first_diff(a, b, ctx=70):
     lo = max(0, i - ctx)
     return "at %d:\n    A: %r\n    B: %r" % (i, a[lo:i + ctx], b[lo:i + ctx])
 
-def soffice_flat(path, outdir):
-    """Convert `path` to flat XML and return its content, normalized."""
-    env = dict(os.environ)
-    env["HOME"] = PROFILE
-    env["SAL_USE_VCLPLUGIN"] = "svp"
-    os.makedirs(PROFILE, exist_ok=True)
+def lo_convert(path, fmt, outdir, fresh=False):
+    """LibreOffice's `fmt` rendering of `path`, left in `outdir` under the
+    name --convert-to would give it (for a human to diff); returns that path,
+    or None if LibreOffice refused the file."""
     os.makedirs(outdir, exist_ok=True)
-    fmt = FLAT_ANY[os.path.splitext(path)[1]]
     out = os.path.join(outdir, os.path.splitext(os.path.basename(path))[0]
-                       + "." + fmt)
+                       + "." + loserver.ext_of(fmt))
     # Remove the target FIRST.  Without this, a conversion that fails or times
     # out leaves the PREVIOUS run's file sitting there and we compare against
     # stale content - which can invent a failure (seen once on small.ppt) just
     # as easily as it can hide a real one.
     if os.path.exists(out):
         os.remove(out)
-    subprocess.run(["soffice", "--headless", "--norestore", "--convert-to",
-                    fmt, "--outdir", outdir, path],
-                   capture_output=True, text=True, env=env, timeout=600)
-    if not os.path.exists(out):
+    got = LO.convert(path, fmt, fresh=fresh)
+    if got is None:
+        return None
+    shutil.copyfile(got, out)
+    return out
+
+def soffice_flat(path, outdir, fresh=False):
+    """Convert `path` to flat XML and return its content, normalized.
+    fresh=True converts even when the cache holds this file already."""
+    out = lo_convert(path, FLAT_ANY[os.path.splitext(path)[1]], outdir, fresh)
+    if out is None:
         return None
     with open(out, encoding="utf-8", errors="replace") as f:
         return normalize(f.read())
 
+def lo_warm(files, fmt_of):
+    """Have the pool convert `files` (those fmt_of maps) ahead of a stage
+    that walks them one by one, LO_SIZE at a time."""
+    if LO is not None:
+        LO.warm([(p, fmt_of(p)) for p in files if fmt_of(p)])
+
 def rebuild_corpus(files, oracle=True):
     outdir = os.path.join(GEN, "rebuilt")
     if os.path.isdir(outdir):
         shutil.rmtree(outdir)
     os.makedirs(outdir)
+    if oracle:
+        lo_warm(files, lambda p: FLAT.get(os.path.splitext(p)[1]))
     for path in files:
         base = os.path.basename(path)
         # CFB ONLY. This stage reads a container through OUR writer and asks
@@ -350,7 +389,9 @@ def rebuild_corpus(files, oracle=True):
         #     normalizer is missing a volatile field and we say so instead of
         #     reporting a pass we did not establish.
         a1 = soffice_flat(path, os.path.join(GEN, "lo_orig1"))
-        a2 = soffice_flat(path, os.path.join(GEN, "lo_orig2"))
+        # ...and the second conversion is never the cache's: a1 may well
+        # come from an earlier run, a2 is LibreOffice's answer today.
+        a2 = soffice_flat(path, os.path.join(GEN, "lo_orig2"), fresh=True)
         b = soffice_flat(out, os.path.join(GEN, "lo_new"))
         if a1 is None or a2 is None:
             fail("%s: LibreOffice could not convert the ORIGINAL" % base)
@@ -584,17 +625,11 @@ def written_ppt(have_lo):
                   "2 pages" % (name, len(WRITTEN_PPT_MUST_HAVE)))
 
 # ---- 4d. documents: our text against LibreOffice's -------------------------
+TXT = "txt:Text (encoded):UTF8"
+
 def lo_txt(path, outdir):
-    env = dict(os.environ)
-    env["HOME"] = PROFILE
-    env["SAL_USE_VCLPLUGIN"] = "svp"
-    os.makedirs(PROFILE, exist_ok=True)
-    os.makedirs(outdir, exist_ok=True)
-    subprocess.run(["soffice", "--headless", "--norestore", "--convert-to",
-                    "txt:Text (encoded):UTF8", "--outdir", outdir, path],
-                   capture_output=True, text=True, env=env, timeout=600)
-    out = os.path.join(outdir, os.path.splitext(os.path.basename(path))[0] + ".txt")
-    if not os.path.exists(out):
+    out = lo_convert(path, TXT, outdir)
+    if out is None:
         return None
     with open(out, encoding="utf-8", errors="replace") as f:
         return f.read()
@@ -648,6 +683,8 @@ def check_fmt_doc(path):
               "the Normal style chain)" % ("fmt.doc", len(FMT_DOC_EXPECT)))
 
 def documents(files, have_lo):
+    if have_lo:
+        lo_warm(files, lambda p: TXT if p.endswith((".doc", ".docx")) else None)
     for path in files:
         if not (path.endswith(".doc") or path.endswith(".docx")):
             continue
@@ -688,6 +725,8 @@ def documents(files, have_lo):
 TAGS = re.compile(r"<[^>]*>")
 
 def presentations(files, have_lo):
+    if have_lo:
+        lo_warm(files, lambda p: "fodp" if p.endswith((".ppt", ".pptx")) else None)
     for path in files:
         if not (path.endswith(".ppt") or path.endswith(".pptx")):
             continue
@@ -728,114 +767,220 @@ def presentations(files, have_lo):
                   "extraction" % (base, len(ours)))
 
 def ppt_fuzz(files, iters=2000):
-    for path in files:
-        if not (path.endswith(".ppt") or path.endswith(".pptx")):
-            continue
-        base = os.path.basename(path)
-        t = time.time()
-        try:
-            r = run([PBIN, "fuzz", path, "77", str(iters)], timeout=1800)
-        except subprocess.TimeoutExpired:
-            fail("%s: presentation fuzz did not terminate" % base)
-            continue
-        if r.returncode:
-            fail("%s: presentation fuzz: %s" % (base, (r.stdout + r.stderr).strip()[:600]))
-        else:
-            print("  %-12s %s in %.1fs" % (base, r.stdout.strip(), time.time() - t))
+    fuzz_stage(files, (".ppt", ".pptx"), PBIN, 77, iters, 1800,
+               "presentation fuzz")
 
 def doc_fuzz(files, iters=3000):
-    for path in files:
-        if not (path.endswith(".doc") or path.endswith(".docx")):
-            continue
-        base = os.path.basename(path)
-        t = time.time()
-        try:
-            r = run([DBIN, "fuzz", path, "4242", str(iters)], timeout=1800)
-        except subprocess.TimeoutExpired:
-            fail("%s: document fuzz did not terminate" % base)
-            continue
-        if r.returncode:
-            fail("%s: document fuzz: %s" % (base, (r.stdout + r.stderr).strip()[:600]))
-        else:
-            print("  %-12s %s in %.1fs" % (base, r.stdout.strip(), time.time() - t))
+    fuzz_stage(files, (".doc", ".docx"), DBIN, 4242, iters, 1800,
+               "document fuzz")
 
 def xls_fuzz(files, iters=3000):
-    for path in files:
-        if not (path.endswith(".xls") or path.endswith(".xlsx")):
-            continue
-        base = os.path.basename(path)
-        t = time.time()
-        try:
-            r = run([XBIN, "fuzz", path, "999", str(iters)], timeout=1800)
-        except subprocess.TimeoutExpired:
-            fail("%s: workbook fuzz did not terminate" % base)
-            continue
-        if r.returncode:
-            fail("%s: workbook fuzz: %s" % (base, (r.stdout + r.stderr).strip()[:600]))
-        else:
-            print("  %-12s %s in %.1fs" % (base, r.stdout.strip(), time.time() - t))
+    fuzz_stage(files, (".xls", ".xlsx"), XBIN, 999, iters, 1800,
+               "workbook fuzz")
 
 # ---- 5. fuzz ----------------------------------------------------------------
 def fuzz(files, iters=4000):
+    fuzz_stage(files, None, BIN, 12345, iters, 900, "fuzz",
+               hang="(a chain walk is unbounded)")
+
+# Every fuzz stage is the same job over a different harness: `BIN fuzz FILE
+# SEED N` walks N mutations, each drawn from an LCG that SEED starts.  A file's
+# `iters` are cut into shards of SHARD mutations; shard k starts from seed+k,
+# so shard 0 is exactly the first SHARD mutations the single process used to
+# walk, and the rest are as new to the reader as the single process's later
+# ones were.  `timeout` is the old whole-file limit; a shard gets its share of
+# it, with headroom for sharing the machine.
+def fuzz_stage(files, exts, binary, seed, iters, timeout, what, hang=""):
+    iters = max(1, int(iters * FUZZ_SCALE))
+    jobs = []
     for path in files:
+        if exts and not path.endswith(exts):
+            continue
+        for k in range(0, (iters + SHARD - 1) // SHARD):
+            n = min(SHARD, iters - k * SHARD)
+            jobs.append((path, seed + k, n))
+    if not jobs:
+        return
+    share = max(120, 4 * timeout * SHARD // iters)
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(JOBS) as ex:
+        done = list(ex.map(lambda j: fuzz_shard(binary, j, share), jobs))
+    per = {}
+    for (path, sd, n), (r, dt) in zip(jobs, done):
+        per.setdefault(path, []).append((sd, n, r, dt))
+    cpu = 0.0
+    for path, shards in per.items():
         base = os.path.basename(path)
+        mut = opened = 0
+        bad = False
+        for sd, n, r, dt in shards:
+            cpu += dt
+            if r is None:
+                fail("%s: %s did not terminate%s\n  replay: %s fuzz %s %d %d"
+                     % (base, what, " " + hang if hang else "", binary, path, sd, n))
+                bad = True
+            elif r.returncode:
+                out = (r.stdout + r.stderr).strip()
+                kept = reproduce(binary, path, sd, n, out)
+                fail("%s: %s: %s%s" % (base, what, out[:600],
+                                       "\n  reproducer: %s" % kept if kept else ""))
+                bad = True
+            else:
+                m = re.match(r"OK (\d+) mutations, (\d+)", r.stdout.strip())
+                if m:
+                    mut += int(m.group(1))
+                    opened += int(m.group(2))
+        if not bad:
+            print("  %-12s OK %d mutations, %d opened, %d shards, %.1fs of cpu"
+                  % (base, mut, opened, len(shards), sum(s[3] for s in shards)))
+    wall = time.time() - t0
+    print("  %d shards on %d jobs in %.1fs (%.1fs of cpu, %.1fx)"
+          % (len(jobs), JOBS, wall, cpu, cpu / wall if wall else 0))
+
+def fuzz_shard(binary, job, timeout):
+    path, sd, n = job
+    with SLOTS:
         t = time.time()
         try:
-            r = run([BIN, "fuzz", path, "12345", str(iters)], timeout=900)
+            r = run([binary, "fuzz", path, str(sd), str(n)], timeout=timeout)
         except subprocess.TimeoutExpired:
-            fail("%s: fuzz did not terminate (a chain walk is unbounded)" % base)
-            continue
-        if r.returncode:
-            fail("%s: fuzz: %s" % (base, (r.stdout + r.stderr).strip()[:600]))
+            r = None
+        return r, time.time() - t
+
+def reproduce(binary, path, sd, n, report):
+    """Bisect a crashed shard to its one crashing mutation, minimise it and
+    keep it in gen/crashes/: returns the file, or None if the crash would not
+    happen again.  Mutation i is walked by `fuzz FILE SEED i+1 i SAVE` alone,
+    which also leaves it in SAVE."""
+    os.makedirs(CRASHES, exist_ok=True)
+    case = os.path.join(CRASHES, ".case.%d.%d" % (os.getpid(),
+                                                   threading.get_ident()))
+
+    def dies(args):
+        try:
+            return run([binary] + args, timeout=600).returncode != 0
+        except subprocess.TimeoutExpired:
+            return False
+
+    def crashes(first, last, save=()):
+        return dies(["fuzz", path, str(sd), str(last), str(first)] + list(save))
+
+    def still(buf):
+        with open(case, "wb") as f:
+            f.write(buf)
+        return dies(["repro", case])
+
+    lo, hi = 0, n                       # the first crash is in [lo, hi)
+    if not crashes(lo, hi):
+        return None
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if crashes(lo, mid):
+            hi = mid
         else:
-            print("  %-12s %s in %.1fs" % (base, r.stdout.strip(), time.time() - t))
+            lo = mid
+    try:
+        if not crashes(lo, lo + 1, [case]):
+            return None
+        if not os.path.exists(case):
+            return None                 # it died before it could write SAVE
+        with open(path, "rb") as f:
+            good = f.read()
+        with open(case, "rb") as f:
+            bad = bytearray(f.read())
+        # Minimise: put back every mutated byte the crash does not need, one
+        # at a time, keeping the crash.  What is left is the handful of bytes
+        # a reader has to look at to see the bug.
+        for off in [i for i in range(len(good)) if good[i] != bad[i]]:
+            trial = bytearray(bad)
+            trial[off] = good[off]
+            if still(trial):
+                bad = trial
+        if not still(bad):
+            return None
+    finally:
+        if os.path.exists(case):
+            os.remove(case)
+    base, ext = os.path.splitext(os.path.basename(path))
+    keep = os.path.join(CRASHES, "%s-%s-s%d-m%d%s"
+                        % (os.path.basename(binary), base, sd, lo, ext))
+    with open(keep, "wb") as f:
+        f.write(bad)
+    with open(keep + ".txt", "w") as f:
+        f.write("%s repro %s\n\n%d byte(s) differ from %s\n\n%s\n" % (
+            binary, keep, sum(1 for i in range(len(good)) if good[i] != bad[i]),
+            path, report))
+    return keep
 
 # ---- main -------------------------------------------------------------------
 def main():
+    global JOBS, FUZZ_SCALE, LO_SIZE, LO, SLOTS
     args = [a for a in sys.argv[1:] if not a.startswith("--")]
     force = "--force-corpus" in sys.argv
     filt = args[0] if args else ""
-
-    def stage(name, fn, *a):
-        if filt and filt not in name:
-            return
-        print("\n== %s ==" % name)
-        fn(*a)
-
-    build()
-    stage("selftest", selftest)
-
+    for a in sys.argv[1:]:
+        if a.startswith("--jobs="):
+            JOBS = max(1, int(a.split("=", 1)[1]))
+            SLOTS = threading.BoundedSemaphore(JOBS)
+        elif a.startswith("--fuzz-scale="):
+            FUZZ_SCALE = float(a.split("=", 1)[1])
+        elif a.startswith("--lo="):
+            LO_SIZE = max(1, int(a.split("=", 1)[1]))
+
+    build("--rebuild" in sys.argv)
     have_lo = shutil.which("soffice") is not None
-    if not have_lo and not os.path.isdir(CORPUS):
+    corpus = have_lo or os.path.isdir(CORPUS)
+    if have_lo:
+        print("\n== corpus ==")
+        ensure_corpus(force)
+        LO = loserver.Pool(LOCACHE, PROFILE, LO_SIZE)
+        print("oracle: %d LibreOffice instance(s), %s, cache %s"
+              % (LO.size, LO.mode, LOCACHE))
+
+    g = stagegraph.Graph(1 if "--serial" in sys.argv else None, filt,
+                         head="\n== %s ==", fail=fail)
+    g.stage("selftest", selftest)
+    try:
+        if corpus:
+            add_stages(g, have_lo)
+        g.run()
+    finally:
+        if LO is not None:
+            LO.close()
+            print("\noracle: %d conversion(s), %d from the cache"
+                  % (LO.hits + LO.misses, LO.hits))
+
+    if not corpus:
         print("\n!! soffice not found and no corpus present: the corpus, "
               "rebuild and fuzz stages need one or the other.")
         print("   WSL: sudo apt install libreoffice-writer libreoffice-calc "
               "libreoffice-impress")
         raise SystemExit(1 if fails else 0)
 
-    if have_lo:
-        print("\n== corpus ==")
-        ensure_corpus(force)
-    files = corpus_files()
-    if not files:
-        fail("corpus is empty")
-    else:
-        stage("corpus read", read_corpus, files)
-        stage("rebuild", rebuild_corpus, files, have_lo)
-        stage("workbook", workbooks, files)
-        stage("written", written, have_lo)
-        stage("written doc", written_doc, have_lo)
-        stage("written ppt", written_ppt, have_lo)
-        stage("document", documents, files, have_lo)
-        stage("presentation", presentations, files, have_lo)
-        stage("fuzz", fuzz, files)
-        stage("workbook fuzz", xls_fuzz, files)
-        stage("document fuzz", doc_fuzz, files)
-        stage("presentation fuzz", ppt_fuzz, files)
-
     print("\n" + ("unodoc gate: %d FAILURE(S)" % len(fails) if fails
                   else "unodoc gate: GREEN"))
     return 1 if fails else 0
 
+def add_stages(g, have_lo):
+    # Each stage writes only its own files under gen/ (rebuilt/, lo_*/), so
+    # they are free to overlap; "written doc" judges the .doc/.docx that
+    # selftest's doctest wtest/wxtest leave behind.
+    files = corpus_files()
+    if not files:
+        fail("corpus is empty")
+        return
+    g.stage("corpus read", read_corpus, files)
+    g.stage("rebuild", rebuild_corpus, files, have_lo)
+    g.stage("workbook", workbooks, files)
+    g.stage("written", written, have_lo)
+    g.stage("written doc", written_doc, have_lo, after=("selftest",))
+    g.stage("written ppt", written_ppt, have_lo)
+    g.stage("document", documents, files, have_lo)
+    g.stage("presentation", presentations, files, have_lo)
+    g.stage("fuzz", fuzz, files)
+    g.stage("workbook fuzz", xls_fuzz, files)
+    g.stage("document fuzz", doc_fuzz, files)
+    g.stage("presentation fuzz", ppt_fuzz, files)
+
 if __name__ == "__main__":
     sys.exit(main())
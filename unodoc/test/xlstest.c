@@ -5,8 +5,11 @@
  *   dump FILE          canonical TSV of everything the reader extracted;
  *                      run_tests.py diffs it against the fixture mkcorpus.py
  *                      wrote from the source document
- *   fuzz FILE SEED N   N mutations of FILE through the container AND the
- *                      workbook reader.  Must never crash, never hang.
+ *   fuzz FILE SEED N [FIRST [SAVE]]
+ *                      N mutations of FILE through the container AND the
+ *                      workbook reader.  Must never crash, never hang.  FIRST
+ *                      and SAVE are run_tests.py's crash bisection (cfbtest.c)
+ *   repro FILE         one saved mutation, walked the way fuzz walks it
  * ======================================================================== */
 #include "unodoc.h"
 #include <stdio.h>
@@ -32,6 +35,16 @@ static unsigned char *slurp(const char *path, long *len)
     return b;
 }
 
+/* write one fuzz case to disk (fuzz ... FIRST SAVE), before it is walked, so
+ * it is there for run_tests.py even when the walk kills the process */
+static void spit(const char *path, const unsigned char *b, long n)
+{
+    FILE *f = fopen(path, "wb");
+    if (!f) return;
+    fwrite(b, 1, (size_t)n, f);
+    fclose(f);
+}
+
 /* TSV-safe.  unodoc text is CP-1252, and the output is emitted as CP-1252
  * bytes for the runner to decode: 0xA0-0xFF go out raw (they are exactly the
  * printable half of CP-1252), while control bytes AND the five CP-1252
@@ -694,11 +707,21 @@ int main(int argc, char **argv)
         free(b);
         return ok ? 0 : 1;
     }
+    if (argc >= 3 && strcmp(argv[1], "repro") == 0) {
+        long n = 0;
+        unsigned char *b = slurp(argv[2], &n);
+        if (!b) { printf("ERR: cannot read %s\n", argv[2]); return 2; }
+        printf("OK %s\n", walk(b, n, 0) ? "opened" : "refused");
+        free(b);
+        return 0;
+    }
     if (argc >= 5 && strcmp(argv[1], "fuzz") == 0) {
         long n = 0;
         unsigned char *b = slurp(argv[2], &n);
         unsigned seed = (unsigned)strtoul(argv[3], 0, 10);
         long iters = strtol(argv[4], 0, 10), t, opened = 0;
+        long first = argc >= 6 ? strtol(argv[5], 0, 10) : 0;
+        const char *save = argc >= 7 ? argv[6] : 0;
         if (!b || n < 512) { printf("ERR: cannot read %s\n", argv[2]); free(b); return 2; }
         for (t = 0; t < iters; t++) {
             unsigned char *m = (unsigned char *)malloc((size_t)n);
@@ -713,13 +736,16 @@ int main(int argc, char **argv)
                 seed = seed * 1103515245u + 12345u;
                 m[off] = (unsigned char)(seed >> 16);
             }
+            if (t < first) { free(m); continue; }
+            if (save) spit(save, m, n);
             opened += walk(m, n, 0);
             free(m);
         }
-        printf("OK %ld mutations, %ld workbooks opened\n", iters, opened);
+        printf("OK %ld mutations, %ld workbooks opened\n", iters - first, opened);
         free(b);
         return 0;
     }
-    printf("usage: xlstest dump FILE | fuzz FILE SEED N\n");
+    printf("usage: xlstest dump FILE | fuzz FILE SEED N [FIRST [SAVE]]"
+           " | repro FILE\n");
     return 2;
 }
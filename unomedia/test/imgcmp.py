@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""imgcmp - how far our RGBA decode is from the reference, fast.
+
+run_tests.py compares every decode against ImageMagick's (or ffmpeg's, or the
+pixels it encoded itself), and it used to do it one byte at a time in a Python
+generator: the max channel delta of the lossless checks and the PSNR of the
+lossy ones each walked w*h*4*frames bytes through the interpreter, every
+coalesced GIF/WebP frame included. That loop, not the decoders, was what made
+a bigger reference scene unaffordable. Here:
+
+  * with NumPy, both sides are viewed as uint8 arrays (no copy), and the
+    delta, the squared error and the per-frame split are array reductions;
+  * without it, identical buffers are settled by one memcmp (the usual
+    lossless PASS), and anything else goes through map(operator.sub, ...)
+    over memoryview slices - C iteration, no per-byte Python frames.
+
+compare() returns the whole picture - max delta and PSNR overall and per
+frame - and heatmap() writes a PNG of where the two disagree (each pixel's
+largest channel delta, red to yellow over a dimmed copy of the reference,
+frames stacked top to bottom) for a failure someone has to look at.
+
+    r = compare(ours, ref, w, h)       # w, h split the buffers into frames
+    r.max_delta, r.psnr, r.frames      # frames: [(max_delta, psnr), ...]
+    r.worst()                          # "frame 3: max delta 17, 41.2 dB"
+    heatmap("diff.png", ours, ref, w, h)
+"""
+import math, operator, struct, zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+PEAK = 99.0                 # the PSNR reported for identical buffers
+
+
+def _db(se, n):
+    if se == 0:
+        return PEAK
+    return 10.0 * math.log10(255.0 * 255.0 * n / se)
+
+
+def _stats(a, b):
+    """(max channel delta, sum of squared error) of two equal-length buffers."""
+    if np is not None:
+        d = np.abs(np.frombuffer(a, np.uint8).astype(np.int16)
+                   - np.frombuffer(b, np.uint8))
+        return int(d.max(initial=0)), int(np.dot(d.astype(np.int64),
+                                                 d.astype(np.int64)))
+    if a == b:
+        return 0, 0
+    d = list(map(operator.sub, a, b))
+    return max(max(d), -min(d)), sum(map(operator.mul, d, d))
+
+
+class Result(object):
+    def __init__(self, n, frames, max_delta, se):
+        self.n = n
+        self.frames = frames        # [(max_delta, psnr)] per frame
+        self.max_delta = max_delta
+        self.psnr = _db(se, n) if n else 0.0
+
+    def worst(self):
+        """The frame that disagrees most, for a FAIL line ("" if only one)."""
+        if len(self.frames) < 2:
+            return ""
+        k = max(range(len(self.frames)), key=lambda i: self.frames[i][0])
+        return "frame %d: max delta %d, %.1f dB" % ((k,) + self.frames[k])
+
+
+def compare(a, b, w=0, h=0):
+    """Compare RGBA buffers `a` and `b`, split into w*h frames when the size
+    allows. Buffers of different lengths compare as PSNR 0 and max delta
+    255, as the old psnr() had it: callers report the sizes themselves."""
+    if len(a) != len(b) or not a:
+        return Result(0, [], 255, 0)
+    size = w * h * 4
+    if not size or len(a) % size:
+        size = len(a)
+    ma, mb = memoryview(a), memoryview(b)
+    frames, worst, se = [], 0, 0
+    for at in range(0, len(a), size):
+        dmax, fse = _stats(ma[at:at + size], mb[at:at + size])
+        frames.append((dmax, _db(fse, size)))
+        worst = max(worst, dmax)
+        se += fse
+    return Result(len(a), frames, worst, se)
+
+
+def psnr(a, b):
+    return compare(a, b).psnr
+
+
+def max_delta(a, b):
+    return compare(a, b).max_delta
+
+
+# ---- the heatmap ------------------------------------------------------------
+def _error_map(a, b):
+    """Each pixel's largest channel delta, and the reference dimmed to a
+    quarter, as the RGB a heatmap is painted over."""
+    if np is not None:
+        x = np.frombuffer(a, np.uint8).reshape(-1, 4).astype(np.int16)
+        y = np.frombuffer(b, np.uint8).reshape(-1, 4)
+        return (np.abs(x - y).max(axis=1).tolist(),
+                (y[:, :3] // 4).tobytes())
+    d = list(map(abs, map(operator.sub, a, b)))
+    px = [max(d[i:i + 4]) for i in range(0, len(d), 4)]
+    dim = bytes(v >> 2 for i, v in enumerate(b) if i & 3 != 3)
+    return px, dim
+
+
+def heatmap(path, a, b, w, h):
+    """Write where `a` and `b` differ as an RGB PNG, w wide and one h-tall
+    band per frame: 0 shows the dimmed reference, 1..31 ramps red to yellow
+    (anything larger is full yellow)."""
+    px, rgb = _error_map(a, b)
+    rgb = bytearray(rgb)
+    for i, d in enumerate(px):
+        if d:
+            rgb[i * 3:i * 3 + 3] = bytes((255, min(255, d * 8), 0))
+    rows = len(px) // w
+    raw = b"".join(b"\0" + bytes(rgb[y * w * 3:(y + 1) * w * 3])
+                   for y in range(rows))
+
+    def chunk(tag, data):
+        return (struct.pack(">I", len(data)) + tag + data
+                + struct.pack(">I", zlib.crc32(tag + data)))
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n"
+                + chunk(b"IHDR", struct.pack(">IIBBBBB", w, rows, 8, 2, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(raw, 6))
+                + chunk(b"IEND", b""))
+    return path
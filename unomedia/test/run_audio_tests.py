@@ -14,7 +14,11 @@ audtest, and compares PCM:
   MIDI             -> a synthesiser, not a decoder: assert rate/duration
                       sanity and that the output is actually sounding
 
-Usage: python3 run_audio_tests.py [filter-substring]
+Built and run like run_tests.py: audtest only rebuilt when something it is
+compiled from changed (--rebuild forces it), the codec families side by side
+as stagegraph.py stages (--serial: one at a time).
+
+Usage: python3 run_audio_tests.py [filter-substring] [--rebuild] [--serial]
 """
 import math, os, struct, subprocess, sys, wave
 
@@ -22,6 +26,8 @@ HERE = os.path.dirname(os.path.abspath(__file__))
 UM   = os.path.dirname(HERE)
 GEN  = os.path.join(HERE, "gen")
 BIN  = os.path.join(GEN, "audtest")
+sys.path.insert(0, HERE)
+import stagegraph                                          # noqa: E402
 
 PASS = []; FAIL = []
 
@@ -30,13 +36,14 @@ def sh(*args):
     return subprocess.run(list(args), check=True, capture_output=True)
 
 
-def build():
+def build(force=False):
     os.makedirs(GEN, exist_ok=True)
     srcs = [os.path.join(UM, f) for f in sorted(os.listdir(UM))
             if f.endswith(".c")]
     srcs.append(os.path.join(HERE, "audtest.c"))
-    sh("gcc", "-O2", "-g", "-fsanitize=address,undefined", "-Wall", "-Wextra",
-       "-I", UM, "-o", BIN, *srcs, "-lm")
+    stagegraph.build([["gcc", "-O2", "-g", "-fsanitize=address,undefined",
+                       "-Wall", "-Wextra", "-I", UM, "-o", BIN, *srcs, "-lm"]],
+                     force=force)
 
 
 def check(name, ok, why=""):
@@ -45,7 +52,7 @@ def check(name, ok, why=""):
 
 
 def decode(path, seek=None):
-    out = os.path.join(GEN, "aud.raw")
+    out = path + ".pcm"                 # per input: the families run at once
     cmd = [BIN, path, out] + ([str(seek)] if seek is not None else [])
     r = subprocess.run(cmd, capture_output=True, text=True)
     raw = open(out, "rb").read() if os.path.exists(out) else b""
@@ -141,13 +148,15 @@ def midi_bytes():
             + b"MTrk" + struct.pack(">I", len(trk)) + trk)
 
 
-def main():
-    filt = sys.argv[1] if len(sys.argv) > 1 else ""
-    build()
-    g = lambda n: os.path.join(GEN, n)
+FILT = ""
+
 
-    # ---- WAV ----
-    if filt in "wav_s16":
+def g(n):
+    return os.path.join(GEN, n)
+
+
+def wav():
+    if FILT in "wav_s16":
         p = g("wav_s16.wav"); gen_tone_wav(p)
         rc, head, raw = decode(p)
         h = parse_head(head) if rc == 0 else {}
@@ -156,15 +165,16 @@ def main():
               and h.get("ch") == 2 and raw == ref,
               head if rc else "mismatch")
     for codec, name in [("pcm_s24le", "wav_s24"), ("pcm_f32le", "wav_f32")]:
-        if filt not in name: continue
+        if FILT not in name: continue
         p = g(name + ".wav"); gen_tone_wav(p, codec)
         rc, head, raw = decode(p)
         if rc != 0: check(name, False, head); continue
         db = psnr(samples(raw), samples(ffmpeg_pcm(p, 44100, 2)))
         check(name, db >= 80.0, "PSNR %.1f dB (%s)" % (db, head))
 
-    # ---- MP3 ----
-    if filt in "mp3_sweep":
+
+def mp3():
+    if FILT in "mp3_sweep":
         p = g("mp3_sweep.mp3"); gen_sweep(p, "libmp3lame", "-b:a", "192k")
         rc, head, raw = decode(p)
         if rc != 0: check("mp3_sweep", False, head)
@@ -173,8 +183,10 @@ def main():
             check("mp3_sweep", db >= 55.0,
                   "PSNR %.1f dB @off %d (%s)" % (db, off, head))
 
-    # ---- AAC (decoder lands with the AAC milestone; these gate it) ----
-    if filt in "aac_m4a":
+
+def aac():
+    # the decoder lands with the AAC milestone; these gate it
+    if FILT in "aac_m4a":
         p = g("aac_m4a.m4a"); gen_sweep(p, "aac", "-b:a", "128k")
         rc, head, raw = decode(p)
         if rc != 0: check("aac_m4a", False, head)
@@ -182,7 +194,7 @@ def main():
             db, off = aligned_psnr(raw, ffmpeg_pcm(p, 44100, 2), 2)
             check("aac_m4a", db >= 50.0,
                   "PSNR %.1f dB @off %d (%s)" % (db, off, head))
-    if filt in "aac_adts":
+    if FILT in "aac_adts":
         p = g("aac_adts.aac"); gen_sweep(p, "aac", "-b:a", "128k", "-f", "adts")
         rc, head, raw = decode(p)
         if rc != 0: check("aac_adts", False, head)
@@ -191,8 +203,10 @@ def main():
             check("aac_adts", db >= 50.0,
                   "PSNR %.1f dB @off %d (%s)" % (db, off, head))
 
-    # ---- MIDI (synth: sanity, not sample compare) ----
-    if filt in "midi_notes":
+
+def midi():
+    # a synth: sanity, not sample compare
+    if FILT in "midi_notes":
         p = g("midi_notes.mid")
         open(p, "wb").write(midi_bytes())
         rc, head, raw = decode(p)
@@ -205,6 +219,18 @@ def main():
             ok = peak > 2000 and 3.0 <= secs <= 6.0   # 4 quarters @120bpm ~4s
         check("midi_notes", ok, head)
 
+
+def main():
+    global FILT
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    FILT = args[0] if args else ""
+    build("--rebuild" in sys.argv)
+    gr = stagegraph.Graph(1 if "--serial" in sys.argv else None,
+                          fail=lambda msg: check(msg, False))
+    for fn in (wav, mp3, aac, midi):
+        gr.stage(fn.__name__, fn)
+    gr.run()
+
     print("\n%d passed, %d failed" % (len(PASS), len(FAIL)))
     if FAIL: sys.exit(1)
 
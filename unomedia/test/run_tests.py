@@ -12,27 +12,42 @@ output against ImageMagick's own decode of the same file.
   animated GIF      -> per-frame vs `convert -coalesce`
   refusal cases     -> expect ERR: with the right reason
 
-Usage: python3 run_tests.py [filter-substring]
+imgtest is only rebuilt when a source, header or flag changed (--rebuild
+forces it), and the format families run side by side as stagegraph.py stages
+once the shared source scene exists, each family's lines printed together
+in the order below. --serial runs them one at a time.
+
+The comparisons are imgcmp.py's (NumPy when it is installed, C-level
+iteration when not), per frame for the animated formats. --diff keeps a
+heatmap of every failing comparison in gen/diff/NAME.png.
+
+Usage: python3 run_tests.py [filter-substring] [--rebuild] [--serial] [--diff]
 """
-import os, subprocess, sys, struct, zlib, math, shutil
+import os, re, subprocess, sys, struct, zlib, shutil
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 UM   = os.path.dirname(HERE)
 GEN  = os.path.join(HERE, "gen")
 BIN  = os.path.join(GEN, "imgtest")
+sys.path.insert(0, HERE)
+import imgcmp                                              # noqa: E402
+import stagegraph                                          # noqa: E402
+
+DIFF = None                 # --diff: where failing comparisons leave a heatmap
 
 CONVERT = shutil.which("convert") or "convert"
 
 def sh(*args, **kw):
     return subprocess.run(list(args), check=True, capture_output=True, **kw)
 
-def build():
+def build(force=False):
     os.makedirs(GEN, exist_ok=True)
     srcs = [os.path.join(UM, f) for f in sorted(os.listdir(UM))
             if f.endswith(".c")]
     srcs.append(os.path.join(HERE, "imgtest.c"))
-    sh("gcc", "-O2", "-g", "-fsanitize=address,undefined", "-Wall", "-Wextra",
-       "-I", UM, "-o", BIN, *srcs, "-lm")
+    stagegraph.build([["gcc", "-O2", "-g", "-fsanitize=address,undefined",
+                       "-Wall", "-Wextra", "-I", UM, "-o", BIN, *srcs, "-lm"]],
+                     force=force)
 
 def ref_rgba(path, coalesce=False):
     """ImageMagick's decode of `path` as raw RGBA (all frames)."""
@@ -41,16 +56,8 @@ def ref_rgba(path, coalesce=False):
     args += ["-depth", "8", "RGBA:-"]
     return sh(*args).stdout
 
-def psnr(a, b):
-    if len(a) != len(b) or not a: return 0.0
-    se = 0
-    for x, y in zip(a, b):
-        d = x - y; se += d * d
-    if se == 0: return 99.0
-    return 10.0 * math.log10(255.0 * 255.0 * len(a) / se)
-
 def decode(path, maxfr=64):
-    out = os.path.join(GEN, "out.raw")
+    out = path + ".out.raw"             # per input: the families run at once
     r = subprocess.run([BIN, "decode", path, out, str(maxfr)],
                        capture_output=True, text=True)
     raw = open(out, "rb").read() if os.path.exists(out) else b""
@@ -112,14 +119,33 @@ def check(name, ok, why=""):
     (PASS if ok else FAIL).append(name)
     print(("PASS " if ok else "FAIL ") + name + ("" if ok else "  " + why))
 
+def dims(head):
+    """The WxH of a decode head ("PNG 97x61 alpha=1 frames=1 ..."); each
+    frame of the raw output is that many RGBA pixels."""
+    m = re.search(r" (\d+)x(\d+) ", head)
+    return (int(m.group(1)), int(m.group(2))) if m else (0, 0)
+
+def verdict(name, head, raw, ref, r, ok, what):
+    """check() one imgcmp result. A multi-frame failure names its worst
+    frame, and under --diff leaves a heatmap in gen/diff/."""
+    notes = [head]
+    if not ok:
+        notes.append(r.worst())
+        w, h = dims(head)
+        if DIFF and w and len(raw) % (w * h * 4) == 0:
+            notes.append(imgcmp.heatmap(os.path.join(DIFF, name + ".png"),
+                                        raw, ref, w, h))
+    check(name, ok, f"{what} ({'; '.join(n for n in notes if n)})")
+
 def cmp_exact(name, path, coalesce=False, maxfr=64):
     rc, head, raw = decode(path, maxfr)
     if rc != 0: check(name, False, head); return
     ref = ref_rgba(path, coalesce)
     if len(raw) != len(ref):
         check(name, False, f"size {len(raw)} != ref {len(ref)} ({head})"); return
-    delta = max((abs(a - b) for a, b in zip(raw, ref)), default=0)
-    check(name, delta == 0, f"max delta {delta} ({head})")
+    r = imgcmp.compare(raw, ref, *dims(head))
+    verdict(name, head, raw, ref, r, r.max_delta == 0,
+            f"max delta {r.max_delta}")
 
 def cmp_psnr(name, path, mindb=40.0):
     rc, head, raw = decode(path)
@@ -127,94 +153,102 @@ def cmp_psnr(name, path, mindb=40.0):
     ref = ref_rgba(path)
     if len(raw) != len(ref):
         check(name, False, f"size {len(raw)} != ref {len(ref)} ({head})"); return
-    db = psnr(raw, ref)
-    check(name, db >= mindb, f"PSNR {db:.1f} dB < {mindb} ({head})")
+    r = imgcmp.compare(raw, ref, *dims(head))
+    verdict(name, head, raw, ref, r, r.psnr >= mindb,
+            f"PSNR {r.psnr:.1f} dB < {mindb}")
 
 def expect_err(name, path, needle):
     rc, head, _ = decode(path)
     ok = rc != 0 and needle.lower() in head.lower()
     check(name, ok, f"got: {head}")
 
-def main():
-    filt = sys.argv[1] if len(sys.argv) > 1 else ""
-    build()
-    os.makedirs(GEN, exist_ok=True)
-    g = lambda n: os.path.join(GEN, n)
-    base = g("base.png")                       # the shared source scene
+FILT = ""
+
+def g(n):
+    return os.path.join(GEN, n)
+
+def want(name):
+    return FILT in name
+
+def scene():
     sh(CONVERT, "-size", "97x61", "gradient:red-blue",
        "(", "-size", "40x30", "xc:rgba(0,255,0,0.5)", ")",
-       "-geometry", "+20+10", "-composite", base)
+       "-geometry", "+20+10", "-composite", g("base.png"))
 
-    # ---- PNG ----
+def png():
+    base = g("base.png")
     for ct, name in [("", "png_rgba"),
                      ("-alpha off", "png_rgb"),
                      ("-colorspace Gray -alpha off", "png_gray"),
                      ("-colors 100 -type Palette -alpha off", "png_pal")]:
         p = g(name + ".png")
         sh(*([CONVERT, base] + (ct.split() if ct else []) + [p]))
-        if filt in name: cmp_exact(name, p)
+        if want(name): cmp_exact(name, p)
     p = g("png_16bit.png"); sh(CONVERT, base, "-depth", "16", p)
-    if filt in "png_16bit": cmp_psnr("png_16bit", p, 45.0)   # we fold 16->8
+    if want("png_16bit"): cmp_psnr("png_16bit", p, 45.0)   # we fold 16->8
     p = g("png_interlace.png"); sh(CONVERT, base, "-interlace", "PNG", p)
-    if filt in "png_interlace": cmp_exact("png_interlace", p)
+    if want("png_interlace"): cmp_exact("png_interlace", p)
     p = g("png_1bit.png")
     sh(CONVERT, base, "-alpha", "off", "-monochrome", p)
-    if filt in "png_1bit": cmp_exact("png_1bit", p)
+    if want("png_1bit"): cmp_exact("png_1bit", p)
 
-    # ---- JPEG ----
+def jpeg():
+    base = g("base.png")
     for q, samp, name in [("92", "4:2:0", "jpg_q92_420"),
                           ("75", "4:4:4", "jpg_q75_444"),
                           ("85", "4:2:2", "jpg_q85_422")]:
         p = g(name + ".jpg")
         sh(CONVERT, base, "-quality", q, "-sampling-factor", samp, p)
-        if filt in name: cmp_psnr(name, p)
+        if want(name): cmp_psnr(name, p)
     p = g("jpg_gray.jpg")
     sh(CONVERT, base, "-colorspace", "Gray", "-quality", "90", p)
-    if filt in "jpg_gray": cmp_psnr("jpg_gray", p)
+    if want("jpg_gray"): cmp_psnr("jpg_gray", p)
     p = g("jpg_prog.jpg")
     sh(CONVERT, base, "-interlace", "Plane", "-quality", "85", p)
-    if filt in "jpg_prog": cmp_psnr("jpg_prog", p)
+    if want("jpg_prog"): cmp_psnr("jpg_prog", p)
     p = g("jpg_prog_gray.jpg")
     sh(CONVERT, base, "-colorspace", "Gray", "-interlace", "Plane",
        "-quality", "90", p)
-    if filt in "jpg_prog_gray": cmp_psnr("jpg_prog_gray", p)
+    if want("jpg_prog_gray"): cmp_psnr("jpg_prog_gray", p)
     p = g("jpg_prog_420.jpg")
     sh(CONVERT, base, "-interlace", "Plane", "-sampling-factor", "4:2:0",
        "-quality", "80", p)
-    if filt in "jpg_prog_420": cmp_psnr("jpg_prog_420", p)
+    if want("jpg_prog_420"): cmp_psnr("jpg_prog_420", p)
 
-    # ---- GIF ----
-    p = g("gif_still.gif"); sh(CONVERT, base, "+dither", "-colors", "64", p)
-    if filt in "gif_still": cmp_exact("gif_still", p)
+def gif():
+    p = g("gif_still.gif"); sh(CONVERT, g("base.png"), "+dither", "-colors", "64", p)
+    if want("gif_still"): cmp_exact("gif_still", p)
     p = g("gif_anim.gif")
     sh(CONVERT, "-delay", "10", "-size", "40x30",
        "xc:red", "xc:green", "xc:blue", "-loop", "0", p)
-    if filt in "gif_anim": cmp_exact("gif_anim", p, coalesce=True)
+    if want("gif_anim"): cmp_exact("gif_anim", p, coalesce=True)
 
-    # ---- BMP ----
+def bmp():
     for extra, name in [([], "bmp_24"),
                         (["-define", "bmp:format=bmp4"], "bmp_v4"),
                         (["-colors", "16", "-type", "Palette",
                           "-alpha", "off", "-compress", "RLE"], "bmp_rle8")]:
         p = g(name + ".bmp")
-        sh(*([CONVERT, base, "-alpha", "off"] + extra + [p]))
-        if filt in name: cmp_exact(name, p)
+        sh(*([CONVERT, g("base.png"), "-alpha", "off"] + extra + [p]))
+        if want(name): cmp_exact(name, p)
 
-    # ---- TGA / PNM / ICO ----
+def tga_pnm_ico():
+    base = g("base.png")
     p = g("tga_rle.tga"); sh(CONVERT, base, "-compress", "RLE", p)
-    if filt in "tga_rle": cmp_exact("tga_rle", p)
+    if want("tga_rle"): cmp_exact("tga_rle", p)
     p = g("tga_raw.tga"); sh(CONVERT, base, "-compress", "None", p)
-    if filt in "tga_raw": cmp_exact("tga_raw", p)
+    if want("tga_raw"): cmp_exact("tga_raw", p)
     p = g("pnm_p6.ppm"); sh(CONVERT, base, "-alpha", "off", p)
-    if filt in "pnm_p6": cmp_exact("pnm_p6", p)
+    if want("pnm_p6"): cmp_exact("pnm_p6", p)
     p = g("pnm_p5.pgm")
     sh(CONVERT, base, "-colorspace", "Gray", "-alpha", "off", p)
-    if filt in "pnm_p5": cmp_exact("pnm_p5", p)
+    if want("pnm_p5"): cmp_exact("pnm_p5", p)
     p = g("ico_32.ico"); sh(CONVERT, base, "-resize", "32x32!", p)
-    if filt in "ico_32": cmp_exact("ico_32", p)
+    if want("ico_32"): cmp_exact("ico_32", p)
 
-    # ---- QOI (hand-built; compared against the pixels we encoded) ----
-    if filt in "qoi_grad":
+def qoi():
+    # hand-built; compared against the pixels we encoded
+    if want("qoi_grad"):
         w, h = 33, 21
         px = gradient_px(w, h)
         write_qoi(g("qoi_grad.qoi"), w, h, px)
@@ -222,38 +256,55 @@ def main():
         check("qoi_grad", rc == 0 and raw == raw_rgba(px),
               head if rc else "pixel mismatch")
 
-    # ---- WebP ----
+def webp():
     # lossy: both decoders read the same deterministic VP8 bitstream, but
     # chroma upsampling + YUV->RGB rounding differ, hence PSNR not exact
+    base = g("base.png")
     p = g("webp_lossy.webp")
     sh("ffmpeg", "-v", "quiet", "-y", "-i", base,
        "-c:v", "libwebp", "-quality", "80", p)
-    if filt in "webp_lossy": cmp_psnr("webp_lossy", p, 35.0)
+    if want("webp_lossy"): cmp_psnr("webp_lossy", p, 35.0)
     p = g("webp_lossless.webp")
     sh("ffmpeg", "-v", "quiet", "-y", "-i", base,
        "-c:v", "libwebp", "-lossless", "1", p)
-    if filt in "webp_lossless": cmp_exact("webp_lossless", p)
+    if want("webp_lossless"): cmp_exact("webp_lossless", p)
     p = g("webp_alpha.webp")     # lossless keeps the base scene's real alpha
     sh("ffmpeg", "-v", "quiet", "-y", "-i", base, "-pix_fmt", "rgba",
        "-c:v", "libwebp", "-lossless", "1", p)
-    if filt in "webp_alpha": cmp_exact("webp_alpha", p)
+    if want("webp_alpha"): cmp_exact("webp_alpha", p)
     p = g("webp_lossy_alpha.webp")   # ALPH chunk on a lossy frame
     sh("ffmpeg", "-v", "quiet", "-y", "-i", base, "-pix_fmt", "yuva420p",
        "-c:v", "libwebp", "-quality", "80", p)
-    if filt in "webp_lossy_alpha": cmp_psnr("webp_lossy_alpha", p, 35.0)
+    if want("webp_lossy_alpha"): cmp_psnr("webp_lossy_alpha", p, 35.0)
     p = g("webp_anim.webp")
     sh("ffmpeg", "-v", "quiet", "-y", "-f", "lavfi",
        "-i", "testsrc=size=64x48:rate=5:duration=1",
        "-c:v", "libwebp_anim", "-lossless", "1", "-loop", "0", p)
-    if filt in "webp_anim": cmp_exact("webp_anim", p, coalesce=True)
+    if want("webp_anim"): cmp_exact("webp_anim", p, coalesce=True)
 
-    # ---- refusals ----
-    if filt in "trunc_png":
-        data = open(base, "rb").read()
+def refusals():
+    if want("trunc_png"):
+        data = open(g("base.png"), "rb").read()
         open(g("trunc.png"), "wb").write(data[:len(data) // 3])
         rc, head, _ = decode(g("trunc.png"))
         check("trunc_png_clean_fail", rc != 0, f"got: {head}")
 
+def main():
+    global FILT, DIFF
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    FILT = args[0] if args else ""
+    build("--rebuild" in sys.argv)
+    os.makedirs(GEN, exist_ok=True)
+    if "--diff" in sys.argv:
+        DIFF = os.path.join(GEN, "diff")
+        os.makedirs(DIFF, exist_ok=True)
+    gr = stagegraph.Graph(1 if "--serial" in sys.argv else None,
+                          fail=lambda msg: check(msg, False))
+    gr.stage("scene", scene)                 # the shared source scene
+    for fn in (png, jpeg, gif, bmp, tga_pnm_ico, qoi, webp, refusals):
+        gr.stage(fn.__name__, fn, after=() if fn is qoi else ("scene",))
+    gr.run()
+
     print(f"\n{len(PASS)} passed, {len(FAIL)} failed")
     if FAIL: sys.exit(1)
 
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""stagegraph - the build cache and stage scheduler the host gates share.
+
+unodoc/test/run_tests.py, run_tests.py and run_audio_tests.py here all did the
+same two things one after another: compile their ASan test binaries, then walk
+a list of stages. So a green run cost the sum of every gcc line and every
+stage, even though the binaries do not depend on each other and most stages
+only read the corpus and wait on subprocesses. This module is the shared half:
+
+  * build(cmds) runs every compile line at once, and skips one whose output
+    is already there from the same inputs: the exact argv (so a flag change
+    rebuilds), the compiler binary (path, size, mtime), and the content of
+    every .c on the line plus every header in the directories it searches
+    (each -I, and each source's own directory). The key is kept beside the
+    binary as BINARY.key; a failed compile removes it.
+  * Graph runs stages as soon as the stages named in their `after` are done,
+    up to `jobs` at once (default: all that are ready). Each stage's prints
+    are buffered and shown whole, in the order the stages were declared, so
+    the log reads as the old sequential one did - one stage's header, then
+    its lines - however the stages interleaved. A stage that raises fails the
+    gate (through the `fail` the gate hands over) without stopping the others;
+    stages after it are not run. jobs=1 runs them in declaration order and
+    prints as they go, exactly as before.
+
+Only prints from the stage's own thread are buffered: a stage that fans out
+into its own worker threads prints its summary after they join (fuzz_stage,
+Pool.warm already do), or those lines reach the terminal as they happen.
+
+    build([["gcc", ..., "-o", BIN, ...], ...], force="--rebuild" in argv)
+    g = Graph(jobs=None, filt=filt, head="\\n== %s ==", fail=fail)
+    g.stage("selftest", selftest)
+    g.stage("written doc", written_doc, have_lo, after=("selftest",))
+    g.run()
+"""
+import concurrent.futures, hashlib, io, json, os, shutil, subprocess, sys
+import threading, time, traceback
+
+
+# ---- the build cache --------------------------------------------------------
+def file_sha(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compiler_stamp(cc):
+    exe = shutil.which(cc)
+    if not exe:
+        return cc
+    exe = os.path.realpath(exe)
+    st = os.stat(exe)
+    return "%s %d %d" % (exe, st.st_size, st.st_mtime_ns)
+
+
+def inputs(cmd):
+    """The files a compile line reads: its sources, and every header in the
+    directories it searches (-I DIR / -IDIR, and each source's own)."""
+    srcs, dirs = [], []
+    for i, a in enumerate(cmd):
+        prev = cmd[i - 1] if i else ""
+        if prev == "-I":
+            dirs.append(a)
+        elif a.startswith("-I") and len(a) > 2:
+            dirs.append(a[2:])
+        elif a.endswith((".c", ".S")) and prev != "-o":
+            srcs.append(os.path.abspath(a))
+    dirs += [os.path.dirname(s) for s in srcs]
+    hdrs = set()
+    for d in set(os.path.abspath(d) for d in dirs):
+        hdrs.update(os.path.join(d, f) for f in os.listdir(d) if f.endswith(".h"))
+    return srcs + sorted(hdrs)
+
+
+def key(cmd):
+    h = hashlib.sha256(json.dumps([cmd, compiler_stamp(cmd[0])]).encode())
+    for p in inputs(cmd):
+        h.update(("\0%s %s" % (p, file_sha(p))).encode())
+    return h.hexdigest()
+
+
+def compile_cached(cmd, force=False):
+    """Run the compile line `cmd` (an argv with -o) unless its output is
+    already built from the same inputs. Returns (output, result): result is
+    None when the cached binary was kept."""
+    out = cmd[cmd.index("-o") + 1]
+    stamp = out + ".key"
+    k = key(cmd)
+    if not force and os.path.exists(out) and os.path.exists(stamp):
+        with open(stamp) as f:
+            if f.read().strip() == k:
+                return out, None
+    if os.path.exists(stamp):
+        os.remove(stamp)
+    r = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if r.returncode == 0:
+        with open(stamp, "w") as f:
+            f.write(k + "\n")
+    return out, r
+
+
+def build(cmds, jobs=None, force=False, label="build"):
+    """Compile every line in `cmds` at once, each through compile_cached().
+    A failure prints the compiler's output and exits, as the gates' build()
+    always did."""
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(jobs or len(cmds) or 1) as ex:
+        done = list(ex.map(lambda c: compile_cached(c, force), cmds))
+    bad = [(out, r) for out, r in done if r is not None and r.returncode]
+    for out, r in bad:
+        print(r.stdout + r.stderr)
+    if bad:
+        raise SystemExit("build failed: " + ", ".join(out for out, r in bad))
+    built = [os.path.basename(out) for out, r in done if r is not None]
+    print("%s: ok (%s)" % (label, "%s built in %.1fs, %d unchanged"
+                           % (" ".join(built), time.time() - t0,
+                              len(done) - len(built))
+                           if built else "all %d unchanged" % len(done)))
+
+
+# ---- the stage graph --------------------------------------------------------
+class _Router(object):
+    """sys.stdout while a Graph runs: a stage thread's prints go to that
+    stage's buffer, everyone else's straight to the terminal."""
+
+    def __init__(self, real):
+        self.real = real
+        self.local = threading.local()
+
+    def _to(self):
+        buf = getattr(self.local, "buf", None)
+        return self.real if buf is None else buf
+
+    def write(self, s):
+        return self._to().write(s)
+
+    def flush(self):
+        self._to().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.real, name)
+
+
+class Stage(object):
+    def __init__(self, name, fn, args, after):
+        self.name = name
+        self.fn = fn
+        self.args = args
+        self.after = tuple(after)
+        self.out = ""
+        self.seconds = 0.0
+        self.error = None           # why it raised, or why it was not run
+        self.ran = False
+
+
+class Graph(object):
+    def __init__(self, jobs=None, filt="", head=None, fail=None):
+        self.jobs = jobs
+        self.filt = filt
+        self.head = head            # "%s" format for a stage's header line
+        self.fail = fail
+        self.stages = []
+
+    def stage(self, name, fn, *args, after=()):
+        """Declare a stage. Everything in `after` must be declared already,
+        so the declaration order is always one a serial run can follow."""
+        known = set(s.name for s in self.stages)
+        for dep in after:
+            if dep not in known:
+                raise ValueError("stage %r is after undeclared %r" % (name, dep))
+        self.stages.append(Stage(name, fn, args, after))
+
+    def _call(self, s, router):
+        if router is not None:
+            buf = router.local.buf = io.StringIO()
+        t = time.time()
+        s.ran = True
+        try:
+            s.fn(*s.args)
+        except Exception as e:                  # noqa: BLE001 - one stage's bug
+            s.error = "%s: %s" % (type(e).__name__, e)
+            traceback.print_exc(file=sys.stdout)
+        except SystemExit as e:                 # a gate's raise SystemExit(msg)
+            s.error = "exited: %s" % e
+        if s.error and self.fail:
+            self.fail("stage %s raised %s" % (s.name, s.error))
+        s.seconds = time.time() - t
+        if router is not None:
+            s.out = buf.getvalue()
+            router.local.buf = None
+
+    def _skip(self, s, why):
+        s.error = why
+        if self.head:
+            print(self.head % s.name)
+        print("  (not run: %s)" % why)
+        if self.fail:
+            self.fail("stage %s not run: %s" % (s.name, why))
+
+    def _show(self, s, real):
+        if not s.ran:
+            self._skip(s, s.error)
+            return
+        if self.head:
+            real.write(self.head % s.name + "\n")
+        real.write(s.out)
+        real.flush()
+
+    def run(self):
+        todo = [s for s in self.stages if not self.filt or self.filt in s.name]
+        names = set(s.name for s in todo)
+        byname = dict((s.name, s) for s in todo)
+        t0 = time.time()
+
+        def broken(s):
+            return [d for d in s.after if d in names and byname[d].error]
+
+        if self.jobs == 1:
+            for s in todo:
+                if broken(s):
+                    self._skip(s, "%s failed" % ", ".join(broken(s)))
+                    continue
+                if self.head:
+                    print(self.head % s.name)
+                self._call(s, None)
+        else:
+            self._parallel(todo, names, byname, broken)
+        ran = [s for s in todo if s.ran]
+        if len(ran) > 1:
+            total = sum(s.seconds for s in ran)
+            wall = time.time() - t0
+            slow = max(ran, key=lambda s: s.seconds)
+            print("\nstages: %d in %.1fs wall (%.1fs of stage time, %.1fx); "
+                  "slowest %s, %.1fs" % (len(ran), wall, total,
+                                         total / wall if wall else 0,
+                                         slow.name, slow.seconds))
+        return todo
+
+    def _parallel(self, todo, names, byname, broken):
+        real = sys.stdout
+        router = sys.stdout = _Router(real)
+        done = set()
+        pending = list(todo)
+        running = {}
+        shown = 0
+        try:
+            with concurrent.futures.ThreadPoolExecutor(
+                    self.jobs or len(todo) or 1) as ex:
+                while pending or running:
+                    for s in list(pending):
+                        if any(d in names and d not in done for d in s.after):
+                            continue
+                        pending.remove(s)
+                        if broken(s):
+                            s.error = "%s failed" % ", ".join(broken(s))
+                            done.add(s.name)
+                        else:
+                            running[ex.submit(self._call, s, router)] = s
+                    if running:
+                        fin, _ = concurrent.futures.wait(
+                            running,
+                            return_when=concurrent.futures.FIRST_COMPLETED)
+                        for f in fin:
+                            f.result()
+                            done.add(running.pop(f).name)
+                    while shown < len(todo) and todo[shown].name in done:
+                        self._show(todo[shown], real)
+                        shown += 1
+        finally:
+            sys.stdout = real
@@ -8,9 +8,18 @@ kernel's wait_frame advances) and the joystick ports ($9111/$9120, returning
 then renders the 22x23 character matrix (screen $1E00 + colour RAM $9600 + the
 char set at $3000 + the $900F background) to a PNG through the VIC palette.
 
-Usage: python vic20/harness.py <prog.prg> <out.png> [instr_millions]
+There is no script here, so no boot/test fork point as in the C64 and Apple II
+harnesses: each run is one shot. What it keeps instead is the machine it ran
+(MPU registers, the 64K, the raster counter, the instruction count) in
+build/snap/, keyed by the PRG and this harness. A later run of the same PRG
+with the same or a larger budget resumes from there and only runs the
+difference; re-shooting an unchanged build is instant. A smaller budget runs
+from power-on and leaves the longer run's snapshot alone. --no-snapshot runs from
+power-on.
+
+Usage: python vic20/harness.py <prog.prg> <out.png> [instr_millions] [--no-snapshot]
 """
-import sys, struct, zlib
+import hashlib, os, sys
 from py65.devices.mpu6502 import MPU
 from py65.memory import ObservableMemory
 
@@ -18,22 +27,27 @@ SCREEN, COLOR, CHARSET = 0x1E00, 0x9600, 0x3000
 PALETTE = [(0,0,0),(255,255,255),(120,40,40),(80,160,170),(120,60,150),(80,150,75),
            (50,40,135),(180,190,110),(120,80,30),(180,130,80),(180,110,110),(135,200,195),
            (170,120,210),(150,210,140),(115,105,200),(220,225,170)]
+SNAPDIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "build", "snap")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+import snapfile                                            # noqa: E402
+MPU_STATE = ("pc", "a", "x", "y", "sp", "p", "processorCycles")
 
-def png(path, w, h, rgb):
-    raw = bytearray()
-    for y in range(h):
-        raw.append(0); raw += rgb[y*w*3:(y+1)*w*3]
-    def ch(t, d): return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t+d))
-    open(path, "wb").write(b"\x89PNG\r\n\x1a\n" + ch(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0))
-                           + ch(b"IDAT", zlib.compress(bytes(raw), 6)) + ch(b"IEND", b""))
+def snap_path(data):
+    h = hashlib.sha256(data)
+    h.update(open(os.path.abspath(__file__), "rb").read())
+    return os.path.join(SNAPDIR, "run-%s.snap" % h.hexdigest()[:32])
 
 def main():
-    prg, out = sys.argv[1], sys.argv[2]
-    budget = int(float(sys.argv[3]) * 1_000_000) if len(sys.argv) > 3 else 8_000_000
+    snap = "--no-snapshot" not in sys.argv
+    args = [a for a in sys.argv[1:] if a != "--no-snapshot"]
+    prg, out = args[0], args[1]
+    budget = int(float(args[2]) * 1_000_000) if len(args) > 2 else 8_000_000
     data = open(prg, "rb").read()
     load = data[0] | (data[1] << 8)
     body = data[2:]
-    mem = ObservableMemory()
+    ram = [0] * 0x10000              # the 64K itself: snapshots bypass the hooks
+    mem = ObservableMemory(subject=ram)
     mem.write(load, list(body))
     raster = [0]
     def rd(addr):
@@ -47,25 +61,31 @@ def main():
     mpu = MPU(memory=mem)
     mpu.pc = 0x120D                  # start (skip the BASIC stub)
     n = 0
+    path = snap_path(data) if snap else None
+    state = snapfile.load(path) if path else None
+    if state and state["n"] <= budget:
+        for k, v in state["mpu"].items():
+            setattr(mpu, k, v)
+        ram[:] = state["ram"]
+        raster[0], n = state["raster"], state["n"]
+        print("resumed %s at %d instrs" % (os.path.basename(path), n))
     while n < budget:
         mpu.step()
         n += 1
-    bg = PALETTE[(mem[0x900F] >> 4) & 15]
+    # only a run that got further replaces the snapshot: a smaller budget
+    # started from power-on and would throw the longer run away
+    if path and (state is None or n > state["n"]):
+        snapfile.save(path, {"mpu": dict((k, getattr(mpu, k)) for k in MPU_STATE),
+                         "ram": bytes(ram), "raster": raster[0], "n": n})
     W, H = 22*8, 23*8
-    rgb = bytearray(W*H*3)
-    for row in range(23):
+    bits, fg = bytearray(22*H), bytearray(22*H)   # per scanline: glyph row + colour, per cell
+    for y in range(H):
         for cx in range(22):
-            off = row*22 + cx
-            chcode = mem[SCREEN + off]
-            fg = PALETTE[mem[COLOR + off] & 15]
-            base = CHARSET + chcode*8
-            for y in range(8):
-                bits = mem[base + y]
-                for x in range(8):
-                    c = fg if (bits & (0x80 >> x)) else bg
-                    p = ((row*8 + y)*W + (cx*8 + x))*3
-                    rgb[p], rgb[p+1], rgb[p+2] = c
-    png(out, W, H, rgb)
+            off = (y >> 3)*22 + cx
+            bits[y*22 + cx] = ram[CHARSET + ram[SCREEN + off]*8 + (y & 7)]
+            fg[y*22 + cx] = ram[COLOR + off] & 15
+    idx = fbconv.two_colour(bits, fg, (ram[0x900F] >> 4) & 15)
+    fbconv.write_png(out, W, H, fbconv.palette(idx, PALETTE))
     print("wrote %s (%dx%d) after %d instrs" % (out, W, H, n))
 
 if __name__ == "__main__":
@@ -22,11 +22,14 @@ to tick the line counter; nothing about the picture is faked.
 
 Usage: python ws/harness.py <rom.ws> <out.png> [instr_millions]
 """
-import sys, struct, zlib
+import os, sys
 from unicorn import Uc, UC_ARCH_X86, UC_MODE_16, UC_PROT_ALL, UC_HOOK_INSN
 from unicorn.x86_const import (UC_X86_REG_CS, UC_X86_REG_IP, UC_X86_REG_SS,
                                UC_X86_REG_SP, UC_X86_INS_OUT, UC_X86_INS_IN)
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tools"))
+import fbconv                                              # noqa: E402
+
 RAM_BASE = 0x00000
 RAM_SIZE = 0x20000            # 128 KB window covering the 16 KB internal RAM + low area
 ROM_SIZE = 0x10000            # 64 KB ROM mapped at 0xF0000..0xFFFFF (top byte at 0xFFFFF)
@@ -39,20 +42,6 @@ io = {}                      # last value written to each I/O port
 held = 0                     # active-high keypad bits for the real-input path (unused by AUTOTEST)
 
 
-def write_png(path, w, h, rgb):
-    raw = bytearray()
-    for y in range(h):
-        raw.append(0)
-        raw += rgb[y * w * 3:(y + 1) * w * 3]
-    def chunk(t, d):
-        return struct.pack(">I", len(d)) + t + d + struct.pack(">I", zlib.crc32(t + d))
-    with open(path, "wb") as f:
-        f.write(b"\x89PNG\r\n\x1a\n")
-        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", w, h, 8, 2, 0, 0, 0)))
-        f.write(chunk(b"IDAT", zlib.compress(bytes(raw), 6)))
-        f.write(chunk(b"IEND", b""))
-
-
 def main():
     rom_path, out_path = sys.argv[1], sys.argv[2]
     budget = int(float(sys.argv[3]) * 1_000_000) if len(sys.argv) > 3 else 8_000_000
@@ -138,14 +127,18 @@ def pal_shade(pool, pal, color):
 
 
 def render(uc, out_path):
+    """Gather each scanline's tile pattern bytes (flipped as the map entry
+    says) into two bitplanes, fold the tile's palette number in as four more,
+    and resolve all 64 (palette, colour) pairs through the shade pool once."""
     W, H = VIS_COLS * 8, VIS_ROWS * 8
-    rgb = bytearray(W * H * 3)
     ram = uc.mem_read(RAM_BASE, 0x4000)
     disp_on = io.get(0x00, 0) & 0x01
     map_base = (io.get(0x07, 0) & 0x07) << 11
     sx, sy = io.get(0x10, 0), io.get(0x11, 0)
     pool = shade_pool()
+    rev = bytes(int("{:08b}".format(b)[::-1], 2) for b in range(256))
 
+    planes = [bytearray(W // 8 * H) for _ in range(6)]
     for ty in range(VIS_ROWS):
         for tx in range(VIS_COLS):
             mcol = ((sx >> 3) + tx) & 31
@@ -161,16 +154,14 @@ def render(uc, out_path):
                 pr = (7 - row) if vflip else row
                 p0 = ram[patt + pr * 2]
                 p1 = ram[patt + pr * 2 + 1]
-                py = ty * 8 + row
-                for col in range(8):
-                    bit = col if hflip else (7 - col)
-                    color = ((p0 >> bit) & 1) | (((p1 >> bit) & 1) << 1)
-                    g = pal_shade(pool, pal, color) if disp_on else 0xC0
-                    px = tx * 8 + col
-                    o = (py * W + px) * 3
-                    rgb[o] = rgb[o + 1] = rgb[o + 2] = g
-    write_png(out_path, W, H, rgb)
-
+                o = (ty * 8 + row) * VIS_COLS + tx
+                planes[0][o] = rev[p0] if hflip else p0
+                planes[1][o] = rev[p1] if hflip else p1
+                for k in range(4):
+                    planes[2 + k][o] = 0xFF if (pal >> k) & 1 else 0
+    shades = [pal_shade(pool, i >> 2, i & 3) if disp_on else 0xC0 for i in range(64)]
+    idx = fbconv.planar(planes)
+    fbconv.write_png(out_path, W, H, fbconv.palette(idx, [(g, g, g) for g in shades]))
 
 if __name__ == "__main__":
     main()